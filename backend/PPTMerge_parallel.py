@@ -14,6 +14,7 @@ from pptx.enum.text import PP_ALIGN
 from pptx.oxml.ns import nsdecls
 from pptx.oxml import parse_xml
 from llm_api import LLMAPIClient
+import tracing
 import math 
 
 # Setup logging
@@ -250,7 +251,7 @@ content_tf.word_wrap = True
 
     try:
         # 调用 LLM
-        response = client.call_api_with_text(prompt)
+        response = client.call_api_for_code(prompt, use_cache=client.pipeline_cache)
         fallback_code = extract_code_block(response)
         
         # 执行生成的代码
@@ -305,7 +306,8 @@ def debug_and_execute_code(client, original_code, scene_name, slide, prs, exec_g
                     error_message=error_message
                 )
                 
-                fixed_code_response = client.call_api_with_text(fix_prompt)
+                # 修复请求不走缓存：同一错误重复出现时需要模型给出新的修复
+                fixed_code_response = client.call_api_for_code(fix_prompt, use_cache=False)
                 current_code = extract_code_block(fixed_code_response)
                 # current_code = try_fix_truncated_code(current_code)
                 if current_code.startswith("错误："):
@@ -321,7 +323,7 @@ def debug_and_execute_code(client, original_code, scene_name, slide, prs, exec_g
 
 def generate_pptx_code(client, manim_code, prompt_template):
     prompt = prompt_template.replace("{code}", manim_code)
-    response = client.call_api_with_text(prompt)
+    response = client.call_api_for_code(prompt, use_cache=client.pipeline_cache)
     return extract_code_block(response)
 
 # --- 新增：样式与品牌辅助函数 ---
@@ -556,11 +558,13 @@ def add_page_numbers(prs):
         except Exception as e:
             logging.warning(f"Failed to add page number: {e}")
 
+@tracing.traced("ppt")
 def process_scene_task(client, scene_name, scene_code, prompt_template, codes_dir, base_display, scene_index):
     """
     并行任务函数：处理单个场景的代码生成和调试
     返回: (scene_index, success, final_code_or_manim_code)
     """
+    tracing.annotate(page=f"{base_display}.{scene_index+1}", scene=scene_name)
     try:
         logging.info(f"  [Start] Processing scene: {scene_name}")
         
@@ -610,10 +614,11 @@ def process_scene_task(client, scene_name, scene_code, prompt_template, codes_di
         logging.error(f"  -> Critical error in task {scene_name}: {e}")
         return (scene_index, False, scene_code)
 
+@tracing.traced("ppt")
 def create_presentation_from_manim(input_path, output_pptx_path, config_path, prompt_template_path,
                                    title=None, subtitle=None, teacher_name=None, teacher_avatar=None,
                                    bg_path=None, left_logo=None, right_logo=None, speech_dir=None,
-                                   workers=4):
+                                   workers=None):
     
     start_time = time.time()
     logging.info("Starting PPT generation process...")
@@ -669,7 +674,9 @@ def create_presentation_from_manim(input_path, output_pptx_path, config_path, pr
                 try:
                     from openai import OpenAI
                     api_key = getattr(client, 'api_key', None) or os.environ.get('OPENAI_API_KEY') or (cfg.get('llm_key') if isinstance(cfg, dict) else None)
-                    client.client = OpenAI(api_key=api_key, base_url=getattr(client, 'base_url', None))
+                    from http_pool import get_http_client
+                    client.client = OpenAI(api_key=api_key, base_url=getattr(client, 'base_url', None),
+                                           http_client=get_http_client())
                 except Exception:
                     pass
         except Exception:
@@ -736,15 +743,15 @@ def create_presentation_from_manim(input_path, output_pptx_path, config_path, pr
 
     logging.info(f"Total scenes to process: {len(tasks)}")
     
-    # 并行执行
+    # 并行执行：线程数只是上限，实际 LLM 并发由 client.limiter（AIMD 自适应）控制
     results = [None] * len(tasks)
-    max_workers = min(len(tasks), workers) # 限制最大并发数
+    max_workers = min(len(tasks), workers or client.limiter.max_limit)
     if max_workers < 1: max_workers = 1
 
     with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
         future_to_index = {
             executor.submit(
-                process_scene_task, 
+                tracing.bind(process_scene_task),
                 t['client'], t['scene_name'], t['scene_code'], 
                 t['prompt_template'], t['codes_dir'], t['base_display'], t['scene_index']
             ): t['scene_index']
@@ -842,14 +849,15 @@ if __name__ == "__main__":
     parser.add_argument("--left_logo", default="/home/TeachMasterAppV2/backend/ppt_templates/sjtupic.png", help="Path to left logo")
     parser.add_argument("--right_logo", default="/home/TeachMasterAppV2/backend/ppt_templates/TeachMaster.png", help="Path to right logo")
     parser.add_argument("--speech_dir", help="Path to speech text directory")
-    parser.add_argument("--workers", type=int, default=2, help="Parallel workers for debugging (default: 2)")
+    parser.add_argument("--workers", type=int, default=None, help="Upper bound on worker threads (default: adaptive limiter max)")
 
     args = parser.parse_args()
     
-    create_presentation_from_manim(
-        args.input_file, args.output_file, args.config, args.prompt,
-        title=args.title, subtitle=args.subtitle, teacher_name=args.teacher,
-        teacher_avatar=args.avatar
-        , bg_path=args.bg, left_logo=args.left_logo, right_logo=args.right_logo,
-        speech_dir=args.speech_dir, workers=args.workers
-    )
\ No newline at end of file
+    with tracing.job(trace_dir=os.path.dirname(os.path.abspath(args.output_file)), stage="ppt"):
+        create_presentation_from_manim(
+            args.input_file, args.output_file, args.config, args.prompt,
+            title=args.title, subtitle=args.subtitle, teacher_name=args.teacher,
+            teacher_avatar=args.avatar
+            , bg_path=args.bg, left_logo=args.left_logo, right_logo=args.right_logo,
+            speech_dir=args.speech_dir, workers=args.workers
+        )
\ No newline at end of file
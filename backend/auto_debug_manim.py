@@ -1,17 +1,34 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import re, sys, json, subprocess, pathlib, argparse
+import os, re, sys, json, time, threading, subprocess, pathlib, argparse
+from contextlib import nullcontext
 from typing import Tuple, Optional
 from openai import OpenAI  # pip install openai>=1.40.0
+from code_stream import FILE, stream_code
+from render_pool import render_in_pool
 #注意需要在/home/EduAgent/miniconda3/envs/manim_env下运行，因为那里manim版本是渲染的时候的版本，修复的时候也要确认manim版本
 RETRY_MAX = 3
 MODEL = "gpt-5"
 RENDER_TIMEOUT = 180  # 秒
+VALIDATE_TIMEOUT = 60  # 秒
 SCENE = None  # None则渲染文件内所有Scene
+# 修复过程只做快速校验，最后完整渲染一次（只为暴露运行期错误）；用预览质量渲染，成片质量只在预览确认后由
+# video_render_final 渲染。渲染结果不写入渲染缓存：之后 breakpoint / wait 阶段还会改写 .py，缓存键对不上
 MANIM_QUALITY = "l"  # ex: -qk (高清), -qm (中), -ql (低)
+VALIDATE_FIRST = True  # 完整渲染前先跳过全部动画执行一遍 construct，几秒内暴露代码异常
 VIDEO_FORMAT = "mp4"
 MAX_LINES = 30  #保留行数
 
+# 批量调试时由 batch_debug 设置：渲染（占 CPU）和 GPT 修复（受限流）分别限制并发，None 表示不限制
+_render_slots: Optional[threading.BoundedSemaphore] = None
+_fix_slots: Optional[threading.BoundedSemaphore] = None
+
+def set_concurrency(render: Optional[int] = None, fix: Optional[int] = None) -> None:
+    """设置进程内同时进行的渲染数和 GPT 修复请求数（0 / None 表示不限制）"""
+    global _render_slots, _fix_slots
+    _render_slots = threading.BoundedSemaphore(render) if render else None
+    _fix_slots = threading.BoundedSemaphore(fix) if fix else None
+
 #注意要在同一目录下面放config.json(被修复的文件夹里不要缺背景图)
 config_path = pathlib.Path("config.json")
 if config_path.exists():
@@ -20,19 +37,54 @@ if config_path.exists():
     api_key = cfg.get("llm_key")
     base_url = cfg.get("debug_settings", {}).get("base_url")
     retry_max = cfg.get("debug_settings", {}).get("max_retries", RETRY_MAX)
-    client = OpenAI(api_key=api_key, base_url=base_url)
 else:
-    client = OpenAI()
-
-def run_manim(py_path: str, scene: Optional[str], media_dir: Optional[str] = None) -> Tuple[bool, str]:
+    # 未提供 config.json 时 OpenAI 客户端读取 OPENAI_API_KEY / OPENAI_BASE_URL
+    api_key = base_url = None
+
+# OpenAI 客户端在第一次修复请求时创建：渲染进程池以 spawn 启动 worker，worker 会重新 import __main__，
+# 放在模块顶层会让每个渲染进程都建一份客户端和连接
+_client: Optional[OpenAI] = None
+_client_lock = threading.Lock()
+
+def _get_client() -> OpenAI:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(api_key=api_key, base_url=base_url)
+    return _client
+
+def cli_media_dir(py_path: str, media_dir: Optional[str] = None) -> pathlib.Path:
+    """
+    CLI 回退时每页单独的 media 目录
+
+    同时调试的多个页面若共用一个 media_dir，manim 会在同一个 Tex 目录里编译并清理 LaTeX 中间文件，
+    互相删掉对方还没转换完的 .dvi / .svg（常驻渲染进程用 svg_cache 加锁处理，CLI 没有这层保护）。
+    """
+    return pathlib.Path(media_dir or "media") / "pages" / pathlib.Path(py_path).stem
+
+def run_manim(py_path: str, scene: Optional[str], media_dir: Optional[str] = None,
+              validate: bool = False, time_limit: Optional[float] = None) -> Tuple[bool, str]:
+    # validate：dry run 且从一个不存在的动画序号开始，construct 照常执行但跳过所有动画、不写视频
+    overrides = {"dry_run": True, "from_animation_number": 10 ** 9} if validate else None
+    timeout = VALIDATE_TIMEOUT if validate else RENDER_TIMEOUT
+    if time_limit is not None:
+        timeout = max(1, min(timeout, time_limit))
+    # 优先交给常驻渲染进程（已预先 import manim），不可用时回退到 CLI
+    pooled = render_in_pool(py_path, scene, MANIM_QUALITY, media_dir=media_dir, cwd=os.getcwd(),
+                            fmt=VIDEO_FORMAT, timeout=timeout, overrides=overrides)
+    if pooled is not None:
+        return pooled.ok, "\n".join(pooled.log.splitlines()[-MAX_LINES:])
     cmd = ["manim", f"-q{MANIM_QUALITY}", py_path]
     if scene:
         cmd.append(scene)
     cmd += ["--format", VIDEO_FORMAT]
-    if media_dir:
-        cmd += ["--media_dir", str(media_dir)]
+    if validate:
+        cmd += ["--dry_run", "-n", str(10 ** 9)]
+    media_dir = cli_media_dir(py_path, media_dir)
+    cmd += ["--media_dir", str(media_dir)]
     try:
-        p = subprocess.run(cmd, capture_output=True, text=True, timeout=RENDER_TIMEOUT)
+        p = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
         ok = (p.returncode == 0)
         out = (p.stdout or "") + "\n" + (p.stderr or "")
         lines = out.splitlines()
@@ -42,6 +94,20 @@ def run_manim(py_path: str, scene: Optional[str], media_dir: Optional[str] = Non
     except subprocess.TimeoutExpired as e:
         return False, f"[TIMEOUT] {e}\n{e.stdout or ''}\n{e.stderr or ''}"
 
+def check_manim(py_path: str, scene: Optional[str], media_dir: Optional[str] = None,
+                deadline: Optional[float] = None) -> Tuple[bool, str]:
+    """先快速校验，通过后才完整渲染一次；完整渲染的报错同样返回给修复流程。deadline 为 time.monotonic() 截止时间"""
+    ok, log = False, ""
+    for validate in ((True, False) if VALIDATE_FIRST else (False,)):
+        with _render_slots or nullcontext():
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False, "[TIMEOUT] 本页调试时间已用完"
+            ok, log = run_manim(py_path, scene, media_dir, validate=validate, time_limit=remaining)
+        if not ok:
+            return ok, log
+    return ok, log
+
 def extract_full_file_from_response(text: str) -> Optional[str]:
     m = re.search(r'<<<FILE_START\s*(.*?)\s*FILE_END>>>', text, re.S)
     if m:
@@ -50,7 +116,46 @@ def extract_full_file_from_response(text: str) -> Optional[str]:
         return text
     return None
 
-def call_gpt_fix(source: str, errlog: str, file_path: str, render_cmd: str, manim_version: str) -> str:
+def _request_options(deadline: Optional[float]) -> dict:
+    """按本页截止时间（time.monotonic()）给单次请求设置超时；时间已用完时抛 TimeoutError"""
+    if deadline is None:
+        return {}
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise TimeoutError("本页调试时间已用完")
+    return {"timeout": left}
+
+def _check_deadline(deadline: Optional[float]) -> None:
+    # 流式读取时请求超时只限制单次读，需要逐段检查总时长
+    if deadline is not None and time.monotonic() >= deadline:
+        raise TimeoutError("本页调试时间已用完")
+
+def _stream_responses_text(messages, deadline: Optional[float] = None):
+    """responses API 流式输出，逐段返回文本"""
+    stream = _get_client().responses.create(model=MODEL, input=messages, temperature=0.0, stream=True,
+                                     **_request_options(deadline))
+    try:
+        for event in stream:
+            _check_deadline(deadline)
+            if getattr(event, "type", "") == "response.output_text.delta":
+                yield event.delta
+    finally:
+        stream.close()
+
+def _stream_chat_text(messages, deadline: Optional[float] = None):
+    """chat.completions 流式输出，逐段返回文本"""
+    stream = _get_client().chat.completions.create(model=MODEL, messages=messages, temperature=0.0, stream=True,
+                                            **_request_options(deadline))
+    try:
+        for chunk in stream:
+            _check_deadline(deadline)
+            if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        stream.close()
+
+def call_gpt_fix(source: str, errlog: str, file_path: str, render_cmd: str, manim_version: str,
+                 deadline: Optional[float] = None) -> str:
     user_payload = f"""
     [环境]
     - manim 版本: {manim_version}
@@ -82,22 +187,11 @@ def call_gpt_fix(source: str, errlog: str, file_path: str, render_cmd: str, mani
 
     text = ""
 
+    # 流式接收：读到 FILE_END>>> 即关闭流，修复结果出现语法错误时提前中止并重新请求
     # 路径 A：responses API
     try:
-        if hasattr(client, "responses"):
-            resp = client.responses.create(
-                model=MODEL,
-                input=[system_msg, user_msg],
-                temperature=0.0
-            )
-            if getattr(resp, "output", None):
-                for item in resp.output:
-                    if getattr(item, "content", None):
-                        for c in item.content:
-                            if getattr(c, "type", "") == "output_text":
-                                text += c.text
-            else:
-                text = getattr(resp, "output_text", "") or str(resp)
+        if hasattr(_get_client(), "responses"):
+            text, _ = stream_code(lambda: _stream_responses_text([system_msg, user_msg], deadline), marker=FILE)
             if text:
                 return text
     except Exception:
@@ -105,24 +199,12 @@ def call_gpt_fix(source: str, errlog: str, file_path: str, render_cmd: str, mani
 
     # 路径 B：chat.completions API
     try:
-        resp = client.chat.completions.create(
-            model=MODEL,
-            messages=[system_msg, user_msg],
-            temperature=0.0
-        )
-        if hasattr(resp, "choices"):
-            choice0 = resp.choices[0]
-            content = getattr(getattr(choice0, "message", None), "content", None)
-            if not content:
-                content = getattr(choice0, "text", None)
-            text = content or ""
-        else:
-            text = resp["choices"][0]["message"]["content"]
+        text, _ = stream_code(lambda: _stream_chat_text([system_msg, user_msg], deadline), marker=FILE)
         return text
     except Exception as e:
         return f"[ERROR] 调用 API 失败：{e}"
 
-def strip_images_and_animations(py_src: str) -> str:
+def strip_images_and_animations(py_src: str, deadline: Optional[float] = None) -> str:
     TEMPLATE_BASE = r'''#!/usr/bin/env python3
     from manim import *
 
@@ -252,11 +334,12 @@ def strip_images_and_animations(py_src: str) -> str:
 
     # 路径 A
     try:
-        if hasattr(client, "responses"):
-            resp = client.responses.create(
+        if hasattr(_get_client(), "responses"):
+            resp = _get_client().responses.create(
                 model=MODEL,
                 input=[system_msg, prompt_user_msg],
-                temperature=0.0
+                temperature=0.0,
+                **_request_options(deadline)
             )
             out_text = ""
             if getattr(resp, "output", None):
@@ -276,10 +359,11 @@ def strip_images_and_animations(py_src: str) -> str:
 
     # 路径 B
     try:
-        resp = client.chat.completions.create(
+        resp = _get_client().chat.completions.create(
             model=MODEL,
             messages=[system_msg, prompt_user_msg],
-            temperature=0.0
+            temperature=0.0,
+            **_request_options(deadline)
         )
         if hasattr(resp, "choices"):
             ch0 = resp.choices[0]
@@ -295,15 +379,24 @@ def strip_images_and_animations(py_src: str) -> str:
     print("[WARN] 降级过程无法解析模型输出，返回原始文本，请手动处理 ERROR!!!")
     return py_src
 
-def main(py_file: str, scene: Optional[str] = SCENE, render_dir: Optional[str] = None):
+def main(py_file: str, scene: Optional[str] = SCENE, render_dir: Optional[str] = None,
+         page_timeout: Optional[float] = None) -> str:
+    """
+    调试并渲染一个页面
+
+    Returns:
+        "ok"（无需修复）/ "fixed" / "downgraded"（写出 .noimg_noanim.py）/ "failed" / "timeout"
+    """
+    deadline = time.monotonic() + page_timeout if page_timeout else None
+    media_dir = None
     if render_dir:
         media_dir = pathlib.Path(render_dir).resolve()
         media_dir.mkdir(parents=True, exist_ok=True)
     src = pathlib.Path(py_file).read_text(encoding="utf-8")
-    ok, log = run_manim(py_file, scene, media_dir)
+    ok, log = check_manim(py_file, scene, media_dir, deadline)
     if ok:
         print("[OK] 初次渲染成功")
-        return
+        return "ok"
 
     try:
         import manim
@@ -315,8 +408,12 @@ def main(py_file: str, scene: Optional[str] = SCENE, render_dir: Optional[str] =
 
     working_src = src
     for i in range(1, RETRY_MAX + 1):
+        if deadline is not None and time.monotonic() >= deadline:
+            print(f"[TIMEOUT] {py_file} 超过 {page_timeout}s，停止修复")
+            return "timeout"
         print(f"[INFO] 第 {i} 次 GPT 修复中…")
-        suggestion = call_gpt_fix(working_src, log, py_file, render_cmd, manim_version)
+        with _fix_slots or nullcontext():
+            suggestion = call_gpt_fix(working_src, log, py_file, render_cmd, manim_version, deadline)
 
         # 先直接抽完整文件
         full = extract_full_file_from_response(suggestion)
@@ -331,23 +428,32 @@ def main(py_file: str, scene: Optional[str] = SCENE, render_dir: Optional[str] =
         working_src = full
 
         pathlib.Path(py_file).write_text(working_src, encoding="utf-8")
-        ok, log = run_manim(py_file, scene, media_dir)
+        ok, log = check_manim(py_file, scene, media_dir, deadline)
         if ok:
             print(f"[OK] 修复成功（已覆盖原文件）：{py_file}")
-            return
+            return "fixed"
         else:
             print(f"[FAIL] 修复后仍报错，第 {i} 次失败。")
 
+    if deadline is not None and time.monotonic() >= deadline:
+        print(f"[TIMEOUT] {py_file} 超过 {page_timeout}s，停止修复")
+        return "timeout"
     # 进入最终降级：删图删动画
     print("[FALLBACK] {RETRY_MAX} 次失败，移除图片与动画指令。")
-    stripped = strip_images_and_animations(working_src)
+    with _fix_slots or nullcontext():
+        stripped = strip_images_and_animations(working_src, deadline)
+    if deadline is not None and time.monotonic() >= deadline:
+        print(f"[TIMEOUT] {py_file} 超过 {page_timeout}s，停止修复")
+        return "timeout"
     downgraded = py_file.replace(".py", ".noimg_noanim.py")
     pathlib.Path(downgraded).write_text(stripped, encoding="utf-8")
-    ok, log2 = run_manim(downgraded, scene, media_dir)
+    ok, log2 = check_manim(downgraded, scene, media_dir, deadline)
     if ok:
         print(f"[OK] 降级版本成功：{downgraded}")
+        return "downgraded"
     else:
         print(f"[ERROR] 连降级版本也失败，请人工查看：{downgraded}\n{log2}")
+        return "failed"
 
 #也可以直接运行：python auto_debug_manim.py  your_scene.py -s SceneClassName -r /path/to/media_dir
 if __name__ == "__main__":
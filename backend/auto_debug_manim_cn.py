@@ -1,21 +1,38 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import re, json, subprocess, pathlib, argparse
+import os, re, json, time, threading, subprocess, pathlib, argparse
+from contextlib import nullcontext
 from typing import Tuple, Optional
 from openai import OpenAI  # pip install openai>=1.40.0
 import asyncio
 from pool import load_keypool_from_config
 from providers import ProviderAdapter, VENDOR_BY_MODEL
+from hedging import HedgeBudget, settings_from_config
 from pathlib import Path
+from render_pool import render_in_pool
 #注意需要在/home/EduAgent/miniconda3/envs/manim_env下运行，因为那里manim版本是渲染的时候的版本，修复的时候也要确认manim版本
 RETRY_MAX = 3
 MODEL = "gpt-5"
 RENDER_TIMEOUT = 300  # 秒
+VALIDATE_TIMEOUT = 60  # 秒
 SCENE = None  # None则渲染文件内所有Scene
+# 修复过程只做快速校验，最后完整渲染一次（只为暴露运行期错误）；用预览质量渲染，成片质量只在预览确认后由
+# video_render_final 渲染。渲染结果不写入渲染缓存：之后 breakpoint / wait 阶段还会改写 .py，缓存键对不上
 MANIM_QUALITY = "l"  # ex: -qk (高清), -qm (中), -ql (低)
+VALIDATE_FIRST = True  # 完整渲染前先跳过全部动画执行一遍 construct，几秒内暴露代码异常
 VIDEO_FORMAT = "mp4"
 MAX_LINES = 30  #保留行数
 
+# 批量调试时由 batch_debug 设置：渲染（占 CPU）和 GPT 修复（受限流）分别限制并发，None 表示不限制
+_render_slots: Optional[threading.BoundedSemaphore] = None
+_fix_slots: Optional[threading.BoundedSemaphore] = None
+
+def set_concurrency(render: Optional[int] = None, fix: Optional[int] = None) -> None:
+    """设置进程内同时进行的渲染数和 GPT 修复请求数（0 / None 表示不限制）"""
+    global _render_slots, _fix_slots
+    _render_slots = threading.BoundedSemaphore(render) if render else None
+    _fix_slots = threading.BoundedSemaphore(fix) if fix else None
+
 # 注意：优先读 config_pool.json（如果没有，就退回 config.json）
 config_pool = pathlib.Path("config_pool.json")
 config_path = config_pool if config_pool.exists() else pathlib.Path("config.json")
@@ -52,61 +69,119 @@ def _norm_model(m: str) -> str:
 
 MODEL = _norm_model(_model_raw)
 
-# —— 初始化 KeyPool + ProviderAdapter（从当前 config 文件加载）——
-_pool = load_keypool_from_config(str(config_path))  # 你的 pool.load_keypool_from_config 已支持传路径
-_adapter = ProviderAdapter(_pool)
+# —— KeyPool + ProviderAdapter 在第一次修复请求时创建（从当前 config 文件加载）——
+# 渲染进程池以 spawn 启动 worker，worker 会重新 import __main__；放在模块顶层会让每个渲染进程都建一份 key 池和连接
+_adapter: Optional[ProviderAdapter] = None
+_adapter_lock = threading.Lock()
 
-# —— 一个同步包装，供下面函数直接调用 —— 
-def _chat_via_providers(messages):
-    return asyncio.run(_adapter.chat(messages, model=MODEL, max_retries=retry_max))
+def _get_adapter() -> ProviderAdapter:
+    global _adapter
+    if _adapter is None:
+        with _adapter_lock:
+            if _adapter is None:
+                _adapter = ProviderAdapter(load_keypool_from_config(str(config_path)))
+    return _adapter
 
+# 对冲配置（llm_settings.hedge）；预算按页面创建，见 main
+_hedge_settings = settings_from_config(cfg)
 
-def run_manim(py_path: str, scene: Optional[str], media_dir: Optional[str] = None) -> Tuple[bool, str]:
-    cmd = ["manim", f"-q{MANIM_QUALITY}", py_path]
-    if scene:
-        cmd.append(scene)
-    cmd += ["--format", VIDEO_FORMAT]
-    if media_dir:
+# —— 一个同步包装，供下面函数直接调用 —— 
+def _chat_via_providers(messages, hedge_budget: Optional[HedgeBudget] = None, deadline: Optional[float] = None):
+    """deadline 为本页截止时间（time.monotonic()），到时取消请求并抛 TimeoutError"""
+    timeout = None
+    if deadline is not None:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            raise TimeoutError("本页调试时间已用完")
+    chat = _get_adapter().chat(messages, model=MODEL, max_retries=retry_max, hedge_budget=hedge_budget)
+    return asyncio.run(asyncio.wait_for(chat, timeout))
+
+
+def cli_media_dir(py_path: str, media_dir: Optional[str] = None) -> Path:
+    """
+    CLI 回退时每页单独的 media 目录
+
+    同时调试的多个页面若共用一个 media_dir，manim 会在同一个 Tex 目录里编译并清理 LaTeX 中间文件，
+    互相删掉对方还没转换完的 .dvi / .svg（常驻渲染进程用 svg_cache 加锁处理，CLI 没有这层保护）。
+    """
+    return Path(media_dir or "media") / "pages" / Path(py_path).stem
+
+def run_manim(py_path: str, scene: Optional[str], media_dir: Optional[str] = None,
+              validate: bool = False, time_limit: Optional[float] = None) -> Tuple[bool, str]:
+    # validate：dry run 且从一个不存在的动画序号开始，construct 照常执行但跳过所有动画、不写视频
+    overrides = {"dry_run": True, "from_animation_number": 10 ** 9} if validate else None
+    timeout = VALIDATE_TIMEOUT if validate else RENDER_TIMEOUT
+    if time_limit is not None:
+        timeout = max(1, min(timeout, time_limit))
+    # 优先交给常驻渲染进程（已预先 import manim），不可用时回退到 CLI
+    pooled = render_in_pool(py_path, scene, MANIM_QUALITY, media_dir=media_dir, cwd=os.getcwd(),
+                            fmt=VIDEO_FORMAT, timeout=timeout, overrides=overrides)
+    if pooled is not None:
+        ok, out = pooled.ok, pooled.log
+    else:
+        cmd = ["manim", f"-q{MANIM_QUALITY}", py_path]
+        if scene:
+            cmd.append(scene)
+        cmd += ["--format", VIDEO_FORMAT]
+        if validate:
+            cmd += ["--dry_run", "-n", str(10 ** 9)]
+        media_dir = cli_media_dir(py_path, media_dir)
         cmd += ["--media_dir", str(media_dir)]
-    try:
-        p = subprocess.run(cmd, capture_output=True, text=True, timeout=RENDER_TIMEOUT)
+        try:
+            p = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired as e:
+            return False, f"[TIMEOUT] {e}\n{e.stdout or ''}\n{e.stderr or ''}"
         ok = (p.returncode == 0)
         out = (p.stdout or "") + "\n" + (p.stderr or "")
-        lines = out.splitlines()
-        if len(lines) > MAX_LINES:
-            out = "\n".join(lines[-MAX_LINES:])
-        # ====== 新增：根据目录结构判断渲染是否真正成功 ======
-        if ok and media_dir:
-            media_dir_path = Path(media_dir)
-            videos_root = media_dir_path / "videos"
-
-            # 当前 py 文件名，例如 1_1.py → "1_1"
-            module_name = Path(py_path).stem
-
-            # 目标目录：media/videos/<py文件名>/
-            module_dir = videos_root / module_name
-
-            mp4_candidates = []
-            if module_dir.exists():
-                # 在该模块目录下递归查找 mp4
-                for mp4_path in module_dir.rglob("*.mp4"):
-                    # 排除片段文件：partial_movie_files 下的是分段
-                    if "partial_movie_files" in mp4_path.parts:
-                        continue
-                    mp4_candidates.append(mp4_path)
-
-            # 如果在对应模块目录下找不到任何成品 mp4，则视为失败
-            if not mp4_candidates:
-                warn = (
-                    f"[WARN] manim 返回码为 0，但在 {module_dir} 下 "
-                    f"未找到任何成品 mp4（仅有 partial_movie_files 或完全无输出）；将视为渲染失败。"
-                )
-                out = out + "\n" + warn
-                ok = False
-        # ====== 新增结束 ======
+    lines = out.splitlines()
+    if len(lines) > MAX_LINES:
+        out = "\n".join(lines[-MAX_LINES:])
+    if validate:
         return ok, out
-    except subprocess.TimeoutExpired as e:
-        return False, f"[TIMEOUT] {e}\n{e.stdout or ''}\n{e.stderr or ''}"
+    # ====== 新增：根据目录结构判断渲染是否真正成功 ======
+    if ok and media_dir:
+        media_dir_path = Path(media_dir)
+        videos_root = media_dir_path / "videos"
+
+        # 当前 py 文件名，例如 1_1.py → "1_1"
+        module_name = Path(py_path).stem
+
+        # 目标目录：media/videos/<py文件名>/
+        module_dir = videos_root / module_name
+
+        mp4_candidates = []
+        if module_dir.exists():
+            # 在该模块目录下递归查找 mp4
+            for mp4_path in module_dir.rglob("*.mp4"):
+                # 排除片段文件：partial_movie_files 下的是分段
+                if "partial_movie_files" in mp4_path.parts:
+                    continue
+                mp4_candidates.append(mp4_path)
+
+        # 如果在对应模块目录下找不到任何成品 mp4，则视为失败
+        if not mp4_candidates:
+            warn = (
+                f"[WARN] manim 返回码为 0，但在 {module_dir} 下 "
+                f"未找到任何成品 mp4（仅有 partial_movie_files 或完全无输出）；将视为渲染失败。"
+            )
+            out = out + "\n" + warn
+            ok = False
+    # ====== 新增结束 ======
+    return ok, out
+
+def check_manim(py_path: str, scene: Optional[str], media_dir: Optional[str] = None,
+                deadline: Optional[float] = None) -> Tuple[bool, str]:
+    """先快速校验，通过后才完整渲染一次；完整渲染的报错同样返回给修复流程。deadline 为 time.monotonic() 截止时间"""
+    ok, log = False, ""
+    for validate in ((True, False) if VALIDATE_FIRST else (False,)):
+        with _render_slots or nullcontext():
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False, "[TIMEOUT] 本页调试时间已用完"
+            ok, log = run_manim(py_path, scene, media_dir, validate=validate, time_limit=remaining)
+        if not ok:
+            return ok, log
+    return ok, log
 
 def extract_full_file_from_response(text: str) -> Optional[str]:
     # 1) 优先：FILE_START … FILE_END 夹心（容忍前缀 <<<、END 后任意数量的 >，以及换行）
@@ -174,7 +249,8 @@ def _sanitize_extracted(code: str) -> str:
 
 
 
-def call_gpt_fix(source: str, errlog: str, file_path: str, render_cmd: str, manim_version: str) -> str:
+def call_gpt_fix(source: str, errlog: str, file_path: str, render_cmd: str, manim_version: str,
+                 hedge_budget: Optional[HedgeBudget] = None, deadline: Optional[float] = None) -> str:
     user_payload = f"""
     [环境]
     - manim 版本: {manim_version}
@@ -209,12 +285,13 @@ def call_gpt_fix(source: str, errlog: str, file_path: str, render_cmd: str, mani
 
     # —— 统一改为：走 ProviderAdapter（KeyPool）——
     try:
-        text = _chat_via_providers([system_msg, user_msg])
+        text = _chat_via_providers([system_msg, user_msg], hedge_budget, deadline)
         return text
     except Exception as e:
         return f"[ERROR] 调用 API 失败：{e}"
 
-def strip_images_and_animations(py_src: str) -> str:
+def strip_images_and_animations(py_src: str, hedge_budget: Optional[HedgeBudget] = None,
+                                deadline: Optional[float] = None) -> str:
     TEMPLATE_BASE = r'''#!/usr/bin/env python3
     from manim import *
 
@@ -351,7 +428,7 @@ def strip_images_and_animations(py_src: str) -> str:
 
     # —— 统一改为：走 ProviderAdapter（KeyPool）——
     try:
-        out_text = _chat_via_providers([system_msg, prompt_user_msg])
+        out_text = _chat_via_providers([system_msg, prompt_user_msg], hedge_budget, deadline)
         full = _extract(out_text)
         if full:
             return full
@@ -363,16 +440,26 @@ def strip_images_and_animations(py_src: str) -> str:
         print("[WARN] 降级过程无法解析模型输出，返回原始文本，请手动处理 ERROR!!!")
         return py_src
 
-def main(py_file: str, scene: Optional[str] = SCENE, render_dir: Optional[str] = None):
+def main(py_file: str, scene: Optional[str] = SCENE, render_dir: Optional[str] = None,
+         page_timeout: Optional[float] = None) -> str:
+    """
+    调试并渲染一个页面
+
+    Returns:
+        "ok"（无需修复）/ "fixed" / "downgraded"（降级版本覆盖原文件）/ "failed"（文件已删除）/ "timeout"
+    """
+    deadline = time.monotonic() + page_timeout if page_timeout else None
+    # 每页一份对冲预算（未配置时为 None）
+    hedge_budget = HedgeBudget.from_config(_hedge_settings)
     media_dir = None
     if render_dir:
         media_dir = pathlib.Path(render_dir).resolve()
         media_dir.mkdir(parents=True, exist_ok=True)
     src = pathlib.Path(py_file).read_text(encoding="utf-8")
-    ok, log = run_manim(py_file, scene, media_dir)
+    ok, log = check_manim(py_file, scene, media_dir, deadline)
     if ok:
         print("[OK] 初次渲染成功")
-        return
+        return "ok"
 
     try:
         import manim
@@ -385,8 +472,12 @@ def main(py_file: str, scene: Optional[str] = SCENE, render_dir: Optional[str] =
     working_src = src
     i = 1
     while i <= RETRY_MAX:
+        if deadline is not None and time.monotonic() >= deadline:
+            print(f"[TIMEOUT] {py_file} 超过 {page_timeout}s，停止修复")
+            return "timeout"
         print(f"[INFO] 第 {i} 次 GPT 修复中…")
-        suggestion = call_gpt_fix(working_src, log, py_file, render_cmd, manim_version)
+        with _fix_slots or nullcontext():
+            suggestion = call_gpt_fix(working_src, log, py_file, render_cmd, manim_version, hedge_budget, deadline)
 
         # 先直接抽完整文件
         full = extract_full_file_from_response(suggestion)
@@ -434,15 +525,22 @@ def main(py_file: str, scene: Optional[str] = SCENE, render_dir: Optional[str] =
 
 
         pathlib.Path(py_file).write_text(working_src, encoding="utf-8")
-        ok, log = run_manim(py_file, scene, media_dir)
+        ok, log = check_manim(py_file, scene, media_dir, deadline)
         if ok:
             print(f"[OK] 修复成功（已覆盖原文件）：{py_file}")
-            return
+            return "fixed"
         else:
             print(f"[FAIL] 修复后仍报错，第 {i-1} 次失败。")
     # 进入最终降级：删图删动画
+    if deadline is not None and time.monotonic() >= deadline:
+        print(f"[TIMEOUT] {py_file} 超过 {page_timeout}s，停止修复")
+        return "timeout"
     print(f"[FALLBACK] {retry_max} 次失败，移除图片与动画指令。")
-    stripped = strip_images_and_animations(working_src)
+    with _fix_slots or nullcontext():
+        stripped = strip_images_and_animations(working_src, hedge_budget, deadline)
+    if deadline is not None and time.monotonic() >= deadline:
+        print(f"[TIMEOUT] {py_file} 超过 {page_timeout}s，停止修复")
+        return "timeout"
     stripped = re.sub(
         r'(?m)^(?P<prefix>\s*bg\s*=\s*ImageMobject\(\s*)(?P<q>["\'])background_default\.png(?P=q)(?P<suffix>\s*\))',
         r'\g<prefix>\g<q>background_baodi.png\g<q>\g<suffix>',
@@ -452,11 +550,11 @@ def main(py_file: str, scene: Optional[str] = SCENE, render_dir: Optional[str] =
 
     # 覆盖原 py 文件，尝试用“无图/降级版本”再渲染一次
     Path(py_file).write_text(stripped, encoding="utf-8")
-    ok, log2 = run_manim(py_file, scene, media_dir)
+    ok, log2 = check_manim(py_file, scene, media_dir, deadline)
 
     if ok:
         print(f"[OK] 降级版本成功：{py_file}")
-        return
+        return "downgraded"
     else:
         print(f"[ERROR] 连降级版本也失败，将删除对应文件：{py_file}\n{log2}")
 
@@ -467,7 +565,7 @@ def main(py_file: str, scene: Optional[str] = SCENE, render_dir: Optional[str] =
         except Exception as e:
             # 这里不要再抛异常，否则有可能影响上层流程，打印 warning 即可
             print(f"[WARN] 删除降级失败文件时出错：{e}")
-        return
+        return "failed"
 
 #也可以直接运行：python auto_debug_manim.py  your_scene.py -s SceneClassName -r /path/to/media_dir
 if __name__ == "__main__":
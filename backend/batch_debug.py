@@ -1,30 +1,108 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import sys, pathlib
+"""
+批量调试目录下的 Manim 代码（页面并行）
+
+- 所有页面同时开始调试，一个坏页面不会挡住其他页面，整批耗时接近最慢的那一页
+- 渲染（占 CPU）和 GPT 修复（受厂商限流）分别限制并发
+- 可设置每页调试时间上限
+- 结束后按 无需修复 / 已修复 / 降级（.noimg_noanim.py）/ 失败 / 超时 分类汇总，并写入目录下的 debug_summary.json
+"""
+import os, sys, json, time, pathlib, argparse
+import concurrent.futures
+from typing import Dict, List, Optional
 import auto_debug_manim as adm  # 和auto_debug_manim.py 放在同一目录
+from render_pool import get_render_pool
+import tracing
 
-def main(folder: str, render_dir: str = None):
-    folder = pathlib.Path(folder)
-    files = sorted(folder.glob("*.py"))
-    for f in files:
-        if f.name in ("auto_debug_manim.py", "batch_debug.py"):
-            continue
-        if f.suffix != ".py":
-            continue
-        print(f"\n=== debug 处理 {f.name} ===")
+SKIP_FILES = {"auto_debug_manim.py", "batch_debug.py"}
+DEFAULT_FIX_WORKERS = 4
+# 同时进行的页面数上限（等待渲染 / 修复名额的页面只占一个空闲线程）
+MAX_PAGE_WORKERS = 64
+SUMMARY_FILE_NAME = "debug_summary.json"
+STATUSES = ("ok", "fixed", "downgraded", "failed", "timeout", "error")
+
+
+def _debug_one(f: pathlib.Path, render_dir: Optional[str], page_timeout: Optional[float]):
+    t0 = time.perf_counter()
+    print(f"\n=== debug 处理 {f.name} ===")
+    with tracing.span("debug", page=f.stem):
         try:
-            adm.main(str(f), render_dir=render_dir)
+            status = adm.main(str(f), render_dir=render_dir, page_timeout=page_timeout) or "ok"
         except Exception as e:
             print(f"[ERROR] {f}: {e}")
+            status = "error"
+        tracing.annotate(status=status)
+    return status, time.perf_counter() - t0
+
+
+def main(folder: str, render_dir: str = None, workers: Optional[int] = None, render_workers: Optional[int] = None,
+         fix_workers: Optional[int] = DEFAULT_FIX_WORKERS, page_timeout: Optional[float] = None) -> Dict[str, List[str]]:
+    """
+    并行调试目录下的所有页面
+
+    Args:
+        folder: 代码目录
+        render_dir: 渲染输出目录（--media_dir）
+        workers: 同时调试的页面数（默认全部页面，上限 MAX_PAGE_WORKERS）
+        render_workers: 同时渲染数（默认 CPU 核数）
+        fix_workers: 同时进行的 GPT 修复请求数
+        page_timeout: 每页调试时间上限（秒），None 表示不限制
+
+    Returns:
+        {状态: [文件名]}
+    """
+    folder = pathlib.Path(folder)
+    files = [f for f in sorted(folder.glob("*.py"))
+             if f.name not in SKIP_FILES and not f.name.endswith(".noimg_noanim.py")]
+    summary: Dict[str, List[str]] = {s: [] for s in STATUSES}
+    if not files:
+        print(f"在 {folder} 中未找到需要调试的文件")
+        return summary
+
+    render_workers = render_workers or os.cpu_count() or 1
+    workers = max(1, min(workers or len(files), MAX_PAGE_WORKERS))
+    adm.set_concurrency(render=render_workers, fix=fix_workers)
+    # 常驻渲染进程数与渲染并发一致（首次创建时生效）
+    get_render_pool(render_workers)
+    print(f"共 {len(files)} 个文件，{workers} 个页面并行，渲染并发 {render_workers}，GPT 修复并发 {fix_workers or '不限'}")
+
+    started = time.perf_counter()
+    seconds: Dict[str, float] = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        future_to_file = {executor.submit(tracing.bind(_debug_one), f, render_dir, page_timeout): f for f in files}
+        for future in concurrent.futures.as_completed(future_to_file):
+            f = future_to_file[future]
+            status, seconds[f.name] = future.result()
+            summary.setdefault(status, []).append(f.name)
+    elapsed = time.perf_counter() - started
+
+    print("\n调试完成")
+    for status in STATUSES:
+        if summary[status]:
+            print(f"{status}: {len(summary[status])} -> {', '.join(sorted(summary[status]))}")
+    slowest = max(seconds, key=seconds.get)
+    print(f"总耗时 {elapsed:.1f}s，最慢页面 {slowest} {seconds[slowest]:.1f}s")
+    try:
+        (folder / SUMMARY_FILE_NAME).write_text(json.dumps(
+            {"summary": {k: sorted(v) for k, v in summary.items()},
+             "seconds": {k: round(v, 2) for k, v in sorted(seconds.items())},
+             "elapsed": round(elapsed, 2)},
+            ensure_ascii=False, indent=2), encoding="utf-8")
+    except OSError as e:
+        print(f"[WARN] 写入 {SUMMARY_FILE_NAME} 失败: {e}")
+    return summary
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("参数不合法，正确用法: python batch_debug.py <文件夹路径>，<可选参数：渲染目录>")
-        sys.exit(1)
-    if len(sys.argv) == 2:
-        main(sys.argv[1])
-    if len(sys.argv) == 3:
-        main(sys.argv[1], sys.argv[2])
-    if len(sys.argv) > 3:
-        print("参数不合法，正确用法: python batch_debug.py <文件夹路径>，<可选参数：渲染目录>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="并行批量调试 Manim 代码")
+    parser.add_argument("folder", help="代码目录")
+    parser.add_argument("render_dir", nargs="?", default=None, help="可选：渲染目录")
+    parser.add_argument("--workers", type=int, default=None, help="同时调试的页面数（默认全部）")
+    parser.add_argument("--render-workers", type=int, default=None, help="同时渲染数（默认 CPU 核数）")
+    parser.add_argument("--fix-workers", type=int, default=DEFAULT_FIX_WORKERS, help="同时进行的 GPT 修复请求数")
+    parser.add_argument("--page-timeout", type=float, default=None, help="每页调试时间上限（秒）")
+    args = parser.parse_args()
+    with tracing.job(trace_dir=args.folder, stage="debug"):
+        result = main(args.folder, args.render_dir, args.workers, args.render_workers, args.fix_workers,
+                      args.page_timeout)
+    sys.exit(1 if result["failed"] or result["timeout"] or result["error"] else 0)
@@ -18,6 +18,8 @@ from io import BytesIO
 from pydub import AudioSegment 
 import time
 
+import tracing
+
 
 PUNCT_SPLIT_PATTERN = re.compile(r'([。！？!?.])')  # 中英标点都切
 SILENCE_MS = 130  # 静音时长（毫秒）
@@ -191,6 +193,7 @@ def _post_with_retry(url: str, headers: dict, json_payload: dict,
                 print(f"[!] TTS request failed after {max_retries} attempts: {e}")
                 return None
             sleep_time = 1.5 ** (attempt - 1)
+            tracing.record_retry(str(e))
             print(f"[!] TTS request error (attempt {attempt}/{max_retries}), "
                   f"retry after {sleep_time:.1f}s: {e}")
             time.sleep(sleep_time)
@@ -227,6 +230,81 @@ def tts_with_cloned_voice(
     return resp.json()
 
 
+@tracing.traced("tts")
+def synthesize_txt_file(api_key: str, voice_id: str, model: str, txt_path: Path, output_dir: Path):
+    """
+    把一页讲稿逐句合成并拼接为 wav，同时把时长追加到 output_dir/speech.txt
+
+    Args:
+        api_key / voice_id / model: MiniMax 参数
+        txt_path: 讲稿文件，输出 wav 与其同名
+        output_dir: 输出目录
+
+    耗时不再写入单独的时间日志：本函数是一个 "tts" span（页 id 为讲稿文件名），记录在当前任务的
+    trace.jsonl 中，任务结束时汇总到 trace_summary.json（见 tracing.job，main 以 output_dir 为 trace_dir 开启）。
+    """
+    tracing.annotate(page=txt_path.stem)
+    text = txt_path.read_text(encoding="utf-8").strip()
+    if not text:
+        print(f"[!] {txt_path.name} 是空的，跳过")
+        return
+    tracing.annotate(chars=len(text))
+
+    sentences = split_text_into_sentences(text)
+    print(f"[*] {txt_path.name} -> {len(sentences)} sentences")
+
+    full_audio = AudioSegment.silent(duration=0)
+
+    for idx, sent in enumerate(sentences, start=1):
+        print(f"    -> TTS sentence {idx}/{len(sentences)}")
+        tts_resp = tts_with_cloned_voice(
+            api_key=api_key,
+            voice_id=voice_id,
+            text=sent,
+            model=model,
+        )
+
+        if tts_resp is None:
+            # 超过最大重试次数仍失败：不报错，这一句用静音占位
+            print(f"[!] sentence {idx}/{len(sentences)} failed after retries, "
+                  f"use silence instead.")
+            seg = AudioSegment.silent(duration=SILENCE_MS * 4)
+        else:
+            seg = resp_to_audiosegment(tts_resp)
+            seg = add_edge_silence(seg, SILENCE_MS)
+
+        full_audio += seg
+
+    out_audio_path = output_dir / txt_path.stem
+    # 导出成 mp3
+    final_mp3_path = out_audio_path.with_suffix(".mp3")
+    full_audio.export(str(final_mp3_path), format="mp3")
+    # 再用 ffmpeg 显式转成 wav（16k 单声道，兼容性最好）
+    final_wav_path = out_audio_path.with_suffix(".wav")
+    os.system(
+        f"ffmpeg -y -i '{final_mp3_path}' '{final_wav_path}' >/dev/null 2>&1"
+    )
+    # >>> 在这里插入删除 mp3 的代码 <<<
+    try:
+        os.remove(final_mp3_path)
+    except Exception as e:
+        print(f"[!] delete mp3 failed: {e}")
+    # <<< 结束插入 >>>
+
+    # 去除拼接爆音 adeclick（先输出到临时文件，再覆盖原文件）
+    temp_wav = final_wav_path.with_name(final_wav_path.stem + "_tmp.wav")
+    os.system(f"ffmpeg -y -i '{final_wav_path}' -af adeclick '{temp_wav}' >/dev/null 2>&1")
+    os.replace(temp_wav, final_wav_path)  # 覆盖原 wav
+
+    # 追加写入一个 speech.txt，给后面的 pipeline 用
+    speech_txt_path = output_dir / "speech.txt"
+    duration_sec = len(full_audio) / 1000.0
+    with open(speech_txt_path, "a", encoding="utf-8") as f:
+        f.write(f"{final_wav_path.name}\t{duration_sec:.2f}\n")
+
+    print(f"[+] saved {out_audio_path}")
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Two-stage MiniMax voice cloning + batch TTS"
@@ -323,66 +401,9 @@ def main():
         print("没有找到任何 .txt 文件")
         return
 
-    for txt_path in txt_files:
-        text = txt_path.read_text(encoding="utf-8").strip()
-        if not text:
-            print(f"[!] {txt_path.name} 是空的，跳过")
-            continue
-
-        sentences = split_text_into_sentences(text)
-        print(f"[*] {txt_path.name} -> {len(sentences)} sentences")
-
-        full_audio = AudioSegment.silent(duration=0)
-
-        for idx, sent in enumerate(sentences, start=1):
-            print(f"    -> TTS sentence {idx}/{len(sentences)}")
-            tts_resp = tts_with_cloned_voice(
-                api_key=api_key,
-                voice_id=args.voice_id,
-                text=sent,
-                model=args.model,
-            )
-
-            if tts_resp is None:
-                # 超过最大重试次数仍失败：不报错，这一句用静音占位
-                print(f"[!] sentence {idx}/{len(sentences)} failed after retries, "
-                      f"use silence instead.")
-                seg = AudioSegment.silent(duration=SILENCE_MS * 4)
-            else:
-                seg = resp_to_audiosegment(tts_resp)
-                seg = add_edge_silence(seg, SILENCE_MS)
-
-            full_audio += seg
-
-        out_audio_path = output_dir / txt_path.stem
-        # 导出成 mp3
-        final_mp3_path = out_audio_path.with_suffix(".mp3")
-        full_audio.export(str(final_mp3_path), format="mp3")
-        # 再用 ffmpeg 显式转成 wav（16k 单声道，兼容性最好）
-        final_wav_path = out_audio_path.with_suffix(".wav")
-        os.system(
-            f"ffmpeg -y -i '{final_mp3_path}' '{final_wav_path}' >/dev/null 2>&1"
-        )
-        # >>> 在这里插入删除 mp3 的代码 <<<
-        try:
-            os.remove(final_mp3_path)
-        except Exception as e:
-            print(f"[!] delete mp3 failed: {e}")
-        # <<< 结束插入 >>>
-
-        # 去除拼接爆音 adeclick（先输出到临时文件，再覆盖原文件）
-        temp_wav = final_wav_path.with_name(final_wav_path.stem + "_tmp.wav")
-        os.system(f"ffmpeg -y -i '{final_wav_path}' -af adeclick '{temp_wav}' >/dev/null 2>&1")
-        os.replace(temp_wav, final_wav_path)  # 覆盖原 wav
-
-        # 追加写入一个 speech.txt，给后面的 pipeline 用
-        speech_txt_path = output_dir / "speech.txt"
-        duration_sec = len(full_audio) / 1000.0
-        with open(speech_txt_path, "a", encoding="utf-8") as f:
-            f.write(f"{final_wav_path.name}\t{duration_sec:.2f}\n")
-
-
-        print(f"[+] saved {out_audio_path}")
+    with tracing.job(trace_dir=str(output_dir), stage="tts"):
+        for txt_path in txt_files:
+            synthesize_txt_file(api_key, args.voice_id, args.model, txt_path, output_dir)
 
     print("[√] all done.")
 
@@ -21,6 +21,12 @@ import subprocess
 from pathlib import Path
 from typing import List, Tuple, Optional
 
+import tracing
+import svg_cache
+from render_pool import render_in_pool, get_render_pool
+from render_cache import get_render_cache, make_render_key
+from segment_render import render_segmented
+
 try:
     from tqdm import tqdm
     HAS_TQDM = True
@@ -31,7 +37,17 @@ except ImportError:
 class ManimBatchRenderer:
     """Manim 批量渲染器"""
     
-    def __init__(self, input_dir: str, output_dir: str, quality: str = "h"):
+    # Manim 默认输出路径中的质量目录
+    QUALITY_FOLDERS = {
+        'l': '480p15',
+        'm': '720p30',
+        'h': '1080p60',
+        'p': '1440p60',
+        'k': '2160p60'
+    }
+
+    def __init__(self, input_dir: str, output_dir: str, quality: str = "h", segments: Optional[bool] = None,
+                 pages: Optional[List[str]] = None):
         """
         初始化渲染器
         
@@ -39,10 +55,17 @@ class ManimBatchRenderer:
             input_dir: 包含 Manim 代码的输入文件夹
             output_dir: 视频输出文件夹
             quality: 渲染质量 (l, m, h, p, k)
+            segments: 是否按 BREAKPOINT 分段并行渲染长页面（默认取环境变量 MANIM_SEGMENT_RENDER）
+            pages: 只渲染这些页面（文件名，不含扩展名）；None 表示全部
         """
         self.input_dir = Path(input_dir).resolve()
         self.output_dir = Path(output_dir).resolve()
         self.quality = quality
+        if segments is None:
+            segments = os.environ.get("MANIM_SEGMENT_RENDER", "").lower() in ("1", "true", "yes")
+        self.segments = segments
+        self.pages = set(pages) if pages else None
+        self.cache = get_render_cache()
         
         # 创建输出目录
         self.output_dir.mkdir(parents=True, exist_ok=True)
@@ -84,6 +107,7 @@ class ManimBatchRenderer:
             print(f"错误: 解析文件 {python_file.name} 时出错: {e}")
             return []
     
+    @tracing.traced("render")
     def render_scene(self, python_file: Path, scene_class: str) -> Optional[Path]:
         """
         渲染单个 Manim 场景
@@ -95,38 +119,65 @@ class ManimBatchRenderer:
         Returns:
             生成的视频文件路径，如果失败则返回 None
         """
+        tracing.annotate(page=python_file.stem, scene=scene_class, quality=self.quality)
         try:
-            # 查找生成的视频文件
-            video_file = self.find_generated_video(python_file, scene_class)
-            if video_file:
-                return video_file
-            # 构建 manim 命令 (新版本格式)
-            cmd = [
-                "manim",
-                "render",  # 新版本需要 render 子命令
-                "-q", self.quality,  # 质量设置
-                str(python_file),
-                scene_class
-            ]
-            
-            # 执行渲染命令
-            result = subprocess.run(
-                cmd,
-                cwd=python_file.parent,  # 在文件所在目录执行
-                capture_output=True,
-                text=True,
-                timeout=300  # 5分钟超时
-            )
-            
-            if result.returncode != 0:
-                print(f"渲染失败: {python_file.name}")
-                if result.stderr:
-                    print(f"错误: {result.stderr}")
-                return None
+            # 按代码、资源、质量和 manim 版本查渲染缓存；改过的页面 key 不同，不会复用旧视频
+            cache_key = None
+            if self.cache is not None:
+                cache_key = make_render_key(python_file, scene_class, self.quality, cwd=python_file.parent)
+                cached = self.cache.get(cache_key)
+                tracing.annotate(render_cache="hit" if cached else "miss")
+                if cached:
+                    return cached
+            # 长页面按 BREAKPOINT 分段并行渲染，输出到 manim 默认位置；不适合分段时整页渲染
+            if self.segments:
+                target = (python_file.parent / "media" / "videos" / python_file.stem
+                          / self.QUALITY_FOLDERS.get(self.quality, '1080p60') / f"{scene_class}.mp4")
+                video_file = render_segmented(python_file, scene_class, self.quality, target)
+                if video_file:
+                    if cache_key is not None:
+                        self.cache.put(cache_key, video_file, label=f"{python_file.stem}:{scene_class}")
+                    return video_file
+
+            # 优先交给常驻渲染进程（已预先 import manim），不可用时回退到 CLI
+            pooled = render_in_pool(str(python_file), scene_class, self.quality,
+                                    cwd=str(python_file.parent), timeout=300)
+            if pooled is not None:
+                tracing.annotate(worker_cpu_s=round(pooled.cpu_s, 3))
+                if not pooled.ok:
+                    print(f"渲染失败: {python_file.name}")
+                    print(f"错误: {pooled.log[-2000:]}")
+                    return None
+            else:
+                # 构建 manim 命令 (新版本格式)
+                cmd = [
+                    "manim",
+                    "render",  # 新版本需要 render 子命令
+                    "-q", self.quality,  # 质量设置
+                    str(python_file),
+                    scene_class
+                ]
+
+                # 执行渲染命令
+                result = subprocess.run(
+                    cmd,
+                    cwd=python_file.parent,  # 在文件所在目录执行
+                    capture_output=True,
+                    text=True,
+                    timeout=300  # 5分钟超时
+                )
+
+                if result.returncode != 0:
+                    print(f"渲染失败: {python_file.name}")
+                    if result.stderr:
+                        print(f"错误: {result.stderr}")
+                    return None
             
             # 查找生成的视频文件
             video_file = self.find_generated_video(python_file, scene_class)
             if video_file:
+                if cache_key is not None:
+                    self.cache.put(cache_key, video_file, label=f"{python_file.stem}:{scene_class}")
                 return video_file
             else:
                 print(f"错误: 找不到生成的视频文件: {scene_class}")
@@ -151,14 +202,7 @@ class ManimBatchRenderer:
             视频文件路径，如果找不到则返回 None
         """
         # Manim 默认输出路径模式
-        quality_folder_map = {
-            'l': '480p15',
-            'm': '720p30', 
-            'h': '1080p60',
-            'p': '1440p60',
-            'k': '2160p60'
-        }
-        quality_folder = quality_folder_map.get(self.quality, '1080p60')
+        quality_folder = self.QUALITY_FOLDERS.get(self.quality, '1080p60')
         
         possible_paths = [
             # 新版 Manim Community 输出路径
@@ -213,6 +257,7 @@ class ManimBatchRenderer:
             print(f"错误: 复制视频文件失败: {e}")
             return False
     
+    @tracing.traced("render")
     def render_all(self) -> dict:
         """
         批量渲染所有 Manim 文件
@@ -222,6 +267,8 @@ class ManimBatchRenderer:
         """
         # 查找所有 Python 文件并按字母顺序排序
         python_files = sorted(list(self.input_dir.glob("*.py")), key=lambda x: x.name)
+        if self.pages is not None:
+            python_files = [f for f in python_files if f.stem in self.pages]
         
         if not python_files:
             print(f"错误: 在 {self.input_dir} 中没有找到 Python 文件")
@@ -282,6 +329,13 @@ class ManimBatchRenderer:
         print(f"成功: {success_count}")
         print(f"失败: {failed_count}")
         print(f"输出目录: {self.output_dir}")
+        if self.cache is not None:
+            stats = self.cache.stats()
+            print(f"渲染缓存: 命中 {stats['hits']}，未命中 {stats['misses']}，"
+                  f"缓存 {stats['entries']} 个视频 / {stats['size_bytes'] / 1024 / 1024:.1f} MB")
+        pool = get_render_pool()
+        if pool is not None and pool.svg_stats:
+            print(svg_cache.format_stats(pool.svg_stats))
         
         return {
             "total": total,
@@ -324,6 +378,19 @@ def main():
         help="渲染质量 (l=低质量, m=中质量, h=高质量, p=1440p, k=4K质量，默认: h)"
     )
     
+    parser.add_argument(
+        "--segments",
+        action="store_true",
+        default=None,
+        help="按 #BREAKPOINT 分段并行渲染长页面（无法安全分段时自动整页渲染）"
+    )
+    
+    parser.add_argument(
+        "--pages",
+        default=None,
+        help="只渲染指定页面，逗号分隔的文件名（不含扩展名），例如 1_1,2_3"
+    )
+    
     args = parser.parse_args()
     
     try:
@@ -331,10 +398,14 @@ def main():
         renderer = ManimBatchRenderer(
             input_dir=args.input_dir,
             output_dir=args.output_dir,
-            quality=args.quality
+            quality=args.quality,
+            segments=args.segments,
+            pages=[p.strip() for p in args.pages.split(",") if p.strip()] if args.pages else None
         )
         
-        results = renderer.render_all()
+        # 由 video_render_merge 调起时沿用其追踪文件，单独运行时写到输出目录
+        with tracing.job(trace_dir=args.output_dir, stage="render"):
+            results = renderer.render_all()
         
         # 根据结果设置退出码
         if results["failed"] == 0:
@@ -7,11 +7,18 @@ import re
 import shutil
 import subprocess
 import tempfile
+import time
 import uuid
 from pathlib import Path
 from typing import List, Optional
 import base64
 
+import svg_cache
+from render_pool import render_in_pool, get_render_pool
+from render_cache import get_render_cache, make_render_key
+from segment_render import render_segmented
+from render_scheduler import get_cost_model, plan_longest_first
+
 try:
     from tqdm import tqdm
     HAS_TQDM = True
@@ -20,11 +27,20 @@ except ImportError:
 
 
 class ParallelManimRenderer:
-    def __init__(self, input_dir: str, output_dir: str, quality: str, workers: int):
+    def __init__(self, input_dir: str, output_dir: str, quality: str, workers: int, segments: Optional[bool] = None,
+                 pages: Optional[List[str]] = None):
         self.input_dir = Path(input_dir).resolve()
         self.output_dir = Path(output_dir).resolve()
         self.quality = quality
         self.workers = max(1, workers)
+        # 是否按 BREAKPOINT 分段并行渲染长页面（默认取环境变量 MANIM_SEGMENT_RENDER）
+        if segments is None:
+            segments = os.environ.get("MANIM_SEGMENT_RENDER", "").lower() in ("1", "true", "yes")
+        self.segments = segments
+        # 只渲染这些页面（文件名，不含扩展名）；None 表示全部
+        self.pages = set(pages) if pages else None
+        self.cache = get_render_cache()
+        self.cost_model = get_cost_model()
         self.output_dir.mkdir(parents=True, exist_ok=True)
         if not self.input_dir.exists():
             raise FileNotFoundError(f"输入目录不存在: {self.input_dir}")
@@ -96,11 +112,14 @@ class ParallelManimRenderer:
             return False
 
     def _render_scene(self, python_file: Path, scene_class: str) -> Optional[Path]:
-        # 如果已存在生成的视频，直接返回
-        existing = self._find_generated_video(python_file, scene_class)
-        if existing:
-            copied = self._copy_video_to_output(existing, python_file)
-            return existing if copied else None
+        # 按代码、资源、质量和 manim 版本查渲染缓存；改过的页面 key 不同，不会复用旧视频
+        cache_key = None
+        if self.cache is not None:
+            cache_key = make_render_key(python_file, scene_class, self.quality, cwd=python_file.parent)
+            cached = self.cache.get(cache_key)
+            if cached:
+                copied = self._copy_video_to_output(cached, python_file)
+                return self.output_dir / f"{python_file.stem}{cached.suffix}" if copied else None
 
         # 为避免多个并发 manim 进程在同一 media/Tex 等中间文件上冲突，
         # 使用每个渲染任务独立的临时工作目录：
@@ -175,41 +194,69 @@ class ParallelManimRenderer:
                             except Exception:
                                 pass
 
-                cmd = [
-                    "manim",
-                    "render",
-                    "-q",
-                    self.quality,
-                    str(tmpdir_path / python_file.name),
-                    scene_class,
-                ]
-
-                try:
-                    result = subprocess.run(
-                        cmd,
-                        cwd=tmpdir_path,
-                        capture_output=True,
-                        text=True,
-                        timeout=1800,
-                    )
-                except subprocess.TimeoutExpired:
-                    print(f"渲染超时 {python_file.name} -> {scene_class}")
-                    return None
-                except Exception as exc:
-                    print(f"渲染异常 {python_file.name} -> {scene_class}: {exc}")
-                    return None
-
-                if result.returncode != 0:
-                    print(f"渲染失败 {python_file.name} -> {scene_class}")
-                    if result.stderr:
-                        print(result.stderr.strip())
-                    return None
-
-                # 在临时目录中查找生成的视频
-                temp_python = tmpdir_path / python_file.name
-                found = self._find_generated_video(temp_python, scene_class)
-                if not found:
-                    return None
+                # 长页面按 BREAKPOINT 分段并行渲染；不适合分段时整页渲染
+                found = None
+                # 实际渲染耗时（worker 上的执行时间，不含排队、分段预演和复制），供调度估算
+                render_seconds = 0.0
+                if self.segments:
+                    timings: List[float] = []
+                    found = render_segmented(tmpdir_path / python_file.name, scene_class, self.quality,
+                                             tmpdir_path / "segmented" / f"{scene_class}.mp4", cwd=tmpdir_path,
+                                             timings=timings)
+                    # 各段耗时之和近似整页单进程渲染的耗时
+                    render_seconds = sum(timings)
+                if found is None:
+                    # 优先交给常驻渲染进程（已预先 import manim），不可用时回退到 CLI
+                    pooled = render_in_pool(str(tmpdir_path / python_file.name), scene_class, self.quality,
+                                            cwd=str(tmpdir_path), timeout=1800, workers=self.workers)
+                    if pooled is not None:
+                        render_seconds = pooled.seconds
+                        if not pooled.ok:
+                            print(f"渲染失败 {python_file.name} -> {scene_class}")
+                            print(pooled.log.strip()[-2000:])
+                            return None
+                    else:
+                        cmd = [
+                            "manim",
+                            "render",
+                            "-q",
+                            self.quality,
+                            str(tmpdir_path / python_file.name),
+                            scene_class,
+                        ]
+
+                        t0 = time.perf_counter()
+                        try:
+                            result = subprocess.run(
+                                cmd,
+                                cwd=tmpdir_path,
+                                capture_output=True,
+                                text=True,
+                                timeout=1800,
+                            )
+                        except subprocess.TimeoutExpired:
+                            print(f"渲染超时 {python_file.name} -> {scene_class}")
+                            return None
+                        except Exception as exc:
+                            print(f"渲染异常 {python_file.name} -> {scene_class}: {exc}")
+                            return None
+                        render_seconds = time.perf_counter() - t0
+
+                        if result.returncode != 0:
+                            print(f"渲染失败 {python_file.name} -> {scene_class}")
+                            if result.stderr:
+                                print(result.stderr.strip())
+                            return None
+
+                    # 在临时目录中查找生成的视频
+                    temp_python = tmpdir_path / python_file.name
+                    found = self._find_generated_video(temp_python, scene_class)
+                    if not found:
+                        return None
+                # 记录实际渲染耗时，供下次调度估算
+                self.cost_model.record(python_file, self.quality, render_seconds)
+                if cache_key is not None:
+                    self.cache.put(cache_key, found, label=f"{python_file.stem}:{scene_class}")
 
                 # 将找到的视频复制到最终输出目录（原子复制）
                 copied = self._copy_video_to_output(found, python_file)
@@ -239,12 +286,19 @@ class ParallelManimRenderer:
 
     def render_all(self) -> dict:
         python_files = sorted(self.input_dir.glob("*.py"), key=lambda p: p.name)
+        if self.pages is not None:
+            python_files = [f for f in python_files if f.stem in self.pages]
         if not python_files:
             print(f"在 {self.input_dir} 中未找到 Python 文件")
             return {"total": 0, "success": 0, "failed": 0}
 
         total = len(python_files)
         print(f"找到 {total} 个文件，使用 {self.workers} 线并发渲染任务")
+        # 按估算耗时从长到短提交，避免长页面排在最后拖长整批时间
+        costs = {p: self.cost_model.estimate(p, self.quality) for p in python_files}
+        python_files, predicted = plan_longest_first(costs, self.workers)
+        print(f"预计总渲染量 {sum(costs.values()):.0f}s，{self.workers} 并发预计 {predicted:.0f}s 完成")
+        started = time.perf_counter()
 
         iterator = None
         if HAS_TQDM:
@@ -271,15 +325,24 @@ class ParallelManimRenderer:
 
         failed = total - success
         print("\n渲染完成")
+        print(f"用时: {time.perf_counter() - started:.0f}s")
         print(f"总数: {total}")
         print(f"成功: {success}")
         print(f"失败: {failed}")
         print(f"输出目录: {self.output_dir}")
+        if self.cache is not None:
+            stats = self.cache.stats()
+            print(f"渲染缓存: 命中 {stats['hits']}，未命中 {stats['misses']}，"
+                  f"缓存 {stats['entries']} 个视频 / {stats['size_bytes'] / 1024 / 1024:.1f} MB")
+        pool = get_render_pool()
+        if pool is not None and pool.svg_stats:
+            print(svg_cache.format_stats(pool.svg_stats))
         return {"total": total, "success": success, "failed": failed}
 
 
-def main(input_dir: str, output_dir: str, quality: str, workers: int) -> int:
-    renderer = ParallelManimRenderer(input_dir, output_dir, quality, workers)
+def main(input_dir: str, output_dir: str, quality: str, workers: int, segments: Optional[bool] = None,
+         pages: Optional[List[str]] = None) -> int:
+    renderer = ParallelManimRenderer(input_dir, output_dir, quality, workers, segments=segments, pages=pages)
     results = renderer.render_all()
     return 0 if results["failed"] == 0 else 1
 
@@ -290,10 +353,14 @@ if __name__ == "__main__":
     parser.add_argument("--output_dir", default="/home/LocalQwen3/model_test/1125_manim_coder_output_video", help="输出视频目录")
     parser.add_argument("--quality", "-q", choices=["l", "m", "h", "p", "k"], default="h", help="渲染质量")
     parser.add_argument("--workers", type=int, default=12, help="并行渲染任务数 (>=1)")
+    parser.add_argument("--segments", action="store_true", default=None,
+                        help="按 #BREAKPOINT 分段并行渲染长页面（无法安全分段时自动整页渲染）")
+    parser.add_argument("--pages", default=None, help="只渲染指定页面，逗号分隔的文件名（不含扩展名），例如 1_1,2_3")
     args = parser.parse_args()
 
     try:
-        exit_code = main(args.input_dir, args.output_dir, args.quality, args.workers)
+        pages = [p.strip() for p in args.pages.split(",") if p.strip()] if args.pages else None
+        exit_code = main(args.input_dir, args.output_dir, args.quality, args.workers, args.segments, pages=pages)
     except KeyboardInterrupt:
         print("\n用户中断操作")
         exit_code = 1
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+OpenAI 兼容 Batch API 的本地替身服务
+
+实现 llm_batch.LLMBatchJob 用到的接口：
+    POST /v1/files                 上传 JSONL（multipart）
+    GET  /v1/files/{id}/content    下载文件
+    POST /v1/batches               创建 batch
+    GET  /v1/batches/{id}          查询状态
+    POST /v1/batches/{id}/cancel   取消
+
+batch 在后台线程里逐条处理：
+- 指定 --upstream 时把每条请求转发给真实的 chat/completions 接口（可给不支持 batch 的代理做批量适配）
+- 否则返回回显内容，用于本地测试批量模式的提交、轮询与结果写回
+
+用法：
+    python batch_stub_server.py --port 18090
+    python batch_stub_server.py --port 18090 --upstream https://xxx.com/v1/ --upstream-key sk-xxx
+"""
+
+import re
+import json
+import time
+import uuid
+import argparse
+import threading
+import email.parser
+import email.policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+import httpx
+
+
+class BatchStore:
+    """内存中的文件与 batch 状态"""
+
+    def __init__(self, upstream: Optional[str] = None, upstream_key: Optional[str] = None, delay: float = 0.0):
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.upstream_key = upstream_key
+        self.delay = delay
+
+    def add_file(self, filename: str, data: bytes, purpose: str) -> Dict[str, Any]:
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        meta = {
+            "id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+            "filename": filename, "purpose": purpose, "status": "processed",
+        }
+        with self.lock:
+            self.files[file_id] = {"meta": meta, "data": data}
+        return meta
+
+    def create_batch(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+        batch = {
+            "id": batch_id, "object": "batch", "endpoint": payload.get("endpoint", "/v1/chat/completions"),
+            "input_file_id": payload["input_file_id"], "completion_window": payload.get("completion_window", "24h"),
+            "status": "validating", "created_at": int(time.time()), "output_file_id": None, "error_file_id": None,
+            "metadata": payload.get("metadata"), "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        with self.lock:
+            self.batches[batch_id] = batch
+        threading.Thread(target=self._process, args=(batch_id,), daemon=True).start()
+        return batch
+
+    def _complete_one(self, client: Optional[httpx.Client], body: Dict[str, Any]) -> Dict[str, Any]:
+        if client is not None:
+            r = client.post(f"{self.upstream}/chat/completions", json=body)
+            return {"status_code": r.status_code, "body": r.json()}
+        messages = body.get("messages") or []
+        last = messages[-1].get("content") if messages else ""
+        if isinstance(last, list):
+            last = "".join(p.get("text", "") for p in last if isinstance(p, dict))
+        return {
+            "status_code": 200,
+            "body": {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": f"[batch-echo] {str(last)[:200]}"}}],
+            },
+        }
+
+    def _process(self, batch_id: str):
+        batch = self.batches[batch_id]
+        lines = self.files[batch["input_file_id"]]["data"].decode("utf-8").splitlines()
+        requests = [json.loads(line) for line in lines if line.strip()]
+        batch["request_counts"]["total"] = len(requests)
+        batch["status"] = "in_progress"
+        client = None
+        if self.upstream:
+            headers = {"Authorization": f"Bearer {self.upstream_key}"} if self.upstream_key else {}
+            client = httpx.Client(headers=headers, timeout=1200)
+        outputs, errors = [], []
+        try:
+            for req in requests:
+                if batch["status"] == "cancelling":
+                    break
+                if self.delay:
+                    time.sleep(self.delay)
+                try:
+                    response = self._complete_one(client, req.get("body") or {})
+                    outputs.append({"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": req.get("custom_id"),
+                                    "response": response, "error": None})
+                    batch["request_counts"]["completed"] += 1
+                except Exception as e:
+                    errors.append({"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": req.get("custom_id"),
+                                   "response": None, "error": {"message": str(e)}})
+                    batch["request_counts"]["failed"] += 1
+        finally:
+            if client is not None:
+                client.close()
+
+        def _dump(items):
+            return ("\n".join(json.dumps(i, ensure_ascii=False) for i in items) + "\n").encode("utf-8")
+
+        if outputs:
+            batch["output_file_id"] = self.add_file(f"{batch_id}_output.jsonl", _dump(outputs), "batch_output")["id"]
+        if errors:
+            batch["error_file_id"] = self.add_file(f"{batch_id}_errors.jsonl", _dump(errors), "batch_output")["id"]
+        batch["status"] = "cancelled" if batch["status"] == "cancelling" else "completed"
+        batch["completed_at"] = int(time.time())
+
+
+class _Handler(BaseHTTPRequestHandler):
+    store: BatchStore = None
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, obj: Any, status: int = 200):
+        data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_GET(self):
+        m = re.fullmatch(r"/(?:v1/)?files/([^/]+)/content", self.path)
+        if m and m.group(1) in self.store.files:
+            data = self.store.files[m.group(1)]["data"]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        m = re.fullmatch(r"/(?:v1/)?batches/([^/]+)", self.path)
+        if m and m.group(1) in self.store.batches:
+            return self._send_json(self.store.batches[m.group(1)])
+        self._send_json({"error": {"message": "not found"}}, 404)
+
+    def do_POST(self):
+        path = self.path
+        if re.fullmatch(r"/(?:v1/)?files", path):
+            raw = (f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n").encode("utf-8") + self._body()
+            msg = email.parser.BytesParser(policy=email.policy.default).parsebytes(raw)
+            fields: Dict[str, Any] = {}
+            filename = "upload.jsonl"
+            for part in msg.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                if part.get_filename():
+                    filename = part.get_filename()
+                fields[name] = part.get_payload(decode=True)
+            meta = self.store.add_file(filename, fields.get("file") or b"",
+                                       (fields.get("purpose") or b"batch").decode("utf-8"))
+            return self._send_json(meta)
+        if re.fullmatch(r"/(?:v1/)?batches", path):
+            payload = json.loads(self._body() or b"{}")
+            if payload.get("input_file_id") not in self.store.files:
+                return self._send_json({"error": {"message": "input file not found"}}, 400)
+            return self._send_json(self.store.create_batch(payload))
+        m = re.fullmatch(r"/(?:v1/)?batches/([^/]+)/cancel", path)
+        if m and m.group(1) in self.store.batches:
+            batch = self.store.batches[m.group(1)]
+            if batch["status"] not in ("completed", "failed", "expired", "cancelled"):
+                batch["status"] = "cancelling"
+            return self._send_json(batch)
+        self._send_json({"error": {"message": "not found"}}, 404)
+
+
+def serve(port: int = 18090, upstream: Optional[str] = None, upstream_key: Optional[str] = None,
+          delay: float = 0.0, background: bool = False) -> ThreadingHTTPServer:
+    """
+    启动替身服务
+
+    Args:
+        port: 监听端口
+        upstream: 转发目标的 base_url（不指定时回显）
+        upstream_key: 转发时使用的 API key
+        delay: 每条请求的模拟处理耗时（秒）
+        background: 是否在后台线程运行（测试中使用）
+    """
+    handler = type("BatchHandler", (_Handler,), {"store": BatchStore(upstream, upstream_key, delay)})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        print(f"Batch stub server listening on http://127.0.0.1:{port}/v1/")
+        server.serve_forever()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for an OpenAI-compatible batch endpoint")
+    parser.add_argument("--port", type=int, default=18090, help="Port to listen on")
+    parser.add_argument("--upstream", default=None, help="Forward each request to this chat base_url")
+    parser.add_argument("--upstream-key", default=None, help="API key for the upstream endpoint")
+    parser.add_argument("--delay", type=float, default=0.0, help="Simulated seconds per request")
+    args = parser.parse_args()
+    serve(args.port, args.upstream, args.upstream_key, args.delay)
+
+
+if __name__ == "__main__":
+    main()
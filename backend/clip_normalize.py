@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+串联前统一片段的编码参数，保证 concat demuxer 可以直接流拷贝
+
+concat demuxer + -c copy 要求所有片段的流参数完全一致：帧率、时间基、profile、分辨率、像素格式不同会得到错乱的
+时间戳，音频采样率 / 声道不同会在拼接处出错。封面 / 片尾（render_cover.py）、gif 转出的片段、用不同 -q 渲染的页面
+都可能和主体不一致。这里：
+
+1. 一次性（并发）探测所有片段的流参数
+2. 以多数片段的参数为标准（视频非 h264 时改为 8-bit h264 High，音频固定为 aac），只对不一致的片段重新编码，其余原样使用
+3. 重新探测确认全部一致后，串联就是纯粹的重新封装
+
+仍无法确认一致时（探测或统一编码失败）不能再用 -c copy，改用 reencode_concat：concat 滤镜统一分辨率 / 帧率 /
+音频参数后整体编码一次。
+"""
+
+import os
+import json
+import shutil
+import subprocess
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import page_mux
+
+FFMPEG = os.environ.get("FFMPEG_BIN") or shutil.which("ffmpeg") or "/home/EduAgent/miniconda3/envs/manim_env/bin/ffmpeg"
+
+# 统一编码时的 x264 crf，与 manim 输出保持一致
+CONFORM_CRF = int(os.environ.get("CONFORM_CRF", "23"))
+# 拼接前需要一致的视频 / 音频流参数
+VIDEO_KEYS = ("codec_name", "profile", "width", "height", "pix_fmt", "r_frame_rate", "time_base")
+AUDIO_KEYS = ("codec_name", "sample_rate", "channels")
+NORMALIZED_DIR_NAME = "normalized"
+
+Signature = Tuple[Tuple, Optional[Tuple]]
+
+
+def probe_streams(path: str) -> Optional[Dict]:
+    """
+    读取首个视频流和首个音频流的参数
+
+    Returns:
+        {"video": {...}, "audio": {...} 或 None, "duration": 秒或 None}；没有视频流或探测失败返回 None
+    """
+    cmd = [page_mux.FFPROBE, "-v", "error",
+           "-show_entries", "stream=codec_type," + ",".join(sorted(set(VIDEO_KEYS + AUDIO_KEYS)))
+           + ":format=duration",
+           "-of", "json", path]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        data = json.loads(result.stdout or "{}")
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError) as e:
+        print(f"⚠️  读取流参数失败: {os.path.basename(path)} - {e}")
+        return None
+    streams = data.get("streams") or []
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    if video is None:
+        return None
+    try:
+        duration = float((data.get("format") or {}).get("duration"))
+    except (TypeError, ValueError):
+        duration = None
+    return {"video": video, "audio": audio, "duration": duration}
+
+
+def signature(info: Dict) -> Signature:
+    """片段可否直接拼接只取决于这组参数"""
+    video = tuple(str(info["video"].get(k)) for k in VIDEO_KEYS)
+    audio = tuple(str(info["audio"].get(k)) for k in AUDIO_KEYS) if info.get("audio") else None
+    return video, audio
+
+
+# ffprobe 的 profile 名（小写） -> libx264 的 -profile:v 取值
+X264_PROFILES = {"constrained baseline": "baseline", "baseline": "baseline", "main": "main",
+                 "high": "high", "high 10": "high10", "high 4:2:2": "high422", "high 4:4:4 predictive": "high444"}
+
+
+def is_high_bit_depth(pix_fmt: Optional[str]) -> bool:
+    """像素格式是否超过 8-bit（如 yuv420p10le）"""
+    return any(f"p{bits}" in (pix_fmt or "") for bits in (9, 10, 12, 14, 16))
+
+
+def x264_profile(profile: Optional[str], pix_fmt: Optional[str] = None) -> str:
+    """
+    ffprobe 的 profile 名转成 libx264 的 -profile:v 取值
+
+    Args:
+        profile: ffprobe 报告的 profile
+        pix_fmt: 目标像素格式；profile 无法识别时按位深选择（8-bit 的 high 无法编码 10-bit 输入）
+    """
+    known = X264_PROFILES.get((profile or "").lower())
+    if known:
+        return known
+    return "high10" if is_high_bit_depth(pix_fmt) else "high"
+
+
+def choose_target(infos: Sequence[Dict]) -> Signature:
+    """
+    以最多片段共有的参数为标准（并列时取靠前的）
+
+    视频不是 h264 时改为 8-bit h264 High（yuv420p）；音频固定为 aac，与 conform 的编码器一致，
+    否则以 mp3 等为标准时统一后的片段永远对不上标准
+    """
+    counts = Counter(signature(info) for info in infos)
+    order = {}
+    for info in infos:
+        order.setdefault(signature(info), len(order))
+    video, audio = max(counts, key=lambda sig: (counts[sig], -order[sig]))
+    if video[0] != "h264":
+        video = ("h264", "High") + video[2:4] + ("yuv420p",) + video[5:]
+    # 只要有片段带音频，标准就带音频（没有音轨的片段补静音），否则拼接后音轨会缺段
+    if audio is None:
+        audio = next((signature(info)[1] for info in infos if info.get("audio")), None)
+    if audio is not None and audio[0] != "aac":
+        audio = ("aac",) + audio[1:]
+    return video, audio
+
+
+def conform(src: str, dst: str, target: Signature, has_audio: bool) -> bool:
+    """
+    按标准参数重新编码一个片段
+
+    Args:
+        src: 原片段
+        dst: 输出路径
+        target: choose_target 的结果
+        has_audio: 原片段是否有音轨（没有且标准需要时补静音）
+    """
+    video, audio = target
+    params = dict(zip(VIDEO_KEYS, video))
+    width, height = params["width"], params["height"]
+    cmd = [FFMPEG, "-y", "-loglevel", "error", "-i", src]
+    if audio and not has_audio:
+        cmd += ["-f", "lavfi", "-i", f"anullsrc=r={audio[1]}:cl={'mono' if audio[2] == '1' else 'stereo'}"]
+    cmd += [
+        "-map", "0:v:0",
+        "-vf", f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+               f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,"
+               f"fps={params['r_frame_rate']},format={params['pix_fmt']}",
+        "-c:v", "libx264", "-profile:v", x264_profile(params["profile"], params["pix_fmt"]), "-crf", str(CONFORM_CRF),
+        "-video_track_timescale", params["time_base"].split("/")[-1],
+    ]
+    if audio:
+        cmd += ["-map", "0:a:0" if has_audio else "1:a", "-c:a", "aac", "-ar", audio[1], "-ac", audio[2]]
+        if not has_audio:
+            cmd += ["-shortest"]
+    else:
+        cmd += ["-an"]
+    cmd += [dst]
+    try:
+        subprocess.run(cmd, capture_output=True, text=True, check=True)
+        return os.path.exists(dst)
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        print(f"❌ 统一编码失败: {os.path.basename(src)} - {getattr(e, 'stderr', e)}")
+        return False
+
+
+def normalize_clips(paths: Sequence[str], work_dir: str) -> Tuple[List[str], bool]:
+    """
+    只重新编码参数与标准不一致的片段
+
+    Args:
+        paths: 按播放顺序排列的片段
+        work_dir: 统一后片段的输出目录（原片段不会被修改）
+
+    Returns:
+        (可直接拼接的片段列表（与 paths 一一对应）, 是否确认可以流拷贝)
+    """
+    probed = page_mux.probe_many(paths, probe=probe_streams)
+    if any(probed[p] is None for p in paths):
+        return list(paths), False
+    target = choose_target([probed[p] for p in paths])
+    mismatched = [p for p in dict.fromkeys(paths) if signature(probed[p]) != target]
+    if not mismatched:
+        print(f"✅ {len(paths)} 个片段编码参数一致，可直接流拷贝")
+        return list(paths), True
+
+    print(f"🔧 {len(mismatched)}/{len(paths)} 个片段编码参数不一致，统一为 "
+          f"{target[0][2]}x{target[0][3]} {target[0][5]}fps {target[0][1]}"
+          + (f"，音频 {target[1][1]}Hz/{target[1][2]}ch" if target[1] else ""))
+    os.makedirs(work_dir, exist_ok=True)
+    replaced = {p: os.path.join(work_dir, f"{i:03d}_{os.path.basename(p)}") for i, p in enumerate(paths)
+                if p in mismatched}
+    jobs = [(os.path.basename(replaced[p]), conform, (p, replaced[p], target, probed[p]["audio"] is not None))
+            for p in mismatched]
+    _, failed = page_mux.mux_pages(jobs, label="统一编码")
+    result = [replaced.get(p, p) for p in paths]
+    if failed:
+        return result, False
+
+    # 重新探测统一后的片段，确认整体可以流拷贝
+    reprobed = page_mux.probe_many(replaced.values(), probe=probe_streams)
+    bad = [p for p in reprobed if reprobed[p] is None or signature(reprobed[p]) != target]
+    for p in bad:
+        print(f"⚠️  统一后参数仍不一致: {os.path.basename(p)}")
+    return result, not bad
+
+
+def _unquote(token: str) -> str:
+    """按 concat demuxer 的规则去掉引号：单引号内原样保留，引号外反斜杠转义下一个字符（'\\'' 即一个单引号）"""
+    out, quoted, i = [], False, 0
+    while i < len(token):
+        c = token[i]
+        if c == "'":
+            quoted = not quoted
+        elif c == "\\" and not quoted and i + 1 < len(token):
+            i += 1
+            out.append(token[i])
+        else:
+            out.append(c)
+        i += 1
+    return "".join(out)
+
+
+def read_filelist(filelist_path: str) -> List[str]:
+    """读取 concat 列表中的片段路径（相对路径相对列表所在目录）"""
+    base_dir = os.path.dirname(os.path.abspath(filelist_path))
+    with open(filelist_path, "r", encoding="utf-8") as f:
+        entries = [_unquote(line.strip()[5:].strip()) for line in f if line.strip().startswith("file ")]
+    return [os.path.join(base_dir, entry) for entry in entries]
+
+
+def normalize_filelist(filelist_path: str) -> bool:
+    """
+    统一 concat 列表（`file <路径>` 每行一个，相对路径相对列表所在目录）中的片段，必要时改写列表
+
+    Returns:
+        是否确认可以流拷贝
+    """
+    paths = read_filelist(filelist_path)
+    if not paths:
+        return False
+    base_dir = os.path.dirname(os.path.abspath(filelist_path))
+    result, safe = normalize_clips(paths, os.path.join(base_dir, NORMALIZED_DIR_NAME))
+    if result != paths:
+        with open(filelist_path, "w", encoding="utf-8") as f:
+            f.writelines(page_mux.concat_list_line(p) for p in result)
+    return safe
+
+
+def reencode_command(paths: Sequence[str], infos: Sequence[Dict], output_file: str) -> List[str]:
+    """
+    concat 滤镜串联并整体编码一次的命令（片段参数不一致、不能流拷贝时使用）
+
+    Args:
+        paths: 按播放顺序排列的片段
+        infos: 与 paths 对应的 probe_streams 结果（需要 duration）
+        output_file: 输出文件
+
+    Returns:
+        ffmpeg 参数列表
+    """
+    video, audio = choose_target(infos)
+    params = dict(zip(VIDEO_KEYS, video))
+    width, height = params["width"], params["height"]
+    cmd = [FFMPEG, "-y", "-loglevel", "error"]
+    for path in paths:
+        cmd += ["-i", path]
+    filters, labels = [], []
+    for i, info in enumerate(infos):
+        duration = f"{info['duration']:.6f}"
+        filters.append(
+            f"[{i}:v:0]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={params['r_frame_rate']},format=yuv420p,"
+            f"trim=end={duration},setpts=PTS-STARTPTS[v{i}]"
+        )
+        labels.append(f"[v{i}]")
+        if audio:
+            layout = "mono" if audio[2] == "1" else "stereo"
+            # 没有音轨的片段补同样时长的静音，concat 滤镜要求每段都有音频
+            source = (f"[{i}:a:0]aresample={audio[1]},aformat=channel_layouts={layout},apad"
+                      if info.get("audio") else f"anullsrc=r={audio[1]}:cl={layout}")
+            filters.append(f"{source},atrim=end={duration},asetpts=PTS-STARTPTS[a{i}]")
+            labels.append(f"[a{i}]")
+    outputs = "[vout][aout]" if audio else "[vout]"
+    filters.append("".join(labels) + f"concat=n={len(paths)}:v=1:a={1 if audio else 0}{outputs}")
+    cmd += ["-filter_complex", ";".join(filters), "-map", "[vout]"]
+    cmd += ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-crf", str(CONFORM_CRF)]
+    if audio:
+        cmd += ["-map", "[aout]", "-c:a", "aac"]
+    cmd += [output_file]
+    return cmd
+
+
+def reencode_concat(filelist_path: str, output_file: str) -> bool:
+    """
+    按 concat 列表的顺序重新编码串联（normalize_filelist 无法确认可以流拷贝时代替 -c copy）
+
+    Returns:
+        是否成功
+    """
+    paths = read_filelist(filelist_path)
+    if not paths:
+        return False
+    probed = page_mux.probe_many(paths, probe=probe_streams)
+    unreadable = [p for p in paths if probed[p] is None or not probed[p].get("duration")]
+    if unreadable:
+        print(f"❌ 无法读取片段时长，不能重新编码串联: {', '.join(os.path.basename(p) for p in unreadable)}")
+        return False
+    print(f"🔧 {len(paths)} 个片段参数不一致，重新编码串联")
+    cmd = reencode_command(paths, [probed[p] for p in paths], output_file)
+    try:
+        subprocess.run(cmd, capture_output=True, text=True, check=True)
+        return os.path.exists(output_file)
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        print(f"❌ 重新编码串联失败: {e}")
+        print(f"   错误输出: {getattr(e, 'stderr', '')}")
+        return False
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+流式代码提取
+
+生成代码的调用（Page_Coder、manim2pptx、自动修复）不再等完整回复后才提取代码：
+1. 边收边找代码起始标记（```python / <<<FILE_START），读到结束标记（``` / FILE_END>>>）立即关闭流，
+   结束标记之后的解释文字不再生成，省输出 token 和时间
+2. 每收到若干整行就对已收到的部分代码做增量语法检查（codeop：未写完返回「不完整」，写错才报错），
+   一旦出现无法通过续写修复的语法错误就中止本次生成并重新请求，不必等到渲染时才发现
+
+返回的是截止到结束标记的原始文本，调用方继续用 extract_code_block / extract_full_file_from_response 提取。
+"""
+
+import re
+import codeop
+import textwrap
+import warnings
+from typing import Callable, Iterable, Optional, Tuple
+
+FENCE = "fence"   # ```python ... ```
+FILE = "file"     # <<<FILE_START ... FILE_END>>>
+
+_START_PATTERNS = {
+    FENCE: re.compile(r"```[ \t]*(?:python|py|python3)?[ \t]*\n", re.I),
+    FILE: re.compile(r"<<<\s*FILE_START[> \t]*\n"),
+}
+_END_PATTERNS = {
+    FENCE: re.compile(r"\n[ \t]*```"),
+    FILE: re.compile(r"(?:<<<\s*)?FILE_END"),
+}
+# 截断后补上的规范结束标记，保证原有的 extract_* 正则能匹配
+_END_MARKERS = {FENCE: "\n```", FILE: "\nFILE_END>>>"}
+# 没有任何标记、直接以代码开头的回复（Page_Coder 常见），视为从头开始的代码
+_BARE_CODE_START = re.compile(r"^\s*(?:from\s|import\s|class\s|def\s|@)")
+# 以 # 开头的回复可能是 markdown 标题（"# Fixed code"）后接代码块，读完仍没有代码块时才视为裸代码
+_COMMENT_START = re.compile(r"^\s*#")
+# 结束标记最长的字符数，增量查找时回看这么多字符，避免标记被切在两个片段之间
+_MARKER_LOOKBEHIND = 16
+
+
+def check_partial_syntax(code: str) -> Optional[SyntaxError]:
+    """
+    检查一段可能没写完的 Python 代码
+
+    Args:
+        code: 已收到的代码（只包含完整的行）
+
+    Returns:
+        出现无法续写修复的语法错误时返回 SyntaxError，合法或尚未写完返回 None
+    """
+    src = textwrap.dedent(code)
+    if not src.strip():
+        return None
+    with warnings.catch_warnings():
+        # manim 代码里大量 LaTeX 字符串，无效转义的 SyntaxWarning 不算错误
+        warnings.simplefilter("ignore")
+        try:
+            codeop.compile_command(src, "<stream>", "exec")
+        except SyntaxError as e:
+            return e
+        except (ValueError, OverflowError):
+            return None
+    return None
+
+
+class StreamingCodeExtractor:
+    """逐片段接收模型输出，识别代码块边界并做增量语法检查"""
+
+    def __init__(self, marker: str = FENCE, validate: bool = True, check_every: int = 8,
+                 stop_on_error: bool = True):
+        """
+        Args:
+            marker: FENCE（markdown 代码块）或 FILE（<<<FILE_START ... FILE_END>>>）
+            validate: 是否做增量语法检查
+            check_every: 每新增多少个完整行检查一次（检查的是全部已收到的代码）
+            stop_on_error: 发现语法错误时是否立即停止读取（否则只记录错误，继续读到结束标记）
+        """
+        if marker not in _START_PATTERNS:
+            raise ValueError(f"unknown marker: {marker}")
+        self.marker = marker
+        self.validate = validate
+        self.check_every = max(1, check_every)
+        self.stop_on_error = stop_on_error
+        self.text = ""
+        self.code_start: Optional[int] = None
+        self.code_end: Optional[int] = None
+        self.end_index: Optional[int] = None
+        self.syntax_error: Optional[SyntaxError] = None
+        # 代码没有起始标记，从回复开头算起
+        self.bare = False
+        self._scan_pos = 0
+        self._checked_lines = 0
+
+    @property
+    def finished(self) -> bool:
+        """已读到结束标记"""
+        return self.end_index is not None
+
+    @property
+    def code(self) -> str:
+        if self.code_start is None:
+            return ""
+        end = self.code_end if self.code_end is not None else len(self.text)
+        return self.text[self.code_start:end]
+
+    def result_text(self) -> str:
+        """截止到结束标记（含，规范化写法）的原始文本；没有读到结束标记时为全部文本"""
+        if self.code_end is None:
+            return self.text
+        return self.text[:self.code_end] + _END_MARKERS[self.marker]
+
+    def feed(self, piece: str) -> bool:
+        """
+        接收一个片段
+
+        Returns:
+            True 表示应当停止读取（已读到结束标记，或出现语法错误）
+        """
+        if self.finished or (self.syntax_error is not None and self.stop_on_error):
+            return True
+        self.text += piece
+
+        if self.code_start is None:
+            m = _START_PATTERNS[self.marker].search(self.text)
+            if m:
+                self.code_start = m.end()
+            elif self.marker == FENCE and _BARE_CODE_START.match(self.text) and "\n" in self.text:
+                self.code_start = 0
+                self.bare = True
+            else:
+                return False
+            # 从起始标记末尾的换行开始找，空代码块也能识别
+            self._scan_pos = max(0, self.code_start - 1)
+
+        m = _END_PATTERNS[self.marker].search(self.text, self._scan_pos)
+        if m and self.bare:
+            # 裸代码之后的 ``` 也可能是代码块的起始标记（```python），等这一行收完再判断
+            line_end = self.text.find("\n", m.end())
+            if line_end < 0:
+                return False
+            if self.text[m.end():line_end].strip():
+                self._restart(line_end + 1)
+                return self.feed("")
+        if m:
+            self.code_end = max(m.start(), self.code_start)
+            self.end_index = m.end()
+            if self.validate and self.syntax_error is None:
+                # 代码已完整：最终检查一次（此时「未写完」也视为错误）
+                self.syntax_error = self._check_complete(self.code)
+            return True
+        self._scan_pos = max(0, self.code_start - 1, len(self.text) - _MARKER_LOOKBEHIND)
+
+        if self.validate and self.syntax_error is None:
+            body = self.text[self.code_start:]
+            complete = body[:body.rfind("\n") + 1]
+            lines = complete.count("\n")
+            if lines - self._checked_lines >= self.check_every:
+                self._checked_lines = lines
+                self.syntax_error = check_partial_syntax(complete)
+                if self.syntax_error is not None and self.stop_on_error:
+                    return True
+        return False
+
+    def _restart(self, code_start: int):
+        """之前当作裸代码的内容其实在代码块之前：从代码块起始标记之后重新开始"""
+        self.code_start = code_start
+        self.bare = False
+        self.syntax_error = None
+        self._scan_pos = max(0, code_start - 1)
+        self._checked_lines = 0
+
+    def finish(self):
+        """流自然结束（没有结束标记，例如被 max_tokens 截断）时检查剩余的行"""
+        if self.code_start is None and self.marker == FENCE and _COMMENT_START.match(self.text):
+            self.code_start = 0
+            self.bare = True
+        if self.bare and not self.finished:
+            # 最后一行是不带换行的 ```
+            m = _END_PATTERNS[FENCE].search(self.text, self._scan_pos)
+            if m and not self.text[m.end():].strip():
+                self.code_end = m.start()
+                self.end_index = m.end()
+                if self.validate and self.syntax_error is None:
+                    self.syntax_error = self._check_complete(self.code)
+                return
+        if self.validate and self.syntax_error is None and self.code_start is not None and not self.finished:
+            self.syntax_error = check_partial_syntax(self.code)
+
+    @staticmethod
+    def _check_complete(code: str) -> Optional[SyntaxError]:
+        src = textwrap.dedent(code)
+        if not src.strip():
+            return None
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            try:
+                compile(src, "<stream>", "exec")
+            except SyntaxError as e:
+                return e
+            except (ValueError, OverflowError):
+                return None
+        return None
+
+
+def stream_code(
+    open_stream: Callable[[], Iterable[str]],
+    marker: str = FENCE,
+    max_attempts: int = 2,
+    validate: bool = True,
+    label: str = "",
+) -> Tuple[str, bool]:
+    """
+    流式消费一次代码生成，读到结束标记即关闭流；出现语法错误时中止并重新请求
+
+    Args:
+        open_stream: 发起一次流式请求、返回文本片段迭代器的函数（每次重试都会重新调用）
+        marker: FENCE 或 FILE
+        max_attempts: 因语法错误重新请求的最多次数（含第一次）
+        validate: 是否做增量语法检查
+        label: 日志前缀
+
+    Returns:
+        (text, ok)：截止到结束标记的原始文本，以及是否通过语法检查；
+        所有尝试都有语法错误时返回最后一次的完整文本，交给调用方原有的修复流程
+    """
+    text = ""
+    max_attempts = max(1, max_attempts)
+    for attempt in range(1, max_attempts + 1):
+        # 最后一次不再中止：读完整个代码块，交给调用方原有的修复流程
+        last = attempt == max_attempts
+        extractor = StreamingCodeExtractor(marker=marker, validate=validate, stop_on_error=not last)
+        pieces = open_stream()
+        try:
+            for piece in pieces:
+                if extractor.feed(piece):
+                    break
+            else:
+                extractor.finish()
+        finally:
+            # 提前结束时关闭底层流，释放连接、停止计费
+            close = getattr(pieces, "close", None)
+            if close is not None:
+                close()
+        text = extractor.result_text()
+        err = extractor.syntax_error
+        if err is None:
+            return text, True
+        if last:
+            print(f"[code_stream]{label} 第 {attempt}/{max_attempts} 次生成仍有语法错误"
+                  f"（第 {err.lineno} 行: {err.msg}），返回完整结果交给后续修复")
+        else:
+            print(f"[code_stream]{label} 第 {attempt}/{max_attempts} 次生成出现语法错误"
+                  f"（第 {err.lineno} 行: {err.msg}），已中止并重新请求")
+    return text, False
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+自适应并发控制（AIMD）
+
+所有调用 LLM 的阶段（代码生成、讲稿生成、PPT 转换、自动修复）共用同一个限流器：
+- 请求成功：并发上限按「每完成一轮（约等于当前上限个请求）+1」加性增长
+- 429 / 5xx / 超时：并发上限减半（同一轮内多个失败只减一次）
+
+用法：
+    limiter = get_limiter("llm", config)
+    with limiter.slot() as s:          # 线程 / 同步代码
+        resp = client.chat.completions.create(...)
+    async with limiter.aslot() as s:   # 协程
+        resp = await client.chat.completions.create(...)
+
+with 块内抛出的异常会自动分类；调用方自己吞掉错误时可调用 s.throttled() / s.failed() 报告结果。
+吞吐量会爬升到当前 key 能承受的水平，厂商限流时自动回退，不再需要固定的 workers 数和 sleep。
+"""
+
+import os
+import re
+import asyncio
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from typing import Any, Dict, Iterator, AsyncIterator, Optional
+
+try:
+    import openai
+    HAS_OPENAI = True
+except ImportError:
+    openai = None
+    HAS_OPENAI = False
+
+# 默认参数，可被 config.json 的 concurrency 段或环境变量覆盖
+DEFAULT_INITIAL = int(os.environ.get("LLM_CONCURRENCY_INITIAL", "4"))
+DEFAULT_MIN = int(os.environ.get("LLM_CONCURRENCY_MIN", "1"))
+DEFAULT_MAX = int(os.environ.get("LLM_CONCURRENCY_MAX", "32"))
+DEFAULT_BACKOFF = 0.5
+
+# 只在拿不到异常对象 / 状态码时才按文本判断；状态码按整词匹配，避免 "1429 tokens" 之类误判
+_THROTTLE_MARKERS = ("rate limit", "rate_limit", "ratelimit", "too many requests", "overloaded",
+                     "bad_response_status_code", "timed out", "timeout")
+_THROTTLE_STATUS_RE = re.compile(r"(?<!\d)(429|502|503|504)(?!\d)")
+
+
+def error_status(exc: BaseException) -> Optional[int]:
+    """异常携带的 HTTP 状态码（openai.APIStatusError / httpx.HTTPStatusError 等），没有时返回 None"""
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_throttle_error(exc: BaseException) -> bool:
+    """
+    判断异常是否代表「服务端过载」：429、5xx 或超时
+
+    Args:
+        exc: 调用 LLM 时抛出的异常（openai / httpx / 其他）
+
+    Returns:
+        True 表示应当降低并发
+    """
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError)):
+        return True
+    if HAS_OPENAI and isinstance(exc, (openai.RateLimitError, openai.APITimeoutError)):
+        return True
+    status = error_status(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    if HAS_OPENAI and isinstance(exc, openai.APIError):
+        # SDK 已给出明确类型（连接错误、参数错误等），不是过载
+        return False
+    if "Timeout" in type(exc).__name__ or "RateLimit" in type(exc).__name__:
+        return True
+    return is_throttle_message(str(exc))
+
+
+def is_throttle_message(text: str) -> bool:
+    """按错误文本判断是否为限流 / 过载（只用于拿不到异常对象、错误已被转成字符串的情况）"""
+    text = (text or "").lower()
+    return any(m in text for m in _THROTTLE_MARKERS) or bool(_THROTTLE_STATUS_RE.search(text))
+
+
+class _Slot:
+    """一次占用的并发名额，记录本次请求的结果"""
+
+    __slots__ = ("epoch", "outcome")
+
+    def __init__(self, epoch: int):
+        self.epoch = epoch
+        self.outcome: Optional[str] = None
+
+    def throttled(self):
+        """报告被限流 / 服务端过载（会触发减半）"""
+        self.outcome = "throttled"
+
+    def failed(self):
+        """报告普通失败（不影响并发上限）"""
+        self.outcome = "failed"
+
+    def succeeded(self):
+        self.outcome = "success"
+
+
+class _AsyncWaiter:
+    __slots__ = ("loop", "future", "granted")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+
+
+class AdaptiveLimiter:
+    """线程与协程共用的 AIMD 并发限流器"""
+
+    def __init__(self, name: str = "llm", initial: int = DEFAULT_INITIAL, min_limit: int = DEFAULT_MIN,
+                 max_limit: int = DEFAULT_MAX, backoff: float = DEFAULT_BACKOFF):
+        """
+        Args:
+            name: 名称（日志用）
+            initial: 初始并发上限
+            min_limit: 并发下限
+            max_limit: 并发上限的上限（同时也是线程池大小的参考值）
+            backoff: 限流时的乘性减小系数
+        """
+        self.name = name
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.backoff = float(backoff)
+        self._limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self._inflight = 0
+        # 每次减半 epoch+1；减半之前发出的请求再失败不会重复减半
+        self._epoch = 0
+        self._cond = threading.Condition()
+        self._async_waiters: "deque[_AsyncWaiter]" = deque()
+        self.successes = 0
+        self.throttles = 0
+
+    def configure(self, min_limit: Optional[int] = None, max_limit: Optional[int] = None,
+                  backoff: Optional[float] = None):
+        """
+        配置文件重新加载后更新上下限和回退系数；当前学到的并发上限保留，只收进新的范围内
+
+        Args:
+            min_limit: 并发下限
+            max_limit: 并发上限的上限
+            backoff: 限流时的乘性减小系数
+        """
+        with self._cond:
+            if min_limit is not None:
+                self.min_limit = max(1, int(min_limit))
+            if max_limit is not None:
+                self.max_limit = max(self.min_limit, int(max_limit))
+            self.max_limit = max(self.min_limit, self.max_limit)
+            if backoff is not None:
+                self.backoff = float(backoff)
+            self._limit = min(max(self._limit, float(self.min_limit)), float(self.max_limit))
+            self._wake_locked()
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, int(self._limit))
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def _try_acquire_locked(self) -> bool:
+        if self._inflight < self.limit:
+            self._inflight += 1
+            return True
+        return False
+
+    def _wake_locked(self):
+        # 优先唤醒协程等待者（名额直接转交），剩余名额交给线程等待者竞争
+        while self._async_waiters and self._inflight < self.limit:
+            waiter = self._async_waiters.popleft()
+            if waiter.future.cancelled():
+                continue
+            waiter.granted = True
+            self._inflight += 1
+            waiter.loop.call_soon_threadsafe(_grant, waiter.future, self._epoch)
+        self._cond.notify_all()
+
+    def acquire(self, timeout: Optional[float] = None) -> int:
+        """
+        阻塞获取一个名额
+
+        Returns:
+            获取时的 epoch，release 时传回
+        """
+        with self._cond:
+            if not self._cond.wait_for(self._try_acquire_locked, timeout=timeout):
+                raise TimeoutError(f"[{self.name}] 等待并发名额超时")
+            return self._epoch
+
+    async def aacquire(self) -> int:
+        """协程版 acquire，等待期间不占用线程"""
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if self._try_acquire_locked():
+                return self._epoch
+            waiter = _AsyncWaiter(loop)
+            self._async_waiters.append(waiter)
+        try:
+            return await waiter.future
+        except asyncio.CancelledError:
+            with self._cond:
+                if waiter.granted:
+                    # 名额已经转交但协程被取消，归还名额
+                    self._inflight -= 1
+                    self._wake_locked()
+                else:
+                    try:
+                        self._async_waiters.remove(waiter)
+                    except ValueError:
+                        pass
+            raise
+
+    def release(self, epoch: int, outcome: str = "success"):
+        """
+        归还名额并根据结果调整并发上限
+
+        Args:
+            epoch: acquire 返回的 epoch
+            outcome: success / throttled / failed
+        """
+        with self._cond:
+            self._inflight -= 1
+            if outcome == "success":
+                self.successes += 1
+                # 加性增长：每完成约 limit 个请求上限 +1
+                self._limit = min(float(self.max_limit), self._limit + 1.0 / max(self._limit, 1.0))
+            elif outcome == "throttled":
+                self.throttles += 1
+                if epoch == self._epoch:
+                    self._limit = max(float(self.min_limit), self._limit * self.backoff)
+                    self._epoch += 1
+                    print(f"[{self.name}] 检测到限流，并发上限降为 {self.limit}")
+            self._wake_locked()
+
+    @contextmanager
+    def slot(self) -> Iterator[_Slot]:
+        """占用一个名额执行一次请求（同步）"""
+        s = _Slot(self.acquire())
+        try:
+            yield s
+        except BaseException as e:
+            if s.outcome is None:
+                s.outcome = "throttled" if is_throttle_error(e) else "failed"
+            raise
+        finally:
+            self.release(s.epoch, s.outcome or "success")
+
+    @asynccontextmanager
+    async def aslot(self) -> AsyncIterator[_Slot]:
+        """占用一个名额执行一次请求（协程）"""
+        s = _Slot(await self.aacquire())
+        try:
+            yield s
+        except asyncio.CancelledError:
+            # 被取消（例如对冲失败方）不代表服务端过载
+            if s.outcome is None:
+                s.outcome = "failed"
+            raise
+        except BaseException as e:
+            if s.outcome is None:
+                s.outcome = "throttled" if is_throttle_error(e) else "failed"
+            raise
+        finally:
+            self.release(s.epoch, s.outcome or "success")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "limit": self.limit,
+            "inflight": self._inflight,
+            "successes": self.successes,
+            "throttles": self.throttles,
+        }
+
+
+def _grant(future: "asyncio.Future", epoch: int):
+    if not future.done():
+        future.set_result(epoch)
+
+
+_limiters: Dict[str, AdaptiveLimiter] = {}
+# 每个限流器最近一次应用的 concurrency 配置段，变化时重新配置
+_limiter_configs: Dict[str, Dict[str, Any]] = {}
+_limiters_lock = threading.Lock()
+
+
+def concurrency_settings(config: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """取出 concurrency 段（兼容 config.json 与 config_pool.json 的 settings 结构），没有时返回 None"""
+    config = config or {}
+    section = config.get("concurrency")
+    if section is None:
+        section = (config.get("settings") or {}).get("concurrency")
+    return section
+
+
+def get_limiter(name: str = "llm", config: Optional[Dict[str, Any]] = None) -> AdaptiveLimiter:
+    """
+    获取进程内共享的限流器（同名只创建一次）
+
+    传入的配置与上次应用的 concurrency 段不同时（例如重新加载了 config_pool.json），
+    按新配置更新已有限流器的上下限，见 AdaptiveLimiter.configure。
+
+    config.json 示例：
+        "concurrency": {"initial": 4, "min": 1, "max": 32, "backoff": 0.5}
+    """
+    cfg = concurrency_settings(config)
+    limiter = _limiters.get(name)
+    if limiter is not None and (cfg is None or cfg == _limiter_configs.get(name)):
+        return limiter
+    cfg = cfg or {}
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = AdaptiveLimiter(
+                name=name,
+                initial=int(cfg.get("initial", DEFAULT_INITIAL)),
+                min_limit=int(cfg.get("min", DEFAULT_MIN)),
+                max_limit=int(cfg.get("max", DEFAULT_MAX)),
+                backoff=float(cfg.get("backoff", DEFAULT_BACKOFF)),
+            )
+            _limiters[name] = limiter
+        elif cfg != _limiter_configs.get(name):
+            limiter.configure(
+                min_limit=int(cfg.get("min", DEFAULT_MIN)),
+                max_limit=int(cfg.get("max", DEFAULT_MAX)),
+                backoff=float(cfg.get("backoff", DEFAULT_BACKOFF)),
+            )
+            print(f"[{name}] 并发配置已更新：{limiter.min_limit}~{limiter.max_limit}，当前上限 {limiter.limit}")
+        _limiter_configs[name] = dict(cfg)
+        return limiter
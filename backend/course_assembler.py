@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+单次 ffmpeg 组装整门课程
+
+video_audio_merge 原流程每页先合并音视频、再 apad + shortest 重新编码一遍、最后再串联，整门课的视频数据
+要在磁盘上写三遍。这里改为一次 ffmpeg 调用（页面很多时按章节各一次）直接写出 Full.mp4：
+
+- 视频：用 concat demuxer 流拷贝，不解码；参数不一致的页面先由 clip_normalize 单独统一，仍不能拷贝时才用
+  concat 滤镜统一分辨率/帧率后整体编码一次
+- 音频：每页 wav 在滤镜图里 apad 补静音、atrim 截到该页视频时长（与 apad + shortest 结果一致），
+  再 concat 成一条音轨，只做一次 AAC 编码
+- 页面时间表：写在成片旁的 <名称>.pages.json，同时作为章节写进 mp4（复制到 course_hub 等地方后仍可读出），
+  重新编码时每页起点强制为关键帧，供 HLS 按页切片
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import subprocess
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import tracing
+import page_mux
+import clip_normalize
+
+FFMPEG = os.environ.get("FFMPEG_BIN") or shutil.which("ffmpeg") or "/home/EduAgent/miniconda3/envs/manim_env/bin/ffmpeg"
+FFPROBE = os.environ.get("FFPROBE_BIN") or shutil.which("ffprobe") or "/home/EduAgent/miniconda3/envs/manim_env/bin/ffprobe"
+
+# 单次调用的最大页面数，超过后按章节分别组装再流拷贝串联（避免打开过多输入文件）
+MAX_PAGES_PER_PASS = int(os.environ.get("COURSE_MAX_PAGES_PER_PASS", "200"))
+# 视频流拷贝要求各页以下参数一致
+_COPY_KEYS = ("codec_name", "profile", "width", "height", "pix_fmt", "r_frame_rate", "time_base")
+_COPY_CODECS = {"h264", "hevc"}
+
+# 组装结果旁的页面时间表（HLS 打包按页对齐切片时使用）
+PAGE_MANIFEST_SUFFIX = ".pages.json"
+
+Page = Tuple[str, str]  # (视频路径, 音频路径)
+
+
+def probe_video(path: str) -> Optional[Dict]:
+    """
+    读取首个视频流的编码参数和时长
+
+    Returns:
+        {"duration": 秒, "codec_name": ..., "width": ..., ...}；失败返回 None
+    """
+    cmd = [FFPROBE, "-v", "error", "-select_streams", "v:0",
+           "-show_entries", "stream=" + ",".join(_COPY_KEYS) + ",duration:format=duration",
+           "-of", "json", path]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        data = json.loads(result.stdout or "{}")
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError) as e:
+        print(f"⚠️  读取视频信息失败: {os.path.basename(path)} - {e}")
+        return None
+    streams = data.get("streams") or []
+    if not streams:
+        return None
+    info = dict(streams[0])
+    try:
+        info["duration"] = float(info.get("duration") or data.get("format", {}).get("duration"))
+    except (TypeError, ValueError):
+        return None
+    return info if info["duration"] > 0 else None
+
+
+def can_copy_video(infos: Sequence[Dict]) -> bool:
+    """各页视频参数一致（且为 concat demuxer 可直接拼接的编码）时可以流拷贝"""
+    first = infos[0]
+    if first.get("codec_name") not in _COPY_CODECS:
+        return False
+    return all(all(info.get(k) == first.get(k) for k in _COPY_KEYS) for info in infos[1:])
+
+
+def _audio_chain(index: int, duration: float, label: str) -> str:
+    # apad 无限补静音，atrim 截到视频时长：等价于原来的 -af apad -shortest
+    return f"[{index}:a]apad,atrim=end={duration:.6f},asetpts=PTS-STARTPTS[{label}]"
+
+
+def build_command(pages: Sequence[Page], infos: Sequence[Dict], output_file: str, list_file: str,
+                  copy_video: bool, chapters_file: Optional[str] = None) -> List[str]:
+    """
+    生成组装命令
+
+    Args:
+        pages: 按播放顺序排列的 (视频, 音频)
+        infos: 与 pages 对应的 probe_video 结果
+        output_file: 输出文件
+        list_file: concat demuxer 列表文件路径（copy_video 时写入）
+        copy_video: 是否流拷贝视频
+        chapters_file: write_chapters_file 写出的章节文件，写入输出的章节信息
+
+    Returns:
+        ffmpeg 参数列表
+    """
+    cmd = [FFMPEG, "-y", "-loglevel", "error"]
+    filters = []
+    if copy_video:
+        with open(list_file, "w", encoding="utf-8") as f:
+            f.writelines(page_mux.concat_list_line(video) for video, _ in pages)
+        cmd += ["-f", "concat", "-safe", "0", "-i", list_file]
+        for _, audio in pages:
+            cmd += ["-i", audio]
+        for i, info in enumerate(infos):
+            filters.append(_audio_chain(i + 1, info["duration"], f"a{i}"))
+        filters.append("".join(f"[a{i}]" for i in range(len(pages))) + f"concat=n={len(pages)}:v=0:a=1[aout]")
+        maps = ["-map", "0:v:0", "-map", "[aout]"]
+        video_codec = ["-c:v", "copy"]
+    else:
+        # 以第一页的分辨率和帧率为准
+        width, height = infos[0].get("width"), infos[0].get("height")
+        fps = infos[0].get("r_frame_rate") or "30"
+        for video, audio in pages:
+            cmd += ["-i", video, "-i", audio]
+        for i, info in enumerate(infos):
+            filters.append(
+                f"[{2 * i}:v:0]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={fps},format=yuv420p,"
+                f"trim=end={info['duration']:.6f},setpts=PTS-STARTPTS[v{i}]"
+            )
+            filters.append(_audio_chain(2 * i + 1, info["duration"], f"a{i}"))
+        filters.append("".join(f"[v{i}][a{i}]" for i in range(len(pages))) + f"concat=n={len(pages)}:v=1:a=1[vout][aout]")
+        maps = ["-map", "[vout]", "-map", "[aout]"]
+        # 每页起点强制为关键帧，HLS 原画档可以按页流拷贝切片
+        starts = page_starts([info["duration"] for info in infos])
+        video_codec = ["-c:v", "libx264", "-pix_fmt", "yuv420p",
+                       "-force_key_frames", ",".join(f"{t:.6f}" for t in starts)]
+    if chapters_file:
+        chapters_input = 1 + len(pages) if copy_video else 2 * len(pages)
+        cmd += ["-f", "ffmetadata", "-i", chapters_file]
+        maps += ["-map_chapters", str(chapters_input)]
+    cmd += ["-filter_complex", ";".join(filters)] + maps + video_codec + ["-c:a", "aac", "-f", "mp4", output_file]
+    return cmd
+
+
+def _run_pass(pages: Sequence[Page], infos: Sequence[Dict], output_file: str, work_dir: str, tag: str,
+              chapters_file: Optional[str] = None) -> bool:
+    copy_video = can_copy_video(infos)
+    list_file = os.path.join(work_dir, f"{tag}.txt")
+    cmd = build_command(pages, infos, output_file, list_file, copy_video, chapters_file)
+    mode = "视频流拷贝" if copy_video else "视频参数不一致，统一后重新编码"
+    print(f"🔧 组装 {tag}: {len(pages)} 页（{mode}）")
+    try:
+        subprocess.run(cmd, capture_output=True, text=True, check=True)
+        return os.path.exists(output_file)
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        print(f"❌ 组装失败: {e}")
+        print(f"   错误输出: {getattr(e, 'stderr', '')}")
+        return False
+
+
+def _concat_copy(parts: Sequence[str], output_file: str, work_dir: str, chapters_file: Optional[str] = None) -> bool:
+    list_file = os.path.join(work_dir, "chapters.txt")
+    with open(list_file, "w", encoding="utf-8") as f:
+        f.writelines(page_mux.concat_list_line(p) for p in parts)
+    cmd = [FFMPEG, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_file]
+    if chapters_file:
+        cmd += ["-f", "ffmetadata", "-i", chapters_file, "-map", "0", "-map_chapters", "1"]
+    cmd += ["-c", "copy", "-f", "mp4", output_file]
+    try:
+        subprocess.run(cmd, capture_output=True, text=True, check=True)
+        return os.path.exists(output_file)
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        print(f"❌ 章节串联失败: {e}")
+        print(f"   错误输出: {getattr(e, 'stderr', '')}")
+        return False
+
+
+def page_starts(durations: Sequence[float]) -> List[float]:
+    """concat 按每页时长依次排布，返回各页起点"""
+    starts, start = [], 0.0
+    for duration in durations:
+        starts.append(start)
+        start += duration
+    return starts
+
+
+def write_chapters_file(path: str, names: Sequence[str], durations: Sequence[float]):
+    """写出 ffmetadata 章节文件（每页一章，毫秒时间基）"""
+    lines = [";FFMETADATA1"]
+    for name, start, duration in zip(names, page_starts(durations), durations):
+        title = "".join("\\" + c if c in "=;#\\\n" else c for c in name)
+        lines += ["[CHAPTER]", "TIMEBASE=1/1000", f"START={int(round(start * 1000))}",
+                  f"END={int(round((start + duration) * 1000))}", f"title={title}"]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def probe_chapters(video_path: str) -> Optional[List[Dict]]:
+    """读取 mp4 中的章节，转成与页面时间表相同的结构；没有章节时返回 None"""
+    cmd = [FFPROBE, "-v", "error", "-show_chapters", "-of", "json", video_path]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        chapters = json.loads(result.stdout or "{}").get("chapters") or []
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError):
+        return None
+    pages = []
+    for i, chapter in enumerate(chapters):
+        try:
+            start, end = float(chapter["start_time"]), float(chapter["end_time"])
+        except (KeyError, TypeError, ValueError):
+            return None
+        name = (chapter.get("tags") or {}).get("title") or f"p{i:03d}"
+        pages.append({"name": name, "start": round(start, 6), "duration": round(end - start, 6)})
+    return pages or None
+
+
+def page_manifest_path(video_path: str) -> str:
+    """组装结果旁记录各页起止时间的文件：<名称>.pages.json"""
+    return os.path.splitext(video_path)[0] + PAGE_MANIFEST_SUFFIX
+
+
+def write_page_manifest(video_path: str, names: Sequence[str], durations: Sequence[float]):
+    """按播放顺序写出各页的起点和时长（concat 按每页视频时长依次排布）"""
+    pages = [{"name": name, "start": round(start, 6), "duration": round(duration, 6)}
+             for name, start, duration in zip(names, page_starts(durations), durations)]
+    try:
+        with open(page_manifest_path(video_path), "w", encoding="utf-8") as f:
+            json.dump({"video": os.path.basename(video_path), "pages": pages}, f, ensure_ascii=False, indent=2)
+    except OSError as e:
+        print(f"⚠️  写入页面时间表失败: {e}")
+
+
+def load_page_manifest(video_path: str) -> Optional[List[Dict]]:
+    """
+    读取页面列表：优先 write_page_manifest 写出的文件，没有时（例如只复制了 mp4 的 course_hub/<job_id>.mp4）
+    读取组装时写入视频的章节；都没有时返回 None
+    """
+    try:
+        with open(page_manifest_path(video_path), "r", encoding="utf-8") as f:
+            pages = json.load(f).get("pages")
+            if pages:
+                return pages
+    except (OSError, ValueError):
+        pass
+    return probe_chapters(video_path)
+
+
+@tracing.traced("merge", step="assemble")
+def assemble_course(chapters: Sequence[Tuple[str, Sequence[Page]]], output_file: str) -> bool:
+    """
+    把整门课程的页面一次组装成一个视频
+
+    每页时长以视频为准：音频短则补静音，音频长则截断（与 merge + pad + concat 三步的结果一致）。
+    总页数不超过 MAX_PAGES_PER_PASS 时只调用一次 ffmpeg；否则每章一次，最后流拷贝串联。
+
+    Args:
+        chapters: [(章节名, [(视频, 音频), ...]), ...]，按播放顺序
+        output_file: 输出视频路径（如 <输出目录>/Full.mp4）
+
+    Returns:
+        是否成功；失败时不会留下不完整的输出文件
+    """
+    chapters = [(name, list(pages)) for name, pages in chapters if pages]
+    all_pages = [page for _, pages in chapters for page in pages]
+    if not all_pages:
+        return False
+    tracing.annotate(pages=len(all_pages))
+    names = [os.path.splitext(os.path.basename(video))[0] for video, _ in all_pages]
+
+    probed = page_mux.probe_many((video for video, _ in all_pages), probe=probe_video)
+    infos = [probed[video] for video, _ in all_pages]
+    if any(info is None for info in infos):
+        return False
+
+    out_dir = os.path.dirname(os.path.abspath(output_file))
+    os.makedirs(out_dir, exist_ok=True)
+    tmp_output = output_file + ".part"
+    with tempfile.TemporaryDirectory(prefix="assemble_", dir=out_dir) as work_dir:
+        if not can_copy_video(infos):
+            # 只重新编码参数不一致的页面，之后整体仍可流拷贝
+            videos, safe = clip_normalize.normalize_clips([video for video, _ in all_pages],
+                                                          os.path.join(work_dir, clip_normalize.NORMALIZED_DIR_NAME))
+            if safe:
+                conformed = dict(zip((video for video, _ in all_pages), videos))
+                chapters = [(name, [(conformed[video], audio) for video, audio in pages]) for name, pages in chapters]
+                all_pages = [page for _, pages in chapters for page in pages]
+                probed = page_mux.probe_many(videos, probe=probe_video)
+                infos = [probed[video] or info for video, info in zip(videos, infos)]
+        chapters_file = os.path.join(work_dir, "chapters.ffmeta")
+        write_chapters_file(chapters_file, names, [info["duration"] for info in infos])
+        if len(all_pages) <= MAX_PAGES_PER_PASS:
+            ok = _run_pass(all_pages, infos, tmp_output, work_dir, "course", chapters_file)
+        else:
+            parts, start = [], 0
+            ok = True
+            for name, pages in chapters:
+                part = os.path.join(work_dir, f"{len(parts):02d}_{name}.mp4")
+                ok = _run_pass(pages, infos[start:start + len(pages)], part, work_dir, name)
+                start += len(pages)
+                if not ok:
+                    break
+                parts.append(part)
+            ok = ok and _concat_copy(parts, tmp_output, work_dir, chapters_file)
+    if not ok:
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+        return False
+    os.replace(tmp_output, output_file)
+    write_page_manifest(output_file, names, [info["duration"] for info in infos])
+    return True
@@ -18,11 +18,20 @@ import json
 import argparse
 import base64
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Tuple, Optional
 import time
 import concurrent.futures
 import shutil
 
+from llm_cache import cacheable, make_cache_key, get_cache_from_config, pipeline_use_cache
+from http_pool import get_http_client, get_async_http_client
+from hedging import (HedgeBudget, backup_key_stream, get_backup_pool, has_backup_key, hedged_stream_sync,
+                     latency_stats, settings_from_config)
+from concurrency import get_limiter
+from code_stream import FENCE, stream_code
+from llm_batch import LLMBatchJob
+import tracing
+
 # 大模型 API 配置
 try:
     import openai
@@ -43,6 +52,16 @@ class ManimCodeGenerator:
         self.prompt_template_no_pic = self._load_prompt_template("prompt_templates/Page_Coder_with_no_pic.txt")
         self.planner_prompt_template = self._load_prompt_template("prompt_templates/Page_Pic_Planner.txt")
         self.verbose = verbose
+        self.cache = get_cache_from_config(self.config)
+        # 生成阶段显式使用缓存（temperature > 0 也缓存），某一页失败后重跑只会重新调用该页
+        self.use_cache = pipeline_use_cache(self.config)
+        # 与其他阶段共用的自适应并发限流器，替代固定 workers 数和调用间 sleep
+        self.limiter = get_limiter("llm", self.config)
+        # 代码生成按首 token 时间对冲（llm_settings.hedge），对冲请求换用 hedge.key_pool 中的另一把 key；每个实例（任务）一份预算
+        hedge_cfg = settings_from_config(self.config)
+        self.hedge_budget = HedgeBudget.from_config(hedge_cfg)
+        self.backup_pool = get_backup_pool(hedge_cfg) if self.hedge_budget is not None else None
+        tracing.configure_pricing(self.config)
         
         # 初始化API客户端
         if HAS_OPENAI:
@@ -121,98 +140,223 @@ class ManimCodeGenerator:
         with open(filepath, 'r', encoding='utf-8') as f:
             return f.read()
     
+    def _cached_completion(self, model: str, messages: list, code: bool = False) -> str:
+        """
+        调用 chat completions 并使用响应缓存（见 llm_cache.pipeline_use_cache），相同输入重跑时直接返回上次结果
+
+        Args:
+            model: 模型名称
+            messages: OpenAI 格式的消息列表
+            code: 是否为代码生成；为 True 时流式接收，代码块结束即关闭流，语法错误时提前中止重发；
+                  配置了 hedge 时按首 token 时间对冲（见 _code_stream）
+
+        Returns:
+            去除首尾空白的响应文本（空响应不写入缓存）
+        """
+        llm_settings = self.config["llm_settings"]
+        cache_key = self._completion_cache_key(model, messages)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                tracing.record_llm(model, cached=True)
+                return cached
+
+        client = openai.OpenAI(
+            api_key=self.config["llm_key"],
+            base_url=llm_settings["base_url"],
+            http_client=get_http_client()
+        )
+        if code:
+            raw_content, ok = stream_code(lambda: self._code_stream(client, model, messages), marker=FENCE)
+            raw_content = raw_content.strip()
+        else:
+            t0 = time.monotonic()
+            with self.limiter.slot():
+                response = client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=llm_settings["max_tokens"],
+                    temperature=llm_settings["temperature"]
+                )
+            raw_content = (response.choices[0].message.content or "").strip()
+            tracing.record_llm_response(model, response, prompt=messages, completion=raw_content,
+                                        latency=time.monotonic() - t0)
+            ok = True
+        if cache_key and raw_content and ok:
+            self.cache.put(cache_key, raw_content, model=model)
+        return raw_content
+
+    def _code_stream(self, client, model: str, messages: list):
+        """
+        代码生成的一次流式请求
+
+        启用对冲时在 hedging 的后台事件循环中执行：超过最近首 token 延迟的分位数还没有输出，
+        就用 key 池中的另一把 key 再发一个流，先出字的胜出，另一个流立即取消
+        """
+        if self.hedge_budget is None:
+            return self._stream_completion(client, model, messages)
+        llm_key = self.config["llm_key"]
+        base_url = self.config["llm_settings"]["base_url"]
+        delay = None
+        if has_backup_key(self.backup_pool, llm_key):
+            delay = self.hedge_budget.delay_for(latency_stats(base_url, model, "ttft"))
+        return hedged_stream_sync(
+            lambda: self._astream_completion(llm_key, base_url, model, messages),
+            lambda: backup_key_stream(
+                self.backup_pool, llm_key,
+                lambda k: self._astream_completion(k.key, k.metadata.get("base_url") or base_url, model, messages),
+            ),
+            delay,
+            self.hedge_budget,
+        )
+
+    def _stream_completion(self, client, model: str, messages: list):
+        """流式调用，逐段返回文本；生成器被提前关闭时断开连接"""
+        llm_settings = self.config["llm_settings"]
+        t0 = time.monotonic()
+        with self.limiter.slot():
+            stream = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=llm_settings["max_tokens"],
+                temperature=llm_settings["temperature"],
+                stream=True
+            )
+            parts = []
+            try:
+                for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                        if not parts:
+                            # 首 token 时间：对冲等待时间据此计算
+                            latency_stats(llm_settings["base_url"], model, "ttft").record_success(time.monotonic() - t0)
+                        parts.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            finally:
+                stream.close()
+                tracing.record_llm_response(model, None, prompt=messages, completion="".join(parts),
+                                            latency=time.monotonic() - t0)
+
+    async def _astream_completion(self, api_key: str, base_url: str, model: str, messages: list):
+        """_stream_completion 的异步版本（对冲用，不重试，失败时抛出）"""
+        llm_settings = self.config["llm_settings"]
+        client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=get_async_http_client())
+        t0 = time.monotonic()
+        async with self.limiter.aslot():
+            stream = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=llm_settings["max_tokens"],
+                temperature=llm_settings["temperature"],
+                stream=True
+            )
+            parts = []
+            try:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                        if not parts:
+                            latency_stats(base_url, model, "ttft").record_success(time.monotonic() - t0)
+                        parts.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            finally:
+                await stream.close()
+                tracing.record_llm_response(model, None, prompt=messages, completion="".join(parts),
+                                            latency=time.monotonic() - t0)
+
+    def _build_planner_messages(self, markdown_content: str) -> list:
+        """构建 Planner 的消息列表（同步与批量模式共用）"""
+        full_prompt = f"{self.planner_prompt_template}\n\n以下是课程内容：\n\n{markdown_content}"
+        return [
+            {"role": "system", "content": "你是一位专业的教学内容策划专家。"},
+            {"role": "user", "content": full_prompt}
+        ]
+
+    def _handle_planner_response(self, raw_content: str, output_base_dir: str, filename: str) -> dict:
+        """
+        解析 Planner 响应并保存日志与 JSON 结果
+        
+        Returns:
+            Planner 结果；解析失败时为不需要图片的保底值
+        """
+        # 保存原始响应日志，方便调试 JSON 解析失败的问题
+        try:
+            log_dir = Path(output_base_dir).parent / "logs"
+            log_dir.mkdir(parents=True, exist_ok=True)
+            log_path = log_dir / f"{Path(filename).stem}_planner_response.txt"
+            with open(log_path, 'w', encoding='utf-8') as f:
+                f.write(f"File: {filename}\n")
+                f.write(f"Time: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+                f.write("-" * 40 + "\n")
+                f.write(raw_content)
+        except Exception as e:
+            print(f"Failed to write planner log: {e}")
+
+        # 解析 JSON
+        plan_result = {"needs_image": False, "images": []} # 默认保底值
+        parse_success = False
+
+        try:
+            # 1. 尝试清理 Markdown 代码块标记
+            content_to_parse = raw_content
+            if "```json" in content_to_parse:
+                content_to_parse = content_to_parse.split("```json")[1].split("```")[0]
+            elif "```" in content_to_parse:
+                content_to_parse = content_to_parse.split("```")[1].split("```")[0]
+            
+            content_to_parse = content_to_parse.strip()
+            
+            # 2. 尝试直接解析
+            plan_result = json.loads(content_to_parse)
+            parse_success = True
+        except json.JSONDecodeError:
+            # 3. 如果失败，尝试用正则提取第一个 { ... }
+            try:
+                match = re.search(r'\{.*\}', raw_content, re.DOTALL)
+                if match:
+                    json_str = match.group(0)
+                    plan_result = json.loads(json_str)
+                    parse_success = True
+            except Exception:
+                pass
+        
+        if not parse_success:
+            print(f"Failed to parse planner JSON for {filename}. Raw content preview: {raw_content[:100]}...")
+            # 使用默认值，但继续执行保存逻辑
+        
+        # 保存 Planner 结果 (无论是解析成功的，还是保底的)
+        planner_dir = Path(output_base_dir).parent / "planner"
+        planner_dir.mkdir(parents=True, exist_ok=True)
+        
+        output_filename = filename.replace('.md', '.json')
+        output_filepath = planner_dir / output_filename
+        
+        with open(output_filepath, 'w', encoding='utf-8') as f:
+            json.dump(plan_result, f, indent=4, ensure_ascii=False)
+            
+        if self.verbose:
+            if parse_success:
+                print(f"  Planner result saved to: {output_filepath}")
+            else:
+                print(f"  Planner parsing failed. Saved default JSON to: {output_filepath}")
+            
+        return plan_result
+
     def plan_images(self, markdown_content: str, output_base_dir: str, filename: str) -> dict:
         """
         调用 Planner 判断是否需要图片
         """
-        full_prompt = f"{self.planner_prompt_template}\n\n以下是课程内容：\n\n{markdown_content}"
+        messages = self._build_planner_messages(markdown_content)
         
         max_retries = 5
         for attempt in range(max_retries):
             try:
-                client = openai.OpenAI(
-                    api_key=self.config["llm_key"],
-                    base_url=self.config["llm_settings"]["base_url"]
-                )
-                
-                response = client.chat.completions.create(
-                    model="gemini-3-pro-preview",
-                    messages=[
-                        {"role": "system", "content": "你是一位专业的教学内容策划专家。"},
-                        {"role": "user", "content": full_prompt}
-                    ],
-                    max_tokens=self.config["llm_settings"]["max_tokens"],
-                    temperature=self.config["llm_settings"]["temperature"]
-                )
-                raw_content = response.choices[0].message.content.strip()
+                raw_content = self._cached_completion("gemini-3-pro-preview", messages)
                 
                 if not raw_content:
                     print(f"  Planner response is empty. Retrying ({attempt + 1}/{max_retries})...")
                     time.sleep(1)
                     continue
 
-                # 保存原始响应日志，方便调试 JSON 解析失败的问题
-                try:
-                    log_dir = Path(output_base_dir).parent / "logs"
-                    log_dir.mkdir(parents=True, exist_ok=True)
-                    log_path = log_dir / f"{Path(filename).stem}_planner_response.txt"
-                    with open(log_path, 'w', encoding='utf-8') as f:
-                        f.write(f"File: {filename}\n")
-                        f.write(f"Time: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
-                        f.write("-" * 40 + "\n")
-                        f.write(raw_content)
-                except Exception as e:
-                    print(f"Failed to write planner log: {e}")
-
-                # 解析 JSON
-                plan_result = {"needs_image": False, "images": []} # 默认保底值
-                parse_success = False
-
-                try:
-                    # 1. 尝试清理 Markdown 代码块标记
-                    content_to_parse = raw_content
-                    if "```json" in content_to_parse:
-                        content_to_parse = content_to_parse.split("```json")[1].split("```")[0]
-                    elif "```" in content_to_parse:
-                        content_to_parse = content_to_parse.split("```")[1].split("```")[0]
-                    
-                    content_to_parse = content_to_parse.strip()
-                    
-                    # 2. 尝试直接解析
-                    plan_result = json.loads(content_to_parse)
-                    parse_success = True
-                except json.JSONDecodeError:
-                    # 3. 如果失败，尝试用正则提取第一个 { ... }
-                    try:
-                        match = re.search(r'\{.*\}', raw_content, re.DOTALL)
-                        if match:
-                            json_str = match.group(0)
-                            plan_result = json.loads(json_str)
-                            parse_success = True
-                    except Exception:
-                        pass
-                
-                if not parse_success:
-                    print(f"Failed to parse planner JSON for {filename}. Raw content preview: {raw_content[:100]}...")
-                    # 使用默认值，但继续执行保存逻辑
-                
-                # 保存 Planner 结果 (无论是解析成功的，还是保底的)
-                planner_dir = Path(output_base_dir).parent / "planner"
-                planner_dir.mkdir(parents=True, exist_ok=True)
-                
-                output_filename = filename.replace('.md', '.json')
-                output_filepath = planner_dir / output_filename
-                
-                with open(output_filepath, 'w', encoding='utf-8') as f:
-                    json.dump(plan_result, f, indent=4, ensure_ascii=False)
-                    
-                if self.verbose:
-                    if parse_success:
-                        print(f"  Planner result saved to: {output_filepath}")
-                    else:
-                        print(f"  Planner parsing failed. Saved default JSON to: {output_filepath}")
-                    
-                return plan_result
+                return self._handle_planner_response(raw_content, output_base_dir, filename)
                 
             except Exception as e:
                 print(f"Planner API call failed (Attempt {attempt + 1}/{max_retries}): {e}")
@@ -233,6 +377,22 @@ class ManimCodeGenerator:
         
         return {"needs_image": False, "images": []}
 
+    def _build_coder_messages(self, markdown_content: str, prompt_template: str) -> list:
+        """构建代码生成的消息列表（同步与批量模式共用）"""
+        full_prompt = f"{prompt_template}\n\n以下是需要转换为 Manim 动画的课程内容：\n\n{markdown_content}"
+        return [
+            {"role": "system", "content": "你是一位专业的 Manim 动画专家，专门为课程制作教学动画。"},
+            {"role": "user", "content": full_prompt}
+        ]
+
+    def _completion_cache_key(self, model: str, messages: list):
+        """与 _cached_completion 一致的缓存 key（批量模式写回缓存用）"""
+        llm_settings = self.config["llm_settings"]
+        if self.cache is None or not cacheable(llm_settings["temperature"], self.use_cache):
+            return None
+        return make_cache_key(model, llm_settings["base_url"], messages,
+                              llm_settings["temperature"], llm_settings["max_tokens"])
+
     def call_llm_api(self, markdown_content: str, prompt_template: str) -> str:
         """
         调用大模型 API 生成 Manim 代码
@@ -244,27 +404,12 @@ class ManimCodeGenerator:
         Returns:
             生成的 Manim Python 代码
         """
-        # 构建完整的 prompt
-        full_prompt = f"{prompt_template}\n\n以下是需要转换为 Manim 动画的课程内容：\n\n{markdown_content}"
+        messages = self._build_coder_messages(markdown_content, prompt_template)
         
         max_retries = 5
         for attempt in range(max_retries):
             try:
-                client = openai.OpenAI(
-                    api_key=self.config["llm_key"],
-                    base_url=self.config["llm_settings"]["base_url"]
-                )
-                
-                response = client.chat.completions.create(
-                    model="gemini-3-pro-preview",
-                    messages=[
-                        {"role": "system", "content": "你是一位专业的 Manim 动画专家，专门为课程制作教学动画。"},
-                        {"role": "user", "content": full_prompt}
-                    ],
-                    max_tokens=self.config["llm_settings"]["max_tokens"],
-                    temperature=self.config["llm_settings"]["temperature"]
-                )
-                raw_content = response.choices[0].message.content.strip()
+                raw_content = self._cached_completion("gemini-3-pro-preview", messages, code=True)
                 
                 if not raw_content:
                     print(f"  Coder response is empty. Retrying ({attempt + 1}/{max_retries})...")
@@ -291,7 +436,8 @@ class ManimCodeGenerator:
             try:
                 client = openai.OpenAI(
                     api_key=self.config["llm_key"],
-                    base_url=self.config["llm_settings"]["base_url"]
+                    base_url=self.config["llm_settings"]["base_url"],
+                    http_client=get_http_client()
                 )
                 
                 # 构造提示词
@@ -300,18 +446,19 @@ class ManimCodeGenerator:
                 if self.verbose:
                     print(f"    Generating image for: {prompt[:30]}... (Attempt {attempt + 1}/{max_retries})")
                 
-                response_stream = client.chat.completions.create(
-                    model=self.config.get("picture_settings", {}).get("model", "gemini-3-pro-image-preview"),
-                    messages=[
-                        {"role": "user", "content": full_prompt}
-                    ],
-                    stream=True
-                )
+                with self.limiter.slot():
+                    response_stream = client.chat.completions.create(
+                        model=self.config.get("picture_settings", {}).get("model", "gemini-3-pro-image-preview"),
+                        messages=[
+                            {"role": "user", "content": full_prompt}
+                        ],
+                        stream=True
+                    )
 
-                full_content = ""
-                for chunk in response_stream:
-                    if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
-                        full_content += chunk.choices[0].delta.content
+                    full_content = ""
+                    for chunk in response_stream:
+                        if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                            full_content += chunk.choices[0].delta.content
                 
                 # 解析 Markdown 图片链接
                 image_url = None
@@ -452,16 +599,57 @@ class ManimCodeGenerator:
         
         print(f"Saved: {output_filepath}")
     
-    def process_single_file(self, filename_filepath, output_base_dir, delay_seconds):
+    def _prepare_coder_input(self, plan_result: dict, markdown_content: str) -> Tuple[str, str]:
+        """
+        根据 Planner 结果选择 prompt 模板，并把图片建议附加到课程内容之前
+
+        Returns:
+            (prompt 模板, 附加了图片建议的课程内容)
+        """
+        image_plan_str = ""
+        if plan_result.get("needs_image", False):
+            selected_prompt = self.prompt_template
+            if self.verbose:
+                print(f"  Planner decided: Images NEEDED. Using standard prompt.")
+            
+            # 格式化图片建议
+            images = plan_result.get("images", [])
+            if images:
+                image_plan_str = "\n\n【Planner 图片建议】\n请参考使用以下图片，并严格按照描述生成代码：\n"
+                for img in images:
+                    idx = img.get("index")
+                    desc = img.get("description")
+                    image_plan_str += f"- 图片 {idx} (ImageMobject(\"{idx}.png\")): {desc}\n"
+        else:
+            selected_prompt = self.prompt_template_no_pic
+            if self.verbose:
+                print(f"  Planner decided: NO images needed. Using no-pic prompt.")
+        
+        # 将图片建议附加到 markdown_content 之前，作为上下文的一部分
+        return selected_prompt, image_plan_str + "\n" + markdown_content
+
+    def _apply_images(self, manim_code: str, plan_result: dict, output_base_dir: str, filename: str) -> str:
+        """Planner 判定需要图片时生成图片并替换代码中的图片路径"""
+        if plan_result.get("needs_image", False):
+            if self.verbose:
+                print(f"  Processing images for {filename}...")
+            return self.process_images_in_code(manim_code, output_base_dir, filename)
+        if self.verbose:
+            print(f"  Skipping image processing as per planner decision.")
+        return manim_code
+
+    @tracing.traced("code_gen")
+    def process_single_file(self, filename_filepath, output_base_dir, delay_seconds=None):
         """
         处理单个文件
         
         Args:
             filename_filepath: (filename, filepath) tuple
             output_base_dir: 输出基础目录
-            delay_seconds: 延迟秒数
+            delay_seconds: 已废弃（频率由自适应限流器控制），保留参数兼容旧调用
         """
         filename, filepath = filename_filepath
+        tracing.annotate(page=os.path.splitext(filename)[0])
         try:
             # 读取Markdown内容
             markdown_content = self.read_markdown_content(filepath)
@@ -472,45 +660,17 @@ class ManimCodeGenerator:
             if self.verbose:
                 print(f"  Calling Planner for {filename}...")
             plan_result = self.plan_images(markdown_content, output_base_dir, filename)
-            needs_image = plan_result.get("needs_image", False)
             
             # 2. 选择 Prompt 模板并准备图片建议
-            image_plan_str = ""
-            if needs_image:
-                selected_prompt = self.prompt_template
-                if self.verbose:
-                    print(f"  Planner decided: Images NEEDED. Using standard prompt.")
-                
-                # 格式化图片建议
-                images = plan_result.get("images", [])
-                if images:
-                    image_plan_str = "\n\n【Planner 图片建议】\n请参考使用以下图片，并严格按照描述生成代码：\n"
-                    for img in images:
-                        idx = img.get("index")
-                        desc = img.get("description")
-                        image_plan_str += f"- 图片 {idx} (ImageMobject(\"{idx}.png\")): {desc}\n"
-            else:
-                selected_prompt = self.prompt_template_no_pic
-                if self.verbose:
-                    print(f"  Planner decided: NO images needed. Using no-pic prompt.")
+            selected_prompt, content_with_plan = self._prepare_coder_input(plan_result, markdown_content)
 
             # 3. 调用LLM生成代码
             if self.verbose:
                 print(f"  Calling LLM API for {filename}...")
-            
-            # 将图片建议附加到 markdown_content 之前，作为上下文的一部分
-            content_with_plan = image_plan_str + "\n" + markdown_content
-            
             manim_code = self.call_llm_api(content_with_plan, selected_prompt)
             
             # 4. 处理图片生成 (仅当 needs_image 为 True 时)
-            if needs_image:
-                if self.verbose:
-                    print(f"  Processing images for {filename}...")
-                manim_code = self.process_images_in_code(manim_code, output_base_dir, filename)
-            else:
-                if self.verbose:
-                    print(f"  Skipping image processing as per planner decision.")
+            manim_code = self._apply_images(manim_code, plan_result, output_base_dir, filename)
             
             # 保存Python代码
             output_filename = filename.replace('.md', '.py')
@@ -520,22 +680,25 @@ class ManimCodeGenerator:
             if self.verbose:
                 print(f"  Saved: {output_filepath}")
             
-            # 延迟避免API频率限制
-            time.sleep(delay_seconds)
-            
             return f"Success: {filename}"
             
         except Exception as e:
             error_msg = f"Error processing {filename}: {e}"
             print(error_msg)
             return error_msg
-    def process_folder(self, input_folder: str, output_dir: str, delay_seconds: float = 1.0, max_workers: int = 4):
+    @tracing.traced("code_gen")
+    def process_folder(self, input_folder: str, output_dir: str, delay_seconds: Optional[float] = None,
+                       max_workers: Optional[int] = None):
         """
         处理整个文件夹，使用并行处理提高效率
         
+        实际并发数由自适应限流器决定（成功时逐步增加，429/5xx/超时时减半），
+        线程池只提供足够的线程，不再限制并发。
+        
         Args:
             input_folder: 输入文件夹路径
-            delay_seconds: API调用之间的延迟（避免频率限制）
+            delay_seconds: 已废弃，保留参数兼容旧调用
+            max_workers: 线程数上限（默认取限流器的并发上限）
         """
         start_time = time.time()  # 开始计时
         
@@ -552,14 +715,15 @@ class ManimCodeGenerator:
             print("No section files found!")
             return
         
-        # 使用线程池并行处理文件
-        # max_workers = 4  # 设置最大并发数，避免API限制
-        print(f"Starting parallel processing with {max_workers} workers...")
+        # 使用线程池并行处理文件；线程数只是上限，真正的并发由 self.limiter 控制
+        max_workers = max(1, min(len(section_files), max_workers or self.limiter.max_limit))
+        print(f"Starting parallel processing with up to {max_workers} threads "
+              f"(adaptive LLM concurrency, current limit {self.limiter.limit})...")
         
         with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
             # 提交所有任务
             future_to_file = {
-                executor.submit(self.process_single_file, filename_filepath, output_base_dir, delay_seconds): filename_filepath
+                executor.submit(tracing.bind(self.process_single_file), filename_filepath, output_base_dir): filename_filepath
                 for filename_filepath in section_files
             }
             
@@ -579,26 +743,110 @@ class ManimCodeGenerator:
                 
                 completed_tasks += 1
                 remaining_tasks = total_tasks - completed_tasks
-                active_workers = min(max_workers, remaining_tasks + (1 if remaining_tasks > 0 else 0))  # 估算活跃工作线程
-                print(f"🔄 Progress: {completed_tasks}/{total_tasks} completed, {remaining_tasks} remaining, ~{active_workers} active workers")
+                print(f"🔄 Progress: {completed_tasks}/{total_tasks} completed, {remaining_tasks} remaining, "
+                      f"LLM concurrency {self.limiter.inflight}/{self.limiter.limit}")
         
         end_time = time.time()  # 结束计时
         total_time = end_time - start_time
         
         print(f"\n✅ Parallel processing completed! Output saved to: {output_base_dir}")
         print(f"⏱️  Total processing time: {total_time:.2f} seconds")
-        print(f"📊 Processed {len(section_files)} files in parallel with {max_workers} workers")
+        print(f"📊 Processed {len(section_files)} files in parallel, limiter: {self.limiter.snapshot()}")
     
-    def pipeline(self, input_folder: str, output_dir: str, delay_seconds: float = 1.0, max_workers: int = 4):
+    @tracing.traced("code_gen", mode="batch")
+    def process_folder_batch(self, input_folder: str, output_dir: str, max_workers: Optional[int] = None):
+        """
+        批量模式：Planner 与代码生成各作为一个 batch 提交（代码生成依赖 Planner 结果，分两轮），
+        完成后按同步模式的方式生成图片并写回同样的输出文件；batch 中失败的请求回退到同步调用
+        
+        Args:
+            input_folder: 输入文件夹路径
+            output_dir: 输出目录
+            max_workers: 图片生成与保存阶段的线程数上限（默认取限流器的并发上限）
+        """
+        start_time = time.time()
+        output_base_dir = output_dir
+        section_files = self.find_section_files(input_folder)
+        if not section_files:
+            print("No section files found!")
+            return
+        
+        model = "gemini-3-pro-preview"
+        llm_settings = self.config["llm_settings"]
+        contents = {filename: self.read_markdown_content(filepath) for filename, filepath in section_files}
+        
+        # 第一轮：Planner
+        planner_job = LLMBatchJob(self.config, name="page_planner",
+                                  state_path=os.path.join(output_base_dir, ".batch_planner.json"))
+        for filename, markdown_content in contents.items():
+            messages = self._build_planner_messages(markdown_content)
+            planner_job.add(filename, model, messages, llm_settings["max_tokens"], llm_settings["temperature"],
+                            cache_key=self._completion_cache_key(model, messages))
+        planner_results = planner_job.run()
+        
+        plans = {}
+        for filename, markdown_content in contents.items():
+            raw_content = (planner_results.get(filename) or "").strip()
+            if raw_content:
+                plans[filename] = self._handle_planner_response(raw_content, output_base_dir, filename)
+            else:
+                plans[filename] = self.plan_images(markdown_content, output_base_dir, filename)
+        
+        # 第二轮：代码生成
+        coder_job = LLMBatchJob(self.config, name="page_coder",
+                                state_path=os.path.join(output_base_dir, ".batch_coder.json"))
+        coder_inputs = {}
+        for filename, markdown_content in contents.items():
+            selected_prompt, content_with_plan = self._prepare_coder_input(plans[filename], markdown_content)
+            coder_inputs[filename] = (selected_prompt, content_with_plan)
+            messages = self._build_coder_messages(content_with_plan, selected_prompt)
+            coder_job.add(filename, model, messages, llm_settings["max_tokens"], llm_settings["temperature"],
+                          cache_key=self._completion_cache_key(model, messages))
+        coder_results = coder_job.run()
+        
+        @tracing.traced("code_gen")
+        def _finish(filename: str) -> str:
+            tracing.annotate(page=os.path.splitext(filename)[0])
+            try:
+                raw_content = (coder_results.get(filename) or "").strip()
+                if raw_content:
+                    manim_code = self.clean_generated_code(raw_content)
+                else:
+                    manim_code = self.call_llm_api(coder_inputs[filename][1], coder_inputs[filename][0])
+                manim_code = self._apply_images(manim_code, plans[filename], output_base_dir, filename)
+                self.save_python_code(manim_code, os.path.join(output_base_dir, filename.replace('.md', '.py')))
+                return f"Success: {filename}"
+            except Exception as e:
+                error_msg = f"Error processing {filename}: {e}"
+                print(error_msg)
+                return error_msg
+        
+        # 图片生成仍走同步接口，按限流器并行
+        max_workers = max(1, min(len(contents), max_workers or self.limiter.max_limit))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for result in executor.map(tracing.bind(_finish), list(contents)):
+                if self.verbose:
+                    print(result)
+        
+        print(f"\n✅ Batch processing completed! Output saved to: {output_base_dir}")
+        print(f"⏱️  Total processing time: {time.time() - start_time:.2f} seconds")
+    
+    def pipeline(self, input_folder: str, output_dir: str, delay_seconds: Optional[float] = None,
+                 max_workers: Optional[int] = None, batch: bool = False):
         """
         简化的流水线接口
         
         Args:
             input_folder: 输入文件夹路径
-            delay_seconds: API调用之间的延迟（避免频率限制）
+            delay_seconds: 已废弃，保留参数兼容旧调用
+            max_workers: 线程数上限（默认取限流器的并发上限）
+            batch: 是否走离线批量接口
         """
         pipeline_start_time = time.time()
-        result = self.process_folder(input_folder, output_dir, delay_seconds=delay_seconds, max_workers=max_workers)
+        if batch:
+            result = self.process_folder_batch(input_folder, output_dir, max_workers=max_workers)
+        else:
+            result = self.process_folder(input_folder, output_dir, delay_seconds=delay_seconds, max_workers=max_workers)
         pipeline_end_time = time.time()
         pipeline_total_time = pipeline_end_time - pipeline_start_time
         print(f"🔄 Pipeline execution time: {pipeline_total_time:.2f} seconds")
@@ -610,17 +858,21 @@ def main():
     parser.add_argument("--folder", default="/home/TeachMaster/ML/nano_test/test_markdown", help="Input folder containing *_*.md files")
     parser.add_argument("--config", default="config.json", help="Config file path")
     parser.add_argument("--output_dir", default="/home/TeachMaster/ML/nano_test/12_13_2/output_code", help="Output directory for generated python files")
-    parser.add_argument("--delay", type=float, default=1.0,
-                        help="Delay between API calls in seconds")
-    parser.add_argument("--workers", type=int, default=4,
-                        help="Number of parallel workers to use")
+    parser.add_argument("--delay", type=float, default=None,
+                        help="Deprecated: request rate is controlled by the adaptive limiter")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Upper bound on worker threads (default: adaptive limiter max)")
+    parser.add_argument("--batch", action="store_true",
+                        help="Submit planner and coder prompts as offline batch jobs")
 
     args = parser.parse_args()
 
     try:
         # 创建生成器并处理文件夹
         generator = ManimCodeGenerator(config_path=args.config)
-        generator.pipeline(args.folder, output_dir=args.output_dir, delay_seconds=args.delay, max_workers=args.workers)
+        with tracing.job(trace_dir=args.output_dir, stage="code_gen"):
+            generator.pipeline(args.folder, output_dir=args.output_dir, delay_seconds=args.delay,
+                               max_workers=args.workers, batch=args.batch)
 
     except Exception as e:
         print(f"Error: {e}")
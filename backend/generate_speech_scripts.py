@@ -20,6 +20,12 @@ from pathlib import Path
 from typing import List, Tuple, Dict, Optional
 import time
 
+from llm_cache import cacheable, make_cache_key, get_cache_from_config, pipeline_use_cache
+from http_pool import get_http_client
+from concurrency import get_limiter
+from llm_batch import LLMBatchJob
+import tracing
+
 # 大模型 API 配置
 try:
     import openai
@@ -41,6 +47,12 @@ class SpeechScriptGenerator:
         self.prompt_template = self._load_prompt_template()
         self.previous_speech = ""  # 用于保持连贯性
         self.verbose = verbose
+        self.cache = get_cache_from_config(self.config)
+        # 生成阶段显式使用缓存（temperature > 0 也缓存），见 llm_cache.pipeline_use_cache
+        self.use_cache = pipeline_use_cache(self.config)
+        # 与其他阶段共用的自适应并发限流器
+        self.limiter = get_limiter("llm", self.config)
+        tracing.configure_pricing(self.config)
         
         # 初始化API客户端
         if HAS_OPENAI:
@@ -120,18 +132,8 @@ class SpeechScriptGenerator:
         with open(filepath, 'r', encoding='utf-8') as f:
             return f.read()
     
-    def call_llm_api(self, previous_speech: str, md_content: str, py_content: str, max_retries: int = 3) -> str:
-        """
-        调用大模型 API 生成讲解稿
-        
-        Args:
-            previous_speech: 上一页的讲解稿内容
-            md_content: Markdown 课程内容
-            py_content: Python 动画脚本内容
-            
-        Returns:
-            生成的讲解稿
-        """
+    def _build_messages(self, previous_speech: str, md_content: str, py_content: str) -> List[Dict[str, str]]:
+        """构建讲解稿生成的消息列表（同步与批量模式共用）"""
         # 构建完整的 prompt
         input_content = f"""
 以下是三部分输入：
@@ -147,27 +149,65 @@ class SpeechScriptGenerator:
 """
         
         full_prompt = f"{self.prompt_template}\n\n{input_content}"
+        return [
+            {"role": "system", "content": "你是一位专业的课程教学专家，专门为教学视频撰写配音讲解稿。"},
+            {"role": "user", "content": full_prompt}
+        ]
+
+    def _cache_key(self, messages: List[Dict[str, str]]) -> Optional[str]:
+        llm_settings = self.config["llm_settings"]
+        if self.cache is None or not cacheable(llm_settings["temperature"], self.use_cache):
+            return None
+        return make_cache_key(llm_settings["model"], llm_settings["base_url"], messages,
+                              llm_settings["temperature"], llm_settings["max_tokens"])
+
+    def call_llm_api(self, previous_speech: str, md_content: str, py_content: str, max_retries: int = 3) -> str:
+        """
+        调用大模型 API 生成讲解稿
+        
+        Args:
+            previous_speech: 上一页的讲解稿内容
+            md_content: Markdown 课程内容
+            py_content: Python 动画脚本内容
+            
+        Returns:
+            生成的讲解稿
+        """
+        llm_settings = self.config["llm_settings"]
+        messages = self._build_messages(previous_speech, md_content, py_content)
+
+        # 命中缓存时直接返回（上一页讲稿也在 prompt 里，前文变化会自动失效）
+        cache_key = self._cache_key(messages)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                tracing.record_llm(llm_settings["model"], cached=True)
+                return self.clean_speech_content(cached)
         
         try:
             client = openai.OpenAI(
                 api_key=self.config["llm_key"],
-                base_url=self.config["llm_settings"]["base_url"]
+                base_url=llm_settings["base_url"],
+                http_client=get_http_client()
             )
 
             last_err = None
             for attempt in range(1, max_retries + 1):
                 try:
-                    response = client.chat.completions.create(
-                        model=self.config["llm_settings"]["model"],
-                        messages=[
-                            {"role": "system", "content": "你是一位专业的课程教学专家，专门为教学视频撰写配音讲解稿。"},
-                            {"role": "user", "content": full_prompt}
-                        ],
-                        max_tokens=self.config["llm_settings"]["max_tokens"],
-                        temperature=self.config["llm_settings"]["temperature"]
-                    )
+                    t0 = time.monotonic()
+                    with self.limiter.slot():
+                        response = client.chat.completions.create(
+                            model=llm_settings["model"],
+                            messages=messages,
+                            max_tokens=llm_settings["max_tokens"],
+                            temperature=llm_settings["temperature"]
+                        )
 
                     raw_speech = response.choices[0].message.content.strip()
+                    tracing.record_llm_response(llm_settings["model"], response, prompt=messages, completion=raw_speech,
+                                                latency=time.monotonic() - t0)
+                    if cache_key and raw_speech:
+                        self.cache.put(cache_key, raw_speech, model=llm_settings["model"])
                     return self.clean_speech_content(raw_speech)
 
                 except Exception as e:
@@ -183,6 +223,7 @@ class SpeechScriptGenerator:
 
                     if should_retry and attempt < max_retries:
                         print(f"API transient error, retry {attempt}/{max_retries}: {err_str}")
+                        tracing.record_retry(err_str)
                         time.sleep(min(2 ** (attempt - 1), 8))  # 指数退避，最多8s
                         continue
 
@@ -230,14 +271,17 @@ class SpeechScriptGenerator:
         
         print(f"Saved: {output_filepath}")
     
-    def process_folders(self, md_folder: str, py_folder: str, output_dir: str="speech", delay_seconds: float = 1.0):
+    @tracing.traced("speech")
+    def process_folders(self, md_folder: str, py_folder: str, output_dir: str="speech", delay_seconds: Optional[float] = None):
         """
         处理两个文件夹，生成讲解稿
         
+        每页依赖上一页讲稿，只能顺序生成；调用频率由共享的自适应限流器控制，不再在页间固定等待。
+        
         Args:
             md_folder: Markdown 文件夹路径
             py_folder: Python 文件夹路径
-            delay_seconds: API调用之间的延迟（避免频率限制）
+            delay_seconds: 已废弃，保留参数兼容旧调用
         """
         # 获取文件夹名称用于输出路径
         output_base_dir = output_dir
@@ -269,7 +313,8 @@ class SpeechScriptGenerator:
                 
                 # 调用LLM生成讲解稿
                 print("  Calling LLM API...")
-                speech = self.call_llm_api(self.previous_speech, md_content, py_content, max_retries=MAX_RETRIES)
+                with tracing.span("speech", page=base_name):
+                    speech = self.call_llm_api(self.previous_speech, md_content, py_content, max_retries=MAX_RETRIES)
                 if "__LLM_FAILED__" in speech:
                     print(f"  Skip {base_name} due to openai_error")
                     continue
@@ -283,11 +328,6 @@ class SpeechScriptGenerator:
                 self.previous_speech = speech
                 print(f"  Generated speech: {len(speech)} chars")
                 
-                # 延迟避免API频率限制
-                if i < len(matching_files):
-                    print(f"  Waiting {delay_seconds}s...")
-                    time.sleep(delay_seconds)
-                    
             except Exception as e:
                 print(f"  Error processing {base_name}: {e}")
                 continue
@@ -295,15 +335,67 @@ class SpeechScriptGenerator:
         print(f"\n✅ Processing completed! Output saved to: {output_base_dir}")
 
         # 打印总结
-    def pipeline(self, markdown_folder: str, manim_folder: str, output_dir: str="speech", delay_seconds: float = 1.0):
+    @tracing.traced("speech", mode="batch")
+    def process_folders_batch(self, md_folder: str, py_folder: str, output_dir: str = "speech"):
+        """
+        批量模式：所有页面的讲稿请求作为一个 batch 提交，完成后写回同样的输出文件
+        
+        批量请求之间无法互相引用结果，因此每页 prompt 中的「上一页讲稿」为空（与同步模式相比页间衔接会弱一些），
+        适合不需要交互的夜间任务。batch 中失败的页面回退到同步调用。
+        
+        Args:
+            md_folder: Markdown 文件夹路径
+            py_folder: Python 文件夹路径
+            output_dir: 输出目录
+        """
+        matching_files = self.find_matching_files(md_folder, py_folder)
+        if not matching_files:
+            print("No matching files found!")
+            return
+        
+        llm_settings = self.config["llm_settings"]
+        job = LLMBatchJob(self.config, name="speech",
+                          state_path=os.path.join(output_dir, ".batch_speech.json"), verbose=True)
+        pages = {}
+        for base_name, md_path, py_path in matching_files:
+            md_content = self.read_file_content(md_path)
+            py_content = self.read_file_content(py_path)
+            messages = self._build_messages("", md_content, py_content)
+            pages[base_name] = (md_content, py_content)
+            job.add(base_name, llm_settings["model"], messages,
+                    max_tokens=llm_settings["max_tokens"], temperature=llm_settings["temperature"],
+                    cache_key=self._cache_key(messages))
+        
+        batch_results = job.run()
+        
+        for base_name, (md_content, py_content) in pages.items():
+            raw_speech = batch_results.get(base_name)
+            if raw_speech is not None:
+                speech = self.clean_speech_content(raw_speech.strip())
+            else:
+                with tracing.span("speech", page=base_name):
+                    speech = self.call_llm_api("", md_content, py_content, max_retries=MAX_RETRIES)
+            if "__LLM_FAILED__" in speech:
+                print(f"  Skip {base_name} due to openai_error")
+                continue
+            self.save_speech_script(speech, os.path.join(output_dir, f"{base_name}.txt"))
+        
+        print(f"\n✅ Batch processing completed! Output saved to: {output_dir}")
+    
+    def pipeline(self, markdown_folder: str, manim_folder: str, output_dir: str="speech", delay_seconds: Optional[float] = None,
+                 batch: bool = False):
         """
         简化的流水线接口
         
         Args:
             markdown_folder: Markdown 文件夹路径
             manim_folder: Python 文件夹路径
-            delay_seconds: API调用之间的延迟（避免频率限制）
+            delay_seconds: 已废弃，保留参数兼容旧调用
+            batch: 是否走离线批量接口
         """
+        if batch:
+            self.process_folders_batch(markdown_folder, manim_folder, output_dir)
+            return
         self.process_folders(markdown_folder, manim_folder, output_dir, delay_seconds=delay_seconds)
 
 
@@ -312,15 +404,22 @@ def main():
     parser.add_argument("md_folder", help="Folder containing .md files")
     parser.add_argument("py_folder", help="Folder containing .py files")
     parser.add_argument("--config", default="config.json", help="Config file path")
-    parser.add_argument("--delay", type=float, default=1.0,
-                        help="Delay between API calls in seconds")
+    parser.add_argument("--delay", type=float, default=None,
+                        help="Deprecated: request rate is controlled by the adaptive limiter")
+    parser.add_argument("--batch", action="store_true",
+                        help="Submit all pages as one offline batch job")
     
     args = parser.parse_args()
     
     try:
         # 创建生成器并处理文件夹
         generator = SpeechScriptGenerator(config_path=args.config)
-        generator.process_folders(args.md_folder, args.py_folder, delay_seconds=args.delay)
+        # 讲稿默认写到 ./speech，追踪文件放在同一目录
+        with tracing.job(trace_dir="speech", stage="speech"):
+            if args.batch:
+                generator.process_folders_batch(args.md_folder, args.py_folder)
+            else:
+                generator.process_folders(args.md_folder, args.py_folder, delay_seconds=args.delay)
         
     except Exception as e:
         print(f"Error: {e}")
@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+"""
+LLM 请求对冲（hedged request）
+
+主请求在「最近延迟的某个分位数」内还没有返回（流式：还没有收到第一个 token）时，
+再发一个重复请求，谁先完成用谁，另一个立即取消，用来压住单页代码生成 / 自动修复的长尾耗时。
+
+每个任务一个 HedgeBudget：额外请求数不超过主请求数的 max_ratio，且不超过 max_extra，
+保证对冲不会让调用量翻倍。配置在 llm_settings.hedge（config_pool.json 中为 settings.llm_settings.hedge），
+由调用方在任务开始时用 HedgeBudget.from_config(settings_from_config(cfg)) 创建预算。
+
+对冲请求换一把 key 发出（同一把 key 慢往往是这把 key 被限速）：ProviderAdapter 从自己的 KeyPool 取，
+只有一把 llm_key 的 LLMAPIClient / ManimCodeGenerator 从 hedge.key_pool 指定的 key 池取（见 get_backup_pool），
+没有别的 key 可用时不对冲。
+
+同步调用方（线程池里的代码生成）通过 run_sync / hedged_stream_sync 在进程内共享的后台事件循环中执行，
+落后的请求在循环中被取消并断开连接，不会像线程一样在后台跑完。
+
+配置示例：
+    "hedge": {"enabled": true, "percentile": 0.95, "max_ratio": 0.1, "key_pool": "config_pool.json"}
+"""
+
+import time
+import asyncio
+import threading
+import contextvars
+import concurrent.futures
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Coroutine, Dict, Iterator, Optional, Tuple, TypeVar
+
+from pool import APIKey, KeyPool, KeyStats, load_keypool_from_config
+from concurrency import is_throttle_error
+
+T = TypeVar("T")
+
+# (base_url, model, kind) -> 延迟统计（kind: total 整个请求 / ttft 首 token），对冲等待时间据此计算
+_latency_stats: Dict[Tuple[Optional[str], str, str], KeyStats] = {}
+_latency_lock = threading.Lock()
+# hedge.key_pool 路径 -> 对冲用的 key 池
+_backup_pools: Dict[str, Optional[KeyPool]] = {}
+_backup_lock = threading.Lock()
+# 同步调用方共用的后台事件循环
+_bridge_loop: Optional[asyncio.AbstractEventLoop] = None
+_bridge_lock = threading.Lock()
+
+
+@dataclass
+class HedgeBudget:
+    percentile: float = 0.95      # 等待多久再对冲：最近延迟的该分位数
+    min_delay: float = 2.0        # 对冲等待时间下限（秒），避免对短请求频繁对冲
+    min_samples: int = 10         # 样本不足时不对冲（分位数不可靠）
+    max_ratio: float = 0.1        # 额外请求数 / 主请求数 上限
+    max_extra: int = 20           # 每个任务额外请求总数上限
+    primaries: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @classmethod
+    def from_config(cls, cfg: Optional[Dict[str, Any]]) -> Optional["HedgeBudget"]:
+        """从配置段构造，例如 {"enabled": true, "percentile": 0.95, "max_ratio": 0.1}；未启用返回 None"""
+        if not cfg or not cfg.get("enabled", False):
+            return None
+        return cls(
+            percentile=float(cfg.get("percentile", 0.95)),
+            min_delay=float(cfg.get("min_delay", 2.0)),
+            min_samples=int(cfg.get("min_samples", 10)),
+            max_ratio=float(cfg.get("max_ratio", 0.1)),
+            max_extra=int(cfg.get("max_extra", 20)),
+        )
+
+    def delay_for(self, stats) -> Optional[float]:
+        """
+        根据延迟统计（pool.KeyStats）计算对冲等待时间
+
+        Returns:
+            秒；样本不足时返回 None 表示不对冲
+        """
+        if stats is None or len(stats.samples) < self.min_samples:
+            return None
+        p = stats.percentile(self.percentile)
+        if p is None:
+            return None
+        return max(self.min_delay, p)
+
+    def note_primary(self):
+        with self._lock:
+            self.primaries += 1
+
+    def try_spend(self) -> bool:
+        """申请一次对冲额度，预算用完返回 False"""
+        with self._lock:
+            if self.hedges >= self.max_extra:
+                return False
+            # 比例上限至少放行 1 次，否则任务开头的请求永远无法对冲
+            if self.hedges >= max(1.0, self.max_ratio * self.primaries):
+                return False
+            self.hedges += 1
+            return True
+
+    def note_hedge_win(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "primaries": self.primaries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+def settings_from_config(cfg: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """从完整配置中取出 llm_settings.hedge（兼容 config.json 与 config_pool.json 的 settings 结构）"""
+    cfg = cfg or {}
+    llm_settings = cfg.get("llm_settings") or (cfg.get("settings") or {}).get("llm_settings") or {}
+    return llm_settings.get("hedge")
+
+
+def latency_stats(base_url: Optional[str], model: str, kind: str = "total") -> KeyStats:
+    """同一 (base_url, model) 的延迟统计，进程内所有客户端共享；流式调用用 kind="ttft" 记录首 token 时间"""
+    key = (base_url, model, kind)
+    stats = _latency_stats.get(key)
+    if stats is None:
+        with _latency_lock:
+            stats = _latency_stats.setdefault(key, KeyStats())
+    return stats
+
+
+def get_backup_pool(cfg: Optional[Dict[str, Any]]) -> Optional[KeyPool]:
+    """
+    对冲请求使用的 key 池（hedge.key_pool 指定的 config_pool.json，同一路径进程内只加载一次）
+
+    Args:
+        cfg: llm_settings.hedge 配置段
+
+    Returns:
+        KeyPool；未配置或文件不存在时返回 None（不对冲）
+    """
+    path = (cfg or {}).get("key_pool")
+    if not path:
+        return None
+    with _backup_lock:
+        if path not in _backup_pools:
+            pool = load_keypool_from_config(path)
+            _backup_pools[path] = pool if isinstance(pool, KeyPool) else None
+            if _backup_pools[path] is None:
+                print(f"[hedge] 对冲 key 池不可用: {path}")
+        return _backup_pools[path]
+
+
+async def acquire_backup_key(pool: Optional[KeyPool], exclude: str, vendor: Optional[str] = "openai") -> Optional[APIKey]:
+    """
+    从 key 池中取一把与主请求不同的 key
+
+    Args:
+        pool: 对冲用的 key 池
+        exclude: 主请求使用的 key
+        vendor: 只取该厂商的 key（OpenAI 兼容接口）
+
+    Returns:
+        APIKey；没有别的 key 可用时返回 None
+    """
+    if pool is None:
+        return None
+    return await pool.acquire_key(vendor=vendor, exclude=exclude)
+
+
+def has_backup_key(pool: Optional[KeyPool], exclude: str, vendor: Optional[str] = "openai") -> bool:
+    """key 池中是否有与主请求不同、当前健康的 key（决定要不要对冲，不消耗令牌）"""
+    if pool is None:
+        return False
+    return any(k.key != exclude and k.healthy() and (vendor is None or k.vendor == vendor) for k in pool._keys)
+
+
+async def backup_key_stream(pool: Optional[KeyPool], exclude: str,
+                            open_stream: Callable[[APIKey], AsyncIterator[str]],
+                            vendor: Optional[str] = "openai") -> AsyncIterator[str]:
+    """
+    换一把 key 发出的对冲流：结果（耗时、是否失败）回报给 key 池；被取消（输给主请求）不计入失败
+
+    Args:
+        pool: 对冲用的 key 池
+        exclude: 主请求使用的 key
+        open_stream: 用指定 key 发起一次流式请求的函数（不重试，失败时抛出）
+        vendor: 只取该厂商的 key
+
+    Raises:
+        RuntimeError: 没有别的 key 可用（hedged_stream 继续等主请求）
+    """
+    k = await acquire_backup_key(pool, exclude, vendor)
+    if k is None:
+        raise RuntimeError("no alternate key for hedged request")
+    t0 = time.monotonic()
+    try:
+        async for piece in open_stream(k):
+            yield piece
+    except Exception as e:
+        await pool.report_failure(k, "rate" if is_throttle_error(e) else "server", latency=time.monotonic() - t0)
+        raise
+    await pool.report_success(k, latency=time.monotonic() - t0)
+
+
+async def backup_key_call(pool: Optional[KeyPool], exclude: str, call: Callable[[APIKey], Awaitable[T]],
+                          vendor: Optional[str] = "openai") -> T:
+    """backup_key_stream 的非流式版本"""
+    k = await acquire_backup_key(pool, exclude, vendor)
+    if k is None:
+        raise RuntimeError("no alternate key for hedged request")
+    t0 = time.monotonic()
+    try:
+        result = await call(k)
+    except Exception as e:
+        await pool.report_failure(k, "rate" if is_throttle_error(e) else "server", latency=time.monotonic() - t0)
+        raise
+    await pool.report_success(k, latency=time.monotonic() - t0)
+    return result
+
+
+async def _cancel(task: "asyncio.Task"):
+    if not task.done():
+        task.cancel()
+    try:
+        await task
+    except BaseException:
+        pass
+
+
+async def hedged_call(
+    primary: Callable[[], Awaitable[T]],
+    backup: Callable[[], Awaitable[T]],
+    delay: Optional[float],
+    budget: Optional[HedgeBudget],
+) -> T:
+    """
+    执行带对冲的调用
+
+    Args:
+        primary: 主请求工厂
+        backup: 对冲请求工厂（通常换一把 key）
+        delay: 等待多久再对冲；None 表示不对冲
+        budget: 任务级对冲预算
+
+    Returns:
+        先成功完成的结果；两个都失败时抛出主请求的异常
+    """
+    if budget is not None:
+        budget.note_primary()
+    first = asyncio.ensure_future(primary())
+    if delay is None or budget is None:
+        return await first
+
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done or not budget.try_spend():
+        return await first
+
+    second = asyncio.ensure_future(backup())
+    pending = {first, second}
+    first_error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        budget.note_hedge_win()
+                    return task.result()
+                if task is first or first_error is None:
+                    first_error = task.exception()
+        raise first_error
+    finally:
+        for task in (first, second):
+            await _cancel(task)
+
+
+async def hedged_stream(
+    primary: Callable[[], AsyncIterator[str]],
+    backup: Callable[[], AsyncIterator[str]],
+    delay: Optional[float],
+    budget: Optional[HedgeBudget],
+) -> AsyncIterator[str]:
+    """
+    流式版本：按「首 token 时间」对冲，先吐出第一个片段的流胜出，另一个流立即关闭
+
+    Yields:
+        胜出流的全部文本片段
+    """
+    if budget is not None:
+        budget.note_primary()
+    gen_a = primary()
+    if delay is None or budget is None:
+        try:
+            async for piece in gen_a:
+                yield piece
+        finally:
+            await gen_a.aclose()
+        return
+
+    task_a = asyncio.ensure_future(gen_a.__anext__())
+    done, _ = await asyncio.wait({task_a}, timeout=delay)
+    winner, first_piece = gen_a, None
+    if done or not budget.try_spend():
+        try:
+            first_piece = await task_a
+        except StopAsyncIteration:
+            return
+    else:
+        gen_b = backup()
+        task_b = asyncio.ensure_future(gen_b.__anext__())
+        pending = {task_a, task_b}
+        gens = {task_a: gen_a, task_b: gen_b}
+        winner = None
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner, first_piece = gens[task], task.result()
+                    break
+        for task, gen in gens.items():
+            if gen is not winner:
+                await _cancel(task)
+                await gen.aclose()
+        if winner is None:
+            # 两个流都没有产出（都异常或都为空）
+            exc = task_a.exception() if task_a.done() and not task_a.cancelled() else None
+            if exc is not None and not isinstance(exc, StopAsyncIteration):
+                raise exc
+            return
+        if winner is gen_b:
+            budget.note_hedge_win()
+
+    # 调用方提前停止读取（例如读到代码块结束标记）时立即关闭胜出的流，断开连接
+    try:
+        yield first_piece
+        async for piece in winner:
+            yield piece
+    finally:
+        await winner.aclose()
+
+
+def _get_bridge_loop() -> asyncio.AbstractEventLoop:
+    """同步调用方共用的后台事件循环（守护线程，进程内一个）"""
+    global _bridge_loop
+    if _bridge_loop is None:
+        with _bridge_lock:
+            if _bridge_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="hedge-loop", daemon=True).start()
+                _bridge_loop = loop
+    return _bridge_loop
+
+
+def run_sync(coro: Coroutine[Any, Any, T]) -> T:
+    """
+    在后台事件循环中执行协程并等待结果（在调用线程的 contextvars 中执行，tracing 的 span 照常生效）
+
+    不能在事件循环线程内调用（会死锁），协程代码直接 await 即可
+    """
+    loop = _get_bridge_loop()
+    ctx = contextvars.copy_context()
+    result: "concurrent.futures.Future" = concurrent.futures.Future()
+
+    def _start():
+        task = loop.create_task(coro)
+
+        def _done(t: "asyncio.Task"):
+            if t.cancelled():
+                result.cancel()
+            elif t.exception() is not None:
+                result.set_exception(t.exception())
+            else:
+                result.set_result(t.result())
+        task.add_done_callback(_done)
+
+    loop.call_soon_threadsafe(_start, context=ctx)
+    return result.result()
+
+
+_STREAM_END = object()
+
+
+async def _anext_or_end(agen: AsyncIterator[str]):
+    try:
+        return await agen.__anext__()
+    except StopAsyncIteration:
+        return _STREAM_END
+
+
+async def _aclose(agen: AsyncIterator[str]):
+    await agen.aclose()
+
+
+def hedged_stream_sync(
+    primary: Callable[[], AsyncIterator[str]],
+    backup: Callable[[], AsyncIterator[str]],
+    delay: Optional[float],
+    budget: Optional[HedgeBudget],
+) -> Iterator[str]:
+    """
+    hedged_stream 的同步版本：在后台事件循环中执行，逐片段取回。
+    落后的流在循环中取消并关闭连接；调用方提前关闭生成器（code_stream 读到结束标记）时关闭胜出的流
+
+    Yields:
+        胜出流的全部文本片段
+    """
+    agen = hedged_stream(primary, backup, delay, budget)
+    try:
+        while True:
+            piece = run_sync(_anext_or_end(agen))
+            if piece is _STREAM_END:
+                return
+            yield piece
+    finally:
+        run_sync(_aclose(agen))
+
+
+def hedged_call_sync(
+    primary: Callable[[], T],
+    backup: Callable[[], T],
+    delay: Optional[float],
+    budget: Optional[HedgeBudget],
+) -> T:
+    """
+    hedged_call 的同步版本：两个请求各在一个线程中执行。线程无法取消，落后的请求在后台跑完后丢弃；
+    LLM 调用请用 run_sync(hedged_call(...))，落后的请求会被取消
+
+    Returns:
+        先成功完成的结果；两个都失败时抛出主请求的异常
+    """
+    if budget is not None:
+        budget.note_primary()
+    if delay is None or budget is None:
+        return primary()
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="hedge")
+    try:
+        first = executor.submit(primary)
+        done, _ = concurrent.futures.wait({first}, timeout=delay)
+        if done or not budget.try_spend():
+            return first.result()
+
+        second = executor.submit(backup)
+        pending = {first, second}
+        first_error: Optional[BaseException] = None
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        budget.note_hedge_win()
+                    return future.result()
+                if future is first or first_error is None:
+                    first_error = future.exception()
+        raise first_error
+    finally:
+        executor.shutdown(wait=False)
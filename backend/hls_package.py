@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+把成片打包成 HLS（fMP4 切片 + m3u8），按页面边界对齐，可附带低分辨率档位
+
+整段 mp4 播放时要先取到 moov 再在大文件里跳转，换清晰度就得换一个完整文件。这里：
+
+1. 读取组装时写出的页面时间表（<名称>.pages.json，或写在 mp4 里的章节，见 course_assembler），没有时整段视为一页
+2. 页面起点对齐到最近的视频关键帧（组装时已强制为关键帧，这里兜底其他来源的视频），原画档才能按页流拷贝
+3. 每页一个任务并行切片：原画档直接流拷贝，低分辨率档按固定间隔强制关键帧后编码
+4. 各页的分片列表用 EXT-X-DISCONTINUITY 串成每档一个 index.m3u8，再写出 master.m3u8 和 pages.json
+   （每页在课程中的起点，供播放器做章节跳转）
+
+输出目录结构（默认 HLS_ROOT/<课程名>/，课程名见 course_name：调用方显式传入的任务 id，
+course_hub/<job_id>.mp4 即 HLS_ROOT/<job_id>/）：
+    master.m3u8
+    pages.json
+    source/index.m3u8, source/p000_init.mp4, source/p000_000.m4s, ...
+    720p/..., 480p/...
+
+后端把 HLS_ROOT 作为静态目录挂在 /hls 下，直接提供这些文件。
+
+环境变量：
+    HLS_ROOT              静态服务的根目录（默认 backend/course_hub/hls）
+    HLS_SEGMENT_SECONDS   目标切片时长（默认 6 秒）
+    HLS_RENDITIONS        额外档位的高度，逗号分隔（默认 720,480；不高于原画的才生成，空字符串表示不生成）
+"""
+
+import os
+import sys
+import json
+import math
+import shutil
+import mimetypes
+import subprocess
+from typing import Dict, List, Optional, Sequence
+
+import page_mux
+from course_assembler import FFMPEG, load_page_manifest, probe_video
+
+HLS_ROOT = os.environ.get("HLS_ROOT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "course_hub", "hls"))
+SEGMENT_SECONDS = float(os.environ.get("HLS_SEGMENT_SECONDS", "6"))
+RENDITIONS = [int(h) for h in os.environ.get("HLS_RENDITIONS", "720,480").split(",") if h.strip()]
+RENDITION_CRF = 23
+MASTER_NAME = "master.m3u8"
+INDEX_NAME = "index.m3u8"
+SOURCE_NAME = "source"
+# 原画档流拷贝时 -ss 落在关键帧之后一点点，避免 ffprobe 输出的时间舍入后早于关键帧而从上一个 GOP 开始
+COPY_SEEK_EPSILON = 0.001
+
+# 旧版本 Python 的 mimetypes 不认识这两种扩展名，静态服务会按 text/plain 返回
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+mimetypes.add_type("video/iso.segment", ".m4s")
+
+
+def course_name(video_path: str, job_id: Optional[str] = None) -> str:
+    """
+    课程在 HLS_ROOT 下的目录名
+
+    - 调用方传入 job_id 时直接使用（流水线中由 video_audio_merge 从 COURSE_JOB_ID 传入）
+    - course_hub/<job_id>.mp4：<job_id>
+    - 其他（流水线中的 Full.mp4）：输出目录名（<输出目录>/video_w_audio/Full.mp4 → <输出目录名>）
+
+    不读取 tracing 的 TRACE_JOB_ID：那是追踪用的随机 id，与前端的任务 id 无关
+    """
+    if job_id:
+        return job_id
+    video_path = os.path.abspath(video_path)
+    parent = os.path.dirname(video_path)
+    stem = os.path.splitext(os.path.basename(video_path))[0]
+    if parent == os.path.dirname(os.path.abspath(HLS_ROOT)):
+        return stem
+    if os.path.basename(parent) == "video_w_audio":
+        parent = os.path.dirname(parent)
+    return os.path.basename(parent) or stem
+
+
+def default_output_dir(video_path: str, job_id: Optional[str] = None) -> str:
+    """HLS_ROOT/<课程名>/（后端把 HLS_ROOT 挂在 /hls 下直接提供）"""
+    return os.path.join(os.path.abspath(HLS_ROOT), course_name(video_path, job_id))
+
+
+def snap_pages(pages: Sequence[Dict], keyframes: Sequence[float], total: float) -> List[Dict]:
+    """
+    把页面起点对齐到最近的关键帧，并按对齐后的起点重新计算时长
+
+    Args:
+        pages: 页面时间表 [{"name", "start", "duration"}]，按播放顺序
+        keyframes: 视频关键帧时间（升序）；为空时原样返回
+        total: 视频总时长
+
+    Returns:
+        对齐后的页面列表；比一个 GOP 还短、对齐后与上一页重合的页面并入上一页
+    """
+    if not keyframes:
+        return [dict(page) for page in pages]
+    snapped: List[Dict] = []
+    for page in pages:
+        start = 0.0 if not snapped else min(keyframes, key=lambda k: abs(k - page["start"]))
+        if snapped and start <= snapped[-1]["start"]:
+            continue
+        snapped.append(dict(page, start=round(start, 6)))
+    for page, following in zip(snapped, snapped[1:] + [None]):
+        end = following["start"] if following else total
+        page["duration"] = round(end - page["start"], 6)
+    return snapped
+
+
+def package_page(video_path: str, start: float, duration: float, out_dir: str, prefix: str,
+                 height: Optional[int] = None) -> bool:
+    """
+    把成片中的一页切成 fMP4 分片和该页的 m3u8
+
+    Args:
+        video_path: 成片
+        start / duration: 该页在成片中的起点和时长（原画档要求起点是关键帧，见 snap_pages）
+        out_dir: 档位目录
+        prefix: 文件名前缀（p000 ...）
+        height: 目标高度，None 表示原画（流拷贝）
+    """
+    seek = start + COPY_SEEK_EPSILON if height is None and start > 0 else start
+    cmd = [FFMPEG, "-y", "-loglevel", "error", "-ss", f"{seek:.6f}", "-i", video_path,
+           "-t", f"{duration:.6f}", "-map", "0:v:0", "-map", "0:a:0?"]
+    if height is None:
+        cmd += ["-c", "copy"]
+    else:
+        cmd += ["-vf", f"scale=-2:{height}", "-c:v", "libx264", "-crf", str(RENDITION_CRF), "-preset", "veryfast",
+                "-pix_fmt", "yuv420p", "-force_key_frames", f"expr:gte(t,n_forced*{SEGMENT_SECONDS:g})",
+                "-c:a", "copy"]
+    cmd += ["-f", "hls", "-hls_time", f"{SEGMENT_SECONDS:g}", "-hls_playlist_type", "vod",
+            "-hls_segment_type", "fmp4", "-hls_fmp4_init_filename", f"{prefix}_init.mp4",
+            "-hls_segment_filename", os.path.join(out_dir, f"{prefix}_%03d.m4s"),
+            os.path.join(out_dir, f"{prefix}.m3u8")]
+    try:
+        subprocess.run(cmd, capture_output=True, text=True, check=True)
+        return os.path.exists(os.path.join(out_dir, f"{prefix}.m3u8"))
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        print(f"❌ 切片失败: {prefix} - {getattr(e, 'stderr', e)}")
+        return False
+
+
+def _page_entries(playlist_path: str) -> List[str]:
+    """取出单页 m3u8 中的 EXT-X-MAP / EXTINF / 分片行"""
+    entries = []
+    with open(playlist_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith(("#EXT-X-MAP", "#EXTINF")) or (line and not line.startswith("#")):
+                entries.append(line)
+    return entries
+
+
+def write_media_playlist(out_dir: str, prefixes: Sequence[str]) -> float:
+    """
+    把各页的 m3u8 串成一个 index.m3u8（页与页之间加 EXT-X-DISCONTINUITY），删除单页 m3u8
+
+    Returns:
+        该档的总码率估计（bit/s）
+    """
+    body, durations, size = [], [], 0
+    for i, prefix in enumerate(prefixes):
+        page_playlist = os.path.join(out_dir, f"{prefix}.m3u8")
+        if i:
+            body.append("#EXT-X-DISCONTINUITY")
+        for entry in _page_entries(page_playlist):
+            body.append(entry)
+            if entry.startswith("#EXTINF:"):
+                durations.append(float(entry[len("#EXTINF:"):].split(",")[0]))
+        os.remove(page_playlist)
+    for name in os.listdir(out_dir):
+        size += os.path.getsize(os.path.join(out_dir, name))
+    header = ["#EXTM3U", "#EXT-X-VERSION:7",
+              f"#EXT-X-TARGETDURATION:{max(1, math.ceil(max(durations, default=SEGMENT_SECONDS)))}",
+              "#EXT-X-MEDIA-SEQUENCE:0", "#EXT-X-PLAYLIST-TYPE:VOD", "#EXT-X-INDEPENDENT-SEGMENTS"]
+    with open(os.path.join(out_dir, INDEX_NAME), "w", encoding="utf-8") as f:
+        f.write("\n".join(header + body + ["#EXT-X-ENDLIST"]) + "\n")
+    return size * 8 / max(sum(durations), 1e-3)
+
+
+def package_course(video_path: str, out_dir: Optional[str] = None,
+                   renditions: Optional[Sequence[int]] = None, job_id: Optional[str] = None) -> Optional[str]:
+    """
+    把成片打包成按页对齐的 HLS
+
+    Args:
+        video_path: 成片（Full.mp4 或 course_hub/<job_id>.mp4）
+        out_dir: 输出目录，默认 default_output_dir(video_path, job_id)；已存在时整体替换
+        renditions: 额外档位的高度，默认 HLS_RENDITIONS
+        job_id: 任务 id（决定 /hls/<job_id>/ 的目录名），见 course_name
+
+    Returns:
+        master.m3u8 路径；失败返回 None（旧的输出保持不变）
+    """
+    info = probe_video(video_path)
+    if info is None:
+        print(f"❌ 无法读取视频信息: {video_path}")
+        return None
+    out_dir = os.path.abspath(out_dir or default_output_dir(video_path, job_id))
+    pages = load_page_manifest(video_path) or [{"name": os.path.splitext(os.path.basename(video_path))[0],
+                                                "start": 0.0, "duration": info["duration"]}]
+    keyframes = page_mux.keyframe_times(video_path) if len(pages) > 1 else []
+    if len(pages) > 1 and not keyframes:
+        print("⚠️  无法读取关键帧，按原页面起点切片")
+    pages = snap_pages(pages, keyframes, info["duration"])
+    width, height = int(info["width"]), int(info["height"])
+    heights = sorted({h for h in (RENDITIONS if renditions is None else renditions) if h < height}, reverse=True)
+    variants = [(SOURCE_NAME, None, width, height)] + [
+        (f"{h}p", h, int(round(width * h / height / 2)) * 2, h) for h in heights]
+    print(f"📦 HLS 打包: {len(pages)} 页，档位 {', '.join(name for name, *_ in variants)}")
+
+    tmp_dir = out_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    prefixes = [f"p{i:03d}" for i in range(len(pages))]
+    jobs = []
+    for name, h, _, _ in variants:
+        os.makedirs(os.path.join(tmp_dir, name))
+        for prefix, page in zip(prefixes, pages):
+            jobs.append((f"{name}/{prefix}", package_page,
+                         (video_path, page["start"], page["duration"], os.path.join(tmp_dir, name), prefix, h)))
+    _, failed = page_mux.mux_pages(jobs, label="切片")
+    if failed:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return None
+
+    master = ["#EXTM3U", "#EXT-X-VERSION:7", "#EXT-X-INDEPENDENT-SEGMENTS"]
+    for name, _, w, h in variants:
+        bandwidth = write_media_playlist(os.path.join(tmp_dir, name), prefixes)
+        master += [f"#EXT-X-STREAM-INF:BANDWIDTH={int(bandwidth * 1.2)},AVERAGE-BANDWIDTH={int(bandwidth)},"
+                   f"RESOLUTION={w}x{h}", f"{name}/{INDEX_NAME}"]
+    with open(os.path.join(tmp_dir, MASTER_NAME), "w", encoding="utf-8") as f:
+        f.write("\n".join(master) + "\n")
+    with open(os.path.join(tmp_dir, "pages.json"), "w", encoding="utf-8") as f:
+        json.dump({"pages": pages}, f, ensure_ascii=False, indent=2)
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(os.path.dirname(out_dir), exist_ok=True)
+    os.replace(tmp_dir, out_dir)
+    print(f"✅ HLS 打包完成: {os.path.join(out_dir, MASTER_NAME)}")
+    return os.path.join(out_dir, MASTER_NAME)
+
+
+def main():
+    """命令行：打包指定视频，或用 --all 补齐 course_hub 中还没有 HLS 的课程"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="把课程视频打包成 HLS")
+    parser.add_argument("videos", nargs="*", help="成片路径")
+    parser.add_argument("--out", default=None, help="输出目录（只打包一个视频时可用）")
+    parser.add_argument("--all", action="store_true", help="打包 HLS_ROOT 上级目录（course_hub）中所有还没有 HLS 的 mp4")
+    parser.add_argument("--renditions", default=None, help="额外档位高度，逗号分隔，如 720,480")
+    parser.add_argument("--job-id", default=None, help="任务 id，输出到 HLS_ROOT/<job_id>/（只打包一个视频时可用）")
+    args = parser.parse_args()
+
+    renditions = [int(h) for h in args.renditions.split(",") if h.strip()] if args.renditions is not None else None
+    videos = list(args.videos)
+    if args.all:
+        hub = os.path.dirname(HLS_ROOT)
+        videos += [os.path.join(hub, name) for name in sorted(os.listdir(hub))
+                   if name.endswith(".mp4")
+                   and not os.path.exists(os.path.join(HLS_ROOT, os.path.splitext(name)[0], MASTER_NAME))]
+    if not videos:
+        parser.print_help()
+        sys.exit(1)
+    single = len(videos) == 1
+    failed = [v for v in videos
+              if not package_course(v, args.out if single else None, renditions, args.job_id if single else None)]
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+进程级共享的 HTTP 连接池
+
+所有 LLM 调用（LLMAPIClient / ManimCodeGenerator / SpeechScriptGenerator / ProviderAdapter）
+共用同一组 keep-alive 连接，不再每个实例、每次调用各自新建 OpenAI 客户端和 TCP/TLS 连接。
+
+- 同步调用：进程内唯一的 httpx.Client（线程安全）
+- 异步调用：每个事件循环一个 httpx.AsyncClient（异步连接池不能跨事件循环使用），
+  事件循环结束（asyncio.run 返回）前自动关闭
+"""
+
+import os
+import asyncio
+import threading
+import weakref
+from typing import Any, Optional
+
+import httpx
+
+# 连接池大小，可通过环境变量调整
+MAX_CONNECTIONS = int(os.environ.get("LLM_HTTP_MAX_CONNECTIONS", "512"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("LLM_HTTP_MAX_KEEPALIVE", "128"))
+KEEPALIVE_EXPIRY = float(os.environ.get("LLM_HTTP_KEEPALIVE_EXPIRY", "90"))
+# 默认超时；OpenAI SDK 会按每次请求的 timeout 覆盖
+DEFAULT_TIMEOUT = httpx.Timeout(1200.0, connect=15.0)
+
+_sync_client: Optional[httpx.Client] = None
+_sync_lock = threading.Lock()
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+# 每个连接池对应的关闭钩子，见 _close_on_loop_shutdown
+_async_closers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = weakref.WeakKeyDictionary()
+_async_lock = threading.Lock()
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def get_http_client() -> httpx.Client:
+    """获取进程内共享的同步 httpx.Client"""
+    global _sync_client
+    if _sync_client is None or _sync_client.is_closed:
+        with _sync_lock:
+            if _sync_client is None or _sync_client.is_closed:
+                _sync_client = httpx.Client(limits=_limits(), timeout=DEFAULT_TIMEOUT)
+    return _sync_client
+
+
+async def _closer(client: httpx.AsyncClient):
+    try:
+        yield
+    finally:
+        # 生成器引用着循环，必须从弱引用表中移除，循环才能被回收
+        loop = asyncio.get_running_loop()
+        if _async_clients.get(loop) is client:
+            _async_clients.pop(loop, None)
+        _async_closers.pop(loop, None)
+        if not client.is_closed:
+            await client.aclose()
+
+
+def _close_on_loop_shutdown(loop: asyncio.AbstractEventLoop, client: httpx.AsyncClient):
+    """
+    事件循环结束前关闭 client
+
+    启动一个停在 yield 处的异步生成器：它登记在当前循环上，asyncio.run 退出前的
+    loop.shutdown_asyncgens() 会在循环内关闭它，finally 中 await client.aclose()。
+    循环本身只弱引用生成器，所以由 _async_closers 持有。
+    """
+    gen = _closer(client)
+    try:
+        gen.__anext__().send(None)
+    except StopIteration:
+        pass
+    _async_closers[loop] = gen
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """获取当前事件循环共享的 httpx.AsyncClient（必须在协程中调用）"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        with _async_lock:
+            client = _async_clients.get(loop)
+            if client is None or client.is_closed:
+                client = httpx.AsyncClient(limits=_limits(), timeout=DEFAULT_TIMEOUT)
+                _async_clients[loop] = client
+                _close_on_loop_shutdown(loop, client)
+    return client
+
+
+async def aclose_async_http_client():
+    """关闭当前事件循环的共享连接池（ARQ worker shutdown 时调用）"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.pop(loop, None)
+    _async_closers.pop(loop, None)
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+
+def close_http_client():
+    """关闭同步共享连接池"""
+    global _sync_client
+    with _sync_lock:
+        if _sync_client is not None and not _sync_client.is_closed:
+            _sync_client.close()
+        _sync_client = None
@@ -5,21 +5,32 @@ LLM API Client using OpenAI with configuration from config.json
 
 import base64
 import time
-from openai import OpenAI
+import asyncio
+import weakref
+from openai import OpenAI, AsyncOpenAI
 import json
 import socket
 import ssl
 import re
 import os
 import argparse
-from typing import List, Dict, Any, Union, Tuple, Optional
+from typing import List, Dict, Any, Union, Tuple, Optional, AsyncIterator
 from PIL import Image
-
+from llm_cache import cacheable, make_cache_key, get_cache_from_config, pipeline_use_cache
+from http_pool import get_http_client, get_async_http_client
+from hedging import (HedgeBudget, backup_key_call, backup_key_stream, get_backup_pool, has_backup_key, hedged_call,
+                     hedged_stream, hedged_stream_sync, latency_stats, run_sync)
+from pool import APIKey, KeyStats
+from concurrency import get_limiter
+from code_stream import FENCE, stream_code
+import tracing
 
 class LLMAPIClient:
     """LLM API client that handles configuration and API operations"""
 
     BUSY_MESSAGE = "服务器繁忙，请稍后再试吧"
+    # 流式接口命中缓存时，每次回放的字符数
+    STREAM_REPLAY_CHUNK = 64
     
     def __init__(self, config_path="config.json"):
         """Initialize the LLM API Client with configuration from JSON file"""
@@ -35,12 +46,30 @@ class LLMAPIClient:
         self.temperature = llm_settings.get('temperature', 1)
         self.max_retries = llm_settings.get('max_retries', 3)
         self.timeout = llm_settings.get('timeout', 1200)
+
+        # 响应缓存（config.json 中 llm_cache.enabled=false 可关闭）
+        self.cache = get_cache_from_config(self.config)
+        # 讲义 / 分页等生成接口传给 cacheable 的 use_cache（temperature > 0 也缓存），见 llm_cache.pipeline_use_cache
+        self.pipeline_cache = pipeline_use_cache(self.config)
+        # 请求对冲（llm_settings.hedge.enabled=true 时开启，同步 / 异步接口都生效）；每个实例一份预算，按任务创建实例即为任务级上限
+        self.hedge_budget = HedgeBudget.from_config(llm_settings.get('hedge'))
+        # 对冲请求换用 hedge.key_pool 中的另一把 key，见 hedging.get_backup_pool
+        self.backup_pool = get_backup_pool(llm_settings.get('hedge')) if self.hedge_budget is not None else None
+        # 进程内所有 LLM 调用共用的自适应并发限流器（config.json 的 concurrency 段）
+        self.limiter = get_limiter("llm", self.config)
+        # token 费用单价（config.json 的 pricing 段），见 tracing
+        tracing.configure_pricing(self.config)
         
-        # 初始化 OpenAI 客户端
+        # 初始化 OpenAI 客户端（共用进程级连接池）
         self.client = OpenAI(
             api_key=self.api_key,
             base_url=self.base_url,
+            http_client=get_http_client(),
         )
+        # 异步客户端按 事件循环 -> base_url 懒加载，见 _get_async_client；
+        # 以循环对象为弱引用键，循环结束后随之释放，不会被 id 相同的新循环误用
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, AsyncOpenAI]]" = \
+            weakref.WeakKeyDictionary()
     
     def _load_config(self):
         """Load configuration from JSON file"""
@@ -178,13 +207,28 @@ class LLMAPIClient:
             # 如果没有base_path，相对于当前工作目录
             return os.path.abspath(img_path)
 
-    def call_api_with_text_and_images(self, text: str, base_path: Optional[str] = None) -> str:
+    def call_api_with_text_and_images(self, text: str, base_path: Optional[str] = None, use_cache: Optional[bool] = None) -> str:
         """
         处理文本中的图片引用并调用API
         
         Args:
             text: 要处理的文本
             base_path: 图片路径的基准目录（通常是markdown文件所在目录）
+            use_cache: 是否使用响应缓存；默认只在 temperature == 0 时缓存（需要每次得到不同结果时传 False）
+        """
+        content = self.build_text_and_images_content(text, base_path)
+        return self._call_api(content, use_cache=use_cache)
+
+    def build_text_and_images_content(self, text: str, base_path: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        把文本中的 ![](path) 图片引用转换为多模态消息内容（文本中补充图片尺寸，图片以 base64 附加）
+        
+        Args:
+            text: 要处理的文本
+            base_path: 图片路径的基准目录
+        
+        Returns:
+            OpenAI 格式的 content 列表
         """
         # 提取图片路径
         image_paths = self.extract_images_from_text(text)
@@ -229,8 +273,7 @@ class LLMAPIClient:
             except Exception as e:
                 print(f"处理图片 {img_path} 时出错: {str(e)}")
         
-        # 调用API
-        return self._call_api(content)
+        return content
     
     # def call_api_with_text(self, text: str) -> str:
     #     """简单的纯文本API调用，不处理图片"""
@@ -244,7 +287,8 @@ class LLMAPIClient:
     #     # 调用API
     #     return self._call_api(content)
 
-    def call_api_with_text(self, text: str, max_tokens: Optional[int] = None, temperature: Optional[float] = None) -> str:
+    def call_api_with_text(self, text: str, max_tokens: Optional[int] = None, temperature: Optional[float] = None,
+                           use_cache: Optional[bool] = None) -> str:
         """简单的纯文本API调用，不处理图片"""
         content = [
             {
@@ -254,9 +298,10 @@ class LLMAPIClient:
         ]
         
         # 调用API，传入自定义参数
-        return self._call_api(content, max_tokens=max_tokens, temperature=temperature)
+        return self._call_api(content, max_tokens=max_tokens, temperature=temperature, use_cache=use_cache)
     
-    def call_api_with_text_stream(self, text: str, max_tokens: Optional[int] = None, temperature: Optional[float] = None):
+    def call_api_with_text_stream(self, text: str, max_tokens: Optional[int] = None, temperature: Optional[float] = None,
+                                  use_cache: Optional[bool] = None):
         """
         简单的纯文本流式API调用，不处理图片
         优化版本：立即返回第一个chunk，最小化延迟
@@ -265,6 +310,7 @@ class LLMAPIClient:
             text: 要发送的文本
             max_tokens: 最大token数（可选，默认使用实例配置）
             temperature: 温度参数（可选，默认使用实例配置）
+            use_cache: 是否使用响应缓存；默认只在 temperature == 0 时缓存
         
         Yields:
             str: 每次返回的文本片段
@@ -277,8 +323,68 @@ class LLMAPIClient:
         ]
         
         # 调用流式API，传入自定义参数
-        yield from self._call_api_stream(content, max_tokens=max_tokens, temperature=temperature)
+        yield from self._call_api_stream(content, max_tokens=max_tokens, temperature=temperature, use_cache=use_cache)
     
+    def call_api_for_code(self, text: str, marker: str = FENCE, max_tokens: Optional[int] = None,
+                          temperature: Optional[float] = None, use_cache: Optional[bool] = None, max_attempts: int = 2) -> str:
+        """
+        代码生成专用接口：流式接收，读到代码块结束标记（``` 或 FILE_END>>>）即关闭流；
+        增量语法检查发现无法续写修复的错误时立即中止并重新请求（见 code_stream）。
+        配置了 llm_settings.hedge 时按首 token 时间对冲（见 _call_api_stream）
+
+        Args:
+            text: 提示词
+            marker: code_stream.FENCE 或 code_stream.FILE
+            max_tokens: 最大token数（可选，默认使用实例配置）
+            temperature: 温度参数（可选，默认使用实例配置）
+            use_cache: 是否使用响应缓存（只缓存通过语法检查的结果）；默认只在 temperature == 0 时缓存
+            max_attempts: 因语法错误重新请求的最多次数（含第一次）
+
+        Returns:
+            截止到结束标记的原始文本，调用方继续用 extract_code_block 等函数提取代码
+        """
+        content = [{"type": "text", "text": text}]
+        actual_max_tokens = max_tokens if max_tokens is not None else self.max_tokens
+        actual_temperature = temperature if temperature is not None else self.temperature
+
+        cache_key = self._cache_key(content, actual_max_tokens, actual_temperature, use_cache)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                tracing.record_llm(self.model, cached=True)
+                return cached
+
+        result, ok = stream_code(
+            lambda: self._call_api_stream(content, actual_max_tokens, actual_temperature, use_cache=False),
+            marker=marker,
+            max_attempts=max_attempts,
+        )
+        if cache_key and ok and result and result != self.BUSY_MESSAGE:
+            self.cache.put(cache_key, result, model=self.model)
+        return result if result else self.BUSY_MESSAGE
+
+    def add_text_to_batch(self, job, custom_id: str, text: str, max_tokens: Optional[int] = None,
+                          temperature: Optional[float] = None):
+        """
+        把一次 call_api_with_text 请求加入批量任务（llm_batch.LLMBatchJob），缓存 key 与同步路径一致
+
+        Args:
+            job: LLMBatchJob 实例
+            custom_id: 请求标识
+            text: 提示词
+        """
+        content = [{"type": "text", "text": text}]
+        actual_max_tokens = max_tokens if max_tokens is not None else self.max_tokens
+        actual_temperature = temperature if temperature is not None else self.temperature
+        job.add(
+            custom_id,
+            self.model,
+            [{"role": "user", "content": content}],
+            max_tokens=actual_max_tokens,
+            temperature=actual_temperature,
+            cache_key=self._cache_key(content, actual_max_tokens, actual_temperature, self.pipeline_cache),
+        )
+
     def generate_course_notes(self, keyword: str) -> str:
         """
         根据关键词生成机器学习课程讲义大纲
@@ -290,7 +396,7 @@ class LLMAPIClient:
             生成的课程讲义大纲
         """
         prompt = self.create_noter_prompt(keyword)
-        return self.call_api_with_text(prompt)
+        return self.call_api_with_text(prompt, use_cache=self.pipeline_cache)
     
     def create_script_writer_prompt(self, keyword: str, search_results: str) -> str:
         """
@@ -345,7 +451,7 @@ class LLMAPIClient:
             生成的完整教学讲义
         """
         prompt = self.create_script_writer_prompt(keyword, search_results)
-        return self.call_api_with_text(prompt)
+        return self.call_api_with_text(prompt, use_cache=self.pipeline_cache)
     
     def generate_chapter_script(self, chapter_topic: str, search_results: str) -> str:
         """
@@ -359,7 +465,7 @@ class LLMAPIClient:
             生成的章节详细讲义
         """
         prompt = self.create_chapter_writer_prompt(chapter_topic, search_results)
-        return self.call_api_with_text(prompt)
+        return self.call_api_with_text(prompt, use_cache=self.pipeline_cache)
     
     def generate_paginated_section(self, section_content: str) -> str:
         """
@@ -372,53 +478,103 @@ class LLMAPIClient:
             添加了分页标记的章节内容
         """
         prompt = self.create_brain_prompt(section_content)
-        return self.call_api_with_text(prompt)
+        return self.call_api_with_text(prompt, use_cache=self.pipeline_cache)
     
+    def _cache_key(self, content: List[Dict[str, Any]], max_tokens: int, temperature: float,
+                   use_cache: Optional[bool] = None) -> Optional[str]:
+        """
+        计算当前请求的缓存 key（model/base_url 在调用时读取，兼容调用方替换 pptx_settings 的写法）
+
+        Returns:
+            缓存 key；未启用缓存或这次调用不应缓存（见 llm_cache.cacheable）时返回 None
+        """
+        if self.cache is None or not cacheable(temperature, use_cache):
+            return None
+        return make_cache_key(self.model, self.base_url, content, temperature, max_tokens)
+
     def _call_api(
         self,
         content: List[Dict[str, Any]],
         max_tokens: Optional[int] = None,
         temperature: Optional[float] = None,
+        use_cache: Optional[bool] = None,
     ) -> str:
-        """发送API请求并处理响应"""
+        """
+        发送API请求并处理响应
+
+        配置了 llm_settings.hedge 时与异步接口一样启用请求对冲：在 hedging 的后台事件循环中执行，
+        对冲请求换一把 key 发出，落后的请求被取消。
+        """
         busy_message = self.BUSY_MESSAGE
         actual_max_tokens = max_tokens if max_tokens is not None else self.max_tokens
         actual_temperature = temperature if temperature is not None else self.temperature
+
+        cache_key = self._cache_key(content, actual_max_tokens, actual_temperature, use_cache)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                tracing.record_llm(self.model, cached=True)
+                return cached
+
+        if self.hedge_budget is not None:
+            response_content = run_sync(hedged_call(
+                lambda: self._acall_api_uncached(content, actual_max_tokens, actual_temperature),
+                lambda: self._abackup_call(content, actual_max_tokens, actual_temperature),
+                self._hedge_delay(),
+                self.hedge_budget,
+            ))
+        else:
+            response_content = self._call_api_uncached(content, actual_max_tokens, actual_temperature)
+
+        if cache_key and response_content and response_content != busy_message:
+            self.cache.put(cache_key, response_content, model=self.model)
+
+        return response_content if response_content else busy_message
+
+    def _call_api_uncached(self, content: List[Dict[str, Any]], max_tokens: int, temperature: float) -> str:
+        busy_message = self.BUSY_MESSAGE
         retry_count = 0
         response_content = None
-
         while retry_count < self.max_retries:
+            t0 = time.monotonic()
             try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": content
-                        }
-                    ],
-                    max_tokens=actual_max_tokens,
-                    temperature=actual_temperature
-                )
+                with self.limiter.slot():
+                    response = self.client.chat.completions.create(
+                        model=self.model,
+                        messages=[
+                            {
+                                "role": "user",
+                                "content": content
+                            }
+                        ],
+                        max_tokens=max_tokens,
+                        temperature=temperature
+                    )
                 
                 if response.choices and response.choices[0].message:
                     response_content = response.choices[0].message.content
+                    self._latency_stats().record_success(time.monotonic() - t0)
                 else:
                     response_content = busy_message
+                tracing.record_llm_response(self.model, response, prompt=content, completion=response_content,
+                                            latency=time.monotonic() - t0)
                 break  # 成功，跳出重试循环
 
             except Exception as e:
+                self._latency_stats().record_failure(time.monotonic() - t0)
                 retry_count += 1
                 print(f"API调用错误 (尝试 {retry_count}/{self.max_retries}): {e}")
                 if retry_count >= self.max_retries:
                     response_content = busy_message
                     break
+                tracing.record_retry(str(e))
                 print(f"等待 {5 * retry_count} 秒后重试...")  # 简单的退避策略
                 time.sleep(5 * retry_count)
 
-        return response_content if response_content else busy_message
+        return response_content
 
-    def _call_api_stream(self, content: List[Dict[str, Any]], max_tokens: Optional[int] = None, temperature: Optional[float] = None):
+    def _call_api_stream(self, content: List[Dict[str, Any]], max_tokens: Optional[int] = None, temperature: Optional[float] = None,
+                         use_cache: Optional[bool] = None):
         """
         发送流式API请求并逐步返回响应（优化版本：最小化延迟）
         
@@ -426,6 +582,7 @@ class LLMAPIClient:
             content: 消息内容
             max_tokens: 最大token数（可选，默认使用实例配置）
             temperature: 温度参数（可选，默认使用实例配置）
+            use_cache: 是否使用响应缓存（命中时直接分段回放缓存内容）；默认只在 temperature == 0 时缓存
         
         Yields:
             str: 每次返回的文本片段
@@ -435,30 +592,73 @@ class LLMAPIClient:
         actual_max_tokens = max_tokens if max_tokens is not None else self.max_tokens
         actual_temperature = temperature if temperature is not None else self.temperature
 
+        cache_key = self._cache_key(content, actual_max_tokens, actual_temperature, use_cache)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                # 按固定长度分段回放，保持调用方的流式消费逻辑不变
+                tracing.record_llm(self.model, cached=True)
+                for i in range(0, len(cached), self.STREAM_REPLAY_CHUNK):
+                    yield cached[i:i + self.STREAM_REPLAY_CHUNK]
+                return
+
+        if self.hedge_budget is not None:
+            # 按首 token 时间对冲（代码生成等长输出的主要长尾），在后台事件循环中执行
+            parts = []
+            for piece in hedged_stream_sync(
+                lambda: self._acall_api_stream_uncached(content, actual_max_tokens, actual_temperature),
+                lambda: self._abackup_stream(content, actual_max_tokens, actual_temperature),
+                self._hedge_delay("ttft"),
+                self.hedge_budget,
+            ):
+                parts.append(piece)
+                yield piece
+            if cache_key and parts and parts != [busy_message]:
+                self.cache.put(cache_key, "".join(parts), model=self.model)
+            return
+
         retry_count = 0
 
         while retry_count < self.max_retries:
+            t0 = time.monotonic()
             try:
-                stream = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": content
-                        }
-                    ],
-                    max_tokens=actual_max_tokens,
-                    temperature=actual_temperature,
-                    stream=True  # 启用流式输出
-                )
-                
-                # 立即yield每个chunk，最小化延迟
-                for chunk in stream:
-                    if chunk.choices and len(chunk.choices) > 0:
-                        delta = chunk.choices[0].delta
-                        if delta and delta.content:
-                            yield delta.content
+                # 名额占用到整个流结束
+                with self.limiter.slot():
+                    stream = self.client.chat.completions.create(
+                        model=self.model,
+                        messages=[
+                            {
+                                "role": "user",
+                                "content": content
+                            }
+                        ],
+                        max_tokens=actual_max_tokens,
+                        temperature=actual_temperature,
+                        stream=True  # 启用流式输出
+                    )
+
+                    # 立即yield每个chunk，最小化延迟
+                    parts = []
+                    try:
+                        for chunk in stream:
+                            if chunk.choices and len(chunk.choices) > 0:
+                                delta = chunk.choices[0].delta
+                                if delta and delta.content:
+                                    if not parts:
+                                        # 首 token 时间：对冲等待时间据此计算
+                                        self._latency_stats("ttft").record_success(time.monotonic() - t0)
+                                    parts.append(delta.content)
+                                    yield delta.content
+                    finally:
+                        # 调用方提前关闭生成器时立即断开连接，不再继续生成
+                        stream.close()
+                        # 流式响应没有 usage，按已收到的文本估算
+                        tracing.record_llm_response(self.model, None, prompt=content, completion="".join(parts),
+                                                    latency=time.monotonic() - t0)
                 
+                # 只缓存完整结束的流（调用方中途关闭生成器时不会走到这里）
+                if cache_key and parts:
+                    self.cache.put(cache_key, "".join(parts), model=self.model)
                 # 成功完成，退出重试循环
                 return
                         
@@ -470,6 +670,7 @@ class LLMAPIClient:
                     # 达到最大重试次数：统一返回忙碌提示，不暴露底层错误细节
                     yield busy_message
                     return
+                tracing.record_retry(str(e))
                 
                 # 重试前短暂等待（减少等待时间以提高响应速度）
                 wait_time = min(2 * retry_count, 5)  # 最多等待5秒
@@ -477,6 +678,280 @@ class LLMAPIClient:
                 time.sleep(wait_time)
 
 
+    # ------------------------------------------------------------------
+    # 异步接口：共用事件循环级连接池，退避使用 asyncio.sleep，不占用线程
+    # ------------------------------------------------------------------
+
+    def _get_async_client(self) -> AsyncOpenAI:
+        """获取绑定当前事件循环共享连接池的 AsyncOpenAI 客户端"""
+        clients = self._async_clients.setdefault(asyncio.get_running_loop(), {})
+        client = clients.get(self.base_url)
+        if client is None:
+            # 底层连接池归 http_pool 管理，循环结束前由它关闭
+            client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                http_client=get_async_http_client(),
+            )
+            clients[self.base_url] = client
+        return client
+
+    async def acall_api_with_text(self, text: str, max_tokens: Optional[int] = None, temperature: Optional[float] = None,
+                                  use_cache: Optional[bool] = None) -> str:
+        """call_api_with_text 的异步版本"""
+        content = [{"type": "text", "text": text}]
+        return await self.acall_api(content, max_tokens=max_tokens, temperature=temperature, use_cache=use_cache)
+
+    async def acall_api_with_text_and_images(self, text: str, base_path: Optional[str] = None, use_cache: Optional[bool] = None) -> str:
+        """call_api_with_text_and_images 的异步版本（图片读取与编码放到线程中，避免阻塞事件循环）"""
+        content = await asyncio.to_thread(self.build_text_and_images_content, text, base_path)
+        return await self.acall_api(content, use_cache=use_cache)
+
+    def _latency_stats(self, kind: str = "total") -> KeyStats:
+        """同一 (base_url, model) 的延迟统计，进程内所有客户端共享（见 hedging.latency_stats）"""
+        return latency_stats(self.base_url, self.model, kind)
+
+    def _hedge_delay(self, kind: str = "total") -> Optional[float]:
+        """对冲等待时间；没有别的 key 可用或延迟样本不足时为 None（不对冲）"""
+        if self.hedge_budget is None or not has_backup_key(self.backup_pool, self.api_key):
+            return None
+        return self.hedge_budget.delay_for(self._latency_stats(kind))
+
+    def _async_client_for(self, k: APIKey) -> AsyncOpenAI:
+        """用 key 池中的另一把 key 访问（对冲请求），连接池与主请求共用"""
+        return AsyncOpenAI(
+            api_key=k.key,
+            base_url=k.metadata.get("base_url") or self.base_url,
+            http_client=get_async_http_client(),
+        )
+
+    async def _abackup_call(self, content: List[Dict[str, Any]], max_tokens: int, temperature: float) -> str:
+        """对冲请求：换一把 key 发一次（不重试，失败时抛出，继续等主请求）"""
+        return await backup_key_call(
+            self.backup_pool, self.api_key,
+            lambda k: self._arequest(self._async_client_for(k), content, max_tokens, temperature),
+        )
+
+    async def _abackup_stream(self, content: List[Dict[str, Any]], max_tokens: int,
+                              temperature: float) -> AsyncIterator[str]:
+        """流式对冲请求：换一把 key 发一次（不重试，失败时抛出，继续等主请求）"""
+        async for piece in backup_key_stream(
+            self.backup_pool, self.api_key,
+            lambda k: self._aopen_stream(self._async_client_for(k), content, max_tokens, temperature),
+        ):
+            yield piece
+
+    async def acall_api(
+        self,
+        content: List[Dict[str, Any]],
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        use_cache: Optional[bool] = None,
+    ) -> str:
+        """
+        _call_api 的异步版本，重试策略与同步版本一致
+        
+        配置了 llm_settings.hedge 时启用请求对冲：超过最近延迟分位数仍未返回就换一把 key 再发一份，先返回者胜出。
+        """
+        busy_message = self.BUSY_MESSAGE
+        actual_max_tokens = max_tokens if max_tokens is not None else self.max_tokens
+        actual_temperature = temperature if temperature is not None else self.temperature
+
+        cache_key = self._cache_key(content, actual_max_tokens, actual_temperature, use_cache)
+        if cache_key:
+            cached = await asyncio.to_thread(self.cache.get, cache_key)
+            if cached is not None:
+                tracing.record_llm(self.model, cached=True)
+                return cached
+
+        def _once():
+            return self._acall_api_uncached(content, actual_max_tokens, actual_temperature)
+
+        if self.hedge_budget is not None:
+            response_content = await hedged_call(
+                _once,
+                lambda: self._abackup_call(content, actual_max_tokens, actual_temperature),
+                self._hedge_delay(),
+                self.hedge_budget,
+            )
+        else:
+            response_content = await _once()
+
+        if cache_key and response_content and response_content != busy_message:
+            await asyncio.to_thread(self.cache.put, cache_key, response_content, self.model)
+
+        return response_content if response_content else busy_message
+
+    async def _acall_api_uncached(self, content: List[Dict[str, Any]], max_tokens: int, temperature: float) -> str:
+        busy_message = self.BUSY_MESSAGE
+        retry_count = 0
+        response_content = None
+        client = self._get_async_client()
+        while retry_count < self.max_retries:
+            try:
+                response_content = await self._arequest(client, content, max_tokens, temperature)
+                break
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                retry_count += 1
+                print(f"API调用错误 (尝试 {retry_count}/{self.max_retries}): {e}")
+                if retry_count >= self.max_retries:
+                    response_content = busy_message
+                    break
+                tracing.record_retry(str(e))
+                print(f"等待 {5 * retry_count} 秒后重试...")
+                await asyncio.sleep(5 * retry_count)
+
+        return response_content
+
+    async def _arequest(self, client: AsyncOpenAI, content: List[Dict[str, Any]], max_tokens: int,
+                        temperature: float) -> str:
+        """发一次请求（不重试，失败时抛出）"""
+        t0 = time.monotonic()
+        try:
+            async with self.limiter.aslot():
+                response = await client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": content
+                        }
+                    ],
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    timeout=self.timeout,
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._latency_stats().record_failure(time.monotonic() - t0)
+            raise
+
+        if response.choices and response.choices[0].message:
+            response_content = response.choices[0].message.content
+            self._latency_stats().record_success(time.monotonic() - t0)
+        else:
+            response_content = self.BUSY_MESSAGE
+        tracing.record_llm_response(self.model, response, prompt=content, completion=response_content,
+                                    latency=time.monotonic() - t0)
+        return response_content
+
+    async def acall_api_stream(self, content: List[Dict[str, Any]], max_tokens: Optional[int] = None,
+                               temperature: Optional[float] = None, use_cache: Optional[bool] = None) -> AsyncIterator[str]:
+        """
+        _call_api_stream 的异步版本
+        
+        启用对冲时按首 token 时间对冲：超过最近首 token 延迟的分位数还没有输出，就换一把 key 再发一个流，先出字的胜出。
+        
+        Yields:
+            str: 每次返回的文本片段
+        """
+        busy_message = self.BUSY_MESSAGE
+        actual_max_tokens = max_tokens if max_tokens is not None else self.max_tokens
+        actual_temperature = temperature if temperature is not None else self.temperature
+
+        cache_key = self._cache_key(content, actual_max_tokens, actual_temperature, use_cache)
+        if cache_key:
+            cached = await asyncio.to_thread(self.cache.get, cache_key)
+            if cached is not None:
+                tracing.record_llm(self.model, cached=True)
+                for i in range(0, len(cached), self.STREAM_REPLAY_CHUNK):
+                    yield cached[i:i + self.STREAM_REPLAY_CHUNK]
+                return
+
+        def _once():
+            return self._acall_api_stream_uncached(content, actual_max_tokens, actual_temperature)
+
+        if self.hedge_budget is not None:
+            pieces = hedged_stream(
+                _once,
+                lambda: self._abackup_stream(content, actual_max_tokens, actual_temperature),
+                self._hedge_delay("ttft"),
+                self.hedge_budget,
+            )
+        else:
+            pieces = _once()
+
+        parts = []
+        async for piece in pieces:
+            parts.append(piece)
+            yield piece
+
+        # 只缓存完整结束的流（失败时的忙碌提示不缓存）
+        if cache_key and parts and parts != [busy_message]:
+            await asyncio.to_thread(self.cache.put, cache_key, "".join(parts), self.model)
+
+    async def _acall_api_stream_uncached(self, content: List[Dict[str, Any]], max_tokens: int,
+                                         temperature: float) -> AsyncIterator[str]:
+        busy_message = self.BUSY_MESSAGE
+        client = self._get_async_client()
+        retry_count = 0
+        while retry_count < self.max_retries:
+            try:
+                async for piece in self._aopen_stream(client, content, max_tokens, temperature):
+                    yield piece
+                return
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                retry_count += 1
+                print(f"流式API调用错误 (尝试 {retry_count}/{self.max_retries}): {e}")
+
+                if retry_count >= self.max_retries:
+                    yield busy_message
+                    return
+                tracing.record_retry(str(e))
+
+                wait_time = min(2 * retry_count, 5)
+                print(f"等待 {wait_time} 秒后重试...")
+                await asyncio.sleep(wait_time)
+
+    async def _aopen_stream(self, client: AsyncOpenAI, content: List[Dict[str, Any]], max_tokens: int,
+                            temperature: float) -> AsyncIterator[str]:
+        """发一次流式请求（不重试，失败时抛出），记录首 token 时间"""
+        t0 = time.monotonic()
+        async with self.limiter.aslot():
+            stream = await client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": content
+                    }
+                ],
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True,
+                timeout=self.timeout,
+            )
+
+            parts = []
+            try:
+                async for chunk in stream:
+                    if chunk.choices and len(chunk.choices) > 0:
+                        delta = chunk.choices[0].delta
+                        if delta and delta.content:
+                            if not parts:
+                                self._latency_stats("ttft").record_success(time.monotonic() - t0)
+                            parts.append(delta.content)
+                            yield delta.content
+            finally:
+                await stream.close()
+                tracing.record_llm_response(self.model, None, prompt=content, completion="".join(parts),
+                                            latency=time.monotonic() - t0)
+
+    async def acall_api_with_text_stream(self, text: str, max_tokens: Optional[int] = None,
+                                         temperature: Optional[float] = None, use_cache: Optional[bool] = None) -> AsyncIterator[str]:
+        """call_api_with_text_stream 的异步版本"""
+        content = [{"type": "text", "text": text}]
+        async for piece in self.acall_api_stream(content, max_tokens=max_tokens, temperature=temperature, use_cache=use_cache):
+            yield piece
+
+
 def process_text_with_images(text: str, config_path: str = "config.json", base_path: Optional[str] = None) -> str:
     """
     处理包含图片的文本
@@ -487,12 +962,12 @@ def process_text_with_images(text: str, config_path: str = "config.json", base_p
         base_path: 图片路径的基准目录（通常是markdown文件所在目录）
     """
     client = LLMAPIClient(config_path=config_path)
-    return client.call_api_with_text_and_images(text, base_path)
+    return client.call_api_with_text_and_images(text, base_path, use_cache=client.pipeline_cache)
 
 def process_text(text: str, config_path: str = "config.json") -> str:
     """简单的纯文本处理函数"""
     client = LLMAPIClient(config_path=config_path)
-    return client.call_api_with_text(text)
+    return client.call_api_with_text(text, use_cache=client.pipeline_cache)
 
 def generate_course_notes(keyword: str, config_path: str = "config.json") -> str:
     """
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+离线批量提交（OpenAI 兼容 Batch API）
+
+夜间生成大课程时，不再逐页走同步 chat 接口，而是：
+1. 收集一个任务的全部 prompt（已命中响应缓存的直接跳过）
+2. 写成 JSONL 上传，创建一个 /v1/chat/completions 的 batch 任务
+3. 轮询直到完成，下载结果按 custom_id 分发，并写入响应缓存
+
+批量接口按批量价格计费、使用单独的限额，不与交互式请求争抢 RPM。
+提交后会把 batch id 记在状态文件里，进程中断后重跑同一任务会继续轮询，不会重复提交。
+
+config.json 示例（不配置时使用 llm_key / llm_settings.base_url）：
+    "batch_settings": {"base_url": "http://127.0.0.1:18090/v1/", "poll_interval": 30, "completion_window": "24h"}
+
+本地测试可用 batch_stub_server.py 启动一个兼容的替身服务。
+"""
+
+import io
+import os
+import json
+import time
+import hashlib
+from typing import Any, Dict, List, Optional
+
+from openai import OpenAI
+
+from llm_cache import get_cache_from_config
+from http_pool import get_http_client
+import tracing
+
+# 终止状态
+_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class LLMBatchJob:
+    """一个批量任务：add() 收集请求，run() 提交并等待结果"""
+
+    def __init__(self, config: Dict[str, Any], name: str = "batch", state_path: Optional[str] = None,
+                 verbose: bool = True):
+        """
+        初始化批量任务
+
+        Args:
+            config: config.json 内容
+            name: 任务名（写入 batch metadata，便于在服务端区分）
+            state_path: 状态文件路径，记录已提交的 batch id；为 None 时不支持断点续跑
+            verbose: 是否打印进度
+        """
+        batch_cfg = config.get("batch_settings", {}) or {}
+        llm_settings = config.get("llm_settings", {}) or {}
+        self.name = name
+        self.state_path = state_path
+        self.verbose = verbose
+        self.endpoint = batch_cfg.get("endpoint", "/v1/chat/completions")
+        self.completion_window = batch_cfg.get("completion_window", "24h")
+        self.poll_interval = float(batch_cfg.get("poll_interval", 30))
+        self.max_wait = float(batch_cfg.get("max_wait_seconds", 26 * 3600))
+        self.client = OpenAI(
+            api_key=batch_cfg.get("api_key") or config.get("llm_key"),
+            base_url=batch_cfg.get("base_url") or llm_settings.get("base_url"),
+            http_client=get_http_client(),
+        )
+        self.cache = get_cache_from_config(config)
+        tracing.configure_pricing(config)
+        self.requests: Dict[str, Dict[str, Any]] = {}
+        self.cache_keys: Dict[str, str] = {}
+        self.results: Dict[str, Optional[str]] = {}
+
+    def add(self, custom_id: str, model: str, messages: List[Dict[str, Any]], max_tokens: Optional[int] = None,
+            temperature: Optional[float] = None, cache_key: Optional[str] = None):
+        """
+        添加一个请求
+
+        Args:
+            custom_id: 请求标识（任务内唯一，结果按它返回）
+            model: 模型名称
+            messages: OpenAI 格式的消息列表
+            max_tokens: 最大输出 token 数
+            temperature: 温度参数
+            cache_key: 与同步调用路径一致的缓存 key；命中时不提交，结果写回时也用它
+        """
+        if cache_key and self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.results[custom_id] = cached
+                tracing.record_llm(model, cached=True)
+                return
+        body: Dict[str, Any] = {"model": model, "messages": messages}
+        if max_tokens is not None:
+            body["max_tokens"] = max_tokens
+        if temperature is not None:
+            body["temperature"] = temperature
+        self.requests[custom_id] = body
+        if cache_key:
+            self.cache_keys[custom_id] = cache_key
+
+    def _fingerprint(self) -> str:
+        raw = json.dumps(self.requests, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _load_state(self) -> Optional[str]:
+        if not self.state_path or not os.path.exists(self.state_path):
+            return None
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if state.get("fingerprint") != self._fingerprint():
+            return None
+        return state.get("batch_id")
+
+    def _save_state(self, batch_id: str):
+        if not self.state_path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        with open(self.state_path, "w", encoding="utf-8") as f:
+            json.dump({"batch_id": batch_id, "fingerprint": self._fingerprint(), "name": self.name,
+                       "submitted_at": time.time()}, f, ensure_ascii=False, indent=2)
+
+    def _clear_state(self):
+        if self.state_path and os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+    def _submit(self) -> str:
+        lines = [
+            json.dumps({"custom_id": cid, "method": "POST", "url": self.endpoint, "body": body}, ensure_ascii=False)
+            for cid, body in self.requests.items()
+        ]
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        uploaded = self.client.files.create(file=(f"{self.name}.jsonl", io.BytesIO(data)), purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=self.endpoint,
+            completion_window=self.completion_window,
+            metadata={"job": self.name},
+        )
+        if self.verbose:
+            print(f"[batch:{self.name}] 已提交 {len(lines)} 个请求，batch id: {batch.id}")
+        self._save_state(batch.id)
+        return batch.id
+
+    def _wait(self, batch_id: str):
+        deadline = time.time() + self.max_wait
+        last_status = None
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            if self.verbose and batch.status != last_status:
+                counts = getattr(batch, "request_counts", None)
+                progress = f" ({counts.completed}/{counts.total})" if counts else ""
+                print(f"[batch:{self.name}] 状态: {batch.status}{progress}")
+                last_status = batch.status
+            if batch.status in _TERMINAL_STATUSES:
+                return batch
+            if time.time() > deadline:
+                raise TimeoutError(f"batch {batch_id} 超过 {self.max_wait:.0f}s 仍未完成")
+            time.sleep(self.poll_interval)
+
+    def _read_file(self, file_id: Optional[str]) -> List[Dict[str, Any]]:
+        if not file_id:
+            return []
+        text = self.client.files.content(file_id).text
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    def run(self) -> Dict[str, Optional[str]]:
+        """
+        提交全部未命中缓存的请求并等待完成
+
+        Returns:
+            custom_id -> 响应文本；失败或未返回的请求为 None（调用方应回退到同步调用）
+        """
+        if not self.requests:
+            return dict(self.results)
+
+        batch_id = self._load_state()
+        if batch_id:
+            if self.verbose:
+                print(f"[batch:{self.name}] 继续等待已提交的 batch: {batch_id}")
+        else:
+            batch_id = self._submit()
+
+        batch = self._wait(batch_id)
+        if batch.status != "completed" and self.verbose:
+            print(f"[batch:{self.name}] batch 结束状态为 {batch.status}，未完成的请求将回退到同步调用")
+
+        for cid in self.requests:
+            self.results.setdefault(cid, None)
+        for item in self._read_file(getattr(batch, "output_file_id", None)):
+            cid = item.get("custom_id")
+            response = item.get("response") or {}
+            if cid not in self.requests or item.get("error") or response.get("status_code") != 200:
+                continue
+            try:
+                content = response["body"]["choices"][0]["message"]["content"]
+            except (KeyError, IndexError, TypeError):
+                continue
+            # 按批量结果里的 usage 记账（费用按 pricing 单价计算，未计入批量折扣）
+            tracing.record_llm_response(self.requests[cid].get("model"), response["body"].get("usage"),
+                                        prompt=self.requests[cid].get("messages"), completion=content)
+            if content:
+                self.results[cid] = content
+                key = self.cache_keys.get(cid)
+                if key and self.cache is not None:
+                    self.cache.put(key, content, model=self.requests[cid].get("model"))
+        for item in self._read_file(getattr(batch, "error_file_id", None)):
+            if self.verbose:
+                print(f"[batch:{self.name}] 请求失败: {item.get('custom_id')}: {item.get('error') or item.get('response')}")
+
+        # 已经拿到结果，后续重跑不应再复用这个 batch
+        self._clear_state()
+        failed = sum(1 for cid in self.requests if self.results.get(cid) is None)
+        if self.verbose:
+            print(f"[batch:{self.name}] 完成：成功 {len(self.requests) - failed}，失败 {failed}，"
+                  f"缓存命中 {len(self.results) - len(self.requests)}")
+        return dict(self.results)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+LLM 响应缓存（内容寻址，持久化到磁盘）
+
+功能：
+1. 以 (model, base_url, 消息内容含图片哈希, temperature, max_tokens) 计算缓存 key
+2. 使用 SQLite 存储响应文本，多线程 / 多进程安全（lru_store.LRUStore）
+3. 按最近访问时间做 LRU 淘汰，总大小超过上限时自动清理
+4. 提供命中率统计，便于观察重跑任务时节省了多少调用
+
+重新生成课程时 Page_Coder / Page_Speaker / BreakPoint / manim2pptx 等 prompt 基本是逐字节相同的，
+命中缓存后直接返回，不再消耗延迟和费用；某一页失败后重跑任务，只会真正调用该页相关的 LLM 请求。
+
+temperature > 0 时同一 prompt 本应每次得到不同的采样结果，默认不缓存（见 cacheable）；
+流水线的生成阶段（Page_Coder / Page_Speaker / 讲义与分页生成 / manim2pptx）按 config.json 的
+llm_cache.cache_sampled（默认 true，见 pipeline_use_cache）显式选择缓存，重跑时复用已生成的页面；
+调试 / 修复循环必须传 use_cache=False。
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional, Union
+
+from lru_store import LRUStore
+
+# 默认缓存目录与大小上限，可通过环境变量覆盖
+DEFAULT_CACHE_DIR = os.environ.get(
+    "LLM_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_cache"),
+)
+DEFAULT_MAX_SIZE_MB = float(os.environ.get("LLM_CACHE_MAX_MB", "1024"))
+# LLM_CACHE_DISABLE=1 时全局关闭缓存（所有调用都直连模型）
+CACHE_DISABLED = os.environ.get("LLM_CACHE_DISABLE", "").lower() in ("1", "true", "yes")
+
+# 缓存 key 的版本号，修改 key 的计算方式时递增，避免读到旧格式的数据
+_KEY_VERSION = 1
+
+
+def _hash_data_url(url: str) -> str:
+    """把 data:image/...;base64,xxx 形式的图片替换成内容哈希，避免 key 里塞进整张图片"""
+    if isinstance(url, str) and url.startswith("data:"):
+        return "sha256:" + hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return url
+
+
+def _normalize_content(content: Any) -> Any:
+    """递归规范化消息内容，图片 URL 统一替换为哈希"""
+    if isinstance(content, list):
+        return [_normalize_content(c) for c in content]
+    if isinstance(content, dict):
+        out = {}
+        for k, v in content.items():
+            if k == "image_url" and isinstance(v, dict):
+                out[k] = {**v, "url": _hash_data_url(v.get("url", ""))}
+            elif k == "url":
+                out[k] = _hash_data_url(v)
+            else:
+                out[k] = _normalize_content(v)
+        return out
+    return content
+
+
+def make_cache_key(
+    model: str,
+    base_url: Optional[str],
+    messages: Union[List[Dict[str, Any]], str],
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+) -> str:
+    """
+    计算缓存 key
+
+    Args:
+        model: 模型名称
+        base_url: 接口地址（不同代理可能对应不同的实际模型）
+        messages: OpenAI 格式的 messages 列表，或单条 content
+        temperature: 温度参数
+        max_tokens: 最大输出 token 数
+
+    Returns:
+        sha256 十六进制字符串
+    """
+    payload = {
+        "v": _KEY_VERSION,
+        "model": model,
+        "base_url": (base_url or "").rstrip("/"),
+        "messages": _normalize_content(messages),
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def cacheable(temperature: Optional[float], use_cache: Optional[bool] = None) -> bool:
+    """
+    这次调用是否读写缓存
+
+    Args:
+        temperature: 实际使用的温度参数
+        use_cache: 调用方的显式选择；None 表示按温度决定，只有确定性采样（temperature == 0）才缓存
+
+    Returns:
+        是否使用缓存
+    """
+    if use_cache is not None:
+        return use_cache
+    return temperature is not None and float(temperature) == 0.0
+
+
+def pipeline_use_cache(config: Dict[str, Any]) -> Optional[bool]:
+    """
+    流水线生成阶段传给 cacheable 的 use_cache
+
+    config.json 示例：
+        "llm_cache": {"cache_sampled": false}    # 生成阶段也只缓存 temperature == 0 的调用
+
+    Returns:
+        True（缓存 temperature > 0 的生成结果）；cache_sampled=false 时为 None（按温度决定）
+    """
+    cache_cfg = (config or {}).get("llm_cache", {}) or {}
+    return True if cache_cfg.get("cache_sampled", True) else None
+
+
+class LLMResponseCache:
+    """基于 SQLite 的 LLM 响应缓存，支持 LRU + 总大小上限淘汰（索引与淘汰见 lru_store）"""
+
+    DB_FILENAME = "llm_cache.sqlite3"
+
+    def __init__(self, cache_dir: Optional[str] = None, max_size_mb: Optional[float] = None):
+        """
+        初始化缓存
+
+        Args:
+            cache_dir: 缓存目录（默认 backend/llm_cache 或环境变量 LLM_CACHE_DIR）
+            max_size_mb: 缓存总大小上限（MB），超过后按最近访问时间淘汰
+        """
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.max_size_bytes = int((max_size_mb if max_size_mb is not None else DEFAULT_MAX_SIZE_MB) * 1024 * 1024)
+        self.db_path = os.path.join(self.cache_dir, self.DB_FILENAME)
+        self.store = LRUStore(self.db_path, self.max_size_bytes,
+                              columns=[("model", "TEXT"), ("response", "TEXT NOT NULL")])
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，命中时刷新最近访问时间"""
+        try:
+            row = self.store.get(key)
+            return row[1] if row is not None else None
+        except sqlite3.Error as e:
+            # 缓存故障不能影响正常调用
+            print(f"[llm_cache] 读取失败，忽略缓存: {e}")
+            return None
+
+    def put(self, key: str, response: str, model: Optional[str] = None):
+        """写入缓存，超过大小上限时淘汰最久未访问的条目"""
+        if not response:
+            return
+        try:
+            self.store.put(key, len(response.encode("utf-8")), model=model, response=response)
+        except sqlite3.Error as e:
+            print(f"[llm_cache] 写入失败，忽略缓存: {e}")
+
+    def invalidate(self, key: str):
+        """删除单条缓存（例如发现缓存的代码无法运行时）"""
+        try:
+            self.store.delete(key)
+        except sqlite3.Error as e:
+            print(f"[llm_cache] 删除失败: {e}")
+
+    def clear(self):
+        """清空缓存"""
+        self.store.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        return self.store.stats()
+
+
+_caches: Dict[str, LLMResponseCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_response_cache(cache_dir: Optional[str] = None, max_size_mb: Optional[float] = None) -> Optional[LLMResponseCache]:
+    """
+    获取进程内共享的缓存实例（同一目录只创建一次）
+
+    Returns:
+        LLMResponseCache；全局禁用或初始化失败时返回 None
+    """
+    if CACHE_DISABLED:
+        return None
+    cache_dir = os.path.abspath(cache_dir or DEFAULT_CACHE_DIR)
+    with _caches_lock:
+        cache = _caches.get(cache_dir)
+        if cache is None:
+            try:
+                cache = LLMResponseCache(cache_dir=cache_dir, max_size_mb=max_size_mb)
+            except (OSError, sqlite3.Error) as e:
+                print(f"[llm_cache] 初始化失败，禁用缓存: {e}")
+                return None
+            _caches[cache_dir] = cache
+        return cache
+
+
+def get_cache_from_config(config: Dict[str, Any]) -> Optional[LLMResponseCache]:
+    """
+    根据 config.json 中的 llm_cache 段获取缓存实例
+
+    config.json 示例：
+        "llm_cache": {"enabled": true, "dir": "/data/llm_cache", "max_size_mb": 2048, "cache_sampled": true}
+    """
+    cache_cfg = (config or {}).get("llm_cache", {}) or {}
+    if not cache_cfg.get("enabled", True):
+        return None
+    return get_response_cache(cache_cfg.get("dir"), cache_cfg.get("max_size_mb"))
+
+
+def main():
+    """命令行：查看或清空缓存"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="LLM 响应缓存管理")
+    parser.add_argument("--dir", default=None, help="缓存目录")
+    parser.add_argument("--clear", action="store_true", help="清空缓存")
+    args = parser.parse_args()
+
+    cache = LLMResponseCache(cache_dir=args.dir)
+    if args.clear:
+        cache.clear()
+        print("缓存已清空")
+    print(json.dumps(cache.stats(), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+SQLite 索引的 LRU 存储（llm_cache / render_cache / svg_cache 共用）
+
+1. 一张 entries 表：key、调用方自定义的列、size、创建 / 最近访问时间、命中次数
+2. WAL 模式，每个线程各持有一个连接，多线程 / 多进程可同时读写同一个库
+3. 写入后总大小超过上限时，按最近访问时间淘汰到上限的 90%；淘汰的条目交给 on_evict 清理对应的文件
+4. 命中 / 未命中 / 写入 / 淘汰计数（本进程内）
+
+SQLite 出错时直接抛出 sqlite3.Error，由调用方决定如何降级（缓存故障不能影响正常调用）。
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+
+class LRUStore:
+    """按最近访问时间淘汰、总大小有上限的 SQLite 索引"""
+
+    def __init__(self, db_path: str, max_size_bytes: int, columns: Sequence[Tuple[str, str]] = (),
+                 on_evict: Optional[Callable[[str, Tuple], None]] = None, min_age: float = 0.0):
+        """
+        初始化存储（库文件和表不存在时创建）
+
+        Args:
+            db_path: SQLite 文件路径
+            max_size_bytes: 总大小上限（字节）
+            columns: 自定义列 [(列名, 类型定义)]，例如 [("path", "TEXT NOT NULL")]
+            on_evict: 条目被淘汰后的回调 (key, 自定义列的值)，用于删除对应的文件
+            min_age: 最近这么多秒内访问过的条目不淘汰（其他进程可能正在读）
+        """
+        self.db_path = db_path
+        self.max_size_bytes = max_size_bytes
+        self.columns = [name for name, _ in columns]
+        self.on_evict = on_evict
+        self.min_age = min_age
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        extra = "".join(f"{name} {decl},\n" for name, decl in columns)
+        conn = self._conn()
+        conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                {extra}size INTEGER NOT NULL,
+                created_ts REAL NOT NULL,
+                last_access_ts REAL NOT NULL,
+                hit_count INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_access ON entries(last_access_ts)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 连接不能跨线程共享，每个线程各自持有一个
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name: str, n: int = 1):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def get(self, key: str, valid: Optional[Callable[[Tuple], bool]] = None) -> Optional[Tuple]:
+        """
+        读取一条，命中时刷新最近访问时间
+
+        Args:
+            key: 条目 key
+            valid: 检查自定义列的值（例如文件是否还在）；返回 False 时删除该条目并按未命中处理
+
+        Returns:
+            自定义列的值；未命中返回 None
+        """
+        conn = self._conn()
+        row = conn.execute(f"SELECT {', '.join(self.columns) or 'key'} FROM entries WHERE key = ?",
+                           (key,)).fetchone()
+        if row is not None and valid is not None and not valid(row):
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            row = None
+        if row is None:
+            self._count("misses")
+            return None
+        conn.execute("UPDATE entries SET last_access_ts = ?, hit_count = hit_count + 1 WHERE key = ?",
+                     (time.time(), key))
+        self._count("hits")
+        return tuple(row)
+
+    def touch(self, key: str) -> bool:
+        """刷新最近访问时间（不计入命中统计），返回条目是否存在"""
+        cur = self._conn().execute("UPDATE entries SET last_access_ts = ?, hit_count = hit_count + 1 WHERE key = ?",
+                                   (time.time(), key))
+        return cur.rowcount > 0
+
+    def put(self, key: str, size: int, **fields: Any):
+        """写入（覆盖）一条，超过大小上限时淘汰最久未访问的条目"""
+        now = time.time()
+        names = ["key"] + list(fields) + ["size", "created_ts", "last_access_ts", "hit_count"]
+        values = [key] + list(fields.values()) + [size, now, now, 0]
+        conn = self._conn()
+        conn.execute(f"INSERT OR REPLACE INTO entries ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+                     values)
+        self._count("writes")
+        self.evict_if_needed()
+
+    def adopt(self, rows: Iterable[Tuple[str, int, float]]):
+        """登记索引里还没有的条目 (key, size, 最近访问时间)，已有的不变（用于接管库建立之前就存在的文件）"""
+        self._conn().executemany(
+            "INSERT OR IGNORE INTO entries (key, size, created_ts, last_access_ts) VALUES (?, ?, ?, ?)",
+            [(key, size, ts, ts) for key, size, ts in rows],
+        )
+
+    def delete(self, key: str) -> Optional[Tuple]:
+        """删除一条，返回它的自定义列（不存在时为 None）"""
+        conn = self._conn()
+        row = conn.execute(f"SELECT {', '.join(self.columns) or 'key'} FROM entries WHERE key = ?",
+                           (key,)).fetchone()
+        conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        return tuple(row) if row is not None else None
+
+    def evict_if_needed(self) -> int:
+        """总大小超过上限时淘汰，返回淘汰的条目数"""
+        conn = self._conn()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_size_bytes:
+            return 0
+        # 一次清理到上限的 90%，避免每次写入都触发淘汰
+        to_free = total - int(self.max_size_bytes * 0.9)
+        cutoff = time.time() - self.min_age
+        freed = 0
+        victims = []
+        cols = "".join(f", {c}" for c in self.columns)
+        for row in conn.execute(f"SELECT key, size, last_access_ts{cols} FROM entries ORDER BY last_access_ts ASC"):
+            if freed >= to_free or (self.min_age and row[2] > cutoff):
+                break
+            victims.append((row[0], tuple(row[3:])))
+            freed += row[1]
+        conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in victims])
+        if self.on_evict is not None:
+            for key, values in victims:
+                self.on_evict(key, values)
+        self._count("evictions", len(victims))
+        return len(victims)
+
+    def clear(self):
+        """清空索引"""
+        self._conn().execute("DELETE FROM entries")
+
+    def stats(self) -> Dict[str, Any]:
+        """条目数、总大小和本进程的命中统计"""
+        row = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": row[0],
+            "size_bytes": row[1],
+            "max_size_bytes": self.max_size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
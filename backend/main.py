@@ -24,6 +24,8 @@ from app.services.scheduler_service import scheduler_service
 import os
 from pathlib import Path
 
+import hls_package
+
 
 ARQ_REDIS_SETTINGS = RedisSettings(host='localhost', port=6380)
 @asynccontextmanager
@@ -139,6 +141,11 @@ if static_dir.exists() and static_dir.is_dir():
 else:
     print(f"静态文件目录不存在: {static_dir}")
 
+# 课程视频的 HLS 切片（hls_package.py 生成），播放地址 /hls/<job_id>/master.m3u8
+hls_dir = Path(hls_package.HLS_ROOT)
+hls_dir.mkdir(parents=True, exist_ok=True)
+app.mount("/hls", StaticFiles(directory=hls_dir), name="hls")
+
 # Include routers
 app.include_router(health.router, prefix="/api/v1", tags=["health"])
 app.include_router(auth.router, prefix="/api/v1/auth", tags=["authentication"])
@@ -24,6 +24,8 @@ import time
 from pathlib import Path
 from typing import List, Tuple, Dict, Optional
 
+import tracing
+
 try:
     from tqdm import tqdm
     HAS_TQDM = True
@@ -512,6 +514,7 @@ Manim动画代码 - 已插入wait语句
             print(f"ERROR: Failed to save processed file for {original_name}: {e}")
             return ""
     
+    @tracing.traced("wait")
     def process_file_pair(self, manim_file: str, script_file: str, output_dir: str) -> Optional[str]:
         """
         处理单个文件对
@@ -525,6 +528,7 @@ Manim动画代码 - 已插入wait语句
             生成的文件路径，如果失败则返回None
         """
         base_name = self.extract_base_filename(manim_file)
+        tracing.annotate(page=base_name)
         manim_name = os.path.basename(manim_file)
         script_name = os.path.basename(script_file)
         
@@ -567,6 +571,7 @@ Manim动画代码 - 已插入wait语句
         else:
             return None
     
+    @tracing.traced("wait")
     def process_all(self, duration_file: str, script_folder: str, manim_folder: str, 
                    output_folder: str) -> List[str]:
         """
@@ -742,12 +747,13 @@ python manim_auto_wait_generator.py audio_duration.txt scripts/ code/ output/
         generator = ManimAutoWaitGenerator()
         
         # 执行完整的工作流程
-        generated_files = generator.process_all(
-            duration_file=args.duration_file,
-            script_folder=args.script_folder,
-            manim_folder=args.manim_folder,
-            output_folder=args.output_folder
-        )
+        with tracing.job(trace_dir=args.output_folder, stage="wait"):
+            generated_files = generator.process_all(
+                duration_file=args.duration_file,
+                script_folder=args.script_folder,
+                manim_folder=args.manim_folder,
+                output_folder=args.output_folder
+            )
         
         if generated_files:
             print(f"\nSUCCESS: 自动Wait语句生成完成!")
@@ -12,6 +12,7 @@ from datetime import datetime
 
 # 导入项目现有的LLM API客户端
 from llm_api import LLMAPIClient
+import tracing
 
 # 尝试导入tqdm进度条
 try:
@@ -469,6 +470,7 @@ Manim动画代码 - 已插入断点
             print(f"ERROR: Failed to save processed files for {original_name}: {e}")
             return "", ""
     
+    @tracing.traced("breakpoint")
     def process_file_pairs(self, matched_pairs: List[Tuple[str, str]], output_dir: str, verbose: bool = True) -> List[Tuple[str, str]]:
         """
         批量处理匹配的文件对
@@ -538,7 +540,9 @@ Manim动画代码 - 已插入断点
                 print(f"  正在处理: {manim_name} ↔ {script_name}")
             
             # 执行断点插入处理
-            processed_code, processed_script = self.insert_breakpoints(manim_code, script_content, manim_name)
+            page_id = self.extract_base_filename(manim_file)
+            with tracing.span("breakpoint", page=page_id):
+                processed_code, processed_script = self.insert_breakpoints(manim_code, script_content, manim_name)
             
             # 统计断点数量
             code_breakpoints = self.count_breakpoints(processed_code, "code")
@@ -551,7 +555,9 @@ Manim动画代码 - 已插入断点
                     print(f"    第1次断点统计: 代码({code_breakpoints}) | 文稿({script_breakpoints}) ✗ - 重新处理")
                 
                 # 再次调用LLM进行断点插入
-                processed_code_retry, processed_script_retry = self.insert_breakpoints(manim_code, script_content, f"{manim_name}(重试)")
+                with tracing.span("breakpoint", page=page_id):
+                    tracing.record_retry("breakpoint count mismatch")
+                    processed_code_retry, processed_script_retry = self.insert_breakpoints(manim_code, script_content, f"{manim_name}(重试)")
                 
                 # 重新统计断点
                 code_breakpoints_retry = self.count_breakpoints(processed_code_retry, "code")
@@ -738,12 +744,13 @@ def main():
         inserter = ManimBreakpointInserter(config_path=args.config)
         
         # 执行文件夹处理
-        generated_pairs = inserter.process_folders(
-            manim_folder=args.manim_folder,
-            script_folder=args.script_folder,
-            output_folder=args.output_folder,
-            verbose=not args.quiet
-        )
+        with tracing.job(trace_dir=args.output_folder, stage="breakpoint"):
+            generated_pairs = inserter.process_folders(
+                manim_folder=args.manim_folder,
+                script_folder=args.script_folder,
+                output_folder=args.output_folder,
+                verbose=not args.quiet
+            )
         
         if generated_pairs:
             print(f"\nSUCCESS: 断点插入处理完成!")
@@ -19,12 +19,15 @@ outline_check.py
 - pool.py 和 providers.py
 """
 
+import json
 import argparse
 import asyncio
 from pathlib import Path
 
 from pool import load_keypool_from_config
 from providers import ProviderAdapter
+from hedging import HedgeBudget, settings_from_config
+import tracing
 
 
 def _clean_llm_text(s: str) -> str:
@@ -65,7 +68,9 @@ async def semantic_check_once(
     if not key_pool.have_live_key():
         raise RuntimeError("config_pool.json 中没有可用的 key，请先配置。")
 
-    provider = ProviderAdapter(key_pool)
+    # 每次检查是一个任务，对冲预算（llm_settings.hedge）随 adapter 创建
+    cfg = json.loads(Path(config_path).read_text(encoding="utf-8"))
+    provider = ProviderAdapter(key_pool, hedge_budget=HedgeBudget.from_config(settings_from_config(cfg)))
 
     messages = [
         {"role": "system", "content": system_prompt},
@@ -79,8 +84,10 @@ async def semantic_check_once(
     return cleaned
 
 
+@tracing.traced("outline")
 async def main_async(args):
     txt_path = Path(args.outline_path)
+    tracing.annotate(page=txt_path.stem)
     if not txt_path.exists():
         raise FileNotFoundError(f"找不到要检查的大纲 txt 文件: {txt_path}")
 
@@ -145,7 +152,9 @@ def main():
     )
     args = ap.parse_args()
 
-    ok = asyncio.run(main_async(args))
+    trace_dir = args.out_suggestion or str(Path(args.outline_path).parent)
+    with tracing.job(trace_dir=trace_dir, stage="outline"):
+        ok = asyncio.run(main_async(args))
     raise SystemExit(0 if ok else 1)
 
 
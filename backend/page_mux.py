@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+逐页音视频合并的并行执行与时长探测
+
+- 时长：wav 直接读 RIFF 头（不启动进程），其他文件用 ffprobe，所有文件一次性并发探测
+- 合并：每页一个任务，多页同时进行（实际工作在 ffmpeg 子进程里，线程只负责等待），结束后汇总进度和失败原因
+"""
+
+import os
+import time
+import shutil
+import struct
+import subprocess
+import concurrent.futures
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import tracing
+
+FFPROBE = os.environ.get("FFPROBE_BIN") or shutil.which("ffprobe") or "/home/EduAgent/miniconda3/envs/manim_env/bin/ffprobe"
+
+# 同时进行的 ffmpeg 任务数
+MUX_WORKERS = int(os.environ.get("MUX_WORKERS", "0")) or (os.cpu_count() or 1)
+# 同时进行的 ffprobe 数（探测几乎只读文件头，可以比 CPU 核数多）
+PROBE_WORKERS = int(os.environ.get("PROBE_WORKERS", "16"))
+
+
+def wav_duration(path: str) -> Optional[float]:
+    """
+    从 RIFF/WAVE 头计算时长（支持 PCM 与 WAVE_FORMAT_EXTENSIBLE）
+
+    Returns:
+        时长（秒）；不是可解析的 wav 时返回 None
+    """
+    try:
+        with open(path, "rb") as f:
+            header = f.read(12)
+            if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+                return None
+            byte_rate = None
+            while True:
+                chunk = f.read(8)
+                if len(chunk) < 8:
+                    return None
+                chunk_id, size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+                if chunk_id == b"fmt ":
+                    fmt = f.read(size)
+                    if len(fmt) < 16:
+                        return None
+                    byte_rate = struct.unpack("<I", fmt[8:12])[0]
+                    if size % 2:
+                        f.seek(1, os.SEEK_CUR)
+                elif chunk_id == b"data":
+                    if not byte_rate:
+                        return None
+                    # 流式写出的 wav 可能没有回填长度，以实际文件大小为准
+                    available = os.path.getsize(path) - f.tell()
+                    if size == 0xFFFFFFFF or size > available:
+                        size = available
+                    return size / byte_rate
+                else:
+                    f.seek(size + size % 2, os.SEEK_CUR)
+    except (OSError, struct.error):
+        return None
+
+
+def probe_duration(path: str) -> float:
+    """使用 ffprobe 获取媒体时长（秒），返回 0 表示失败"""
+    try:
+        result = subprocess.run(
+            [FFPROBE, "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", path],
+            capture_output=True, text=True, check=True,
+        )
+        return float(result.stdout.strip())
+    except Exception:
+        return 0.0
+
+
+def media_duration(path: str) -> float:
+    """wav 读文件头，其他文件用 ffprobe；返回 0 表示失败"""
+    if path.lower().endswith(".wav"):
+        duration = wav_duration(path)
+        if duration is not None:
+            return duration
+    return probe_duration(path)
+
+
+def keyframe_times(path: str) -> List[float]:
+    """首个视频流所有关键帧的时间（只读包信息，不解码），按时间排序；失败返回空列表"""
+    try:
+        result = subprocess.run(
+            [FFPROBE, "-v", "error", "-select_streams", "v:0",
+             "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", path],
+            capture_output=True, text=True, check=True,
+        )
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return []
+    times = []
+    for line in result.stdout.splitlines():
+        pts, _, flags = line.partition(",")
+        if "K" not in flags:
+            continue
+        try:
+            times.append(float(pts))
+        except ValueError:
+            continue
+    return sorted(times)
+
+
+def probe_many(paths: Iterable[str], probe: Callable[[str], object] = media_duration,
+               workers: Optional[int] = None) -> Dict[str, object]:
+    """
+    一次性并发探测所有文件
+
+    Args:
+        paths: 文件路径（重复的只探测一次）
+        probe: 单个文件的探测函数，默认取时长
+        workers: 并发数，默认 PROBE_WORKERS
+
+    Returns:
+        {路径: 探测结果}
+    """
+    paths = list(dict.fromkeys(paths))
+    if not paths:
+        return {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers or PROBE_WORKERS, len(paths))) as executor:
+        return dict(zip(paths, executor.map(probe, paths)))
+
+
+def concat_list_line(path: str) -> str:
+    """concat demuxer 列表中的一行（绝对路径，单引号转义）"""
+    escaped = os.path.abspath(path).replace("'", "'\\''")
+    return f"file '{escaped}'\n"
+
+
+def mux_pages(jobs: Sequence[Tuple[str, Callable[..., bool], tuple]], workers: Optional[int] = None,
+              label: str = "合并") -> Tuple[List[str], Dict[str, str]]:
+    """
+    并行执行逐页任务，打印进度和失败汇总
+
+    Args:
+        jobs: [(页面名, 函数, 参数)]，函数返回是否成功
+        workers: 并发数，默认 MUX_WORKERS
+        label: 日志中的步骤名
+
+    Returns:
+        (成功的页面名（按 jobs 顺序）, {失败的页面名: 原因})
+    """
+    if not jobs:
+        return [], {}
+    workers = max(1, min(workers or MUX_WORKERS, len(jobs)))
+    print(f"🎬 并行{label}: {len(jobs)} 页，{workers} 个并发")
+    started = time.perf_counter()
+    ok: Dict[str, bool] = {}
+    failed: Dict[str, str] = {}
+
+    def run(func, args):
+        t0 = time.perf_counter()
+        return func(*args), time.perf_counter() - t0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        future_to_name = {executor.submit(tracing.bind(run), func, args): name for name, func, args in jobs}
+        for done, future in enumerate(concurrent.futures.as_completed(future_to_name), 1):
+            name = future_to_name[future]
+            try:
+                success, seconds = future.result()
+            except Exception as e:
+                success, seconds = False, 0.0
+                failed[name] = f"{type(e).__name__}: {e}"
+            if success:
+                ok[name] = True
+                print(f"[{done}/{len(jobs)}] ✅ {name} ({seconds:.1f}s)")
+            else:
+                failed.setdefault(name, "ffmpeg 返回失败")
+                print(f"[{done}/{len(jobs)}] ❌ {name}")
+
+    elapsed = time.perf_counter() - started
+    succeeded = [name for name, _, _ in jobs if name in ok]
+    print(f"📊 {label}结果: ✅ 成功 {len(succeeded)} 页，❌ 失败 {len(failed)} 页，耗时 {elapsed:.1f}s")
+    for name in sorted(failed):
+        print(f"   ❌ {name}: {failed[name]}")
+    return succeeded, failed
@@ -8,6 +8,8 @@ import argparse
 import os
 import glob
 from llm_api import LLMAPIClient
+from llm_batch import LLMBatchJob
+import tracing
 
 
 class Paginator:
@@ -18,6 +20,7 @@ class Paginator:
         self.llm_client = LLMAPIClient(config_path=config_path)
         self.verbose = verbose
 
+    @tracing.traced("paginate")
     def paginate_section_file(self, section_file_path):
         """
         对单个章节文件进行分页处理
@@ -29,6 +32,7 @@ class Paginator:
         Returns:
             分页后的内容
         """
+        tracing.annotate(page=os.path.splitext(os.path.basename(section_file_path))[0])
         try:
             # 读取原始文件内容
             with open(section_file_path, 'r', encoding='utf-8') as f:
@@ -81,6 +85,7 @@ class Paginator:
         
         return output_path
     
+    @tracing.traced("paginate")
     def process_sections_directory(self, sections_dir, output_dir="scripts"):
         """
         处理整个sections目录中的所有markdown文件
@@ -148,9 +153,82 @@ class Paginator:
         
         return results
     
-    def pipeline(self, sections_dir, output_dir="scripts"):
-        """简化的流水线接口"""
+    @tracing.traced("paginate", mode="batch")
+    def process_sections_directory_batch(self, sections_dir, output_dir="scripts"):
+        """
+        批量模式：所有章节的分页请求作为一个 batch 提交，完成后写回同样的输出文件
+        
+        Args:
+            sections_dir: sections目录路径
+            output_dir: 输出目录
+        
+        Returns:
+            处理结果统计（格式与 process_sections_directory 相同）
+        """
+        if not os.path.exists(sections_dir):
+            print(f"目录不存在: {sections_dir}")
+            return None
+        
+        md_files = sorted(glob.glob(os.path.join(sections_dir, "*.md")))
+        if not md_files:
+            print(f"在目录 {sections_dir} 中未找到markdown文件")
+            return None
+        
+        results = {
+            'total': len(md_files),
+            'success': 0,
+            'failed': 0,
+            'skipped': 0,
+            'files': []
+        }
+        
+        job = LLMBatchJob(self.llm_client.config, name="paginate",
+                          state_path=os.path.join(output_dir, ".batch_paginate.json"), verbose=self.verbose)
+        contents = {}
+        for md_file in md_files:
+            with open(md_file, 'r', encoding='utf-8') as f:
+                contents[md_file] = f.read()
+            # 内容太短的不分页，与同步模式一致
+            if len(contents[md_file].strip()) >= 100:
+                prompt = self.llm_client.create_brain_prompt(contents[md_file])
+                self.llm_client.add_text_to_batch(job, md_file, prompt)
+        
+        batch_results = job.run()
+        
+        for md_file in md_files:
+            if len(contents[md_file].strip()) < 100:
+                paginated_content = contents[md_file]
+            else:
+                paginated_content = batch_results.get(md_file)
+                if paginated_content is None:
+                    # batch 中失败的请求回退到同步调用
+                    paginated_content = self.paginate_section_file(md_file)
+            
+            if paginated_content is None:
+                results['failed'] += 1
+                results['files'].append({'file': md_file, 'status': 'failed'})
+                continue
+            
+            try:
+                output_path = self.save_paginated_file(md_file, paginated_content, output_dir=output_dir)
+                results['success'] += 1
+                results['files'].append({
+                    'file': md_file, 
+                    'output': output_path,
+                    'status': 'success'
+                })
+            except Exception as e:
+                print(f"保存文件时出错: {e}")
+                results['failed'] += 1
+                results['files'].append({'file': md_file, 'status': 'failed'})
+        
+        return results
+    
+    def pipeline(self, sections_dir, output_dir="scripts", batch=False):
+        """简化的流水线接口（batch=True 时走离线批量接口）"""
         os.makedirs(output_dir, exist_ok=True)
+        if batch:
+            return self.process_sections_directory_batch(sections_dir, output_dir=output_dir)
         results = self.process_sections_directory(sections_dir, output_dir=output_dir)
         return results
     
@@ -194,6 +272,11 @@ def main():
         action="store_true",
         help="静默模式，只显示结果摘要"
     )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="离线批量模式：所有请求作为一个 batch 提交（适合夜间任务）"
+    )
     
     args = parser.parse_args()
     
@@ -202,9 +285,13 @@ def main():
         paginator = Paginator(config_path=args.config)
         
         # 处理sections目录
-        results = paginator.process_sections_directory(
-            args.sections_dir
-        )
+        with tracing.job(trace_dir=args.sections_dir, stage="paginate"):
+            if args.batch:
+                results = paginator.process_sections_directory_batch(args.sections_dir)
+            else:
+                results = paginator.process_sections_directory(
+                    args.sections_dir
+                )
         
         # 显示结果摘要
         paginator.print_summary(results)
@@ -1,6 +1,17 @@
-import asyncio, time, random, json, pathlib
-from typing import Optional, Dict, List, Any
+import asyncio, time, random, json, pathlib, os, hashlib, math, weakref, threading
+from typing import Optional, Dict, List, Any, Callable
 from dataclasses import dataclass, field
+from collections import deque
+
+from concurrency import get_limiter
+
+# 分布式模式依赖 redis（可选）
+try:
+    from redis import asyncio as aioredis
+    HAS_REDIS = True
+except ImportError:
+    aioredis = None
+    HAS_REDIS = False
 
 # 给每个key限流防止超过并行数量限制
 @dataclass
@@ -54,6 +65,69 @@ class CircuitBreaker:
         # open 过期后允许半开探测，不过权重降低，如果健康再恢复正常状态
         return not self.is_open() and self.failure_count >= self.threshold
 
+# 每把 key 的滚动延迟 / 错误率统计，用于按延迟选 key
+@dataclass
+class KeyStats:
+    alpha: float = 0.2               # EWMA 平滑系数，越大越偏向最近的样本
+    window: int = 200                # 计算 p50/p95 的最近样本数
+    ewma_latency: float = 0.0        # 秒
+    ewma_error: float = 0.0          # 0~1
+    count: int = 0
+    errors: int = 0
+    last_ts: float = 0.0
+    samples: deque = field(default_factory=deque)
+
+    def _push(self, latency: float):
+        self.samples.append(latency)
+        while len(self.samples) > self.window:
+            self.samples.popleft()
+        if self.count == 0:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency += self.alpha * (latency - self.ewma_latency)
+        self.count += 1
+        self.last_ts = time.time()
+
+    def record_success(self, latency: float):
+        self._push(latency)
+        self.ewma_error *= (1 - self.alpha)
+
+    def record_failure(self, latency: Optional[float] = None):
+        # 失败的耗时也计入延迟（超时类错误本身就说明这条线路慢）
+        if latency is not None:
+            self._push(latency)
+        else:
+            self.count += 1
+            self.last_ts = time.time()
+        self.errors += 1
+        self.ewma_error += self.alpha * (1 - self.ewma_error)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        idx = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+        return ordered[idx]
+
+    def expected_latency(self) -> float:
+        # 期望耗时：平均延迟按错误率放大（出错就要重试，相当于更慢）；没有样本时返回 0 让新 key 先被试用
+        if self.count == 0:
+            return 0.0
+        return self.ewma_latency / max(0.05, 1.0 - self.ewma_error)
+
+    def snapshot(self) -> Dict[str, Any]:
+        p50 = self.percentile(0.5)
+        p95 = self.percentile(0.95)
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "error_rate": round(self.ewma_error, 4),
+            "ewma_ms": round(self.ewma_latency * 1000, 1),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "expected_ms": round(self.expected_latency() * 1000, 1),
+        }
+
 # key的包装
 @dataclass
 class APIKey:
@@ -66,6 +140,9 @@ class APIKey:
     min_cooldown: float = 5.0   # 短冷却时长
     next_probe_ts: float = 0.0  # 半开探测时机
     metadata: Dict[str, Any] = field(default_factory=dict)
+    stats: KeyStats = field(default_factory=KeyStats)
+    # 所属 KeyPool 的回调：健康状态在池外被修改时通知它重建轮询序列
+    on_health_change: Optional[Callable[[], None]] = field(default=None, repr=False, compare=False)
 
     def healthy(self) -> bool:
         if self.dead:
@@ -75,15 +152,83 @@ class APIKey:
         return True
 
     def short_cooldown(self, seconds: float):
-        # 出错时短冷却
-        self.breaker.open_until = max(self.breaker.open_until, time.time() + seconds)
+        # 出错时短冷却；缓存的轮询序列里可能还有这把 key，必须让所属 KeyPool 重建
+        until = time.time() + seconds
+        if until > self.breaker.open_until:
+            self.breaker.open_until = until
+            if self.on_health_change is not None:
+                self.on_health_change()
+
+# 平滑加权轮询（nginx SWRR）：key 健康状态变化时预先算好一整轮的选择序列，
+# 之后每次选择只需移动游标，O(1)；同一轮内高权重 key 也不会连续扎堆被选中
+class WeightedSchedule:
+    def __init__(self, keys: List[APIKey], valid_until: float = float("inf")):
+        self.keys = [k for k in keys if k.weight > 0]
+        self.valid_until = valid_until  # 有熔断中的 key 到期恢复时需要重建
+        self.seq = self._build(self.keys)
+        self.cursor = 0
+
+    @staticmethod
+    def _build(keys: List[APIKey]) -> List[APIKey]:
+        if not keys:
+            return []
+        g = 0
+        for k in keys:
+            g = math.gcd(g, k.weight)
+        weights = [k.weight // g for k in keys]
+        total = sum(weights)
+        current = [0] * len(keys)
+        seq = []
+        for _ in range(total):
+            best = 0
+            for i, w in enumerate(weights):
+                current[i] += w
+                if current[i] > current[best]:
+                    best = i
+            current[best] -= total
+            seq.append(keys[best])
+        return seq
+
+    def next(self) -> Optional[APIKey]:
+        if not self.seq:
+            return None
+        k = self.seq[self.cursor % len(self.seq)]
+        self.cursor += 1
+        return k
+
+    def rotation(self) -> List[APIKey]:
+        # 从当前游标开始的一轮里，每把 key 出现一次（用于快路径失败后的兜底遍历）
+        out: List[APIKey] = []
+        seen = set()
+        n = len(self.seq)
+        for i in range(n):
+            k = self.seq[(self.cursor + i) % n]
+            if id(k) not in seen:
+                seen.add(id(k))
+                out.append(k)
+                if len(out) == len(self.keys):
+                    break
+        return out
+
 
 # -------- KeyPool --------
 class KeyPool:
-    def __init__(self, keys: List[APIKey]):
+    def __init__(self, keys: List[APIKey], latency_aware: bool = True, explore_ratio: float = 0.05):
         self._keys = keys
-        self._lock = asyncio.Lock()
+        # 按延迟选择：从轮询序列里取两把 key，用期望耗时低的那把（power of two choices）；
+        # 以 explore_ratio 的概率跳过比较，保证慢 key 也持续有新样本，恢复后能重新分到流量
+        self.latency_aware = latency_aware
+        self.explore_ratio = explore_ratio
         self._rr_cursor = 0
+        # vendor -> WeightedSchedule；_health_version 变化或熔断到期时重建
+        self._schedules: Dict[Any, WeightedSchedule] = {}
+        self._schedule_versions: Dict[Any, int] = {}
+        self._health_version = 0
+        # 同一个池会被多个线程各自的事件循环共用（例如 batch_debug 的线程里各自 asyncio.run），
+        # 轮询游标、令牌桶和熔断状态的读改写都要在锁内完成；锁内没有 await，不会阻塞事件循环太久
+        self._lock = threading.Lock()
+        for k in keys:
+            k.on_health_change = self._mark_health_changed
 
     def _eligible_keys(self) -> List[APIKey]:
         now = time.time()
@@ -98,63 +243,363 @@ class KeyPool:
         return out
 
     def _weighted_round_robin(self, candidates: List[APIKey]) -> Optional[APIKey]:
-        # 按照weight选择
-        expanded = []
-        for k in candidates:
-            expanded.extend([k] * max(0, k.weight))
-        if not expanded:
+        # 按照weight选择（保留给临时候选列表使用，常规选择走 _schedule）
+        total = sum(max(0, k.weight) for k in candidates)
+        if total <= 0:
             return None
-        choice = expanded[self._rr_cursor % len(expanded)]
+        pos = self._rr_cursor % total
         self._rr_cursor += 1
-        return choice
+        for k in candidates:
+            pos -= max(0, k.weight)
+            if pos < 0:
+                return k
+        return None
+
+    def _mark_health_changed(self):
+        self._health_version += 1
+
+    def _schedule(self, vendor: Optional[str]) -> WeightedSchedule:
+        sched = self._schedules.get(vendor)
+        if (sched is None
+                or self._schedule_versions.get(vendor) != self._health_version
+                or time.time() >= sched.valid_until):
+            now = time.time()
+            cands = []
+            valid_until = float("inf")
+            for k in self._keys:
+                if k.dead or (vendor and k.vendor != vendor):
+                    continue
+                if k.breaker.open_until > now:
+                    valid_until = min(valid_until, k.breaker.open_until)
+                    continue
+                cands.append(k)
+            cursor = sched.cursor if sched else 0
+            sched = WeightedSchedule(cands, valid_until=valid_until)
+            sched.cursor = cursor
+            self._schedules[vendor] = sched
+            self._schedule_versions[vendor] = self._health_version
+        return sched
 
-    async def acquire_key(self, vendor: Optional[str] = None) -> Optional[APIKey]:
-        async with self._lock:
-            cands = [k for k in self._eligible_keys() if (not vendor or k.vendor == vendor)]
-            if not cands:
+    async def acquire_key(self, vendor: Optional[str] = None, exclude: Optional[str] = None) -> Optional[APIKey]:
+        """
+        Args:
+            vendor: 只选该厂商的 key
+            exclude: 不选这把 key（对冲请求换 key 用）；没有别的 key 时返回 None
+        """
+        with self._lock:
+            return self._select(vendor, exclude)
+
+    def _select(self, vendor: Optional[str], exclude: Optional[str]) -> Optional[APIKey]:
+        # 调用方持有 self._lock
+        sched = self._schedule(vendor)
+        # 快路径：轮到的 key 有令牌就直接用
+        k = sched.next()
+        if k is None:
+            return None
+        if exclude is not None:
+            # 对冲请求：从轮询顺序中去掉 exclude，直接走慢路径
+            order = [o for o in sched.rotation() if o.key != exclude]
+            if not order:
                 return None
-            # 找能用的key，都不能就等那个最短等待的
-            best = None
-            best_wait = float("inf")
-            for _ in range(len(cands)):
-                k = self._weighted_round_robin(cands)
-                if not k:
-                    break
-                if k.bucket.try_consume(1):
-                    return k
-                else:
-                    wait = k.bucket.time_to_avail(1)
-                    if wait < best_wait:
-                        best_wait = wait
-                        best = k
-            return best
-
-    async def report_success(self, k: APIKey):
-        async with self._lock:
+            for o in order:
+                if o.bucket.try_consume(1):
+                    return o
+            return min(order, key=lambda o: o.bucket.time_to_avail(1))
+        # 只有两把 key 时每次比较的都是同一对，总选快的那把，权重失效；这时只按加权轮询
+        if self.latency_aware and len(sched.keys) > 2 and random.random() >= self.explore_ratio:
+            other = sched.next()
+            if other is not k and other.stats.expected_latency() < k.stats.expected_latency():
+                k, other = other, k
+            if k.bucket.try_consume(1):
+                return k
+            if other is not k and other.bucket.try_consume(1):
+                return other
+        elif k.bucket.try_consume(1):
+            return k
+        # 慢路径：按轮询顺序找其他有令牌的 key，都不能就返回等待最短的
+        best = k
+        best_wait = k.bucket.time_to_avail(1)
+        for other in sched.rotation():
+            if other is k:
+                continue
+            if other.bucket.try_consume(1):
+                return other
+            wait = other.bucket.time_to_avail(1)
+            if wait < best_wait:
+                best_wait = wait
+                best = other
+        return best
+
+    async def report_success(self, k: APIKey, latency: Optional[float] = None):
+        with self._lock:
+            if latency is not None:
+                k.stats.record_success(latency)
+            was_failing = k.breaker.failure_count > 0 or k.breaker.open_until > 0
             k.breaker.record_success()
+            if was_failing:
+                self._mark_health_changed()
 
-    async def report_failure(self, k: APIKey, kind: str, retry_after: Optional[float] = None):
+    async def report_failure(self, k: APIKey, kind: str, retry_after: Optional[float] = None,
+                             latency: Optional[float] = None):
         """
         kind: 'auth' | 'rate' | 'server' | 'network' | 'other'
+        latency: 本次失败调用的耗时（秒），用于延迟统计
         """
-        async with self._lock:
+        with self._lock:
+            k.stats.record_failure(latency)
+            was_healthy = k.healthy()
             if kind == 'auth':
                 k.dead = True  # 死了
-                return
-            if kind == 'rate':
+            elif kind == 'rate':
                 cool = retry_after if retry_after else random.uniform(8, 20)
                 k.breaker.record_failure(cool=cool)
-                return
-            if kind in ('server', 'network'):
+            elif kind in ('server', 'network'):
                 k.breaker.record_failure(cool=random.uniform(10, 60))
-                return
-            # 其他未知错误：短冷却
-            k.breaker.record_failure(cool=k.min_cooldown)
+            else:
+                # 其他未知错误：短冷却
+                k.breaker.record_failure(cool=k.min_cooldown)
+            if was_healthy != k.healthy():
+                self._mark_health_changed()
 
     def have_live_key(self) -> bool:
         return any(k.healthy() for k in self._keys)
 
-def load_keypool_from_config(path: str = "config_pool.json") -> List[APIKey]:
+    def stats_snapshot(self) -> List[Dict[str, Any]]:
+        """每把 key 的健康与延迟统计（key 已脱敏），供监控 / 调试查看"""
+        out = []
+        for k in self._keys:
+            mask = (k.key[:4] + "…" + k.key[-4:]) if isinstance(k.key, str) and len(k.key) > 8 else "****"
+            item = {
+                "key": mask,
+                "vendor": k.vendor,
+                "base_url": k.metadata.get("base_url"),
+                "weight": k.weight,
+                "dead": k.dead,
+                "breaker_open": k.breaker.is_open(),
+            }
+            item.update(k.stats.snapshot())
+            out.append(item)
+        return out
+
+
+# -------- RedisKeyPool：多个 ARQ 进程共享 key 状态 --------
+# 令牌桶、熔断、dead 标记都存在 Redis 里，通过 Lua 脚本原子修改；
+# 时间统一取 Redis 服务器的 TIME，避免多台机器时钟不一致。
+# 每把 key 在 Redis 中的数据（kid = key 的 sha1 前缀，不落明文 key）：
+#   {prefix}:{kid}  hash: tokens, ts, failures, open_until, probe_until, dead
+
+# KEYS: 候选 key 的 hash（按加权轮询顺序）
+# ARGV: amount, half_open_probe_seconds, 然后每把 key 依次 capacity, refill_rate
+# 返回: {选中的下标(1-based, 0 表示都没令牌), 最短等待毫秒, 状态串(每把 key 一位: d=dead o=open h=half-open 其他=ok)}
+_ACQUIRE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local amount = tonumber(ARGV[1])
+local probe_window = tonumber(ARGV[2])
+local best_wait = -1
+local states = {}
+for i, hkey in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[1 + i * 2])
+    local rate = tonumber(ARGV[2 + i * 2])
+    local h = redis.call('HMGET', hkey, 'tokens', 'ts', 'failures', 'open_until', 'probe_until', 'dead', 'threshold')
+    local tokens = tonumber(h[1]) or capacity
+    local ts = tonumber(h[2]) or now
+    local failures = tonumber(h[3]) or 0
+    local open_until = tonumber(h[4]) or 0
+    local probe_until = tonumber(h[5]) or 0
+    local dead = h[6] == '1'
+    local threshold = tonumber(h[7]) or 3
+    local state = '.'
+    if dead then
+        state = 'd'
+    elseif now < open_until or now < probe_until then
+        state = 'o'
+    else
+        -- 熔断过期后进入半开：同一时刻只允许一个进程去探测
+        local half_open = failures >= threshold
+        tokens = math.min(capacity, tokens + (now - ts) * rate)
+        if tokens >= amount then
+            tokens = tokens - amount
+            redis.call('HSET', hkey, 'tokens', tokens, 'ts', now)
+            if half_open then
+                redis.call('HSET', hkey, 'probe_until', now + probe_window)
+            end
+            states[i] = half_open and 'h' or '.'
+            for j = i + 1, #KEYS do states[j] = '?' end
+            return {i, 0, table.concat(states)}
+        end
+        redis.call('HSET', hkey, 'tokens', tokens, 'ts', now)
+        local wait = 0
+        if rate > 0 then wait = (amount - tokens) / rate else wait = 86400 end
+        if best_wait < 0 or wait < best_wait then best_wait = wait end
+    end
+    states[i] = state
+end
+return {0, math.floor(best_wait * 1000), table.concat(states)}
+"""
+
+# KEYS[1]: key hash; ARGV: threshold, cool_seconds, kind
+# 返回: open_until（0 表示未熔断）
+_FAILURE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local threshold = tonumber(ARGV[1])
+local cool = tonumber(ARGV[2])
+if ARGV[3] == 'auth' then
+    redis.call('HSET', KEYS[1], 'dead', '1')
+    return 0
+end
+local failures = redis.call('HINCRBY', KEYS[1], 'failures', 1)
+redis.call('HSET', KEYS[1], 'threshold', threshold, 'probe_until', 0)
+if failures >= threshold then
+    local open_until = now + cool
+    local cur = tonumber(redis.call('HGET', KEYS[1], 'open_until')) or 0
+    if open_until > cur then
+        redis.call('HSET', KEYS[1], 'open_until', open_until)
+    end
+    return tostring(math.max(open_until, cur))
+end
+return 0
+"""
+
+_SUCCESS_LUA = """
+redis.call('HSET', KEYS[1], 'failures', 0, 'open_until', 0, 'probe_until', 0)
+return 1
+"""
+
+
+class RedisKeyPool(KeyPool):
+    """
+    分布式 KeyPool：接口与 KeyPool 相同，状态保存在 Redis 中，所有 worker 进程共享。
+    这样不管启动多少个 ARQ 进程，每把 key 的集群总请求速率都不会超过配置的 rpm。
+    Redis 不可用时退回进程内状态（即 KeyPool 的行为），保证调用不中断。
+    """
+
+    def __init__(self, keys: List[APIKey], redis_url: str, prefix: str = "keypool",
+                 probe_seconds: float = 30.0, max_wait_seconds: float = 60.0, **kwargs):
+        if not HAS_REDIS:
+            raise ImportError("redis 未安装，无法使用分布式 KeyPool：pip install redis")
+        super().__init__(keys, **kwargs)
+        self.redis_url = redis_url
+        self.prefix = prefix
+        self.probe_seconds = probe_seconds      # 半开探测窗口，窗口内其他进程不会再选这把 key
+        self.max_wait_seconds = max_wait_seconds  # 令牌不足时最多等待多久
+        # redis.asyncio 的连接绑定创建时的事件循环，不能跨 asyncio.run() 复用：
+        # 每个事件循环在第一次使用时各建一个客户端，循环结束后随之释放
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]" = weakref.WeakKeyDictionary()
+
+    def _conn(self) -> Dict[str, Any]:
+        """当前事件循环的 Redis 客户端和已注册的脚本（必须在协程中调用）"""
+        loop = asyncio.get_running_loop()
+        conn = self._clients.get(loop)
+        if conn is None:
+            client = aioredis.from_url(self.redis_url, decode_responses=True)
+            conn = {
+                "redis": client,
+                "acquire": client.register_script(_ACQUIRE_LUA),
+                "failure": client.register_script(_FAILURE_LUA),
+                "success": client.register_script(_SUCCESS_LUA),
+            }
+            self._clients[loop] = conn
+        return conn
+
+    def _hkey(self, k: APIKey) -> str:
+        kid = k.metadata.get("_kid")
+        if not kid:
+            kid = hashlib.sha1(f"{k.vendor}:{k.key}".encode("utf-8")).hexdigest()[:16]
+            k.metadata["_kid"] = kid
+        return f"{self.prefix}:{kid}"
+
+    async def acquire_key(self, vendor: Optional[str] = None, exclude: Optional[str] = None) -> Optional[APIKey]:
+        deadline = time.time() + self.max_wait_seconds
+        while True:
+            # 按加权轮询顺序给出本次尝试顺序；熔断状态以 Redis 为准，所以只排除本地已知 dead 的 key
+            with self._lock:
+                sched = self._redis_schedule(vendor)
+                sched.next()
+                order = [k for k in sched.rotation() if k.key != exclude]
+            if not order:
+                return None
+            # 与进程内模式相同的 power of two choices：前两把里期望耗时低的先试（只有两把时按权重顺序）
+            if (self.latency_aware and len(order) > 2 and random.random() >= self.explore_ratio
+                    and order[1].stats.expected_latency() < order[0].stats.expected_latency()):
+                order[0], order[1] = order[1], order[0]
+
+            argv: List[Any] = [1, self.probe_seconds]
+            for k in order:
+                argv += [k.bucket.capacity, k.bucket.refill_rate]
+            try:
+                idx, wait_ms, states = await self._conn()["acquire"](keys=[self._hkey(k) for k in order], args=argv)
+            except Exception as e:
+                print(f"[keypool] Redis 不可用，退回进程内限流: {e}")
+                return await super().acquire_key(vendor, exclude)
+
+            # 同步 dead 状态到本地，供 have_live_key 使用
+            with self._lock:
+                for k, st in zip(order, states):
+                    if st == 'd' and not k.dead:
+                        k.dead = True
+                        self._mark_health_changed()
+            idx = int(idx)
+            if idx > 0:
+                return order[idx - 1]
+            if all(st in ('d', 'o') for st in states):
+                return None
+            wait = int(wait_ms) / 1000.0
+            if time.time() + wait > deadline:
+                return None
+            # 令牌不足：等到最早可用的时刻再原子地抢一次
+            await asyncio.sleep(wait + random.uniform(0, 0.05))
+
+    def _redis_schedule(self, vendor: Optional[str]) -> WeightedSchedule:
+        # 本地不知道其他进程触发的熔断，只在 dead 集合变化时重建
+        cache_key = ("redis", vendor)
+        sched = self._schedules.get(cache_key)
+        if sched is None or self._schedule_versions.get(cache_key) != self._health_version:
+            cands = [k for k in self._keys if not k.dead and (not vendor or k.vendor == vendor)]
+            cursor = sched.cursor if sched else 0
+            sched = WeightedSchedule(cands)
+            sched.cursor = cursor
+            self._schedules[cache_key] = sched
+            self._schedule_versions[cache_key] = self._health_version
+        return sched
+
+    async def report_success(self, k: APIKey, latency: Optional[float] = None):
+        # 延迟统计保存在本进程（各 worker 各自观测），限流 / 熔断状态走 Redis
+        with self._lock:
+            if latency is not None:
+                k.stats.record_success(latency)
+            k.breaker.record_success()
+        try:
+            await self._conn()["success"](keys=[self._hkey(k)], args=[])
+        except Exception as e:
+            print(f"[keypool] Redis 写入失败: {e}")
+
+    async def report_failure(self, k: APIKey, kind: str, retry_after: Optional[float] = None,
+                             latency: Optional[float] = None):
+        """
+        kind: 'auth' | 'rate' | 'server' | 'network' | 'other'
+        """
+        if kind == 'rate':
+            cool = retry_after if retry_after else random.uniform(8, 20)
+        elif kind in ('server', 'network'):
+            cool = random.uniform(10, 60)
+        else:
+            cool = k.min_cooldown
+        # 本地也记一份，Redis 故障退回进程内模式时状态不丢
+        await super().report_failure(k, kind, retry_after=retry_after, latency=latency)
+        try:
+            await self._conn()["failure"](keys=[self._hkey(k)], args=[k.breaker.threshold, cool, kind])
+        except Exception as e:
+            print(f"[keypool] Redis 写入失败: {e}")
+
+    async def aclose(self):
+        """关闭当前事件循环的 Redis 客户端"""
+        conn = self._clients.pop(asyncio.get_running_loop(), None)
+        if conn is not None:
+            await conn["redis"].aclose()
+
+def load_keypool_from_config(path: str = "config_pool.json", redis_url: Optional[str] = None) -> List[APIKey]:
     """
     从同目录下 configpool.json 载入 API Key。
     支援两种格式：
@@ -164,14 +609,21 @@ def load_keypool_from_config(path: str = "config_pool.json") -> List[APIKey]:
          "keys": [
            {"key": "sk-xxx", "vendor": "openai", "weight": 3, "rpm": 90, "base_url": ""},
            {"key": "gm-yyy", "vendor": "gemini", "weight": 2}
-         ]
+         ],
+         "redis": { "url": "redis://localhost:6380/0", "prefix": "keypool" }
        }
+    配置了 redis.url（或传入 redis_url / 环境变量 KEYPOOL_REDIS_URL）时返回 RedisKeyPool，
+    多个 worker 进程共享限流和熔断状态。
+    可选 "routing": {"latency_aware": true, "explore_ratio": 0.05} 控制按延迟选 key。
+    可选 "concurrency"（或 settings.concurrency）：每次加载都会更新进程级 LLM 限流器，见 concurrency.get_limiter。
     """
     p = pathlib.Path(path)
     if not p.exists():
         return []
 
     cfg = json.loads(p.read_text(encoding="utf-8"))
+    # 重新加载配置时同步更新进程级 LLM 限流器（concurrency 段）
+    get_limiter("llm", cfg)
 
     keys_cfg = cfg.get("keys", [])
     defaults: Dict[str, Any] = cfg.get("defaults", {})
@@ -205,4 +657,25 @@ def load_keypool_from_config(path: str = "config_pool.json") -> List[APIKey]:
         metadata = {"base_url": base_url} if base_url else {}
         out.append(APIKey(key=cfg["llm_key"], vendor="openai", weight=3, bucket=bucket, metadata=metadata))
 
-    return KeyPool(out)
\ No newline at end of file
+    routing_cfg = cfg.get("routing", {}) or {}
+    pool_kwargs = {
+        "latency_aware": bool(routing_cfg.get("latency_aware", True)),
+        "explore_ratio": float(routing_cfg.get("explore_ratio", 0.05)),
+    }
+
+    redis_cfg = cfg.get("redis", {}) or {}
+    redis_url = redis_url or redis_cfg.get("url") or os.environ.get("KEYPOOL_REDIS_URL")
+    if redis_url:
+        if not HAS_REDIS:
+            print("[keypool] 配置了 redis 但未安装 redis 包，使用进程内 KeyPool")
+            return KeyPool(out, **pool_kwargs)
+        return RedisKeyPool(
+            out,
+            redis_url=redis_url,
+            prefix=redis_cfg.get("prefix", "keypool"),
+            probe_seconds=float(redis_cfg.get("probe_seconds", 30.0)),
+            max_wait_seconds=float(redis_cfg.get("max_wait_seconds", 60.0)),
+            **pool_kwargs,
+        )
+
+    return KeyPool(out, **pool_kwargs)
\ No newline at end of file
@@ -1,7 +1,11 @@
-import asyncio, httpx
-from typing import Dict, Any, List, Tuple
+import asyncio, httpx, time
+from typing import Dict, Any, List, Tuple, Optional
 from pool import KeyPool, APIKey
-from openai import OpenAI
+from openai import AsyncOpenAI
+from http_pool import get_async_http_client
+from hedging import HedgeBudget, hedged_call
+from concurrency import AdaptiveLimiter, error_status, get_limiter, is_throttle_error, is_throttle_message
+import tracing
 #from zai import ZhipuAiClient
 
 DEBUG_PROVIDER = True
@@ -45,14 +49,29 @@ def _flatten_to_text_messages(messages: List[Dict[str, Any]]) -> List[Dict[str,
 
 # 封装pool.py，提供统一的调用接口
 class ProviderAdapter:
-    def __init__(self, key_pool: KeyPool):
+    def __init__(self, key_pool: KeyPool, hedge_budget: Optional[HedgeBudget] = None,
+                 limiter: Optional[AdaptiveLimiter] = None):
         self.pool = key_pool
         self.client = httpx.AsyncClient(timeout=60)
+        # 对冲预算（每个任务一份）；为 None 时不做请求对冲
+        self.hedge_budget = hedge_budget
+        # 自适应并发限流（默认与 LLMAPIClient 共用进程级 "llm" 限流器）
+        self.limiter = limiter or get_limiter("llm")
 
     async def aclose(self):
         await self.client.aclose()
 
-    async def chat(self, messages: List[Dict[str, Any]], model: str, max_retries: int = 3) -> str:
+    def key_stats(self) -> List[Dict[str, Any]]:
+        """查看每把 key / 代理的延迟（EWMA、p50、p95）与错误率"""
+        return self.pool.stats_snapshot()
+
+    async def chat(self, messages: List[Dict[str, Any]], model: str, max_retries: int = 3,
+                   hedge_budget: Optional[HedgeBudget] = None) -> str:
+        """
+        Args:
+            hedge_budget: 本次调用所属任务的对冲预算（长期复用的 adapter 按任务传入）；默认用构造时的预算
+        """
+        budget = hedge_budget or self.hedge_budget
         vendor = VENDOR_BY_MODEL.get(model)
         if not vendor:
             raise ValueError(f"Unknown model: {model}")
@@ -93,10 +112,27 @@ class ProviderAdapter:
                 continue
 
             try:
-                if DEBUG_PROVIDER:
-                    key_mask = (k.key[:4] + "…" + k.key[-4:]) if isinstance(k.key, str) and len(k.key) > 8 else "****"
-                    print(f"[provider] attempt={attempt} use key vendor={k.vendor} weight={getattr(k, 'weight', '?')} key={key_mask}")
+                if budget is not None:
+                    return await self._hedged_call_with_key(k, vendor, norm_messages, model, attempt, budget)
+                return await self._call_with_key(k, norm_messages, model, attempt)
+            except (httpx.HTTPStatusError, httpx.RequestError) as e:
+                last_err = e
+                tracing.record_retry(str(e))
+                # 尝试换 key
+                await asyncio.sleep(0.0)
+                continue
 
+        raise RuntimeError(f"all retries exhausted; last error: {last_err}")
+
+    async def _call_with_key(self, k: APIKey, norm_messages: List[Dict[str, str]], model: str, attempt: int) -> str:
+        """用指定 key 调用一次，并把结果（耗时、错误类型）回报给 KeyPool"""
+        t0 = time.monotonic()
+        try:
+            if DEBUG_PROVIDER:
+                key_mask = (k.key[:4] + "…" + k.key[-4:]) if isinstance(k.key, str) and len(k.key) > 8 else "****"
+                print(f"[provider] attempt={attempt} use key vendor={k.vendor} weight={getattr(k, 'weight', '?')} key={key_mask}")
+
+            async with self.limiter.aslot() as slot:
                 if k.vendor == "openai":
                     text, meta = await self._call_openai(k, norm_messages, model)
                 elif k.vendor == "gemini":
@@ -105,41 +141,83 @@ class ProviderAdapter:
                     text, meta = await self._call_bigmodel_sdk(k, norm_messages, model)  # ← 改为 SDK
                 else:
                     raise RuntimeError(f"unsupported vendor: {k.vendor}")
+                if meta.get("error"):
+                    if self._is_throttled(meta):
+                        slot.throttled()
+                    else:
+                        slot.failed()
+
+        except httpx.HTTPStatusError as e:
+            status = e.response.status_code
+            retry_after = None
+            if 'retry-after' in e.response.headers:
+                try:
+                    retry_after = float(e.response.headers['retry-after'])
+                except:
+                    retry_after = None
+
+            latency = time.monotonic() - t0
+            if status in (401, 403):
+                await self.pool.report_failure(k, 'auth', latency=latency)
+            elif status == 429:
+                await self.pool.report_failure(k, 'rate', retry_after=retry_after, latency=latency)
+            elif 500 <= status < 600:
+                await self.pool.report_failure(k, 'server', latency=latency)
+            else:
+                await self.pool.report_failure(k, 'other', latency=latency)
+            raise
+
+        except (httpx.RequestError, httpx.ReadTimeout):
+            await self.pool.report_failure(k, 'network', latency=time.monotonic() - t0)
+            raise
+
+        latency = time.monotonic() - t0
+        if meta.get("error"):
+            # SDK 内部重试后仍失败、以错误文本返回的情况，同样计入该 key 的错误率；限流按 rate 冷却
+            exc = meta.get("exception")
+            status = error_status(exc) if exc is not None else None
+            if status in (401, 403):
+                await self.pool.report_failure(k, 'auth', latency=latency)
+            elif self._is_throttled(meta) and (status == 429 or status is None):
+                await self.pool.report_failure(k, 'rate', latency=latency)
+            else:
+                await self.pool.report_failure(k, 'server', latency=latency)
+        else:
+            await self.pool.report_success(k, latency=latency)
+            tracing.record_llm_response(model, meta.get("usage"), prompt=norm_messages, completion=text, latency=latency)
+        return text
+
+    @staticmethod
+    def _is_throttled(meta: Dict[str, Any]) -> bool:
+        """以错误返回的调用是否属于限流 / 过载：有异常对象时按类型和状态码判断，否则才看错误文本"""
+        exc = meta.get("exception")
+        if exc is not None:
+            return is_throttle_error(exc)
+        return is_throttle_message(meta.get("error", ""))
+
+    async def _hedged_call_with_key(self, k: APIKey, vendor: str, norm_messages: List[Dict[str, str]],
+                                    model: str, attempt: int, budget: HedgeBudget) -> str:
+        """
+        主请求超过该 key 最近延迟的分位数仍未返回时，换一把 key 发对冲请求，先完成者胜出。
+        被取消的请求不计入 key 的失败统计。
+        """
+        delay = budget.delay_for(k.stats)
 
-                await self.pool.report_success(k)
-                return text
-
-
-            except httpx.HTTPStatusError as e:
-                status = e.response.status_code
-                retry_after = None
-                if 'retry-after' in e.response.headers:
-                    try:
-                        retry_after = float(e.response.headers['retry-after'])
-                    except:
-                        retry_after = None
-
-                if status in (401, 403):
-                    await self.pool.report_failure(k, 'auth')
-                elif status == 429:
-                    await self.pool.report_failure(k, 'rate', retry_after=retry_after)
-                elif 500 <= status < 600:
-                    await self.pool.report_failure(k, 'server')
-                else:
-                    await self.pool.report_failure(k, 'other')
-                last_err = e
-                # 尝试换 key
-                await asyncio.sleep(0.0)
-                continue
-
-            except (httpx.RequestError, httpx.ReadTimeout) as e:
-                await self.pool.report_failure(k, 'network')
-                last_err = e
-                # 换 key
-                await asyncio.sleep(0.0)
-                continue
-
-        raise RuntimeError(f"all retries exhausted; last error: {last_err}")
+        async def _backup() -> str:
+            other = await self.pool.acquire_key(vendor=vendor, exclude=k.key)
+            if other is None:
+                # 没有别的 key 可用：对冲分支直接失败，继续等主请求
+                raise RuntimeError("no alternate key for hedged request")
+            if DEBUG_PROVIDER:
+                print(f"[provider] hedge after {delay:.1f}s")
+            return await self._call_with_key(other, norm_messages, model, attempt)
+
+        return await hedged_call(
+            lambda: self._call_with_key(k, norm_messages, model, attempt),
+            _backup,
+            delay,
+            budget,
+        )
     '''
     async def _call_openai(self, k: APIKey, messages, model) -> Tuple[str, Dict[str, Any]]:
         # 支持代理 base_url（若 metadata 里有，否则走官方）
@@ -174,18 +252,18 @@ class ProviderAdapter:
 
     async def _call_openai(self, k: APIKey, messages, model) -> Tuple[str, Dict[str, Any]]:
         """
-        最小化实现：仅用 OpenAI SDK，同步调用 + 简单重试；不依赖 ProviderAdapter 的成员变量。
+        最小化实现：仅用 OpenAI SDK（异步客户端，共用事件循环级连接池）+ 简单重试；不依赖 ProviderAdapter 的成员变量。
         - attempts: 固定 3 次
         - temperature: 固定 0.2
         - 不设置 max_tokens（走服务端/模型默认）
         """
         base_url = (k.metadata.get("base_url") if isinstance(k.metadata, dict) else None) or "https://api.openai.com/v1"
-        client = OpenAI(api_key=k.key, base_url=base_url)
+        client = AsyncOpenAI(api_key=k.key, base_url=base_url, http_client=get_async_http_client())
 
         attempts = 3
         for i in range(1, attempts + 1):
             try:
-                resp = client.chat.completions.create(
+                resp = await client.chat.completions.create(
                     model=model,
                     messages=messages,
                     temperature=0.2
@@ -208,7 +286,7 @@ class ProviderAdapter:
                 print(f"[openai] 调用失败 第 {i}/{attempts} 次：{e}")
                 if i >= attempts:
                     # 最小改动：不抛出 httpx 异常，直接返回错误文本（避免打破上层异常分类逻辑）
-                    return f"错误：达到最大重试次数后API调用失败。最后错误: {e}", {}
+                    return f"错误：达到最大重试次数后API调用失败。最后错误: {e}", {"error": str(e), "exception": e}
                 # 简单线性退避
                 await asyncio.sleep(5 * i)
 
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+渲染结果缓存（内容寻址，持久化到磁盘）
+
+功能：
+1. 以 (场景代码及其导入的本地模块, 引用的图片等资源, Scene 类名, 质量, 输出格式, manim 版本, 模板参数)
+   计算缓存 key，任何一项变化都会重新渲染，不会再用到改代码前的旧视频
+2. 成品视频按 key 存放在共享目录，不同任务目录里相同的页面（例如封面、尾页）只渲染一次
+3. 使用 SQLite 记录索引（lru_store.LRUStore），按最近访问时间做 LRU 淘汰，总大小超过上限时自动清理
+4. 提供命中率统计
+
+修改课程中某一页后重跑，只有这一页会真正渲染。
+"""
+
+import os
+import re
+import ast
+import json
+import shutil
+import sqlite3
+import hashlib
+import threading
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from lru_store import LRUStore
+
+# 默认缓存目录与大小上限，可通过环境变量覆盖
+DEFAULT_CACHE_DIR = os.environ.get(
+    "RENDER_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "render_cache"),
+)
+DEFAULT_MAX_SIZE_MB = float(os.environ.get("RENDER_CACHE_MAX_MB", "20480"))
+# RENDER_CACHE_DISABLE=1 时全局关闭缓存（每次都重新渲染）
+CACHE_DISABLED = os.environ.get("RENDER_CACHE_DISABLE", "").lower() in ("1", "true", "yes")
+
+# 缓存 key 的版本号，修改 key 的计算方式时递增
+_KEY_VERSION = 1
+
+# 代码里以字符串形式引用、会影响画面的资源文件
+_ASSET_PATTERN = re.compile(
+    r"""["']([^"'\n]+\.(?:png|jpe?g|gif|bmp|webp|svg|tiff?|mp3|wav|ogg|ttf|otf|ttc|tex|csv|json))["']""",
+    re.I,
+)
+_BACKEND_DIR = Path(__file__).resolve().parent
+
+
+def _file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _local_imports(source: str) -> List[str]:
+    """代码中 import 的顶层模块名"""
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return []
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.extend(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.append(node.module.split(".")[0])
+    return names
+
+
+def _resolve(name: str, search_dirs: Iterable[Path]) -> Optional[Path]:
+    p = Path(name)
+    if p.is_absolute():
+        return p if p.is_file() else None
+    for d in search_dirs:
+        cand = d / p
+        if cand.is_file():
+            return cand
+    return None
+
+
+def collect_scene_inputs(py_path: Union[str, Path], cwd: Optional[Union[str, Path]] = None
+                         ) -> Tuple[Dict[str, str], Dict[str, Optional[str]]]:
+    """
+    收集影响渲染结果的输入文件
+
+    场景文件本身、它 import 的本地模块（递归，例如 Demo_cn.py），以及这些代码中按文件名引用的资源。
+    查找顺序与渲染时一致：代码所在目录、工作目录、backend 目录。
+
+    Args:
+        py_path: 场景代码文件
+        cwd: 渲染时的工作目录（默认为代码所在目录）
+
+    Returns:
+        (sources, assets)：文件名 -> 内容哈希；找不到的资源哈希为 None（补上文件后 key 会变化）
+    """
+    py_path = Path(py_path).resolve()
+    search_dirs = [py_path.parent]
+    for d in (Path(cwd).resolve() if cwd else None, _BACKEND_DIR):
+        if d is not None and d not in search_dirs:
+            search_dirs.append(d)
+
+    sources: Dict[str, str] = {}
+    assets: Dict[str, Optional[str]] = {}
+    pending = [py_path]
+    seen = set()
+    while pending:
+        path = pending.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        raw = path.read_bytes()
+        sources[path.name] = hashlib.sha256(raw).hexdigest()
+        text = raw.decode("utf-8", errors="replace")
+        for module in _local_imports(text):
+            found = _resolve(f"{module}.py", search_dirs)
+            if found is not None:
+                pending.append(found.resolve())
+        for name in _ASSET_PATTERN.findall(text):
+            if name in assets:
+                continue
+            found = _resolve(name, [path.parent] + search_dirs)
+            assets[name] = _file_digest(found) if found is not None else None
+
+    # 工作目录下的 manim.cfg 也会影响输出
+    for d in search_dirs[:2]:
+        cfg = d / "manim.cfg"
+        if cfg.is_file():
+            assets[f"manim.cfg@{d.name}"] = _file_digest(cfg)
+            break
+    return sources, assets
+
+
+_manim_version: Optional[str] = None
+_version_lock = threading.Lock()
+
+
+def manim_version() -> str:
+    """实际用于渲染的 manim 版本（优先 MANIM_PYTHON 指定的解释器），结果在进程内缓存"""
+    global _manim_version
+    with _version_lock:
+        if _manim_version is not None:
+            return _manim_version
+        version = None
+        python = os.environ.get("MANIM_PYTHON")
+        if not python:
+            try:
+                from importlib.metadata import version as _pkg_version, PackageNotFoundError
+                try:
+                    version = _pkg_version("manim")
+                except PackageNotFoundError:
+                    version = None
+            except ImportError:
+                version = None
+        if version is None:
+            cmd = [python, "-c", "import manim; print(manim.__version__)"] if python else ["manim", "--version"]
+            try:
+                out = subprocess.run(cmd, capture_output=True, text=True, timeout=60).stdout
+                version = out.strip().splitlines()[-1] if out.strip() else None
+            except (OSError, subprocess.TimeoutExpired):
+                version = None
+        _manim_version = version or "unknown"
+        return _manim_version
+
+
+def make_render_key(
+    py_path: Union[str, Path],
+    scene: Optional[str],
+    quality: str,
+    fmt: str = "mp4",
+    cwd: Optional[Union[str, Path]] = None,
+    extra: Optional[Dict[str, Any]] = None,
+    extra_files: Optional[Iterable[Union[str, Path]]] = None,
+) -> str:
+    """
+    计算渲染缓存 key
+
+    Args:
+        py_path: 场景代码文件
+        scene: Scene 类名
+        quality: 渲染质量（l/m/h/p/k 或 manim 的质量名）
+        fmt: 输出格式
+        cwd: 渲染时的工作目录
+        extra: 其他影响画面的参数（例如封面的标题、教师姓名）
+        extra_files: 不在代码里直接出现、但会影响画面的文件（例如通过参数传入的背景图、头像）
+
+    Returns:
+        sha256 十六进制字符串
+    """
+    sources, assets = collect_scene_inputs(py_path, cwd)
+    files = {}
+    for f in extra_files or []:
+        p = Path(f)
+        files[str(f)] = _file_digest(p) if p.is_file() else None
+    payload = {
+        "v": _KEY_VERSION,
+        "sources": sources,
+        "assets": assets,
+        "scene": scene,
+        "quality": quality,
+        "format": fmt,
+        "manim": manim_version(),
+        "extra": extra or {},
+        "extra_files": files,
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    """基于 SQLite 索引 + 文件存储的渲染结果缓存，支持 LRU + 总大小上限淘汰（索引与淘汰见 lru_store）"""
+
+    DB_FILENAME = "render_cache.sqlite3"
+
+    def __init__(self, cache_dir: Optional[str] = None, max_size_mb: Optional[float] = None):
+        """
+        初始化缓存
+
+        Args:
+            cache_dir: 缓存目录（默认 backend/render_cache 或环境变量 RENDER_CACHE_DIR）
+            max_size_mb: 缓存总大小上限（MB），超过后按最近访问时间淘汰
+        """
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.objects_dir = os.path.join(self.cache_dir, "objects")
+        self.max_size_bytes = int((max_size_mb if max_size_mb is not None else DEFAULT_MAX_SIZE_MB) * 1024 * 1024)
+        self.db_path = os.path.join(self.cache_dir, self.DB_FILENAME)
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.store = LRUStore(self.db_path, self.max_size_bytes,
+                              columns=[("path", "TEXT NOT NULL"), ("label", "TEXT")], on_evict=self._remove_object)
+
+    @staticmethod
+    def _remove_object(key: str, values: Tuple):
+        try:
+            os.remove(values[0])
+        except OSError:
+            pass
+
+    def _object_path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.objects_dir, key[:2], f"{key}{suffix}")
+
+    def get(self, key: str) -> Optional[Path]:
+        """读取缓存，命中时刷新最近访问时间并返回缓存中的视频路径（只读，调用方应复制）"""
+        try:
+            # 文件被手动删除：按未命中处理
+            row = self.store.get(key, valid=lambda r: os.path.exists(r[0]))
+            return Path(row[0]) if row is not None else None
+        except sqlite3.Error as e:
+            # 缓存故障不能影响正常渲染
+            print(f"[render_cache] 读取失败，忽略缓存: {e}")
+            return None
+
+    def put(self, key: str, video_path: Union[str, Path], label: Optional[str] = None) -> Optional[Path]:
+        """
+        写入缓存（复制一份视频到缓存目录），超过大小上限时淘汰最久未访问的条目
+
+        Returns:
+            缓存中的视频路径；写入失败时返回 None
+        """
+        video_path = Path(video_path)
+        if not video_path.is_file() or video_path.stat().st_size == 0:
+            return None
+        dest = self._object_path(key, video_path.suffix or ".mp4")
+        tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copyfile(video_path, tmp)
+            os.replace(tmp, dest)
+            self.store.put(key, os.path.getsize(dest), path=dest, label=label)
+            return Path(dest)
+        except (OSError, sqlite3.Error) as e:
+            print(f"[render_cache] 写入失败，忽略缓存: {e}")
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return None
+
+    def invalidate(self, key: str):
+        """删除单条缓存"""
+        try:
+            row = self.store.delete(key)
+            if row is not None and os.path.exists(row[0]):
+                os.remove(row[0])
+        except (OSError, sqlite3.Error) as e:
+            print(f"[render_cache] 删除失败: {e}")
+
+    def clear(self):
+        """清空缓存"""
+        self.store.clear()
+        shutil.rmtree(self.objects_dir, ignore_errors=True)
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        return self.store.stats()
+
+
+_caches: Dict[str, RenderCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_render_cache(cache_dir: Optional[str] = None, max_size_mb: Optional[float] = None) -> Optional[RenderCache]:
+    """
+    获取进程内共享的缓存实例（同一目录只创建一次）
+
+    Returns:
+        RenderCache；全局禁用或初始化失败时返回 None
+    """
+    if CACHE_DISABLED:
+        return None
+    cache_dir = os.path.abspath(cache_dir or DEFAULT_CACHE_DIR)
+    with _caches_lock:
+        cache = _caches.get(cache_dir)
+        if cache is None:
+            try:
+                cache = RenderCache(cache_dir=cache_dir, max_size_mb=max_size_mb)
+            except (OSError, sqlite3.Error) as e:
+                print(f"[render_cache] 初始化失败，禁用缓存: {e}")
+                return None
+            _caches[cache_dir] = cache
+        return cache
+
+
+def main():
+    """命令行：查看或清空缓存"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="渲染结果缓存管理")
+    parser.add_argument("--dir", default=None, help="缓存目录")
+    parser.add_argument("--clear", action="store_true", help="清空缓存")
+    args = parser.parse_args()
+
+    cache = RenderCache(cache_dir=args.dir)
+    if args.clear:
+        cache.clear()
+        print("缓存已清空")
+    print(json.dumps(cache.stats(), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
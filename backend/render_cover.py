@@ -10,11 +10,14 @@
 """
 import sys
 import os
+import shutil
+import inspect
 import argparse
 from pathlib import Path
 from manim import *
 from Demo import MergedLayoutScene2
 from EndingDemo import EndingScene
+from render_cache import get_render_cache, make_render_key
 
 def render_videos(title, avatar_image="csh.png", professor_name="Prof. Siheng Chen", background_image="SAI.png", 
                  cover_output=None, ending_output=None, quality="high"):
@@ -143,51 +146,69 @@ def render_single_video(scene_class, title, avatar_image, professor_name, backgr
     
     # 创建场景并渲染
     final_output_file = None
+    # 相同标题、教师和图片的封面/尾页在不同课程间只渲染一次
+    cache = get_render_cache() if (output_dir and output_filename) else None
+    cache_key = None
+    if cache is not None:
+        cache_key = make_render_key(
+            inspect.getsourcefile(scene_class), scene_class.__name__, quality_map[quality],
+            extra={"title": title, "professor_name": professor_name},
+            extra_files=[Path(avatar_image).resolve(), Path(background_image).resolve()],
+        )
     try:
-        scene = scene_class(class_title_text=title, avatar_image=avatar_image, professor_name=professor_name, background_image=background_image)
-        scene.render()
+        cached = cache.get(cache_key) if cache_key else None
+        if cached:
+            final_output_file = output_dir / f"{output_filename}{cached.suffix}"
+            shutil.copy2(cached, final_output_file)
+            print(f"命中渲染缓存: {final_output_file}")
+        else:
+            scene = scene_class(class_title_text=title, avatar_image=avatar_image, professor_name=professor_name, background_image=background_image)
+            scene.render()
         
-        # 查找并重命名输出文件
-        if output_dir:
-            # 查找生成的视频文件，优先查找质量目录
-            video_dir = output_dir / "videos" / f"{config.quality}"
-            if not video_dir.exists():
-                # 如果质量目录不存在，查找所有可能的视频目录
-                video_dirs = list(output_dir.glob("videos/*/"))
-                if video_dirs:
-                    for vdir in video_dirs:
-                        if vdir.is_dir():
-                            video_files = list(vdir.glob("*.mp4"))
-                            if video_files:
-                                video_dir = vdir
-                                break
+            # 查找并重命名输出文件
+            if output_dir:
+                # 查找生成的视频文件，优先查找质量目录
+                video_dir = output_dir / "videos" / f"{config.quality}"
+                if not video_dir.exists():
+                    # 如果质量目录不存在，查找所有可能的视频目录
+                    video_dirs = list(output_dir.glob("videos/*/"))
+                    if video_dirs:
+                        for vdir in video_dirs:
+                            if vdir.is_dir():
+                                video_files = list(vdir.glob("*.mp4"))
+                                if video_files:
+                                    video_dir = vdir
+                                    break
             
-            if video_dir and video_dir.exists():
-                video_files = list(video_dir.glob("*.mp4"))
-                if video_files and output_filename:
-                    # 重命名文件为指定名称
-                    original_file = video_files[0]
-                    new_file = output_dir / f"{output_filename}.mp4"
-                    if original_file != new_file:
-                        original_file.rename(new_file)
-                        final_output_file = new_file
-                    else:
-                        final_output_file = original_file
-                elif video_files:
-                    final_output_file = video_files[0]
+                if video_dir and video_dir.exists():
+                    video_files = list(video_dir.glob("*.mp4"))
+                    if video_files and output_filename:
+                        # 重命名文件为指定名称
+                        original_file = video_files[0]
+                        new_file = output_dir / f"{output_filename}.mp4"
+                        if original_file != new_file:
+                            original_file.rename(new_file)
+                            final_output_file = new_file
+                        else:
+                            final_output_file = original_file
+                    elif video_files:
+                        final_output_file = video_files[0]
                     
-            # 生成对应的txt文件
-            if output_filename and final_output_file:
-                txt_file = output_dir / f"{output_filename}.txt"
-                scene_type = "封面" if scene_class == MergedLayoutScene2 else "尾页"
-                if scene_class == MergedLayoutScene2:
-                    txt_content = f"大家好！欢迎大家聆听本学期的机器学习课程，我是授课老师{professor_name}，今天让我们一起走进{title}吧。"
-                else:
-                    txt_content = f"感谢大家聆听本次{title}课程，希望大家都有所收获！我是授课老师{professor_name}，期待与大家下次课程再见。"
-                with open(txt_file, 'w', encoding='utf-8') as f:
-                    f.write(txt_content)
-                print(f"📝 {scene_type}文本文件: {txt_file}")
-                
+            if cache_key and final_output_file:
+                cache.put(cache_key, final_output_file, label=f"{scene_class.__name__}:{title}")
+
+        # 生成对应的txt文件
+        if output_filename and final_output_file:
+            txt_file = output_dir / f"{output_filename}.txt"
+            scene_type = "封面" if scene_class == MergedLayoutScene2 else "尾页"
+            if scene_class == MergedLayoutScene2:
+                txt_content = f"大家好！欢迎大家聆听本学期的机器学习课程，我是授课老师{professor_name}，今天让我们一起走进{title}吧。"
+            else:
+                txt_content = f"感谢大家聆听本次{title}课程，希望大家都有所收获！我是授课老师{professor_name}，期待与大家下次课程再见。"
+            with open(txt_file, 'w', encoding='utf-8') as f:
+                f.write(txt_content)
+            print(f"📝 {scene_type}文本文件: {txt_file}")
+            
     except Exception as e:
         print(f"详细错误信息: {e}")
         import traceback
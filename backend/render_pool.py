@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+"""
+常驻 Manim 渲染进程池
+
+原来每渲染一个场景就起一个 `manim render` 子进程，每次都要重新 import manim / numpy / cairo / pango
+和场景模块，短页面（标题页、纯文字页）的大部分时间花在解释器启动上。这里改为：
+
+- 启动若干常驻 worker 进程，每个进程只 import 一次 manim
+- 通过管道接收任务 (代码文件, Scene 类名, 质量, 输出目录)，在进程内渲染；
+  每个任务在 tempconfig 中执行，结束后全局 config 恢复原样，本次导入的场景模块也会被清理
+- 处理满 N 个任务或常驻内存超过上限后 worker 自动退出，由进程池补新的
+- 超时的任务直接杀掉 worker 进程
+- 静止的 self.wait() 只编码一帧（见 static_hold.py）
+- 所有 worker 共用一份 LaTeX / Text SVG 缓存（见 svg_cache.py）
+- 公式用预编译的格式文件编译，可选在渲染前批量编译场景中的公式（见 tex_engine.py）
+
+输出路径与 CLI 一致（media_dir/videos/<文件名>/<质量目录>/<Scene>.mp4），调用方原有的查找逻辑不用改。
+当前解释器没有 manim、或通过 MANIM_RENDER_POOL=0 关闭时 get_render_pool() 返回 None，调用方回退到 CLI 子进程。
+
+环境变量：
+    MANIM_RENDER_POOL        1/0，是否启用（默认 1）
+    MANIM_RENDER_WORKERS     worker 数（默认 CPU 核数）
+    MANIM_WORKER_MAX_JOBS    每个 worker 处理多少个任务后重启（默认 50）
+    MANIM_WORKER_MAX_RSS_MB  常驻内存超过多少 MB 后重启（默认 2048）
+    MANIM_PYTHON             worker 使用的解释器（manim 装在另一个环境时指定）
+"""
+
+import io
+import os
+import sys
+import time
+import threading
+import traceback
+import importlib.util
+import multiprocessing
+from contextlib import redirect_stdout, redirect_stderr
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import svg_cache
+import tex_engine
+
+DEFAULT_MAX_JOBS = int(os.environ.get("MANIM_WORKER_MAX_JOBS", "50"))
+DEFAULT_MAX_RSS_MB = int(os.environ.get("MANIM_WORKER_MAX_RSS_MB", "2048"))
+# worker 启动（import manim）的最长等待时间
+START_TIMEOUT = 120
+
+# CLI 的 -q 参数与 manim config.quality 的对应关系
+QUALITY_NAMES = {
+    "l": "low_quality",
+    "m": "medium_quality",
+    "h": "high_quality",
+    "p": "production_quality",
+    "k": "fourk_quality",
+}
+
+
+@dataclass
+class RenderResult:
+    ok: bool
+    log: str = ""
+    videos: List[str] = field(default_factory=list)
+    seconds: float = 0.0
+    cpu_s: float = 0.0
+
+
+class RenderPoolUnavailable(RuntimeError):
+    """worker 无法启动（例如解释器里没有 manim），调用方应回退到 CLI"""
+
+
+# ----------------------------------------------------------------------
+# worker 进程
+# ----------------------------------------------------------------------
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        try:
+            import resource
+            # Linux 上单位是 KB（峰值）
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        except ImportError:
+            return 0.0
+
+
+def _scene_classes(module, scene_base) -> List[str]:
+    """模块中定义的全部 Scene 子类（按定义顺序），对应 CLI 不指定 Scene 时的行为"""
+    names = []
+    for name, obj in vars(module).items():
+        if (isinstance(obj, type) and issubclass(obj, scene_base) and obj is not scene_base
+                and obj.__module__ == module.__name__):
+            names.append(name)
+    return names
+
+
+def _run_job(job: Dict[str, Any], seq: int) -> Dict[str, Any]:
+    from manim import config, tempconfig, Scene
+
+    py_path = os.path.abspath(job["py_path"])
+    cwd = job.get("cwd") or os.path.dirname(py_path)
+    overrides = {
+        "input_file": py_path,
+        "quality": QUALITY_NAMES.get(job.get("quality") or "h", "high_quality"),
+        "format": job.get("format") or "mp4",
+        "write_to_movie": True,
+        "progress_bar": "none",
+    }
+    if job.get("media_dir"):
+        overrides["media_dir"] = os.path.abspath(os.path.join(cwd, job["media_dir"]))
+    # 公式和文字 SVG 写到共享缓存目录，而不是每个任务自己的 media 下
+    if svg_cache.is_installed():
+        overrides.update(svg_cache.config_overrides())
+    # 调用方额外指定的配置（例如分段渲染的 from/upto_animation_number）
+    overrides.update(job.get("overrides") or {})
+
+    buf = io.StringIO()
+    videos: List[str] = []
+    ok = False
+    old_cwd = os.getcwd()
+    old_path = list(sys.path)
+    old_modules = set(sys.modules)
+    t0, c0 = time.perf_counter(), time.process_time()
+    try:
+        os.chdir(cwd)
+        sys.path.insert(0, os.path.dirname(py_path))
+        with redirect_stdout(buf), redirect_stderr(buf), tempconfig({}):
+            # 与 CLI 一致：工作目录下的 manim.cfg 先生效，任务参数覆盖其上
+            cfg_file = os.path.join(cwd, "manim.cfg")
+            if os.path.exists(cfg_file):
+                config.digest_file(cfg_file)
+            for key, value in overrides.items():
+                config[key] = value
+
+            spec = importlib.util.spec_from_file_location(f"_manim_job_{seq}", py_path)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[spec.name] = module
+            spec.loader.exec_module(module)
+            # 模块级的 config（例如 tex_template）已生效，按它批量编译字面量公式
+            tex_engine.prewarm(py_path)
+
+            names = [job["scene"]] if job.get("scene") else _scene_classes(module, Scene)
+            if not names:
+                raise RuntimeError(f"No Scene subclass found in {py_path}")
+            for name in names:
+                scene = getattr(module, name)()
+                scene.render()
+                movie = getattr(scene.renderer.file_writer, "movie_file_path", None)
+                if movie:
+                    videos.append(str(movie))
+        ok = True
+    except BaseException:
+        buf.write("\n" + traceback.format_exc())
+    finally:
+        os.chdir(old_cwd)
+        sys.path[:] = old_path
+        # 清理本次任务导入的场景模块及其同目录的依赖，下个任务重新加载最新代码
+        job_dir = os.path.dirname(py_path)
+        for name in set(sys.modules) - old_modules:
+            mod_file = getattr(sys.modules.get(name), "__file__", None) or ""
+            if name.startswith("_manim_job_") or os.path.dirname(os.path.abspath(mod_file)) == job_dir:
+                sys.modules.pop(name, None)
+    return {
+        "ok": ok,
+        "log": buf.getvalue(),
+        "videos": videos,
+        "seconds": time.perf_counter() - t0,
+        "cpu_s": time.process_time() - c0,
+        "svg_cache": svg_cache.flush_stats(),
+    }
+
+
+def _worker_main(conn, max_jobs: int, max_rss_mb: int):
+    try:
+        import manim  # noqa: F401  预先导入，后续任务不再付出导入开销
+        version = getattr(manim, "__version__", "unknown")
+        # 静止 wait 只编码一帧，写完后由 ffmpeg 补齐时长
+        import static_hold
+        static_hold.install()
+        tex_engine.install()
+        svg_cache.install()
+    except BaseException as e:
+        conn.send({"ready": False, "error": f"{type(e).__name__}: {e}"})
+        return
+    conn.send({"ready": True, "manim": version, "pid": os.getpid()})
+
+    done = 0
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        if job is None:
+            return
+        done += 1
+        result = _run_job(job, done)
+        result["recycle"] = done >= max_jobs or (max_rss_mb > 0 and _rss_mb() > max_rss_mb)
+        try:
+            conn.send(result)
+        except (BrokenPipeError, OSError):
+            return
+        if result["recycle"]:
+            return
+
+
+# ----------------------------------------------------------------------
+# 进程池（父进程侧，线程安全）
+# ----------------------------------------------------------------------
+
+class _Worker:
+    __slots__ = ("process", "conn", "jobs")
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.jobs = 0
+
+    def stop(self, kill: bool = False):
+        try:
+            if kill:
+                self.process.kill()
+            else:
+                self.conn.send(None)
+        except (BrokenPipeError, OSError, AttributeError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(timeout=5)
+        self.conn.close()
+
+
+class RenderWorkerPool:
+    """常驻 manim worker 进程池；render() 可在多个线程中并发调用"""
+
+    def __init__(self, workers: Optional[int] = None, max_jobs: int = DEFAULT_MAX_JOBS,
+                 max_rss_mb: int = DEFAULT_MAX_RSS_MB):
+        """
+        Args:
+            workers: worker 进程数上限（默认 CPU 核数）
+            max_jobs: 每个 worker 处理多少个任务后重启
+            max_rss_mb: worker 常驻内存超过该值（MB）后重启；0 表示不限制
+        """
+        self.max_workers = max(1, workers or os.cpu_count() or 1)
+        self.max_jobs = max(1, max_jobs)
+        self.max_rss_mb = max_rss_mb
+        # spawn：父进程里通常已有线程（线程池、连接池），fork 不安全
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle: List[_Worker] = []
+        self._total = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self.unavailable_reason: Optional[str] = None
+        self.manim_version: Optional[str] = None
+        self.jobs = 0
+        self.restarts = 0
+        # 各 worker 汇报的公式/文字缓存统计（本进程启动以来）
+        self.svg_stats: Dict[str, float] = {}
+
+    @property
+    def available(self) -> bool:
+        return self.unavailable_reason is None and not self._closed
+
+    def _spawn(self) -> _Worker:
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.max_jobs, self.max_rss_mb),
+            daemon=True,
+            name="manim-render-worker",
+        )
+        process.start()
+        child_conn.close()
+        worker = _Worker(process, parent_conn)
+        if not parent_conn.poll(START_TIMEOUT):
+            worker.stop(kill=True)
+            raise RenderPoolUnavailable("manim worker did not start in time")
+        try:
+            hello = parent_conn.recv()
+        except (EOFError, OSError) as e:
+            worker.stop(kill=True)
+            raise RenderPoolUnavailable(f"manim worker exited during start-up: {e}")
+        if not hello.get("ready"):
+            worker.stop(kill=True)
+            raise RenderPoolUnavailable(hello.get("error") or "manim worker failed to start")
+        self.manim_version = hello.get("manim")
+        return worker
+
+    def _acquire(self) -> _Worker:
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RenderPoolUnavailable("render pool is closed")
+                if self.unavailable_reason:
+                    raise RenderPoolUnavailable(self.unavailable_reason)
+                if self._idle:
+                    return self._idle.pop()
+                if self._total < self.max_workers:
+                    self._total += 1
+                    break
+                self._cond.wait()
+        # 在锁外启动新 worker（需要几秒钟 import manim）
+        try:
+            return self._spawn()
+        except RenderPoolUnavailable as e:
+            with self._cond:
+                self._total -= 1
+                self.unavailable_reason = str(e)
+                self._cond.notify_all()
+            raise
+
+    def _release(self, worker: Optional[_Worker]):
+        with self._cond:
+            if worker is None:
+                self._total -= 1
+            elif self._closed:
+                self._total -= 1
+                worker.stop()
+            else:
+                self._idle.append(worker)
+            self._cond.notify()
+
+    def warm(self, n: Optional[int] = None):
+        """提前并行启动 n 个 worker（默认启动到上限），避免第一批任务等待 import"""
+        n = min(n or self.max_workers, self.max_workers)
+        threads = []
+        started: List[_Worker] = []
+        lock = threading.Lock()
+
+        def _start():
+            try:
+                w = self._acquire()
+            except RenderPoolUnavailable:
+                return
+            with lock:
+                started.append(w)
+
+        for _ in range(max(0, n - self._total)):
+            t = threading.Thread(target=_start, daemon=True)
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        for w in started:
+            self._release(w)
+
+    def render(self, py_path: str, scene: Optional[str] = None, quality: str = "h", media_dir: Optional[str] = None,
+               cwd: Optional[str] = None, fmt: str = "mp4", timeout: Optional[float] = None,
+               overrides: Optional[Dict[str, Any]] = None) -> RenderResult:
+        """
+        在 worker 中渲染一个代码文件
+
+        Args:
+            py_path: 场景代码文件
+            scene: Scene 类名；None 时渲染文件中的全部 Scene
+            quality: l / m / h / p / k
+            media_dir: 输出目录（相对 cwd）；None 时使用 manim 默认值（cwd 下的 media）
+            cwd: 渲染时的工作目录（相对路径的图片等资源据此查找）；默认为代码文件所在目录
+            fmt: 输出格式，mp4 / mov / gif
+            timeout: 超时秒数；超时会杀掉该 worker
+            overrides: 额外的 manim config 项（键名同 manim.cfg）
+
+        Returns:
+            RenderResult；worker 不可用时抛出 RenderPoolUnavailable
+        """
+        # 相对路径按调用方的工作目录解析（worker 的工作目录是它启动时的目录）
+        py_path = os.path.abspath(py_path)
+        cwd = os.path.abspath(cwd) if cwd else None
+        job = {"py_path": py_path, "scene": scene, "quality": quality, "media_dir": media_dir,
+               "cwd": cwd, "format": fmt, "overrides": overrides}
+        worker = self._acquire()
+        t0 = time.perf_counter()
+        reply: Optional[Dict[str, Any]] = None
+        error = ""
+        try:
+            worker.conn.send(job)
+            if worker.conn.poll(timeout):
+                reply = worker.conn.recv()
+            else:
+                error = f"[TIMEOUT] render exceeded {timeout}s"
+        except (EOFError, OSError) as e:
+            # worker 崩溃（段错误、被 OOM 杀掉等）
+            error = f"[WORKER CRASH] {type(e).__name__}: {e}"
+
+        with self._cond:
+            self.jobs += 1
+            for key, value in ((reply or {}).get("svg_cache") or {}).items():
+                self.svg_stats[key] = self.svg_stats.get(key, 0) + value
+            if reply is None or reply.get("recycle"):
+                self.restarts += 1
+        if reply is None:
+            worker.stop(kill=True)
+            self._release(None)
+            return RenderResult(False, error, seconds=time.perf_counter() - t0)
+        if reply.get("recycle"):
+            # worker 达到任务数或内存上限，已自行退出；下次按需补新的
+            worker.stop()
+            self._release(None)
+        else:
+            self._release(worker)
+        return RenderResult(reply["ok"], reply["log"], reply["videos"], reply["seconds"], reply["cpu_s"])
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._total -= len(idle)
+            self._cond.notify_all()
+        for w in idle:
+            w.stop()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "workers": self._total,
+            "idle": len(self._idle),
+            "max_workers": self.max_workers,
+            "jobs": self.jobs,
+            "restarts": self.restarts,
+            "manim": self.manim_version,
+            "unavailable": self.unavailable_reason,
+            "svg_cache": dict(self.svg_stats),
+        }
+
+
+_pool: Optional[RenderWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_render_pool(workers: Optional[int] = None) -> Optional[RenderWorkerPool]:
+    """
+    获取进程内共享的渲染进程池
+
+    Args:
+        workers: 首次创建时的 worker 数上限（默认取 MANIM_RENDER_WORKERS 或 CPU 核数）
+
+    Returns:
+        进程池；关闭或不可用时返回 None（调用方回退到 manim CLI）
+    """
+    global _pool
+    if os.environ.get("MANIM_RENDER_POOL", "1").lower() in ("0", "false", "no"):
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                env_workers = os.environ.get("MANIM_RENDER_WORKERS")
+                python = os.environ.get("MANIM_PYTHON")
+                if python:
+                    # set_executable 修改的是整个进程的 spawn 解释器，只在创建进程池时设置一次
+                    multiprocessing.get_context("spawn").set_executable(python)
+                _pool = RenderWorkerPool(workers=workers or (int(env_workers) if env_workers else None))
+    return _pool if _pool.available else None
+
+
+def render_in_pool(py_path: str, scene: Optional[str] = None, quality: str = "h", media_dir: Optional[str] = None,
+                   cwd: Optional[str] = None, fmt: str = "mp4", timeout: Optional[float] = None,
+                   workers: Optional[int] = None, overrides: Optional[Dict[str, Any]] = None) -> Optional[RenderResult]:
+    """
+    用共享进程池渲染；进程池关闭或不可用时返回 None，调用方走原来的 manim CLI
+
+    参数含义同 RenderWorkerPool.render，workers 只在首次创建进程池时生效
+    """
+    pool = get_render_pool(workers)
+    if pool is None:
+        return None
+    try:
+        return pool.render(py_path, scene, quality, media_dir=media_dir, cwd=cwd, fmt=fmt, timeout=timeout,
+                           overrides=overrides)
+    except RenderPoolUnavailable as e:
+        print(f"[render_pool] 常驻渲染进程不可用，回退到 manim CLI: {e}")
+        return None
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+渲染任务调度：静态估算每页渲染耗时，按从长到短的顺序分配给并发 worker
+
+按文件名顺序提交时，排在最后的长页面会让其他 worker 空等。这里：
+
+1. 从代码静态提取特征：self.play 次数及 run_time、self.wait 时长（常量循环次数会相乘）、
+   MathTex/Tex、Text、ImageMobject 的数量，再按分辨率和帧率折算
+2. 代价 = 各特征的线性组合；每次实际渲染后记录 (特征, 耗时)，样本够多时用带正则的最小二乘重新拟合系数，
+   代码完全相同的页面直接使用上次的实际耗时
+3. 按估算耗时从长到短提交（LPT），空闲的 worker 总是先拿到剩下最长的任务，整批完成时间接近 总工作量 / 并发数
+
+环境变量：
+    RENDER_TIMINGS_FILE   耗时记录文件（默认 <渲染缓存目录>/timings.jsonl）
+"""
+
+import os
+import ast
+import json
+import heapq
+import hashlib
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Hashable, List, Optional, Tuple, Union
+
+import svg_cache
+from render_cache import DEFAULT_CACHE_DIR
+
+DEFAULT_TIMINGS_FILE = os.environ.get("RENDER_TIMINGS_FILE", os.path.join(DEFAULT_CACHE_DIR, "timings.jsonl"))
+
+# 相对 1080p60 的 像素数 × 帧率
+QUALITY_FACTORS = {
+    "l": 854 * 480 * 15 / (1920 * 1080 * 60),
+    "m": 1280 * 720 * 30 / (1920 * 1080 * 60),
+    "h": 1.0,
+    "p": 2560 * 1440 * 60 / (1920 * 1080 * 60),
+    "k": 3840 * 2160 * 60 / (1920 * 1080 * 60),
+}
+# 特征顺序：常数项, 动画秒数×分辨率, 等待秒数×分辨率, play 次数, 公式数, 文字数, 图片数
+FEATURE_NAMES = ("const", "anim_s", "wait_s", "plays", "tex", "text", "images")
+# 没有历史数据时的经验系数（秒）；静止 wait 只编码一帧，单价远低于动画
+DEFAULT_COEFFS = (8.0, 1.5, 0.05, 0.3, 0.4, 0.15, 0.3)
+# 拟合所需的最少样本数，以及只使用最近多少条
+MIN_FIT_SAMPLES = 20
+MAX_FIT_SAMPLES = 2000
+# 向经验系数收缩的强度，样本少时不至于拟合出离谱的系数
+RIDGE = 1.0
+
+_TEX_CLASSES = {"MathTex", "Tex", "SingleStringMathTex"}
+_TEXT_CLASSES = {"Text", "MarkupText", "Paragraph"}
+_IMAGE_CLASSES = {"ImageMobject", "SVGMobject"}
+
+
+@dataclass
+class CostFeatures:
+    """从场景代码静态提取的特征（未乘分辨率系数）"""
+    anim_s: float = 0.0
+    wait_s: float = 0.0
+    plays: float = 0.0
+    tex: float = 0.0
+    text: float = 0.0
+    images: float = 0.0
+
+    def vector(self, quality: str) -> Tuple[float, ...]:
+        q = QUALITY_FACTORS.get(quality, 1.0)
+        return (1.0, self.anim_s * q, self.wait_s * q, self.plays, self.tex, self.text, self.images)
+
+
+def _const_number(node: ast.AST) -> Optional[float]:
+    try:
+        value = ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        return None
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def _loop_count(node: ast.For) -> float:
+    """常量 range(...) 或字面量序列的循环次数，其他情况按 1 次计"""
+    it = node.iter
+    if isinstance(it, (ast.List, ast.Tuple, ast.Set)):
+        return float(max(1, len(it.elts)))
+    if isinstance(it, ast.Call) and isinstance(it.func, ast.Name) and it.func.id == "range" and not it.keywords:
+        args = [_const_number(a) for a in it.args]
+        if args and all(a is not None for a in args):
+            try:
+                return float(max(1, len(range(*(int(a) for a in args)))))
+            except (ValueError, OverflowError):
+                pass
+    return 1.0
+
+
+def _call_name(node: ast.Call) -> Optional[str]:
+    func = node.func
+    if isinstance(func, ast.Name):
+        return func.id
+    if isinstance(func, ast.Attribute):
+        return func.attr
+    return None
+
+
+def _is_self_call(node: ast.Call, method: str) -> bool:
+    func = node.func
+    return (isinstance(func, ast.Attribute) and func.attr == method
+            and isinstance(func.value, ast.Name) and func.value.id == "self")
+
+
+def _visit(node: ast.AST, weight: float, feats: CostFeatures):
+    if isinstance(node, ast.Call):
+        name = _call_name(node)
+        if _is_self_call(node, "play"):
+            run_time = next((_const_number(kw.value) for kw in node.keywords if kw.arg == "run_time"), None)
+            feats.plays += weight
+            feats.anim_s += weight * (run_time if run_time is not None else 1.0)
+        elif _is_self_call(node, "wait"):
+            duration = _const_number(node.args[0]) if node.args else None
+            if duration is None:
+                duration = next((_const_number(kw.value) for kw in node.keywords if kw.arg == "duration"), None)
+            feats.wait_s += weight * (duration if duration is not None else 1.0)
+        elif name in _TEX_CLASSES:
+            feats.tex += weight
+        elif name in _TEXT_CLASSES:
+            feats.text += weight
+        elif name in _IMAGE_CLASSES:
+            feats.images += weight
+    if isinstance(node, ast.For):
+        inner = weight * _loop_count(node)
+        _visit(node.iter, weight, feats)
+        for child in node.body:
+            _visit(child, inner, feats)
+        for child in node.orelse:
+            _visit(child, weight, feats)
+        return
+    for child in ast.iter_child_nodes(node):
+        _visit(child, weight, feats)
+
+
+def extract_features(py_path: Union[str, Path]) -> CostFeatures:
+    """
+    静态提取场景代码的渲染代价特征
+
+    Args:
+        py_path: 场景代码文件
+
+    Returns:
+        CostFeatures；解析失败时全为 0（只剩常数项）
+    """
+    feats = CostFeatures()
+    try:
+        tree = ast.parse(Path(py_path).read_text(encoding="utf-8"))
+    except (OSError, SyntaxError, ValueError):
+        return feats
+    _visit(tree, 1.0, feats)
+    return feats
+
+
+def _solve(a: List[List[float]], b: List[float]) -> Optional[List[float]]:
+    """高斯消元（部分主元）解 a x = b"""
+    n = len(b)
+    m = [row[:] + [b[i]] for i, row in enumerate(a)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        if abs(m[pivot][col]) < 1e-12:
+            return None
+        m[col], m[pivot] = m[pivot], m[col]
+        for r in range(n):
+            if r != col:
+                f = m[r][col] / m[col][col]
+                for c in range(col, n + 1):
+                    m[r][c] -= f * m[col][c]
+    return [m[i][n] / m[i][i] for i in range(n)]
+
+
+def fit_coefficients(samples: List[Tuple[Tuple[float, ...], float]],
+                     prior: Tuple[float, ...] = DEFAULT_COEFFS, ridge: float = RIDGE) -> Tuple[float, ...]:
+    """
+    用带正则的最小二乘拟合代价系数（向 prior 收缩，结果截断为非负）
+
+    Args:
+        samples: [(特征向量, 实际秒数)]
+        prior: 收缩目标
+        ridge: 正则强度（按样本数缩放）
+
+    Returns:
+        系数；样本不足或无解时返回 prior
+    """
+    if len(samples) < MIN_FIT_SAMPLES:
+        return tuple(prior)
+    n = len(prior)
+    # (XᵀX + λI) w = Xᵀy + λ·prior
+    lam = ridge * len(samples) / 100
+    a = [[lam if i == j else 0.0 for j in range(n)] for i in range(n)]
+    b = [lam * p for p in prior]
+    for x, y in samples:
+        for i in range(n):
+            b[i] += x[i] * y
+            for j in range(n):
+                a[i][j] += x[i] * x[j]
+    w = _solve(a, b)
+    if w is None:
+        return tuple(prior)
+    return tuple(max(0.0, v) for v in w)
+
+
+def _code_digest(py_path: Union[str, Path]) -> Optional[str]:
+    try:
+        return hashlib.sha256(Path(py_path).read_bytes()).hexdigest()
+    except OSError:
+        return None
+
+
+class RenderCostModel:
+    """渲染耗时估算，记录实际耗时并据此修正"""
+
+    def __init__(self, timings_file: Optional[str] = None):
+        """
+        Args:
+            timings_file: 耗时记录文件（JSON lines）
+        """
+        self.timings_file = timings_file or DEFAULT_TIMINGS_FILE
+        self._lock = threading.Lock()
+        self._samples: List[Tuple[Tuple[float, ...], float]] = []
+        self._known: Dict[Tuple[str, str], float] = {}
+        self._load()
+        self.coeffs = fit_coefficients(self._samples)
+
+    def _load(self):
+        try:
+            with open(self.timings_file, "r", encoding="utf-8") as f:
+                lines = f.readlines()[-MAX_FIT_SAMPLES:]
+        except OSError:
+            return
+        for line in lines:
+            try:
+                rec = json.loads(line)
+                x = tuple(float(v) for v in rec["x"])
+                seconds = float(rec["seconds"])
+            except (ValueError, KeyError, TypeError):
+                continue
+            if len(x) != len(FEATURE_NAMES):
+                continue
+            self._samples.append((x, seconds))
+            if rec.get("digest"):
+                self._known[(rec["digest"], rec.get("quality", ""))] = seconds
+
+    def estimate(self, py_path: Union[str, Path], quality: str = "h") -> float:
+        """
+        估算一个页面的渲染耗时（秒）
+
+        Args:
+            py_path: 场景代码文件
+            quality: l / m / h / p / k
+
+        Returns:
+            估算秒数；同样的代码渲染过则返回上次的实际耗时
+        """
+        digest = _code_digest(py_path)
+        with self._lock:
+            known = self._known.get((digest, quality)) if digest else None
+        if known is not None:
+            return known
+        x = extract_features(py_path).vector(quality)
+        return sum(w * v for w, v in zip(self.coeffs, x))
+
+    def record(self, py_path: Union[str, Path], quality: str, seconds: float):
+        """
+        记录一次实际渲染耗时（缓存命中等未真正渲染的情况不要记录）
+
+        Args:
+            py_path: 场景代码文件
+            quality: 渲染质量
+            seconds: 实际耗时
+        """
+        x = extract_features(py_path).vector(quality)
+        digest = _code_digest(py_path)
+        rec = {"x": [round(v, 4) for v in x], "seconds": round(seconds, 3), "quality": quality, "digest": digest}
+        with self._lock:
+            self._samples.append((x, seconds))
+            if digest:
+                self._known[(digest, quality)] = seconds
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.timings_file)), exist_ok=True)
+            with svg_cache.file_lock(self.timings_file + ".lock"):
+                with open(self.timings_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(rec) + "\n")
+        except OSError as e:
+            print(f"[render_scheduler] 写入耗时记录失败: {e}")
+
+    def refit(self) -> Tuple[float, ...]:
+        """用目前的样本重新拟合系数"""
+        with self._lock:
+            samples = self._samples[-MAX_FIT_SAMPLES:]
+        self.coeffs = fit_coefficients(samples)
+        return self.coeffs
+
+
+def plan_longest_first(costs: Dict[Hashable, float], workers: int) -> Tuple[List[Hashable], float]:
+    """
+    按估算耗时从长到短排序，并模拟贪心分配得到预计完成时间
+
+    Args:
+        costs: {任务: 估算秒数}
+        workers: 并发数
+
+    Returns:
+        (提交顺序, 预计整批完成时间)
+    """
+    order = sorted(costs, key=lambda k: costs[k], reverse=True)
+    loads = [0.0] * max(1, workers)
+    for job in order:
+        heapq.heapreplace(loads, loads[0] + costs[job])
+    return order, max(loads)
+
+
+_model: Optional[RenderCostModel] = None
+_model_lock = threading.Lock()
+
+
+def get_cost_model() -> RenderCostModel:
+    """获取进程内共享的耗时模型"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = RenderCostModel()
+    return _model
+
+
+def main():
+    """命令行：估算目录中各页面的渲染耗时及调度结果"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="估算 Manim 页面渲染耗时")
+    parser.add_argument("input_dir", help="包含 Manim 代码的目录")
+    parser.add_argument("--quality", "-q", choices=list(QUALITY_FACTORS), default="h")
+    parser.add_argument("--workers", type=int, default=12)
+    args = parser.parse_args()
+
+    model = get_cost_model()
+    print("系数: " + ", ".join(f"{n}={w:.3g}" for n, w in zip(FEATURE_NAMES, model.coeffs)))
+    costs = {p: model.estimate(p, args.quality) for p in sorted(Path(args.input_dir).glob("*.py"))}
+    order, makespan = plan_longest_first(costs, args.workers)
+    for p in order:
+        print(f"{costs[p]:8.1f}s  {p.name}")
+    total = sum(costs.values())
+    print(f"总工作量 {total:.1f}s，{args.workers} 并发预计 {makespan:.1f}s（下限 {total / max(1, args.workers):.1f}s）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+按 BREAKPOINT 分段并行渲染长页面
+
+ManimBreakpointInserter 插入的 `#BREAKPOINT: n` 把每页代码分成与讲稿对齐的若干段，但整页仍是一个
+顺序渲染的场景，长页面在一个核上要跑几分钟。这里：
+
+1. 探测：把独占一行的 `#BREAKPOINT: n` 换成打印当前动画序号的语句，以跳过所有动画的方式（不出帧）
+   快速执行一遍 construct，得到每个断点处的动画序号（renderer.num_plays）和场景时间。跳过动画时
+   renderer.time 不前进，场景时间由探测子类累加每次 play 的 run_time / wait 的时长得到
+2. 分段：按场景时间把断点合并成不超过 max_segments 段
+3. 渲染：每段用 manim 的 from_animation_number / upto_animation_number 渲染——之前的动画以跳过方式执行，
+   只重建 mobject 状态、不出帧；各段在不同 worker 上并行
+4. 拼接：各段编码参数相同，ffmpeg concat 直接流拷贝
+
+以下情况无法安全地重建状态，返回 None 由调用方整页渲染：
+- 断点不是独占一行、出现在循环里（执行多次）或执行顺序与编号不一致
+- 代码使用了依赖真实播放时间的 updater、声音、分 section 输出等（见 _UNSAFE_PATTERN）
+- 页面太短（场景时间小于 min_seconds）或分不出两段
+- 任何一段渲染或拼接失败
+"""
+
+import os
+import re
+import sys
+import shutil
+import time
+import tempfile
+import subprocess
+import concurrent.futures
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import tracing
+from render_pool import render_in_pool
+
+FFMPEG = os.environ.get("FFMPEG_BIN") or shutil.which("ffmpeg") or "/home/EduAgent/miniconda3/envs/manim_env/bin/ffmpeg"
+
+MARK_PREFIX = "__SEGMENT_MARK__"
+_BREAKPOINT_LINE = re.compile(r"^([ \t]*)#\s*BREAKPOINT:\s*(\d+)\s*$")
+_BREAKPOINT_ANY = re.compile(r"#\s*BREAKPOINT:\s*\d+")
+# 跳过动画时这些写法的状态与真实播放不一致（或输出不能直接拼接）
+_UNSAFE_PATTERN = re.compile(
+    r"add_updater|always_redraw|TracedPath|turn_animation_into_updater|add_sound|next_section"
+    r"|renderer\.time|self\.time\b"
+)
+_MARK_LINE = re.compile(rf"{MARK_PREFIX} (\S+) (\d+) ([-+\d.eE]+)")
+# 探测用的子类名
+_PROBE_SUFFIX = "SegmentProbe"
+# 探测时累计的场景时间（秒）
+_PROBE_TIME_ATTR = "_segment_probe_time"
+
+
+def build_probe_source(code: str, scene: str) -> Optional[str]:
+    """
+    生成探测用的代码：断点行换成打印语句，末尾追加一个打印动画总数的子类
+
+    Returns:
+        探测代码；无法安全分段时返回 None
+    """
+    if _UNSAFE_PATTERN.search(code):
+        return None
+    lines = code.split("\n")
+    found = 0
+    for i, line in enumerate(lines):
+        m = _BREAKPOINT_LINE.match(line)
+        if m:
+            indent, n = m.group(1), m.group(2)
+            lines[i] = (f'{indent}print("{MARK_PREFIX} {n}", self.renderer.num_plays, '
+                        f'getattr(self, "{_PROBE_TIME_ATTR}", 0), flush=True)  # BREAKPOINT: {n}')
+            found += 1
+        elif _BREAKPOINT_ANY.search(line):
+            # 断点跟在代码行后面，无法原样替换
+            return None
+    if found == 0:
+        return None
+    lines += [
+        "",
+        "",
+        f"class {scene}{_PROBE_SUFFIX}({scene}):",
+        "    def construct(self):",
+        # play / wait 都经过 renderer.play，compile_animation_data 之后 scene.duration 即本次时长
+        f"        self.{_PROBE_TIME_ATTR} = 0.0",
+        "        renderer_play = self.renderer.play",
+        "",
+        "        def timed_play(scene, *args, **kwargs):",
+        "            renderer_play(scene, *args, **kwargs)",
+        f'            self.{_PROBE_TIME_ATTR} += float(getattr(scene, "duration", 0) or 0)',
+        "",
+        "        self.renderer.play = timed_play",
+        "        super().construct()",
+        f'        print("{MARK_PREFIX} end", self.renderer.num_plays, self.{_PROBE_TIME_ATTR}, flush=True)',
+        "",
+    ]
+    probe = "\n".join(lines)
+    try:
+        compile(probe, "<probe>", "exec")
+    except SyntaxError:
+        return None
+    return probe
+
+
+def parse_marks(log: str) -> Optional[Tuple[List[Tuple[int, float]], Tuple[int, float]]]:
+    """
+    解析探测输出
+
+    Returns:
+        ([(动画序号, 场景时间), ...] 按断点出现顺序, (动画总数, 总时长))；断点重复执行或顺序异常时返回 None
+    """
+    marks: List[Tuple[int, float]] = []
+    seen = set()
+    end = None
+    for name, plays, t in _MARK_LINE.findall(log):
+        if name == "end":
+            end = (int(plays), float(t))
+            continue
+        if name in seen:
+            # 断点在循环里，执行了多次
+            return None
+        seen.add(name)
+        marks.append((int(plays), float(t)))
+    if end is None or not marks:
+        return None
+    if any(b[0] < a[0] for a, b in zip(marks, marks[1:])) or marks[-1][0] > end[0]:
+        return None
+    return marks, end
+
+
+def split_segments(marks: List[Tuple[int, float]], end: Tuple[int, float], max_segments: int
+                   ) -> List[Tuple[int, int]]:
+    """
+    把断点合并成不超过 max_segments 段，各段场景时间尽量接近
+
+    Returns:
+        [(from_animation_number, upto_animation_number), ...]；最后一段 upto 为 -1（渲染到结尾）
+    """
+    total_plays, total_time = end
+    # 候选切点：去掉开头、结尾和重复的位置
+    cuts = sorted({(p, t) for p, t in marks if 0 < p < total_plays})
+    if not cuts or max_segments < 2:
+        return []
+    # 没有场景时间信息时按动画数均分
+    use_time = total_time > 0
+    total = total_time if use_time else float(total_plays)
+    n = min(max_segments, len(cuts) + 1)
+    chosen = set()
+    for j in range(1, n):
+        goal = total * j / n
+        best = min(cuts, key=lambda c: abs((c[1] if use_time else float(c[0])) - goal))
+        chosen.add(best[0])
+    chosen = sorted(chosen)
+    bounds = [0] + chosen
+    segments = [(a, b - 1) for a, b in zip(bounds, bounds[1:])]
+    segments.append((bounds[-1], -1))
+    return segments
+
+
+def _render(py_path: Path, scene: str, quality: str, media_dir: Path, cwd: Path, timeout: float,
+            from_n: int = 0, upto_n: int = -1, dry_run: bool = False
+            ) -> Tuple[bool, str, Optional[Path], float]:
+    """渲染一次（优先常驻进程池，不可用时用 CLI），返回 (ok, 日志, 视频路径, 实际渲染秒数（不含排队）)"""
+    overrides = {}
+    cli_args = []
+    if dry_run:
+        overrides = {"dry_run": True, "from_animation_number": 10 ** 9}
+        cli_args = ["--dry_run", "-n", str(10 ** 9)]
+    elif from_n or upto_n >= 0:
+        overrides = {"from_animation_number": from_n}
+        if upto_n >= 0:
+            overrides["upto_animation_number"] = upto_n
+        cli_args = ["-n", f"{from_n},{upto_n}" if upto_n >= 0 else str(from_n)]
+
+    pooled = render_in_pool(str(py_path), scene, quality, media_dir=str(media_dir), cwd=str(cwd),
+                            timeout=timeout, overrides=overrides)
+    if pooled is not None:
+        ok, log, seconds = pooled.ok, pooled.log, pooled.seconds
+    else:
+        cmd = ["manim", "render", "-q", quality, str(py_path), scene, "--media_dir", str(media_dir)] + cli_args
+        t0 = time.perf_counter()
+        try:
+            p = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return False, f"[TIMEOUT] render exceeded {timeout}s", None, time.perf_counter() - t0
+        ok, log = p.returncode == 0, (p.stdout or "") + "\n" + (p.stderr or "")
+        seconds = time.perf_counter() - t0
+    if not ok or dry_run:
+        return ok, log, None, seconds
+    videos = [v for v in media_dir.rglob(f"{scene}.mp4") if "partial_movie_files" not in v.parts]
+    return bool(videos), log, (videos[0] if videos else None), seconds
+
+
+def concat_segments(videos: List[Path], output_path: Path) -> bool:
+    """流拷贝拼接各段（同一配置渲染，编码参数一致）"""
+    list_file = output_path.with_name(f".{output_path.stem}_segments.txt")
+    list_file.write_text("".join(f"file '{v.resolve()}'\n" for v in videos), encoding="utf-8")
+    tmp_out = output_path.with_name(f".{output_path.stem}.tmp{output_path.suffix}")
+    cmd = [FFMPEG, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", str(list_file),
+           "-c", "copy", "-movflags", "+faststart", str(tmp_out)]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0 or not tmp_out.exists() or tmp_out.stat().st_size == 0:
+            print(f"[segment_render] 拼接失败: {result.stderr.strip()[-500:]}")
+            return False
+        os.replace(tmp_out, output_path)
+        return True
+    finally:
+        for f in (list_file, tmp_out):
+            try:
+                f.unlink()
+            except OSError:
+                pass
+
+
+@tracing.traced("render", step="segments")
+def render_segmented(python_file: Path, scene: str, quality: str, output_path: Path,
+                     cwd: Optional[Path] = None, max_segments: Optional[int] = None,
+                     min_seconds: float = 20.0, timeout: float = 600,
+                     timings: Optional[List[float]] = None) -> Optional[Path]:
+    """
+    分段并行渲染一个场景
+
+    Args:
+        python_file: 场景代码文件
+        scene: Scene 类名
+        quality: l / m / h / p / k
+        output_path: 拼接后的视频路径
+        cwd: 渲染时的工作目录（默认为代码所在目录）
+        max_segments: 最多分几段（默认 CPU 核数）
+        min_seconds: 场景时长低于该值时不分段
+        timeout: 每段渲染的超时秒数
+        timings: 传入列表时，成功后追加各段在 worker 上的实际渲染秒数（不含排队），供耗时模型记录
+
+    Returns:
+        拼接后的视频路径；不适合分段或任何一步失败时返回 None（调用方应整页渲染）
+    """
+    python_file = Path(python_file).resolve()
+    cwd = Path(cwd).resolve() if cwd else python_file.parent
+    max_segments = max_segments or os.cpu_count() or 1
+    tracing.annotate(page=python_file.stem, scene=scene, quality=quality)
+    if max_segments < 2:
+        return None
+    try:
+        code = python_file.read_text(encoding="utf-8")
+    except OSError:
+        return None
+    probe_code = build_probe_source(code, scene)
+    if probe_code is None:
+        return None
+
+    # 探测文件放在原目录，保证同目录模块和相对路径资源的解析方式不变
+    probe_file = python_file.with_name(f"_{python_file.stem}_segment_probe.py")
+    with tempfile.TemporaryDirectory(prefix="segments_") as tmpdir:
+        tmp = Path(tmpdir)
+        try:
+            probe_file.write_text(probe_code, encoding="utf-8")
+            ok, log, _, _ = _render(probe_file, f"{scene}{_PROBE_SUFFIX}", quality, tmp / "probe", cwd, timeout,
+                                 dry_run=True)
+        finally:
+            try:
+                probe_file.unlink()
+            except OSError:
+                pass
+        parsed = parse_marks(log) if ok else None
+        if parsed is None:
+            return None
+        marks, end = parsed
+        if end[1] and end[1] < min_seconds:
+            return None
+        segments = split_segments(marks, end, max_segments)
+        if len(segments) < 2:
+            return None
+        tracing.annotate(segments=len(segments))
+        print(f"[segment_render] {python_file.name} -> {scene}: 分 {len(segments)} 段并行渲染")
+
+        def _one(index: int, bounds: Tuple[int, int]) -> Tuple[bool, str, Optional[Path], float]:
+            return _render(python_file, scene, quality, tmp / f"seg_{index:03d}", cwd, timeout,
+                           from_n=bounds[0], upto_n=bounds[1])
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(segments)) as executor:
+            results = list(executor.map(tracing.bind(_one), range(len(segments)), segments))
+        for i, (seg_ok, seg_log, video, _) in enumerate(results):
+            if not seg_ok or video is None:
+                print(f"[segment_render] 第 {i + 1} 段渲染失败，改为整页渲染: {seg_log.strip()[-500:]}")
+                return None
+
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        if not concat_segments([v for _, _, v, _ in results], output_path):
+            return None
+    if timings is not None:
+        timings.extend(seconds for _, _, _, seconds in results)
+    return output_path
+
+
+def main():
+    """命令行：分段渲染单个文件（调试用）"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="按 BREAKPOINT 分段并行渲染 Manim 场景")
+    parser.add_argument("python_file", help="Manim 代码文件")
+    parser.add_argument("scene", help="Scene 类名")
+    parser.add_argument("output", help="输出视频路径")
+    parser.add_argument("--quality", "-q", default="h", choices=["l", "m", "h", "p", "k"])
+    parser.add_argument("--max-segments", type=int, default=None)
+    args = parser.parse_args()
+
+    result = render_segmented(Path(args.python_file), args.scene, args.quality, Path(args.output),
+                              max_segments=args.max_segments)
+    if result is None:
+        print("无法分段渲染（或渲染失败）")
+        sys.exit(1)
+    print(f"输出: {result}")
+
+
+if __name__ == "__main__":
+    main()
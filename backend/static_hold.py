@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+静止等待段只编码一帧
+
+ManimAutoWaitGenerator 按讲稿时长插入大量 self.wait(x)，往往占视频时长的大半。manim 对没有 updater、
+不随时间变化的 wait 已经不再重绘（is_current_animation_frozen_frame），但仍会把同一帧按 60fps 重复写入
+编码器：每秒 60 张原始 RGBA 帧经管道送给 x264。
+
+install() 之后（在渲染进程中调用一次）：
+- 静止 wait 只向该段的 partial movie 写入一帧，场景时间照常推进
+- 该段写完后用 ffmpeg tpad 把最后一帧克隆成原来的帧数，编码参数与 manim 的 partial movie 一致，
+  manim 最后照常拼接各段
+
+这样讲稿很长、动画很少的页面，渲染时间取决于动画时长而不是音频时长。只处理不透明的 mp4 输出，
+找不到 ffmpeg 或设置 MANIM_STATIC_HOLDS=0 时不启用。
+"""
+
+import os
+import shutil
+import subprocess
+from typing import Optional
+
+FFMPEG = os.environ.get("FFMPEG_BIN") or shutil.which("ffmpeg") or "/home/EduAgent/miniconda3/envs/manim_env/bin/ffmpeg"
+# 短于该时长的 wait 仍按原方式写帧（省下的时间不够一次 ffmpeg 启动）
+MIN_HOLD_SECONDS = float(os.environ.get("MANIM_STATIC_HOLD_MIN_SECONDS", "0.5"))
+
+_installed = False
+
+
+def extend_last_frame(path: str, extra_frames: int, fps: float, crf: Optional[int] = None):
+    """
+    把视频最后一帧克隆 extra_frames 帧（原地替换）
+
+    Args:
+        path: partial movie 文件
+        extra_frames: 追加的帧数
+        fps: 帧率
+        crf: x264 crf（与 manim 的 partial movie 保持一致）
+    """
+    tmp = f"{path}.hold.tmp.mp4"
+    cmd = [
+        FFMPEG, "-y", "-loglevel", "error", "-i", path,
+        "-vf", f"tpad=stop_mode=clone:stop={extra_frames}",
+        "-r", f"{fps:g}", "-c:v", "libx264", "-pix_fmt", "yuv420p",
+    ]
+    if crf is not None:
+        cmd += ["-crf", str(crf)]
+    cmd += ["-an", "-movflags", "+faststart", tmp]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0 or not os.path.exists(tmp):
+        raise RuntimeError(f"static hold: ffmpeg tpad failed for {path}: {result.stderr.strip()[-500:]}")
+    os.replace(tmp, path)
+
+
+def install() -> bool:
+    """
+    在当前进程的 manim 上启用静止等待优化（重复调用无副作用）
+
+    Returns:
+        是否已启用
+    """
+    global _installed
+    if _installed:
+        return True
+    if os.environ.get("MANIM_STATIC_HOLDS", "1").lower() in ("0", "false", "no"):
+        return False
+    if not (os.path.isfile(FFMPEG) or shutil.which(FFMPEG)):
+        return False
+    try:
+        from manim import config
+        from manim.renderer.cairo_renderer import CairoRenderer
+        from manim.scene.scene_file_writer import SceneFileWriter
+    except ImportError:
+        return False
+
+    orig_freeze = CairoRenderer.freeze_current_frame
+    orig_end = SceneFileWriter.end_animation
+
+    def freeze_current_frame(self, duration):
+        dt = 1 / self.camera.frame_rate
+        frames = int(duration / dt)
+        writer = self.file_writer
+        if (duration < MIN_HOLD_SECONDS or frames < 2 or self.skip_animations
+                or config.format != "mp4" or config.transparent):
+            return orig_freeze(self, duration)
+        # 只写一帧，剩余帧在本段写完后由 ffmpeg 补齐；场景时间照常推进
+        self.add_frame(self.get_frame(), num_frames=1)
+        self.time += (frames - 1) * dt
+        writer._static_hold = (frames - 1, self.camera.frame_rate)
+
+    def end_animation(self, allow_write=False, *args, **kwargs):
+        result = orig_end(self, allow_write, *args, **kwargs)
+        hold = getattr(self, "_static_hold", None)
+        if hold is not None:
+            self._static_hold = None
+            path = self.partial_movie_files[-1] if self.partial_movie_files else None
+            if allow_write and path and os.path.exists(path):
+                extend_last_frame(str(path), hold[0], hold[1], crf=23)
+        return result
+
+    CairoRenderer.freeze_current_frame = freeze_current_frame
+    SceneFileWriter.end_animation = end_animation
+    _installed = True
+    return True
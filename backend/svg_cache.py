@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+全局共享的 LaTeX / Text SVG 缓存
+
+manim 的 Tex/MathTex 和 Text 结果默认缓存在各自 media 目录下（media/Tex、media/texts，每个任务目录一份），
+同一个公式或标题在每个任务、每个 worker 里都要重新跑一遍 latex + dvisvgm。这里：
+
+1. 所有渲染 worker 的 tex_dir / text_dir 指向同一个目录（文件名本身就是 manim 按内容计算的哈希）
+2. 同一个公式用文件锁串行编译，其他 worker 等待后直接复用；Text 的 SVG 先写临时文件再原子替换。
+   目录是共用的，关闭 manim 编译后清扫整个 tex_dir 的 delete_nonsvg_files（会删掉其他 worker 正在用的
+   .dvi/.xdv，而且每个公式都要扫一遍目录），每次编译只在持有自己的锁时删除自己的中间文件
+3. 每个 SVG 登记在 lru_store 的索引里（svg_cache.sqlite3），命中时刷新最近使用时间，写入后总大小超过上限时
+   按最久未使用淘汰（只淘汰一段时间内没用过的，避免删掉正在读的文件），不用每次扫描整个目录
+4. 统计命中率和节省的 LaTeX 编译时间，累计写入缓存目录下的 stats.json
+
+在渲染进程中调用 install() 启用（render_pool 的 worker 启动时会调用），渲染时通过 config_overrides()
+把 tex_dir / text_dir 指向缓存目录。
+
+环境变量：
+    SVG_CACHE_DIR       缓存目录（默认 backend/svg_cache）
+    SVG_CACHE_MAX_MB    总大小上限（默认 2048）
+    SVG_CACHE_DISABLE   1 时关闭
+"""
+
+import os
+import glob
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+from lru_store import LRUStore
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "SVG_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "svg_cache"),
+)
+DEFAULT_MAX_SIZE_MB = float(os.environ.get("SVG_CACHE_MAX_MB", "2048"))
+CACHE_DISABLED = os.environ.get("SVG_CACHE_DISABLE", "").lower() in ("1", "true", "yes")
+
+STATS_FILE_NAME = "stats.json"
+DB_FILENAME = "svg_cache.sqlite3"
+# 最近这么久内用过的文件不淘汰（其他 worker 可能正在读）
+_EVICT_MIN_AGE = 600
+_COUNTERS = ("tex_hits", "tex_misses", "tex_compile_s", "text_hits", "text_misses", "text_compile_s")
+
+_lock = threading.Lock()
+_local = threading.local()
+_stats: Dict[str, float] = {k: 0 for k in _COUNTERS}
+_state: Dict[str, Any] = {"installed": False, "dir": None, "max_bytes": 0, "store": None}
+
+
+def _tex_dir(cache_dir: str) -> str:
+    return os.path.join(cache_dir, "Tex")
+
+
+def _text_dir(cache_dir: str) -> str:
+    return os.path.join(cache_dir, "texts")
+
+
+@contextmanager
+def file_lock(path: str):
+    """跨进程文件锁（不支持 fcntl 的平台上退化为无锁）"""
+    if not HAS_FCNTL:
+        yield
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# 编译一个公式产生的中间文件（.tex 保留，与 manim 一致）
+_TEX_INTERMEDIATES = (".dvi", ".xdv", ".pdf", ".log", ".aux")
+
+
+def svg_lock(svg_path: str, cache_dir: Optional[str] = None):
+    """
+    tex_dir 中某个 SVG 的文件锁：编译、替换或清理该 SVG 及其中间文件时持有
+
+    Args:
+        svg_path: SVG 路径（文件名是 manim 的 tex_hash）
+        cache_dir: 缓存目录，默认已启用的目录
+    """
+    stem = os.path.splitext(os.path.basename(str(svg_path)))[0]
+    cache_dir = cache_dir or _state["dir"] or DEFAULT_CACHE_DIR
+    return file_lock(os.path.join(cache_dir, "locks", stem[:2], f"{stem}.lock"))
+
+
+def remove_intermediates(svg_path: str):
+    """删除与该 SVG 同名的中间文件（调用方持有 svg_lock）"""
+    base = os.path.splitext(str(svg_path))[0]
+    for suffix in _TEX_INTERMEDIATES:
+        try:
+            os.remove(base + suffix)
+        except OSError:
+            pass
+
+
+def _add(key: str, value: float = 1):
+    with _lock:
+        _stats[key] += value
+
+
+def _open_store(cache_dir: str, max_bytes: int) -> LRUStore:
+    """缓存目录的索引；条目 key 为相对缓存目录、去掉扩展名的路径（Tex/<哈希>），淘汰时删除同名的所有文件"""
+
+    def remove_group(key: str, values: Tuple):
+        for p in glob.glob(glob.escape(os.path.join(cache_dir, key)) + ".*"):
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+    return LRUStore(os.path.join(cache_dir, DB_FILENAME), max_bytes, on_evict=remove_group, min_age=_EVICT_MIN_AGE)
+
+
+def _record(svg_path: str, compiled: bool):
+    """登记新生成的 SVG（compiled）或刷新命中的 SVG 的最近使用时间；索引故障不影响渲染"""
+    store = _state["store"]
+    if store is None:
+        return
+    base = os.path.splitext(os.path.abspath(str(svg_path)))[0]
+    key = os.path.relpath(base, _state["dir"])
+    if key.startswith(".."):
+        # 不在缓存目录里（没有应用 config_overrides 的渲染），不归索引管
+        return
+    try:
+        if compiled or not store.touch(key):
+            size = sum(os.path.getsize(p) for p in glob.glob(glob.escape(base) + ".*") if os.path.isfile(p))
+            store.put(key, size)
+    except (OSError, sqlite3.Error) as e:
+        print(f"[svg_cache] 索引更新失败: {e}")
+
+
+def is_installed() -> bool:
+    return _state["installed"]
+
+
+def config_overrides(cache_dir: Optional[str] = None) -> Dict[str, Any]:
+    """渲染时需要覆盖的 manim config（缓存关闭时为空）"""
+    if CACHE_DISABLED:
+        return {}
+    cache_dir = os.path.abspath(cache_dir or _state["dir"] or DEFAULT_CACHE_DIR)
+    overrides: Dict[str, Any] = {"tex_dir": _tex_dir(cache_dir), "text_dir": _text_dir(cache_dir)}
+    if _supports_no_latex_cleanup():
+        overrides["no_latex_cleanup"] = True
+    return overrides
+
+
+def _supports_no_latex_cleanup() -> bool:
+    try:
+        from manim import config
+    except ImportError:
+        return False
+    return "no_latex_cleanup" in getattr(config, "_OPTS", ())
+
+
+def _svg_complete(path: str) -> bool:
+    """编译中途被杀掉会留下半个 SVG，命中时检查结尾"""
+    try:
+        with open(path, "rb") as f:
+            f.seek(max(0, os.path.getsize(path) - 64))
+            return b"</svg>" in f.read()
+    except OSError:
+        return False
+
+
+def _patch_tex(cache_dir: str) -> bool:
+    try:
+        import manim.utils.tex_file_writing as tfw
+        from manim import config
+    except ImportError:
+        return False
+
+    orig_to_svg = tfw.tex_to_svg_file
+    orig_compile = tfw.compile_tex
+
+    def compile_tex(*args, **kwargs):
+        # tex_to_svg_file 内部调用，说明本次没有命中
+        _local.compiled = True
+        return orig_compile(*args, **kwargs)
+
+    def svg_path(expression, environment, template) -> str:
+        # 与 manim generate_tex_file 的命名一致：tex_dir/<tex_hash(tex 代码)>.svg
+        if environment is not None:
+            code = template.get_texcode_for_expression_in_env(expression, environment)
+        else:
+            code = template.get_texcode_for_expression(expression)
+        return os.path.join(config.get_dir("tex_dir"), f"{tfw.tex_hash(code)}.svg")
+
+    def tex_to_svg_file(expression, environment=None, tex_template=None):
+        template = tex_template or config.tex_template
+        with svg_lock(svg_path(expression, environment, template), cache_dir):
+            _local.compiled = False
+            t0 = time.perf_counter()
+            svg = orig_to_svg(expression, environment=environment, tex_template=tex_template)
+            if not _local.compiled and not _svg_complete(str(svg)):
+                # 残缺的结果：连同中间文件删掉重新编译
+                try:
+                    os.remove(str(svg))
+                except OSError:
+                    pass
+                remove_intermediates(str(svg))
+                svg = orig_to_svg(expression, environment=environment, tex_template=tex_template)
+            if _local.compiled:
+                remove_intermediates(str(svg))
+                _add("tex_misses")
+                _add("tex_compile_s", time.perf_counter() - t0)
+            else:
+                _add("tex_hits")
+            _record(str(svg), _local.compiled)
+        return svg
+
+    tfw.compile_tex = compile_tex
+    tfw.tex_to_svg_file = tex_to_svg_file
+    # 不支持 no_latex_cleanup 的 manim 版本也不能清扫共享目录，中间文件由上面按公式删除
+    if hasattr(tfw, "delete_nonsvg_files"):
+        tfw.delete_nonsvg_files = lambda *args, **kwargs: None
+    # Tex 类在自己的模块里 from ... import 了一份引用，也要替换
+    for name in ("manim.mobject.text.tex_mobject", "manim.mobject.svg.tex_mobject"):
+        try:
+            module = __import__(name, fromlist=["tex_to_svg_file"])
+        except ImportError:
+            continue
+        if hasattr(module, "tex_to_svg_file"):
+            module.tex_to_svg_file = tex_to_svg_file
+    return True
+
+
+def _patch_text() -> bool:
+    try:
+        import manimpango
+        from manim.mobject.text import text_mobject
+    except ImportError:
+        return False
+
+    def atomic(func):
+        # 目标 SVG 路径是参数中唯一以 .svg 结尾的字符串：先写到临时文件再替换，其他 worker 不会读到半个文件
+        def wrapper(*args, **kwargs):
+            args = list(args)
+            target = None
+            for i, v in enumerate(args):
+                if isinstance(v, str) and v.endswith(".svg"):
+                    target, tmp = v, f"{v}.{os.getpid()}.{threading.get_ident()}.tmp.svg"
+                    args[i] = tmp
+                    break
+            else:
+                for k, v in kwargs.items():
+                    if isinstance(v, str) and v.endswith(".svg"):
+                        target, tmp = v, f"{v}.{os.getpid()}.{threading.get_ident()}.tmp.svg"
+                        kwargs[k] = tmp
+                        break
+            t0 = time.perf_counter()
+            if target is None:
+                return func(*args, **kwargs)
+            try:
+                func(*args, **kwargs)
+                os.replace(tmp, target)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            _record(target, True)
+            _add("text_misses")
+            _add("text_compile_s", time.perf_counter() - t0)
+            return target
+        return wrapper
+
+    manimpango.text2svg = atomic(manimpango.text2svg)
+    try:
+        manimpango.MarkupUtils.text2svg = staticmethod(atomic(manimpango.MarkupUtils.text2svg))
+    except (AttributeError, TypeError):
+        # 扩展类型不允许改属性时，MarkupText 仍按原方式写入
+        pass
+
+    # _text2svg 每构造一次 Text 调用一次，未命中时才会调用上面的 text2svg
+    for cls_name in ("Text", "MarkupText"):
+        cls = getattr(text_mobject, cls_name, None)
+        orig = getattr(cls, "_text2svg", None)
+        if orig is None:
+            continue
+
+        def _text2svg(self, *args, _orig=orig, **kwargs):
+            misses = _stats["text_misses"]
+            result = _orig(self, *args, **kwargs)
+            if _stats["text_misses"] == misses:
+                _add("text_hits")
+                _record(str(result), False)
+            return result
+
+        cls._text2svg = _text2svg
+    return True
+
+
+def install(cache_dir: Optional[str] = None, max_size_mb: Optional[float] = None) -> bool:
+    """
+    在当前进程的 manim 上启用共享缓存（重复调用无副作用）
+
+    Returns:
+        是否已启用
+    """
+    if _state["installed"]:
+        return True
+    if CACHE_DISABLED:
+        return False
+    cache_dir = os.path.abspath(cache_dir or DEFAULT_CACHE_DIR)
+    try:
+        os.makedirs(_tex_dir(cache_dir), exist_ok=True)
+        os.makedirs(_text_dir(cache_dir), exist_ok=True)
+    except OSError as e:
+        print(f"[svg_cache] 初始化失败，不使用共享缓存: {e}")
+        return False
+    if not _patch_tex(cache_dir):
+        return False
+    _patch_text()
+    max_bytes = int((max_size_mb if max_size_mb is not None else DEFAULT_MAX_SIZE_MB) * 1024 * 1024)
+    try:
+        store = _open_store(cache_dir, max_bytes)
+    except sqlite3.Error as e:
+        # 没有索引时照常共享缓存，只是不做淘汰
+        print(f"[svg_cache] 索引初始化失败，不做淘汰: {e}")
+        store = None
+    _state.update(installed=True, dir=cache_dir, max_bytes=max_bytes, store=store)
+    evict(cache_dir, max_bytes)
+    return True
+
+
+def flush_stats() -> Dict[str, float]:
+    """
+    把本进程自上次调用以来的统计累加到 stats.json
+
+    Returns:
+        本次累加的增量
+    """
+    if not _state["installed"]:
+        return {}
+    with _lock:
+        delta = dict(_stats)
+        for k in _COUNTERS:
+            _stats[k] = 0
+    cache_dir = _state["dir"]
+    if any(delta.values()):
+        path = os.path.join(cache_dir, STATS_FILE_NAME)
+        with file_lock(os.path.join(cache_dir, "locks", "stats.lock")):
+            total = load_stats(cache_dir, raw=True)
+            for k in _COUNTERS:
+                total[k] = total.get(k, 0) + delta[k]
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(total, f, indent=2)
+            os.replace(tmp, path)
+    return delta
+
+
+def summarize(stats: Dict[str, float]) -> Dict[str, float]:
+    """补充命中率和估算节省的编译时间（命中次数 × 平均编译耗时）"""
+    out = dict(stats)
+    for kind in ("tex", "text"):
+        hits, misses = stats.get(f"{kind}_hits", 0), stats.get(f"{kind}_misses", 0)
+        out[f"{kind}_hit_rate"] = hits / (hits + misses) if hits + misses else 0.0
+        avg = stats.get(f"{kind}_compile_s", 0) / misses if misses else 0.0
+        out[f"{kind}_saved_s"] = hits * avg
+    return out
+
+
+def load_stats(cache_dir: Optional[str] = None, raw: bool = False) -> Dict[str, float]:
+    """读取累计统计"""
+    path = os.path.join(os.path.abspath(cache_dir or DEFAULT_CACHE_DIR), STATS_FILE_NAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            stats = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        stats = {}
+    return stats if raw else summarize(stats)
+
+
+def format_stats(stats: Dict[str, float]) -> str:
+    s = summarize(stats)
+    return (f"公式缓存: 命中 {s.get('tex_hits', 0):.0f} / 未命中 {s.get('tex_misses', 0):.0f}"
+            f"（{s['tex_hit_rate']:.0%}，节省约 {s['tex_saved_s']:.1f}s）；"
+            f"文字缓存: 命中 {s.get('text_hits', 0):.0f} / 未命中 {s.get('text_misses', 0):.0f}"
+            f"（{s['text_hit_rate']:.0%}）")
+
+
+def evict(cache_dir: Optional[str] = None, max_bytes: Optional[int] = None) -> int:
+    """
+    把索引里还没有的文件登记进去（例如启用索引之前生成的），总大小超过上限时按最近使用时间淘汰
+    （同一哈希的 .tex/.dvi/.svg 等一起删除）。写入新 SVG 时索引会自行淘汰，这里只在启动和命令行中调用
+
+    Returns:
+        删除的条目数
+    """
+    cache_dir = os.path.abspath(cache_dir or DEFAULT_CACHE_DIR)
+    if max_bytes is None:
+        max_bytes = int(DEFAULT_MAX_SIZE_MB * 1024 * 1024)
+    groups: Dict[str, list] = {}
+    for sub in (_tex_dir(cache_dir), _text_dir(cache_dir)):
+        try:
+            entries = list(os.scandir(sub))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            key = os.path.relpath(os.path.join(sub, entry.name.split(".", 1)[0]), cache_dir)
+            g = groups.setdefault(key, [0, 0.0])
+            g[0] += st.st_size
+            g[1] = max(g[1], st.st_mtime)
+    try:
+        store = _state["store"] if _state["store"] is not None and _state["dir"] == cache_dir else None
+        store = store or _open_store(cache_dir, max_bytes)
+        store.max_size_bytes = max_bytes
+        store.adopt((key, size, mtime) for key, (size, mtime) in groups.items())
+        return store.evict_if_needed()
+    except sqlite3.Error as e:
+        print(f"[svg_cache] 淘汰失败: {e}")
+        return 0
+
+
+def main():
+    """命令行：查看统计、手动淘汰或清空缓存"""
+    import argparse
+    import shutil
+
+    parser = argparse.ArgumentParser(description="共享 LaTeX/Text SVG 缓存管理")
+    parser.add_argument("--dir", default=None, help="缓存目录")
+    parser.add_argument("--evict", action="store_true", help="按大小上限淘汰")
+    parser.add_argument("--clear", action="store_true", help="清空缓存")
+    args = parser.parse_args()
+
+    cache_dir = os.path.abspath(args.dir or DEFAULT_CACHE_DIR)
+    if args.clear:
+        for sub in (_tex_dir(cache_dir), _text_dir(cache_dir)):
+            shutil.rmtree(sub, ignore_errors=True)
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(os.path.join(cache_dir, DB_FILENAME + suffix))
+            except OSError:
+                pass
+        print("缓存已清空")
+    if args.evict:
+        print(f"淘汰 {evict(cache_dir)} 个条目")
+    print(json.dumps(load_stats(cache_dir), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import importlib
+import os
+import subprocess
+
+import pytest
+
+import clip_normalize
+import page_mux
+from clip_normalize import choose_target, signature, x264_profile
+
+
+def info(codec="h264", profile="High", width=1920, height=1080, pix_fmt="yuv420p", fps="60/1", tb="1/15360",
+         audio=("aac", "44100", 2)):
+    video = {"codec_name": codec, "profile": profile, "width": width, "height": height, "pix_fmt": pix_fmt,
+             "r_frame_rate": fps, "time_base": tb}
+    if audio is None:
+        return {"video": video, "audio": None}
+    return {"video": video, "audio": dict(zip(clip_normalize.AUDIO_KEYS, audio))}
+
+
+def test_signature_ignores_unrelated_fields():
+    a, b = info(), info()
+    b["video"]["duration"] = "12.5"
+    assert signature(a) == signature(b)
+    assert signature(info(fps="30/1")) != signature(a)
+    assert signature(info(audio=("aac", "48000", 2))) != signature(a)
+    assert signature(info(audio=None))[1] is None
+
+
+def test_majority_wins_and_ties_go_to_first_clip():
+    cover, page = info(width=1280, height=720), info()
+    assert choose_target([cover, page, page]) == signature(page)
+    assert choose_target([cover, page]) == signature(cover)
+
+
+def test_non_h264_target_becomes_8bit_high():
+    video, _ = choose_target([info(codec="hevc", profile="Main 10", pix_fmt="yuv420p10le")])
+    assert video[:2] == ("h264", "High")
+    assert video[4] == "yuv420p"
+    assert video[2:4] == ("1920", "1080")
+
+
+def test_audio_is_pinned_to_aac_and_added_when_any_clip_has_it():
+    _, audio = choose_target([info(audio=("mp3", "44100", 2))])
+    assert audio == ("aac", "44100", "2")
+    _, audio = choose_target([info(audio=None), info(audio=None), info(audio=("aac", "48000", 1))])
+    assert audio == ("aac", "48000", "1")
+    assert choose_target([info(audio=None)])[1] is None
+
+
+def test_x264_profile_follows_bit_depth_for_unknown_profiles():
+    assert x264_profile("High") == "high"
+    assert x264_profile("High 10", "yuv420p10le") == "high10"
+    assert x264_profile("Constrained Baseline") == "baseline"
+    assert x264_profile(None, "yuv420p") == "high"
+    assert x264_profile("Main 10", "yuv420p10le") == "high10"
+
+
+def test_read_filelist_unescapes_quotes(tmp_path):
+    odd = tmp_path / "it's a clip.mp4"
+    listing = tmp_path / "file.txt"
+    listing.write_text(page_mux.concat_list_line(str(odd)) + "file plain.mp4\n" + "# comment\n", encoding="utf-8")
+    assert clip_normalize.read_filelist(str(listing)) == [str(odd), str(tmp_path / "plain.mp4")]
+
+
+def test_normalize_filelist_keeps_list_when_clips_match(tmp_path, monkeypatch):
+    odd = tmp_path / "it's.mp4"
+    listing = tmp_path / "file.txt"
+    original = page_mux.concat_list_line(str(odd))
+    listing.write_text(original, encoding="utf-8")
+    seen = []
+
+    def fake_normalize(paths, work_dir):
+        seen.extend(paths)
+        return list(paths), True
+
+    monkeypatch.setattr(clip_normalize, "normalize_clips", fake_normalize)
+    assert clip_normalize.normalize_filelist(str(listing))
+    assert seen == [str(odd)]
+    assert listing.read_text(encoding="utf-8") == original
+
+
+def test_reencode_command_scales_to_target_and_fills_missing_audio():
+    infos = [dict(info(width=1280, height=720, audio=None), duration=2.0), dict(info(), duration=3.0),
+             dict(info(), duration=4.0)]
+    cmd = clip_normalize.reencode_command(["a.mp4", "b.mp4", "c.mp4"], infos, "out.mp4")
+    graph = cmd[cmd.index("-filter_complex") + 1]
+    assert "-c:v" in cmd and "copy" not in cmd
+    assert graph.count("scale=1920:1080") == 3
+    assert "anullsrc=r=44100:cl=stereo,atrim=end=2.000000" in graph
+    assert "[1:a:0]aresample=44100" in graph
+    assert graph.endswith("concat=n=3:v=1:a=1[vout][aout]")
+    assert cmd[-1] == "out.mp4"
+
+
+@pytest.mark.parametrize("module", ["video_concat", "video_audio_merge"])
+def test_concat_videos_reencodes_when_clips_not_copy_safe(tmp_path, monkeypatch, module):
+    mod = importlib.import_module(module)
+    clips = [tmp_path / "1_Introduction.mp4", tmp_path / "2_Method.mp4"]
+    listing = tmp_path / "file.txt"
+    listing.write_text("".join(page_mux.concat_list_line(str(c)) for c in clips), encoding="utf-8")
+    monkeypatch.setattr(clip_normalize, "normalize_filelist", lambda path: False)
+    monkeypatch.setattr(clip_normalize, "probe_streams",
+                        lambda path: dict(info(fps="30/1" if path.endswith("1_Introduction.mp4") else "60/1"),
+                                          duration=1.5))
+    commands = []
+
+    def fake_run(cmd, **kwargs):
+        commands.append(cmd)
+        open(cmd[-1] if os.path.isabs(cmd[-1]) else os.path.join(kwargs.get("cwd", ""), cmd[-1]), "wb").close()
+        return subprocess.CompletedProcess(cmd, 0, "", "")
+
+    monkeypatch.setattr(subprocess, "run", fake_run)
+    assert mod.concat_videos(str(listing), str(tmp_path))
+    assert len(commands) == 1
+    assert "copy" not in commands[0]
+    assert commands[0][-1] == str(tmp_path / "Full.mp4")
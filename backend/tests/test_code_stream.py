@@ -0,0 +1,89 @@
+from code_stream import FENCE, FILE, StreamingCodeExtractor, stream_code
+
+
+def feed_all(text, step=1, **kwargs):
+    extractor = StreamingCodeExtractor(**kwargs)
+    for i in range(0, len(text), step):
+        if extractor.feed(text[i:i + step]):
+            break
+    else:
+        extractor.finish()
+    return extractor
+
+
+def test_fenced_block_stops_at_closing_fence():
+    text = "Here you go:\n```python\nx = 1\ny = 2\n```\nExplanation that should never be read"
+    ex = feed_all(text)
+    assert ex.finished
+    assert ex.code == "x = 1\ny = 2"
+    assert ex.syntax_error is None
+    assert "Explanation" not in ex.result_text()
+
+
+def test_heading_before_fenced_block_is_not_bare_code():
+    text = "# Fixed code\n\nThe scene had a typo.\n```python\nfrom manim import *\n\nclass A(Scene):\n    pass\n```\ntrailing"
+    for step in (1, 3, len(text)):
+        ex = feed_all(text, step=step)
+        assert ex.finished
+        assert ex.syntax_error is None
+        assert ex.code == "from manim import *\n\nclass A(Scene):\n    pass"
+
+
+def test_bare_code_until_closing_fence():
+    text = "from manim import *\n\nclass A(Scene):\n    def construct(self):\n        pass\n```\nnotes"
+    ex = feed_all(text)
+    assert ex.bare and ex.finished
+    assert ex.syntax_error is None
+    assert ex.code.startswith("from manim import *") and "```" not in ex.code
+
+
+def test_bare_code_followed_by_opening_fence_restarts():
+    text = "import os\n```python\nimport sys\nprint(sys.argv)\n```\n"
+    ex = feed_all(text)
+    assert ex.finished and not ex.bare
+    assert ex.code == "import sys\nprint(sys.argv)"
+
+
+def test_comment_only_reply_without_fence_is_bare_code():
+    ex = feed_all("# config\nx = 1\ny = x + 1\n")
+    assert ex.bare
+    assert ex.syntax_error is None
+    assert ex.code == "# config\nx = 1\ny = x + 1\n"
+
+
+def test_bare_code_ending_with_fence_without_newline():
+    ex = feed_all("import os\nprint(os.sep)\n```")
+    assert ex.finished
+    assert ex.code == "import os\nprint(os.sep)"
+
+
+def test_syntax_error_stops_early():
+    text = "```python\n" + "x = (\n" + "def f(:\n" * 10 + "```"
+    ex = feed_all(text, check_every=2)
+    assert ex.syntax_error is not None
+    assert not ex.finished
+
+
+def test_file_marker():
+    ex = feed_all("<<<FILE_START\nx = 1\nFILE_END>>>\nrest", marker=FILE)
+    assert ex.finished and ex.code == "x = 1\n"
+
+
+def test_stream_code_retries_after_syntax_error_and_closes_stream():
+    closed = []
+    replies = iter(["```python\nx = = 1\n" + "y = 2\n" * 10 + "```", "```python\nx = 1\n```\nbye"])
+
+    class Stream:
+        def __init__(self, text):
+            self.pieces = iter(text)
+
+        def __iter__(self):
+            return self.pieces
+
+        def close(self):
+            closed.append(True)
+
+    text, ok = stream_code(lambda: Stream(next(replies)), marker=FENCE, max_attempts=2)
+    assert ok
+    assert text.endswith("x = 1\n```")
+    assert len(closed) == 2
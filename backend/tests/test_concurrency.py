@@ -0,0 +1,52 @@
+import httpx
+import openai
+
+import concurrency
+from concurrency import AdaptiveLimiter, get_limiter, is_throttle_error, is_throttle_message
+
+
+def status_error(cls, status):
+    request = httpx.Request("POST", "https://api.example.com/v1/chat/completions")
+    response = httpx.Response(status, request=request)
+    return cls("error", response=response, body=None)
+
+
+def test_throttle_classified_by_type_and_status():
+    assert is_throttle_error(status_error(openai.RateLimitError, 429))
+    assert is_throttle_error(status_error(openai.InternalServerError, 503))
+    assert not is_throttle_error(status_error(openai.BadRequestError, 400))
+    assert not is_throttle_error(status_error(openai.AuthenticationError, 401))
+    request = httpx.Request("POST", "https://api.example.com")
+    assert is_throttle_error(openai.APITimeoutError(request=request))
+    assert is_throttle_error(TimeoutError())
+    # 明确的 SDK 错误类型不再按错误文本猜
+    assert not is_throttle_error(openai.BadRequestError("prompt is 1429 tokens, rate limit field invalid",
+                                                        response=httpx.Response(400, request=request), body=None))
+
+
+def test_throttle_message_fallback_matches_whole_status_codes():
+    assert is_throttle_message("Error code: 429 - Too Many Requests")
+    assert is_throttle_message("upstream returned 503")
+    assert is_throttle_message("Rate limit reached for gpt-5")
+    assert not is_throttle_message("prompt is 14290 tokens long")
+    assert not is_throttle_message("invalid value for temperature")
+
+
+def test_limiter_reconfigured_when_config_changes(monkeypatch):
+    monkeypatch.setattr(concurrency, "_limiters", {})
+    monkeypatch.setattr(concurrency, "_limiter_configs", {})
+    limiter = get_limiter("t", {"concurrency": {"initial": 8, "min": 1, "max": 16}})
+    assert limiter.limit == 8
+    assert get_limiter("t") is limiter
+    assert get_limiter("t", {"llm_key": "x"}) is limiter and limiter.max_limit == 16
+
+    assert get_limiter("t", {"settings": {"concurrency": {"min": 2, "max": 4, "backoff": 0.25}}}) is limiter
+    assert (limiter.min_limit, limiter.max_limit, limiter.backoff, limiter.limit) == (2, 4, 0.25, 4)
+
+
+def test_configure_keeps_learned_limit_inside_new_bounds():
+    limiter = AdaptiveLimiter(initial=6, min_limit=1, max_limit=32)
+    limiter.configure(min_limit=8)
+    assert limiter.limit == 8
+    limiter.configure(min_limit=1, max_limit=64)
+    assert limiter.limit == 8
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import os
+
+import hedging
+from generate_manim_codes_for_effi_test_nano import ManimCodeGenerator
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_generator(tmp_path, monkeypatch, llm_cache=None, hedge=None):
+    config = {
+        "llm_key": "sk-test",
+        "llm_settings": {"model": "gemini-3-pro-preview", "base_url": "http://127.0.0.1:9/v1/",
+                         "max_tokens": 100, "temperature": 0.8, "hedge": hedge},
+        "llm_cache": dict({"dir": str(tmp_path / "llm_cache")}, **(llm_cache or {})),
+    }
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(config), encoding="utf-8")
+    monkeypatch.chdir(BACKEND)
+    generator = ManimCodeGenerator(config_path=str(path))
+    calls = []
+
+    def fake_stream(client, model, messages):
+        calls.append(model)
+        yield "```python\nfrom manim import *\n"
+        yield "class Page(Scene):\n    pass\n```"
+
+    monkeypatch.setattr(generator, "_stream_completion", fake_stream)
+    return generator, calls
+
+
+def test_sampled_page_coder_call_hits_cache_on_rerun(tmp_path, monkeypatch):
+    generator, calls = make_generator(tmp_path, monkeypatch)
+    first = generator.call_llm_api("# 1_1", generator.prompt_template)
+    assert "class Page(Scene)" in first and calls == ["gemini-3-pro-preview"]
+    # 重跑同一页：temperature 0.8 也直接读缓存，不再调用模型
+    assert generator.call_llm_api("# 1_1", generator.prompt_template) == first
+    assert len(calls) == 1
+    assert generator.cache.stats()["hits"] == 1
+
+
+def test_cache_sampled_false_keeps_temperature_rule(tmp_path, monkeypatch):
+    generator, calls = make_generator(tmp_path, monkeypatch, {"cache_sampled": False})
+    generator.call_llm_api("# 1_1", generator.prompt_template)
+    generator.call_llm_api("# 1_1", generator.prompt_template)
+    assert len(calls) == 2
+
+
+def test_code_stream_hedges_onto_another_pool_key(tmp_path, monkeypatch):
+    pool_path = tmp_path / "config_pool.json"
+    pool_path.write_text(json.dumps({"keys": [{"key": "sk-test", "vendor": "openai"},
+                                              {"key": "sk-alt", "vendor": "openai"}]}), encoding="utf-8")
+    hedge = {"enabled": True, "min_samples": 1, "min_delay": 0.01, "key_pool": str(pool_path)}
+    generator, calls = make_generator(tmp_path, monkeypatch, {"enabled": False}, hedge=hedge)
+    hedging.latency_stats("http://127.0.0.1:9/v1/", "gemini-3-pro-preview", "ttft").record_success(0.01)
+    used = []
+
+    async def fake_astream(api_key, base_url, model, messages):
+        used.append(api_key)
+        if api_key == "sk-test":
+            await asyncio.sleep(5)
+        yield "```python\nclass Page(Scene):\n    pass\n```"
+
+    monkeypatch.setattr(generator, "_astream_completion", fake_astream)
+    code = generator.call_llm_api("# 1_1", generator.prompt_template)
+    assert code.startswith("class Page(Scene)")
+    assert used == ["sk-test", "sk-alt"] and calls == []
+    assert generator.hedge_budget.hedge_wins == 1
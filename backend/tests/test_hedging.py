@@ -0,0 +1,184 @@
+import asyncio
+import contextvars
+import threading
+import time
+
+from hedging import (HedgeBudget, acquire_backup_key, backup_key_stream, has_backup_key, hedged_call,
+                     hedged_call_sync, hedged_stream, hedged_stream_sync, run_sync, settings_from_config)
+from pool import APIKey, KeyPool, TokenBucket
+
+
+def test_settings_from_both_config_layouts():
+    hedge = {"enabled": True, "max_ratio": 0.2}
+    assert settings_from_config({"llm_settings": {"hedge": hedge}}) == hedge
+    assert settings_from_config({"settings": {"llm_settings": {"hedge": hedge}}}) == hedge
+    assert settings_from_config({}) is None
+    assert HedgeBudget.from_config(settings_from_config({"llm_settings": {}})) is None
+
+
+def test_sync_without_delay_runs_primary_only():
+    budget = HedgeBudget()
+    calls = []
+    assert hedged_call_sync(lambda: calls.append("a") or "a", lambda: calls.append("b") or "b", None, budget) == "a"
+    assert calls == ["a"]
+    assert budget.primaries == 1 and budget.hedges == 0
+
+
+def test_sync_backup_wins_when_primary_is_slow():
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return "slow"
+
+    budget = HedgeBudget()
+    try:
+        assert hedged_call_sync(slow, lambda: "fast", 0.01, budget) == "fast"
+    finally:
+        release.set()
+    assert budget.hedges == 1 and budget.hedge_wins == 1
+
+
+def test_sync_hedge_respects_budget():
+    budget = HedgeBudget(max_extra=0)
+    t0 = time.monotonic()
+    assert hedged_call_sync(lambda: time.sleep(0.05) or "a", lambda: "b", 0.01, budget) == "a"
+    assert time.monotonic() - t0 >= 0.05
+    assert budget.hedges == 0
+
+
+def test_sync_primary_error_raised_when_both_fail():
+    def fail(msg):
+        def run():
+            time.sleep(0.02)
+            raise RuntimeError(msg)
+        return run
+
+    budget = HedgeBudget()
+    try:
+        hedged_call_sync(fail("primary"), fail("backup"), 0.001, budget)
+    except RuntimeError as e:
+        assert str(e) == "primary"
+    else:
+        raise AssertionError("expected RuntimeError")
+
+
+def stream(pieces, first_delay=0.0, log=None, name=""):
+    async def gen():
+        try:
+            await asyncio.sleep(first_delay)
+            for piece in pieces:
+                yield piece
+                await asyncio.sleep(0)
+            if log is not None:
+                log.append(name + ":done")
+        finally:
+            if log is not None:
+                log.append(name + ":closed")
+    return gen
+
+
+async def collect(agen):
+    return [piece async for piece in agen]
+
+
+def test_stream_backup_wins_and_primary_is_closed():
+    log = []
+    budget = HedgeBudget()
+    out = asyncio.run(collect(hedged_stream(stream(["slow"], 5, log, "a"), stream(["b1", "b2"], 0, log, "b"),
+                                            0.01, budget)))
+    assert out == ["b1", "b2"]
+    assert log == ["a:closed", "b:done", "b:closed"]
+    assert budget.hedges == 1 and budget.hedge_wins == 1
+
+
+def test_stream_fast_primary_never_starts_backup():
+    log = []
+    budget = HedgeBudget()
+    out = asyncio.run(collect(hedged_stream(stream(["a1", "a2"], 0, log, "a"), stream(["b"], 0, log, "b"),
+                                            0.5, budget)))
+    assert out == ["a1", "a2"]
+    assert not any(entry.startswith("b") for entry in log)
+    assert budget.primaries == 1 and budget.hedges == 0
+
+
+def test_stream_hedge_respects_budget():
+    log = []
+    budget = HedgeBudget(max_extra=0)
+    out = asyncio.run(collect(hedged_stream(stream(["a"], 0.05, log, "a"), stream(["b"], 0, log, "b"),
+                                            0.01, budget)))
+    assert out == ["a"]
+    assert not any(entry.startswith("b") for entry in log)
+    assert budget.hedges == 0
+
+
+def test_stream_failed_backup_keeps_waiting_for_primary():
+    async def broken():
+        raise RuntimeError("no alternate key for hedged request")
+        yield  # pragma: no cover
+
+    budget = HedgeBudget()
+    out = asyncio.run(collect(hedged_stream(stream(["a"], 0.05), broken, 0.01, budget)))
+    assert out == ["a"] and budget.hedge_wins == 0
+
+
+def test_async_call_backup_wins_and_primary_is_cancelled():
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append("primary")
+            raise
+        return "slow"
+
+    async def fast():
+        return "fast"
+
+    budget = HedgeBudget()
+    assert asyncio.run(hedged_call(slow, fast, 0.01, budget)) == "fast"
+    assert cancelled == ["primary"]
+    assert budget.hedge_wins == 1
+
+
+def test_sync_stream_runs_on_background_loop_and_closes_early():
+    log = []
+    budget = HedgeBudget()
+    pieces = hedged_stream_sync(stream(["slow"], 5, log, "a"), stream(["b1", "b2", "b3"], 0, log, "b"), 0.01, budget)
+    assert next(pieces) == "b1"
+    # 调用方读到结束标记后提前关闭：胜出的流也随之关闭
+    pieces.close()
+    assert log == ["a:closed", "b:closed"]
+    assert budget.hedge_wins == 1
+
+
+def test_run_sync_keeps_caller_context():
+    var = contextvars.ContextVar("var", default=None)
+    var.set("caller")
+
+    async def read():
+        return var.get()
+
+    assert run_sync(read()) == "caller"
+
+
+def test_backup_key_differs_from_primary():
+    keys = [APIKey(key=name, vendor="openai", bucket=TokenBucket(capacity=10, refill_rate=1, tokens=10))
+            for name in ("main", "alt")]
+    kp = KeyPool(keys, latency_aware=False)
+    assert has_backup_key(kp, "main") and not has_backup_key(kp, "main", vendor="gemini")
+    assert not has_backup_key(None, "main")
+
+    async def pick():
+        return [(await acquire_backup_key(kp, "main")).key for _ in range(4)]
+
+    assert asyncio.run(pick()) == ["alt"] * 4
+
+    async def open_stream(k):
+        yield k.key
+
+    out = asyncio.run(collect(backup_key_stream(kp, "main", open_stream)))
+    assert out == ["alt"] and keys[1].stats.samples
+    keys[1].dead = True
+    assert not has_backup_key(kp, "main")
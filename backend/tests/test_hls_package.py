@@ -0,0 +1,78 @@
+import os
+
+import course_assembler
+import hls_package
+import tracing
+
+
+def page(name, start, duration):
+    return {"name": name, "start": start, "duration": duration}
+
+
+def test_snap_pages_moves_starts_to_nearest_keyframe():
+    pages = [page("1_1", 0.0, 10.0), page("1_2", 10.0, 5.0), page("2_1", 15.0, 5.0)]
+    snapped = hls_package.snap_pages(pages, [0.0, 4.0, 9.8, 12.0, 15.3, 18.0], 20.0)
+    assert [p["start"] for p in snapped] == [0.0, 9.8, 15.3]
+    assert [p["duration"] for p in snapped] == [9.8, 5.5, 4.7]
+    assert [p["name"] for p in snapped] == ["1_1", "1_2", "2_1"]
+    # 原列表不被修改
+    assert pages[1]["start"] == 10.0
+
+
+def test_snap_pages_merges_page_shorter_than_gop():
+    pages = [page("a", 0.0, 4.0), page("b", 4.0, 0.5), page("c", 4.5, 5.5)]
+    snapped = hls_package.snap_pages(pages, [0.0, 4.4, 8.0], 10.0)
+    assert [(p["name"], p["start"], p["duration"]) for p in snapped] == [("a", 0.0, 4.4), ("b", 4.4, 5.6)]
+
+
+def test_snap_pages_without_keyframes_keeps_pages():
+    pages = [page("a", 0.0, 3.0), page("b", 3.0, 2.0)]
+    assert hls_package.snap_pages(pages, [], 5.0) == pages
+
+
+def test_write_media_playlist_joins_pages_with_discontinuity(tmp_path):
+    for prefix, durations in (("p000", (6.0, 2.5)), ("p001", (4.2,))):
+        lines = ["#EXTM3U", "#EXT-X-VERSION:7", "#EXT-X-TARGETDURATION:6", f'#EXT-X-MAP:URI="{prefix}_init.mp4"']
+        for i, d in enumerate(durations):
+            lines += [f"#EXTINF:{d:.6f},", f"{prefix}_{i:03d}.m4s"]
+            (tmp_path / f"{prefix}_{i:03d}.m4s").write_bytes(b"\0" * 1000)
+        lines.append("#EXT-X-ENDLIST")
+        (tmp_path / f"{prefix}.m3u8").write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    bandwidth = hls_package.write_media_playlist(str(tmp_path), ["p000", "p001"])
+    text = (tmp_path / hls_package.INDEX_NAME).read_text(encoding="utf-8").splitlines()
+    assert not (tmp_path / "p000.m3u8").exists() and not (tmp_path / "p001.m3u8").exists()
+    assert text[0] == "#EXTM3U" and text[-1] == "#EXT-X-ENDLIST"
+    assert "#EXT-X-TARGETDURATION:6" in text
+    assert text.count("#EXT-X-DISCONTINUITY") == 1
+    body = text[text.index('#EXT-X-MAP:URI="p000_init.mp4"'):-1]
+    assert body == ['#EXT-X-MAP:URI="p000_init.mp4"', "#EXTINF:6.000000,", "p000_000.m4s",
+                    "#EXTINF:2.500000,", "p000_001.m4s", "#EXT-X-DISCONTINUITY",
+                    '#EXT-X-MAP:URI="p001_init.mp4"', "#EXTINF:4.200000,", "p001_000.m4s"]
+    assert bandwidth > 0
+
+
+def test_output_dir_is_under_hls_root(tmp_path, monkeypatch):
+    hub = tmp_path / "course_hub"
+    monkeypatch.setattr(hls_package, "HLS_ROOT", str(hub / "hls"))
+    assert hls_package.default_output_dir(str(hub / "job42.mp4")) == str(hub / "hls" / "job42")
+    full = tmp_path / "outputs" / "KNN_9757" / "video_w_audio" / "Full.mp4"
+    assert hls_package.default_output_dir(str(full)) == str(hub / "hls" / "KNN_9757")
+    assert hls_package.default_output_dir(str(full), job_id="job42") == str(hub / "hls" / "job42")
+    # 追踪任务的随机 id 不影响目录名
+    with tracing.job(trace_dir=str(tmp_path / "trace")):
+        assert hls_package.default_output_dir(str(full)) == str(hub / "hls" / "KNN_9757")
+
+
+def test_chapters_file_matches_page_manifest(tmp_path):
+    path = tmp_path / "chapters.ffmeta"
+    course_assembler.write_chapters_file(str(path), ["1_1", "a=b;c"], [2.5, 1.25])
+    assert path.read_text(encoding="utf-8").splitlines() == [
+        ";FFMETADATA1",
+        "[CHAPTER]", "TIMEBASE=1/1000", "START=0", "END=2500", "title=1_1",
+        "[CHAPTER]", "TIMEBASE=1/1000", "START=2500", "END=3750", "title=a\\=b\\;c",
+    ]
+    video = tmp_path / "Full.mp4"
+    course_assembler.write_page_manifest(str(video), ["1_1", "1_2"], [2.5, 1.25])
+    assert course_assembler.load_page_manifest(str(video)) == [page("1_1", 0.0, 2.5), page("1_2", 2.5, 1.25)]
+    assert os.path.basename(course_assembler.page_manifest_path(str(video))) == "Full.pages.json"
@@ -0,0 +1,28 @@
+import asyncio
+import gc
+
+import http_pool
+
+
+def test_async_client_per_loop_and_closed_when_loop_ends():
+    async def get():
+        client = http_pool.get_async_http_client()
+        assert http_pool.get_async_http_client() is client
+        return client
+
+    first = asyncio.run(get())
+    second = asyncio.run(get())
+    assert first is not second
+    assert first.is_closed and second.is_closed
+    gc.collect()
+    assert len(http_pool._async_clients) == 0
+
+
+def test_aclose_async_http_client():
+    async def run():
+        client = http_pool.get_async_http_client()
+        await http_pool.aclose_async_http_client()
+        assert client.is_closed
+        assert http_pool.get_async_http_client() is not client
+
+    asyncio.run(run())
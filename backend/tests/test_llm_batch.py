@@ -0,0 +1,109 @@
+import pytest
+
+import batch_stub_server
+from llm_batch import LLMBatchJob
+
+
+@pytest.fixture
+def stub():
+    server = batch_stub_server.serve(port=0, background=True)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _config(server, tmp_path):
+    port = server.server_address[1]
+    return {
+        "llm_key": "sk-test",
+        "batch_settings": {"base_url": f"http://127.0.0.1:{port}/v1/", "poll_interval": 0.05,
+                           "max_wait_seconds": 10},
+        "llm_cache": {"dir": str(tmp_path / "cache")},
+    }
+
+
+def _store(server):
+    return server.RequestHandlerClass.store
+
+
+def _messages(text):
+    return [{"role": "user", "content": text}]
+
+
+def _interrupted(self, batch_id):
+    # 模拟提交后、结果返回前进程被中断
+    raise KeyboardInterrupt
+
+
+def test_submit_poll_and_write_back(stub, tmp_path):
+    config = _config(stub, tmp_path)
+    job = LLMBatchJob(config, name="t", verbose=False)
+    job.add("a", "gpt-test", _messages("alpha"), cache_key="key-a")
+    job.add("b", "gpt-test", _messages("beta"), max_tokens=10, temperature=0.0)
+    results = job.run()
+    assert results == {"a": "[batch-echo] alpha", "b": "[batch-echo] beta"}
+    assert len(_store(stub).batches) == 1
+    assert job.cache.get("key-a") == "[batch-echo] alpha"
+
+    # 缓存命中的请求不再提交
+    again = LLMBatchJob(config, name="t", verbose=False)
+    again.add("a", "gpt-test", _messages("alpha"), cache_key="key-a")
+    assert again.run() == {"a": "[batch-echo] alpha"}
+    assert len(_store(stub).batches) == 1
+
+
+def test_partial_failures_are_returned_as_none(stub, tmp_path, monkeypatch):
+    store = _store(stub)
+    echo = store._complete_one
+
+    def complete(client, body):
+        text = body["messages"][-1]["content"]
+        if text == "raise":
+            raise RuntimeError("upstream down")
+        if text == "500":
+            return {"status_code": 500, "body": {"error": {"message": "boom"}}}
+        return echo(client, body)
+
+    monkeypatch.setattr(store, "_complete_one", complete)
+    job = LLMBatchJob(_config(stub, tmp_path), name="t", verbose=False)
+    for cid in ("ok", "raise", "500"):
+        job.add(cid, "gpt-test", _messages(cid), cache_key=f"key-{cid}")
+    results = job.run()
+    assert results == {"ok": "[batch-echo] ok", "raise": None, "500": None}
+    assert job.cache.get("key-ok") is not None
+    assert job.cache.get("key-raise") is None and job.cache.get("key-500") is None
+
+
+def test_resume_from_persisted_batch_id(stub, tmp_path, monkeypatch):
+    config = _config(stub, tmp_path)
+    state = tmp_path / "state" / "batch.json"
+    first = LLMBatchJob(config, name="t", state_path=str(state), verbose=False)
+    first.add("a", "gpt-test", _messages("alpha"))
+    with monkeypatch.context() as m:
+        m.setattr(LLMBatchJob, "_wait", _interrupted)
+        with pytest.raises(KeyboardInterrupt):
+            first.run()
+    assert state.exists()
+    assert len(_store(stub).batches) == 1
+
+    resumed = LLMBatchJob(config, name="t", state_path=str(state), verbose=False)
+    resumed.add("a", "gpt-test", _messages("alpha"))
+    monkeypatch.setattr(LLMBatchJob, "_submit", lambda self: pytest.fail("不应重复提交"))
+    assert resumed.run() == {"a": "[batch-echo] alpha"}
+    assert not state.exists()
+
+
+def test_changed_requests_do_not_reuse_persisted_batch(stub, tmp_path, monkeypatch):
+    config = _config(stub, tmp_path)
+    state = tmp_path / "batch.json"
+    first = LLMBatchJob(config, name="t", state_path=str(state), verbose=False)
+    first.add("a", "gpt-test", _messages("alpha"))
+    with monkeypatch.context() as m:
+        m.setattr(LLMBatchJob, "_wait", _interrupted)
+        with pytest.raises(KeyboardInterrupt):
+            first.run()
+
+    changed = LLMBatchJob(config, name="t", state_path=str(state), verbose=False)
+    changed.add("a", "gpt-test", _messages("gamma"))
+    assert changed.run() == {"a": "[batch-echo] gamma"}
+    assert len(_store(stub).batches) == 2
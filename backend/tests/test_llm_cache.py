@@ -0,0 +1,48 @@
+from llm_cache import LLMResponseCache, cacheable, make_cache_key, pipeline_use_cache
+
+
+def image(data):
+    return [{"type": "text", "text": "describe"},
+            {"type": "image_url", "image_url": {"url": "data:image/png;base64," + data, "detail": "high"}}]
+
+
+def test_key_depends_on_every_request_parameter():
+    base = make_cache_key("gpt-5", "https://api.example.com/v1", "hi", 0, 100)
+    assert make_cache_key("gpt-5", "https://api.example.com/v1/", "hi", 0, 100) == base
+    assert make_cache_key("gpt-4o", "https://api.example.com/v1", "hi", 0, 100) != base
+    assert make_cache_key("gpt-5", "https://other.example.com/v1", "hi", 0, 100) != base
+    assert make_cache_key("gpt-5", "https://api.example.com/v1", "hello", 0, 100) != base
+    assert make_cache_key("gpt-5", "https://api.example.com/v1", "hi", 0.8, 100) != base
+    assert make_cache_key("gpt-5", "https://api.example.com/v1", "hi", 0, 200) != base
+
+
+def test_key_hashes_image_content():
+    assert make_cache_key("m", None, image("AAAA")) == make_cache_key("m", None, image("AAAA"))
+    assert make_cache_key("m", None, image("AAAA")) != make_cache_key("m", None, image("BBBB"))
+
+
+def test_only_deterministic_sampling_is_cached_by_default():
+    assert cacheable(0)
+    assert cacheable(0.0)
+    assert not cacheable(0.8)
+    assert not cacheable(None)
+    assert cacheable(0.8, use_cache=True)
+    assert not cacheable(0, use_cache=False)
+
+
+def test_pipeline_stages_opt_in_to_sampled_cache():
+    assert pipeline_use_cache({}) is True
+    assert cacheable(0.8, pipeline_use_cache({"llm_cache": {"cache_sampled": True}}))
+    assert not cacheable(0.8, pipeline_use_cache({"llm_cache": {"cache_sampled": False}}))
+    assert cacheable(0, pipeline_use_cache({"llm_cache": {"cache_sampled": False}}))
+
+
+def test_put_get_and_invalidate(tmp_path):
+    cache = LLMResponseCache(cache_dir=str(tmp_path))
+    key = make_cache_key("m", None, "hi", 0, 10)
+    assert cache.get(key) is None
+    cache.put(key, "hello", model="m")
+    assert cache.get(key) == "hello"
+    cache.invalidate(key)
+    assert cache.get(key) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
@@ -0,0 +1,64 @@
+import os
+import threading
+
+from lru_store import LRUStore
+
+
+def test_get_put_delete_and_custom_columns(tmp_path):
+    store = LRUStore(str(tmp_path / "db" / "s.sqlite3"), 1000, columns=[("path", "TEXT NOT NULL"), ("label", "TEXT")])
+    assert store.get("a") is None
+    store.put("a", 10, path="/x", label="L")
+    assert store.get("a") == ("/x", "L")
+    assert store.get("a", valid=lambda row: row[0] != "/x") is None
+    assert store.get("a") is None
+    store.put("b", 10, path="/y")
+    assert store.delete("b") == ("/y", None) and store.delete("b") is None
+    stats = store.stats()
+    assert (stats["hits"], stats["misses"], stats["writes"], stats["entries"]) == (1, 3, 2, 0)
+
+
+def test_evicts_least_recently_used_to_ninety_percent(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("lru_store.time.time", lambda: now[0])
+    evicted = []
+    store = LRUStore(str(tmp_path / "s.sqlite3"), 100, columns=[("path", "TEXT")],
+                     on_evict=lambda key, values: evicted.append((key, values)))
+    for i, key in enumerate("abcd"):
+        now[0] += 1
+        store.put(key, 25, path=f"/{key}")
+    now[0] += 1
+    store.get("a")
+    now[0] += 1
+    store.put("e", 25, path="/e")
+    # 125 > 100：淘汰到 90 以内，最久未访问的是 b、c
+    assert evicted == [("b", ("/b",)), ("c", ("/c",))]
+    assert store.stats()["size_bytes"] == 75 and store.evictions == 2
+
+
+def test_min_age_protects_recent_entries_and_adopt_keeps_existing(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("lru_store.time.time", lambda: now[0])
+    store = LRUStore(str(tmp_path / "s.sqlite3"), 50, min_age=600)
+    store.adopt([("old", 40, 100.0), ("new", 40, 990.0)])
+    store.adopt([("old", 1, 999.0)])
+    assert store.stats()["size_bytes"] == 80
+    assert store.evict_if_needed() == 1
+    assert store.get("old") is None and store.get("new") == ("new",)
+    assert store.touch("new") and not store.touch("old")
+
+
+def test_threads_share_one_database(tmp_path):
+    store = LRUStore(str(tmp_path / "s.sqlite3"), 10 ** 6, columns=[("v", "TEXT")])
+
+    def worker(n):
+        for i in range(50):
+            store.put(f"{n}-{i}", 1, v=str(i))
+            assert store.get(f"{n}-{i}") == (str(i),)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert store.stats()["entries"] == 400
+    assert os.path.exists(str(tmp_path / "s.sqlite3"))
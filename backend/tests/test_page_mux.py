@@ -0,0 +1,51 @@
+import struct
+import wave
+
+import page_mux
+
+
+def write_pcm(path, seconds, rate=16000, channels=1):
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b"\0\0" * channels * int(rate * seconds))
+
+
+def test_pcm_duration(tmp_path):
+    path = tmp_path / "a.wav"
+    write_pcm(path, 1.5, rate=24000, channels=2)
+    assert page_mux.wav_duration(str(path)) == 1.5
+
+
+def test_skips_extra_chunks_and_odd_padding(tmp_path):
+    rate, data = 8000, b"\0\0" * 8000
+    fmt = struct.pack("<HHIIHH", 1, 1, rate, rate * 2, 2, 16)
+    body = (b"WAVE" + b"fmt " + struct.pack("<I", len(fmt)) + fmt
+            + b"LIST" + struct.pack("<I", 3) + b"abc\0"
+            + b"data" + struct.pack("<I", len(data)) + data)
+    path = tmp_path / "b.wav"
+    path.write_bytes(b"RIFF" + struct.pack("<I", len(body)) + body)
+    assert page_mux.wav_duration(str(path)) == 1.0
+
+
+def test_streamed_wav_without_data_size(tmp_path):
+    path = tmp_path / "c.wav"
+    write_pcm(path, 2.0)
+    raw = bytearray(path.read_bytes())
+    idx = raw.index(b"data")
+    raw[idx + 4:idx + 8] = struct.pack("<I", 0xFFFFFFFF)
+    path.write_bytes(bytes(raw))
+    assert page_mux.wav_duration(str(path)) == 2.0
+    # 写到一半被截断：按实际长度计算
+    path.write_bytes(bytes(raw[:idx + 8 + 16000]))
+    assert page_mux.wav_duration(str(path)) == 0.5
+
+
+def test_non_wav_returns_none(tmp_path):
+    path = tmp_path / "d.mp3"
+    path.write_bytes(b"ID3\x03\0\0\0\0\0\0" + b"\0" * 100)
+    assert page_mux.wav_duration(str(path)) is None
+    assert page_mux.wav_duration(str(tmp_path / "missing.wav")) is None
+    (tmp_path / "e.wav").write_bytes(b"RIFF\0\0\0\0WAVEdata\4\0\0\0\0\0\0\0")
+    assert page_mux.wav_duration(str(tmp_path / "e.wav")) is None
@@ -0,0 +1,194 @@
+import sys
+import time
+import asyncio
+import threading
+
+import pytest
+
+import pool
+from pool import APIKey
+
+
+@pytest.mark.skipif(not pool.HAS_REDIS, reason="redis 未安装")
+def test_redis_client_is_created_per_event_loop():
+    kp = pool.RedisKeyPool([APIKey(key="k", vendor="openai")], redis_url="redis://localhost:6399/0")
+    assert len(kp._clients) == 0
+
+    async def conn():
+        first, second = kp._conn(), kp._conn()
+        assert first is second
+        return first["redis"]
+
+    a = asyncio.run(conn())
+    b = asyncio.run(conn())
+    assert a is not b
+
+    async def close():
+        kp._conn()
+        await kp.aclose()
+        return kp._clients.get(asyncio.get_running_loop())
+
+    assert asyncio.run(close()) is None
+
+
+def keys(*weights):
+    return [APIKey(key=f"k{i}", vendor="openai", weight=w) for i, w in enumerate(weights)]
+
+
+def test_weighted_schedule_is_smooth():
+    a, b, c = keys(5, 1, 1)
+    sched = pool.WeightedSchedule([a, b, c])
+    assert [k.key for k in sched.seq] == ["k0", "k0", "k1", "k0", "k2", "k0", "k0"]
+    assert [sched.next() for _ in range(8)][-1] is a
+
+
+def test_weighted_schedule_reduces_weights_and_skips_zero():
+    a, b, c = keys(4, 2, 0)
+    sched = pool.WeightedSchedule([a, b, c])
+    assert sched.keys == [a, b]
+    assert len(sched.seq) == 3
+
+
+def test_rotation_starts_at_cursor_and_lists_each_key_once():
+    a, b, c = keys(2, 1, 1)
+    sched = pool.WeightedSchedule([a, b, c])
+    sched.next()
+    rot = sched.rotation()
+    assert rot[0] is sched.seq[1]
+    assert sorted(k.key for k in rot) == ["k0", "k1", "k2"]
+    assert pool.WeightedSchedule([]).next() is None
+
+
+def test_short_cooldown_invalidates_cached_schedule(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(pool.time, "time", lambda: now[0])
+    a, b = keys(1, 1)
+    kp = pool.KeyPool([a, b], latency_aware=False)
+    assert kp._schedule("openai").keys == [a, b]
+
+    b.short_cooldown(30)
+    sched = kp._schedule("openai")
+    assert sched.keys == [a]
+    assert sched.valid_until == 1030.0
+    assert all(asyncio.run(kp.acquire_key("openai")) is a for _ in range(3))
+
+    now[0] = 1031.0
+    assert kp._schedule("openai").keys == [a, b]
+
+
+def test_shorter_cooldown_does_not_rebuild(monkeypatch):
+    monkeypatch.setattr(pool.time, "time", lambda: 1000.0)
+    a, b = keys(1, 1)
+    kp = pool.KeyPool([a, b])
+    b.short_cooldown(30)
+    version = kp._health_version
+    b.short_cooldown(5)
+    assert kp._health_version == version
+
+
+def test_acquire_from_many_threads_keeps_weights_and_tokens():
+    # batch_debug 在多个线程里各自 asyncio.run 共用同一个池
+    ks = keys(3, 1, 1, 1)
+    for k in ks:
+        k.bucket = pool.TokenBucket(capacity=10 ** 6, refill_rate=0.0, tokens=10 ** 6)
+    kp = pool.KeyPool(ks, latency_aware=False)
+    counts = {k.key: 0 for k in ks}
+    lock = threading.Lock()
+
+    def worker():
+        async def run():
+            got = [await kp.acquire_key("openai") for _ in range(600)]
+            with lock:
+                for k in got:
+                    counts[k.key] += 1
+        asyncio.run(run())
+
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+    # 缩短 GIL 切换间隔，没有锁时竞争几乎必然出现
+    switch = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        sys.setswitchinterval(switch)
+    assert counts == {"k0": 4800, "k1": 1600, "k2": 1600, "k3": 1600}
+    assert all(k.bucket.tokens == 10 ** 6 - counts[k.key] for k in ks)
+
+
+def test_latency_choice_keeps_weights_with_two_keys():
+    a, b = keys(3, 1)
+    for k in (a, b):
+        k.bucket = pool.TokenBucket(capacity=1000, refill_rate=0.0, tokens=1000)
+    a.stats.record_success(2.0)
+    b.stats.record_success(0.1)
+    kp = pool.KeyPool([a, b], explore_ratio=0.0)
+    picked = [asyncio.run(kp.acquire_key("openai")) for _ in range(400)]
+    assert picked.count(a) == 300
+
+
+# ---- RedisKeyPool 的 Lua 脚本（fakeredis + lupa 执行，两个池实例模拟两个 worker 进程）----
+
+@pytest.fixture
+def redis_pools(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    if not pool.HAS_REDIS:
+        pytest.skip("redis 未安装")
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(pool.aioredis, "from_url",
+                        lambda url, **kw: fakeredis.aioredis.FakeRedis(server=server, **kw))
+
+    def make(*specs, **kwargs):
+        # 每个池有自己的 APIKey 对象（不同进程），同名 key 在 Redis 里共用一个 hash
+        ks = [APIKey(key=name, vendor="openai", bucket=pool.TokenBucket(capacity=cap, refill_rate=0.0),
+                     min_cooldown=0.2) for name, cap in specs]
+        kwargs.setdefault("max_wait_seconds", 0.2)
+        return pool.RedisKeyPool(ks, redis_url="redis://fake", latency_aware=False, **kwargs)
+    return make
+
+
+def _acquire(kp):
+    k = asyncio.run(kp.acquire_key("openai"))
+    return k.key if k is not None else None
+
+
+def test_redis_tokens_are_limited_across_pools(redis_pools):
+    a, b = redis_pools(("k", 3)), redis_pools(("k", 3))
+    got = [_acquire(a), _acquire(b), _acquire(a), _acquire(b), _acquire(a)]
+    assert got == ["k", "k", "k", None, None]
+
+
+def test_redis_breaker_opens_after_threshold(redis_pools):
+    a, b = redis_pools(("bad", 100), ("good", 100)), redis_pools(("bad", 100), ("good", 100))
+    bad = a._keys[0]
+    for _ in range(bad.breaker.threshold - 1):
+        asyncio.run(a.report_failure(bad, "server"))
+    assert "bad" in {_acquire(b) for _ in range(4)}
+    asyncio.run(a.report_failure(bad, "server"))
+    assert {_acquire(b) for _ in range(6)} == {"good"}
+
+
+def test_redis_half_open_allows_a_single_prober(redis_pools):
+    a, b = redis_pools(("k", 100)), redis_pools(("k", 100))
+    k = a._keys[0]
+    for _ in range(k.breaker.threshold):
+        asyncio.run(a.report_failure(k, "other"))
+    assert _acquire(b) is None
+    time.sleep(0.25)
+    assert _acquire(a) == "k"
+    # 探测窗口内另一个进程不会再选这把 key
+    assert _acquire(b) is None
+    asyncio.run(a.report_success(k))
+    assert _acquire(b) == "k"
+
+
+def test_redis_dead_key_is_never_selected(redis_pools):
+    a, b = redis_pools(("dead", 100), ("live", 100)), redis_pools(("dead", 100), ("live", 100))
+    asyncio.run(a.report_failure(a._keys[0], "auth"))
+    assert {_acquire(b) for _ in range(6)} == {"live"}
+    assert b._keys[0].dead
+    asyncio.run(a.report_failure(a._keys[1], "auth"))
+    assert _acquire(b) is None
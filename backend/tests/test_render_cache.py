@@ -0,0 +1,68 @@
+import pytest
+
+import render_cache
+from render_cache import RenderCache, collect_scene_inputs, make_render_key
+
+
+@pytest.fixture(autouse=True)
+def fixed_manim_version(monkeypatch):
+    monkeypatch.setattr(render_cache, "_manim_version", "0.18.1")
+
+
+@pytest.fixture
+def page(tmp_path):
+    (tmp_path / "helpers.py").write_text("COLOR = 'BLUE'\n", encoding="utf-8")
+    (tmp_path / "bg.png").write_bytes(b"png-1")
+    scene = tmp_path / "1_1.py"
+    scene.write_text("from manim import *\nimport helpers\n\nclass S(Scene):\n"
+                     "    def construct(self):\n        self.add(ImageMobject('bg.png'))\n", encoding="utf-8")
+    return scene
+
+
+def test_inputs_follow_local_imports_and_assets(page):
+    sources, assets = collect_scene_inputs(page)
+    assert set(sources) == {"1_1.py", "helpers.py"}
+    assert set(assets) == {"bg.png"} and assets["bg.png"] is not None
+
+
+def test_key_stable_and_sensitive_to_render_settings(page):
+    key = make_render_key(page, "S", "l")
+    assert make_render_key(page, "S", "l") == key
+    assert make_render_key(page, "T", "l") != key
+    assert make_render_key(page, "S", "h") != key
+    assert make_render_key(page, "S", "l", fmt="gif") != key
+    assert make_render_key(page, "S", "l", extra={"title": "KNN"}) != key
+
+
+def test_key_changes_with_imported_module_and_asset(page, tmp_path):
+    key = make_render_key(page, "S", "l")
+    (tmp_path / "helpers.py").write_text("COLOR = 'RED'\n", encoding="utf-8")
+    key2 = make_render_key(page, "S", "l")
+    assert key2 != key
+    (tmp_path / "bg.png").write_bytes(b"png-2")
+    assert make_render_key(page, "S", "l") != key2
+
+
+def test_key_changes_with_manim_version(page, monkeypatch):
+    key = make_render_key(page, "S", "l")
+    monkeypatch.setattr(render_cache, "_manim_version", "0.19.0")
+    assert make_render_key(page, "S", "l") != key
+
+
+def test_missing_asset_changes_key_once_provided(page, tmp_path):
+    (tmp_path / "bg.png").unlink()
+    assert collect_scene_inputs(page)[1]["bg.png"] is None
+    key = make_render_key(page, "S", "l")
+    (tmp_path / "bg.png").write_bytes(b"png-1")
+    assert make_render_key(page, "S", "l") != key
+
+
+def test_put_get_and_deleted_object(tmp_path):
+    cache = RenderCache(cache_dir=str(tmp_path / "cache"))
+    video = tmp_path / "S.mp4"
+    video.write_bytes(b"video")
+    stored = cache.put("ab" * 32, video, label="1_1:S")
+    assert stored is not None and cache.get("ab" * 32) == stored
+    stored.unlink()
+    assert cache.get("ab" * 32) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
@@ -0,0 +1,66 @@
+import pytest
+
+import render_scheduler
+from render_scheduler import (DEFAULT_COEFFS, MIN_FIT_SAMPLES, RenderCostModel, extract_features,
+                              fit_coefficients, plan_longest_first)
+
+
+def test_plan_longest_first_orders_by_cost_and_predicts_makespan():
+    order, makespan = plan_longest_first({"a": 2.0, "b": 7.0, "c": 3.0, "d": 5.0}, 2)
+    assert order == ["b", "d", "c", "a"]
+    # b、d 各占一个 worker，c 接在先空闲的 d 后（8），a 接在 b 后（9）
+    assert makespan == 9.0
+
+
+def test_plan_longest_first_single_worker_and_empty():
+    assert plan_longest_first({"a": 1.0, "b": 2.0}, 1)[1] == 3.0
+    assert plan_longest_first({"a": 1.0}, 0)[1] == 1.0
+    assert plan_longest_first({}, 4) == ([], 0.0)
+
+
+def test_extract_features_multiplies_constant_loops(tmp_path):
+    scene = tmp_path / "p.py"
+    scene.write_text(
+        "from manim import *\n"
+        "class S(Scene):\n"
+        "    def construct(self):\n"
+        "        t = MathTex('x')\n"
+        "        for i in range(3):\n"
+        "            self.play(Write(Text('a')), run_time=2)\n"
+        "        for c in items:\n"
+        "            self.wait()\n"
+        "        self.wait(0.5)\n",
+        encoding="utf-8",
+    )
+    f = extract_features(scene)
+    assert (f.plays, f.anim_s, f.wait_s, f.tex, f.text, f.images) == (3, 6, 1.5, 1, 3, 0)
+    assert f.vector("l")[1] == pytest.approx(6 * render_scheduler.QUALITY_FACTORS["l"])
+
+
+def test_fit_recovers_linear_coefficients():
+    true = (5.0, 2.0, 0.1, 0.5, 1.0, 0.2, 0.0)
+    samples = []
+    for i in range(200):
+        x = (1.0, i % 17, (i * 3) % 11, i % 5, (i * 7) % 4, i % 3, 0.0)
+        samples.append((x, sum(w * v for w, v in zip(true, x))))
+    fitted = fit_coefficients(samples, ridge=1e-6)
+    assert fitted[:6] == pytest.approx(true[:6], abs=1e-3)
+    # 没有样本的特征保持经验系数
+    assert fitted[6] == pytest.approx(DEFAULT_COEFFS[6], abs=1e-3)
+
+
+def test_fit_needs_enough_samples():
+    samples = [((1.0,) * 7, 10.0)] * (MIN_FIT_SAMPLES - 1)
+    assert fit_coefficients(samples) == DEFAULT_COEFFS
+
+
+def test_recorded_timing_is_reused_for_identical_code(tmp_path):
+    scene = tmp_path / "p.py"
+    scene.write_text("class S: pass\n", encoding="utf-8")
+    model = RenderCostModel(timings_file=str(tmp_path / "timings.jsonl"))
+    assert model.estimate(scene, "l") == pytest.approx(DEFAULT_COEFFS[0])
+    model.record(scene, "l", 42.0)
+    assert model.estimate(scene, "l") == 42.0
+    assert model.estimate(scene, "h") == pytest.approx(DEFAULT_COEFFS[0])
+    reloaded = RenderCostModel(timings_file=str(tmp_path / "timings.jsonl"))
+    assert reloaded.estimate(scene, "l") == 42.0
@@ -0,0 +1,127 @@
+import contextlib
+import io
+from pathlib import Path
+
+import segment_render
+from segment_render import build_probe_source, parse_marks, split_segments
+
+# 不依赖 manim 的最小场景：play / wait 都经过 renderer.play，renderer 不记录场景时间（与跳过动画时一致）
+PAGE = '''
+class Renderer:
+    def __init__(self):
+        self.num_plays = 0
+
+    def play(self, scene, *anims, run_time=1.0, duration=None):
+        scene.duration = duration if duration is not None else run_time
+        self.num_plays += 1
+
+
+class Scene:
+    def __init__(self):
+        self.renderer = Renderer()
+
+    def play(self, *anims, run_time=1.0):
+        self.renderer.play(self, *anims, run_time=run_time)
+
+    def wait(self, duration=1.0):
+        self.renderer.play(self, duration=duration)
+
+
+class Page(Scene):
+    def construct(self):
+        self.play("a", run_time=2)
+        #BREAKPOINT: 1
+        self.play("b", run_time=3)
+        self.wait(5)
+        #BREAKPOINT: 2
+        self.play("c", run_time=1)
+'''
+
+
+def _run_probe(source, scene):
+    out = io.StringIO()
+    namespace = {}
+    with contextlib.redirect_stdout(out):
+        exec(compile(source, "<probe>", "exec"), namespace)
+        namespace[scene]().construct()
+    return out.getvalue()
+
+
+def test_probe_accumulates_run_time_and_waits():
+    probe = build_probe_source(PAGE, "Page")
+    marks, end = parse_marks(_run_probe(probe, "PageSegmentProbe"))
+    assert marks == [(1, 2.0), (3, 10.0)]
+    assert end == (4, 11.0)
+
+
+def test_probe_rejects_unsafe_or_inline_breakpoints():
+    assert build_probe_source(PAGE.replace('self.play("c"', 'self.add_sound("x"); self.play("c"'), "Page") is None
+    assert build_probe_source(PAGE.replace('self.wait(5)\n        #BREAKPOINT: 2',
+                                           'self.wait(5)  #BREAKPOINT: 2'), "Page") is None
+    assert build_probe_source("class Page:\n    pass\n", "Page") is None
+
+
+def test_parse_marks_rejects_loops_and_disorder():
+    mark = segment_render.MARK_PREFIX
+    ok = f"{mark} 1 2 2.0\n{mark} 2 5 9.5\n{mark} end 6 12.0\n"
+    assert parse_marks(ok) == ([(2, 2.0), (5, 9.5)], (6, 12.0))
+    assert parse_marks(f"{mark} 1 2 2.0\n{mark} 1 4 4.0\n{mark} end 6 12.0\n") is None
+    assert parse_marks(f"{mark} 1 5 2.0\n{mark} 2 3 4.0\n{mark} end 6 12.0\n") is None
+    assert parse_marks(f"{mark} 1 2 2.0\n") is None
+
+
+def test_split_balances_on_scene_time():
+    # 前几个动画很短、最后一个很长：按时间切而不是按动画数均分
+    marks = [(1, 1.0), (2, 2.0), (3, 3.0), (4, 30.0)]
+    assert split_segments(marks, (5, 60.0), 2) == [(0, 3), (4, -1)]
+    assert split_segments(marks, (5, 0.0), 2) == [(0, 1), (2, -1)]
+
+
+def test_split_merges_duplicate_and_edge_cuts():
+    marks = [(0, 0.0), (2, 5.0), (2, 5.0), (6, 12.0)]
+    assert split_segments(marks, (6, 12.0), 4) == [(0, 1), (2, -1)]
+    assert split_segments([(0, 0.0)], (3, 9.0), 4) == []
+    assert split_segments(marks, (6, 12.0), 1) == []
+
+
+def test_short_page_is_not_split(tmp_path, monkeypatch):
+    page = tmp_path / "p.py"
+    page.write_text(PAGE, encoding="utf-8")
+    renders = []
+
+    def fake_render(py_path, scene, quality, media_dir, cwd, timeout, from_n=0, upto_n=-1, dry_run=False):
+        if dry_run:
+            return True, _run_probe(Path(py_path).read_text(encoding="utf-8"), scene), None, 0.0
+        renders.append((from_n, upto_n))
+        return False, "", None, 1.0
+
+    monkeypatch.setattr(segment_render, "_render", fake_render)
+    # 场景时长 11 秒：低于 min_seconds 时整页渲染
+    assert segment_render.render_segmented(page, "Page", "l", tmp_path / "out.mp4", max_segments=4,
+                                           min_seconds=20) is None
+    assert renders == []
+    segment_render.render_segmented(page, "Page", "l", tmp_path / "out.mp4", max_segments=4, min_seconds=5)
+    assert renders[0] == (0, 0)
+    assert not (tmp_path / "_p_segment_probe.py").exists()
+
+
+def test_segment_worker_seconds_are_reported(tmp_path, monkeypatch):
+    page = tmp_path / "p.py"
+    page.write_text(PAGE, encoding="utf-8")
+
+    def fake_render(py_path, scene, quality, media_dir, cwd, timeout, from_n=0, upto_n=-1, dry_run=False):
+        if dry_run:
+            return True, _run_probe(Path(py_path).read_text(encoding="utf-8"), scene), None, 9.0
+        video = Path(media_dir) / f"{scene}.mp4"
+        video.parent.mkdir(parents=True, exist_ok=True)
+        video.write_bytes(b"")
+        return True, "", video, 2.5
+
+    monkeypatch.setattr(segment_render, "_render", fake_render)
+    monkeypatch.setattr(segment_render, "concat_segments", lambda videos, out: True)
+    timings = []
+    out = segment_render.render_segmented(page, "Page", "l", tmp_path / "out.mp4", max_segments=2,
+                                          min_seconds=5, timings=timings)
+    assert out == tmp_path / "out.mp4"
+    # 只记录各段在 worker 上的耗时，不含预演
+    assert timings == [2.5, 2.5]
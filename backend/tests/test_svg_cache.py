@@ -0,0 +1,36 @@
+import os
+import time
+
+import svg_cache
+
+
+def _write(path, size, mtime):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+    os.utime(path, (mtime, mtime))
+
+
+def test_evict_adopts_existing_files_and_removes_whole_groups(tmp_path):
+    old = time.time() - 3600
+    _write(tmp_path / "Tex" / "aaa.svg", 60, old - 10)
+    _write(tmp_path / "Tex" / "aaa.tex", 10, old - 10)
+    _write(tmp_path / "Tex" / "bbb.svg", 60, old)
+    _write(tmp_path / "texts" / "ccc.svg", 60, time.time())
+    # 190 字节，上限 150：淘汰最久未用的 aaa 一组（.svg 和 .tex 一起）
+    assert svg_cache.evict(str(tmp_path), 150) == 1
+    assert sorted(p.name for p in (tmp_path / "Tex").iterdir()) == ["bbb.svg"]
+    # 上限再降低也不会删最近用过的 ccc
+    assert svg_cache.evict(str(tmp_path), 10) == 1
+    assert [p.name for p in (tmp_path / "texts").iterdir()] == ["ccc.svg"]
+
+
+def test_record_indexes_only_files_in_cache_dir(tmp_path, monkeypatch):
+    store = svg_cache._open_store(str(tmp_path), 10 ** 6)
+    monkeypatch.setitem(svg_cache._state, "store", store)
+    monkeypatch.setitem(svg_cache._state, "dir", str(tmp_path))
+    _write(tmp_path / "Tex" / "abc.svg", 30, time.time())
+    _write(tmp_path / "Tex" / "abc.tex", 5, time.time())
+    svg_cache._record(str(tmp_path / "Tex" / "abc.svg"), compiled=True)
+    svg_cache._record(str(tmp_path.parent / "elsewhere.svg"), compiled=True)
+    assert store.stats()["entries"] == 1 and store.stats()["size_bytes"] == 35
+    assert store.get(os.path.join("Tex", "abc")) is not None
@@ -0,0 +1,156 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import tracing
+
+
+@pytest.fixture(autouse=True)
+def _clean_env(monkeypatch):
+    for k in (tracing.TRACE_FILE_ENV, tracing.TRACE_JOB_ENV, tracing.TRACE_DIR_ENV):
+        monkeypatch.delenv(k, raising=False)
+
+
+def _span(span_id, stage, wall, page=None, parent=None, ts=0.0, **extra):
+    rec = {"type": "span", "span_id": span_id, "stage": stage, "page": page, "parent": parent,
+           "ts": ts, "wall_s": wall, "cpu_s": wall / 2, "child_cpu_s": 0.0}
+    rec.update(extra)
+    return rec
+
+
+def test_summarize_nested_same_stage_not_double_counted():
+    records = [
+        _span("a", "render", 10.0),
+        _span("b", "render", 4.0, page="p1", parent="a"),
+        _span("c", "render", 3.0, page="p1", parent="b"),
+        _span("d", "render", 5.0, page="p2", parent="a"),
+    ]
+    st = tracing.summarize(records)["stages"]["render"]
+    assert st["wall_s"] == 10.0
+    assert st["spans"] == 4
+    # p1 的内层同页 span 不算新的一页
+    assert st["pages"] == 2
+
+
+def test_summarize_whole_span_takes_precedence_over_pages():
+    records = [
+        _span("a", "tts", 6.0),
+        _span("b", "tts", 5.0, page="p1"),
+        _span("c", "tts", 5.0, page="p2"),
+    ]
+    assert tracing.summarize(records)["stages"]["tts"]["wall_s"] == 6.0
+
+
+def test_summarize_paged_only_sums_pages_and_attributes_llm():
+    records = [
+        _span("b", "code_gen", 2.0, page="p1", job="j1"),
+        _span("c", "code_gen", 3.0, page="p2", ts=1.0),
+        {"type": "llm", "stage": "code_gen", "page": "p2", "tokens_in": 10, "tokens_out": 5, "cost": 0.5,
+         "cached": True},
+        {"type": "retry", "stage": "code_gen", "page": "p2"},
+    ]
+    summary = tracing.summarize(records)
+    st = summary["stages"]["code_gen"]
+    assert st["wall_s"] == 5.0
+    assert (st["llm_calls"], st["cache_hits"], st["tokens_in"], st["retries"]) == (1, 1, 10, 1)
+    assert summary["job"] == "j1"
+    assert summary["wall_s"] == 4.0
+    assert summary["pages"][0]["page"] == "p2" and summary["pages"][0]["cost"] == 0.5
+
+
+def test_job_disabled_without_dir():
+    with tracing.job() as path:
+        assert path is None
+        assert tracing.trace_file() is None
+
+
+def test_nested_job_only_outer_writes_summary(tmp_path):
+    outer_dir, inner_dir = tmp_path / "outer", tmp_path / "inner"
+    with tracing.job(job_id="j1", trace_dir=str(outer_dir), stage="outer") as path:
+        with tracing.job(job_id="other", trace_dir=str(inner_dir), stage="inner") as inner_path:
+            assert inner_path == path
+            assert tracing.current_job_id() == "j1"
+            with tracing.span("render", page="p1"):
+                pass
+        assert not (outer_dir / tracing.SUMMARY_FILE_NAME).exists()
+    assert not inner_dir.exists()
+    assert tracing.trace_file() is None
+    records = tracing.load_records(path)
+    assert {r["stage"] for r in records} == {"outer", "inner", "render"}
+    assert all(r["job"] == "j1" for r in records)
+    summary = json.loads((outer_dir / tracing.SUMMARY_FILE_NAME).read_text(encoding="utf-8"))
+    assert set(summary["stages"]) == {"outer", "inner", "render"}
+
+
+def test_job_does_not_touch_os_environ(tmp_path):
+    with tracing.job(trace_dir=str(tmp_path)):
+        assert tracing.TRACE_FILE_ENV not in os.environ
+        env = tracing.child_env({"PATH": "/bin"})
+        assert env[tracing.TRACE_FILE_ENV] == str(tmp_path / tracing.TRACE_FILE_NAME)
+        assert env[tracing.TRACE_JOB_ENV] == tracing.current_job_id()
+        assert env["PATH"] == "/bin"
+    assert tracing.TRACE_FILE_ENV not in tracing.child_env({})
+
+
+def test_job_inherits_env_from_parent_process(tmp_path, monkeypatch):
+    path = str(tmp_path / "parent.jsonl")
+    monkeypatch.setenv(tracing.TRACE_FILE_ENV, path)
+    monkeypatch.setenv(tracing.TRACE_JOB_ENV, "parent")
+    with tracing.job(trace_dir=str(tmp_path / "child"), stage="render") as got:
+        assert got == path
+    records = tracing.load_records(path)
+    assert records[0]["job"] == "parent"
+    # 父进程的任务负责写汇总
+    assert not (tmp_path / tracing.SUMMARY_FILE_NAME).exists()
+
+
+def test_concurrent_jobs_do_not_clobber(tmp_path):
+    first_in = threading.Event()
+    second_done = threading.Event()
+
+    def first():
+        with tracing.job(job_id="a", trace_dir=str(tmp_path / "a"), stage="a"):
+            first_in.set()
+            second_done.wait(5)
+            with tracing.span("after"):
+                pass
+
+    def second():
+        first_in.wait(5)
+        with tracing.job(job_id="b", trace_dir=str(tmp_path / "b"), stage="b"):
+            with tracing.span("inside"):
+                pass
+        second_done.set()
+
+    with ThreadPoolExecutor(2) as ex:
+        for f in [ex.submit(first), ex.submit(second)]:
+            f.result()
+
+    a = tracing.load_records(str(tmp_path / "a" / tracing.TRACE_FILE_NAME))
+    b = tracing.load_records(str(tmp_path / "b" / tracing.TRACE_FILE_NAME))
+    assert {r["stage"] for r in a} == {"a", "after"} and {r["job"] for r in a} == {"a"}
+    assert {r["stage"] for r in b} == {"b", "inside"} and {r["job"] for r in b} == {"b"}
+    assert (tmp_path / "a" / tracing.SUMMARY_FILE_NAME).exists()
+    assert (tmp_path / "b" / tracing.SUMMARY_FILE_NAME).exists()
+
+
+def test_bind_carries_span_and_job_into_thread_pool(tmp_path):
+    def work(page):
+        with tracing.span("render", page=page):
+            tracing.record_retry("boom")
+        return tracing.current_job_id()
+
+    with tracing.job(job_id="j", trace_dir=str(tmp_path), stage="render") as path:
+        with ThreadPoolExecutor(2) as ex:
+            bound = list(ex.map(tracing.bind(work), ["p1", "p2"]))
+            unbound = ex.submit(tracing.current_job_id).result()
+    assert bound == ["j", "j"]
+    assert unbound is None
+    records = tracing.load_records(path)
+    outer = next(r for r in records if r["type"] == "span" and r["page"] is None)
+    pages = [r for r in records if r["type"] == "span" and r["page"] is not None]
+    assert {r["parent"] for r in pages} == {outer["span_id"]}
+    assert outer["retries"] == 2
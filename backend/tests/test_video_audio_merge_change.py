@@ -0,0 +1,40 @@
+import page_mux
+import video_audio_merge_change as vamc
+
+
+def head(**overrides):
+    info = {"codec_name": "h264", "profile": "High", "level": 42, "width": 1920, "height": 1080,
+            "pix_fmt": "yuv420p", "r_frame_rate": "60/1", "time_base": "1/15360"}
+    info.update(overrides)
+    return info
+
+
+def test_tail_args_copy_head_parameters():
+    args = vamc.tail_encode_args(head())
+    assert args[args.index("-profile:v") + 1] == "high"
+    assert args[args.index("-level:v") + 1] == "4.2"
+    assert args[args.index("-pix_fmt") + 1] == "yuv420p"
+    assert args[args.index("-r") + 1] == "60/1"
+    assert args[args.index("-video_track_timescale") + 1] == "15360"
+
+
+def test_tail_args_for_10bit_head():
+    args = vamc.tail_encode_args(head(profile="High 10", pix_fmt="yuv420p10le", level=51))
+    assert args[args.index("-profile:v") + 1] == "high10"
+    assert args[args.index("-level:v") + 1] == "5.1"
+    assert args[args.index("-pix_fmt") + 1] == "yuv420p10le"
+
+
+def test_unmatchable_heads_fall_back_to_full_encode():
+    assert vamc.tail_encode_args(head(codec_name="hevc")) is None
+    assert vamc.tail_encode_args(head(profile="Progressive High")) is None
+    assert vamc.tail_encode_args(head(level=-99)) is None
+    assert vamc.tail_encode_args(head(level=None)) is None
+
+
+def test_keyframe_before(monkeypatch):
+    monkeypatch.setattr(page_mux, "keyframe_times", lambda path: [0.0, 2.0, 4.0, 6.0])
+    assert vamc.keyframe_before("x.mp4", 5.0) == 4.0
+    assert vamc.keyframe_before("x.mp4", 4.0) == 4.0
+    monkeypatch.setattr(page_mux, "keyframe_times", lambda path: [])
+    assert vamc.keyframe_before("x.mp4", 5.0) == 0.0
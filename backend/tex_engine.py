@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+LaTeX 编译加速：预编译格式文件 + 按场景批量编译公式
+
+manim 每个 Tex/MathTex 都单独跑一次 latex + dvisvgm，每次都要重新加载整个导言区（amsmath、physics、
+ctex 等），中文课程里这部分启动时间占了公式编译的大头。这里：
+
+1. 预编译格式：把 tex 模板的导言区用 `-ini` + `\\dump` 编译成 .fmt（按编译器版本和导言区内容命名，
+   每次部署/模板变化只编译一次，多进程用文件锁），之后每个公式只编译正文
+2. 批量编译（可选）：渲染前静态扫描场景代码中字面量的 MathTex/Tex，合成一个多页文档（standalone 的 multi
+   模式，每个公式一页），一次 latex + 一次 dvisvgm 得到全部 SVG，按 manim 的文件名放进 tex_dir；
+   之后场景构造时直接命中。扫描结果不准确（动态拼接的公式、不同模板）只会多编译几页，不会影响输出
+
+任何一步失败都回退到 manim 原来的逐个编译。在渲染进程中调用 install() 启用（render_pool 的 worker 启动时会调用），
+部署时可先运行 `python tex_engine.py --build` 预编译默认模板的格式文件。
+
+环境变量：
+    MANIM_TEX_FMT     1/0，是否使用预编译格式（默认 1）
+    MANIM_TEX_BATCH   1/0，渲染前是否批量编译场景中的公式（默认 0）
+    TEX_FMT_DIR       格式文件目录（默认 <svg 缓存目录>/fmt）
+"""
+
+import os
+import re
+import ast
+import time
+import hashlib
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import svg_cache
+
+FMT_ENABLED = os.environ.get("MANIM_TEX_FMT", "1").lower() not in ("0", "false", "no")
+BATCH_ENABLED = os.environ.get("MANIM_TEX_BATCH", "0").lower() in ("1", "true", "yes")
+DEFAULT_FMT_DIR = os.environ.get("TEX_FMT_DIR", os.path.join(svg_cache.DEFAULT_CACHE_DIR, "fmt"))
+
+# 能 dump 格式文件的编译器及其基础格式（luatex 的格式无法保存已加载的 Lua 状态，不处理）
+_BASE_FORMATS = {"latex": "latex", "pdflatex": "pdflatex", "xelatex": "xelatex"}
+_BEGIN_DOCUMENT = "\\begin{document}"
+_END_DOCUMENT = "\\end{document}"
+_STANDALONE_CLASS = re.compile(r"\\documentclass\s*(?:\[([^\]]*)\])?\s*\{standalone\}")
+# 静态扫描的类及其默认 (tex 环境, 参数连接符)
+_TEX_CLASSES = {
+    "MathTex": ("align*", " "),
+    "SingleStringMathTex": ("align*", " "),
+    "Tex": ("center", ""),
+}
+# 这些参数会改变公式的拆分或模板，扫描时跳过
+_SKIP_KWARGS = {"tex_template", "tex_environment", "arg_separator", "substrings_to_isolate",
+                "tex_to_color_map", "isolate"}
+
+_versions: Dict[str, str] = {}
+_installed = False
+
+
+def split_preamble(tex_code: str) -> Tuple[str, str]:
+    """
+    把完整的 tex 代码拆成 (导言区, 正文)
+
+    Returns:
+        导言区（到 \\begin{document} 之前）和正文（begin/end document 之间）；没有 document 环境时导言区为空
+    """
+    start = tex_code.find(_BEGIN_DOCUMENT)
+    if start < 0:
+        return "", tex_code
+    end = tex_code.rfind(_END_DOCUMENT)
+    end = end if end > start else len(tex_code)
+    return tex_code[:start], tex_code[start + len(_BEGIN_DOCUMENT):end]
+
+
+def _compiler_version(compiler: str) -> str:
+    """格式文件只能被同一版本的引擎加载，版本号计入文件名"""
+    if compiler not in _versions:
+        try:
+            out = subprocess.run([compiler, "--version"], capture_output=True, text=True, timeout=30).stdout
+            _versions[compiler] = out.splitlines()[0] if out else ""
+        except (OSError, subprocess.SubprocessError):
+            _versions[compiler] = ""
+    return _versions[compiler]
+
+
+def _fmt_env(fmt_dir: str) -> Dict[str, str]:
+    # 末尾的分隔符表示继续搜索默认路径
+    return dict(os.environ, TEXFORMATS=f"{fmt_dir}{os.pathsep}")
+
+
+def _compile_command(compiler: str, output_format: str, fmt_name: Optional[str], jobname: str,
+                     output_dir: str, tex_file: str) -> List[str]:
+    cmd = [compiler, "-interaction=batchmode", "-halt-on-error"]
+    if fmt_name:
+        cmd.append(f"-fmt={fmt_name}")
+    if compiler == "xelatex":
+        cmd.append("-no-pdf")
+    else:
+        cmd.append(f"-output-format={output_format.lstrip('.')}")
+    cmd += [f"-jobname={jobname}", f"-output-directory={output_dir}", tex_file]
+    return cmd
+
+
+def build_format(compiler: str, preamble: str, fmt_dir: Optional[str] = None) -> Optional[str]:
+    """
+    把导言区编译成格式文件（已存在时直接返回）
+
+    Args:
+        compiler: latex / pdflatex / xelatex
+        preamble: 导言区（含 \\documentclass）
+        fmt_dir: 格式文件目录
+
+    Returns:
+        格式名（配合 TEXFORMATS=fmt_dir 使用）；不支持或编译失败时返回 None
+    """
+    base = _BASE_FORMATS.get(compiler)
+    if base is None or not preamble.strip():
+        return None
+    version = _compiler_version(compiler)
+    if not version:
+        return None
+    fmt_dir = os.path.abspath(fmt_dir or DEFAULT_FMT_DIR)
+    name = "manim_" + hashlib.sha256(f"{compiler}\0{version}\0{preamble}".encode("utf-8")).hexdigest()[:16]
+    fmt_file = os.path.join(fmt_dir, f"{name}.fmt")
+    failed_file = os.path.join(fmt_dir, f"{name}.failed")
+    if os.path.exists(fmt_file):
+        return name
+    if os.path.exists(failed_file):
+        return None
+
+    with svg_cache.file_lock(os.path.join(fmt_dir, f"{name}.lock")):
+        if os.path.exists(fmt_file):
+            return name
+        if os.path.exists(failed_file):
+            return None
+        build_dir = os.path.join(fmt_dir, f"{name}.build")
+        os.makedirs(build_dir, exist_ok=True)
+        ini_file = os.path.join(build_dir, f"{name}.ini.tex")
+        with open(ini_file, "w", encoding="utf-8") as f:
+            f.write(preamble.rstrip() + "\n\\dump\n")
+        t0 = time.perf_counter()
+        cmd = [compiler, "-ini", "-interaction=batchmode", "-halt-on-error", f"-jobname={name}",
+               f"&{base}", ini_file]
+        try:
+            result = subprocess.run(cmd, cwd=build_dir, capture_output=True, text=True, timeout=300)
+            built = os.path.join(build_dir, f"{name}.fmt")
+            ok = result.returncode == 0 and os.path.exists(built)
+        except (OSError, subprocess.SubprocessError):
+            ok = False
+        if ok:
+            os.replace(built, fmt_file)
+            # 用一个简单公式验证格式文件能正常加载（例如字体无法 dump 的情况）
+            ok = _probe_format(compiler, name, fmt_dir, build_dir)
+            if not ok:
+                os.remove(fmt_file)
+        if not ok:
+            with open(failed_file, "w", encoding="utf-8") as f:
+                f.write(" ".join(cmd) + "\n")
+            print(f"[tex_engine] 格式文件编译失败，回退到逐个完整编译: {compiler} ({failed_file})")
+            return None
+        print(f"[tex_engine] 已生成格式文件 {name}.fmt ({time.perf_counter() - t0:.1f}s)")
+        return name
+
+
+def _probe_format(compiler: str, name: str, fmt_dir: str, build_dir: str) -> bool:
+    probe = os.path.join(build_dir, "probe.tex")
+    with open(probe, "w", encoding="utf-8") as f:
+        f.write(f"{_BEGIN_DOCUMENT}\n$x^2$\n{_END_DOCUMENT}\n")
+    output_format = ".xdv" if compiler == "xelatex" else (".pdf" if compiler == "pdflatex" else ".dvi")
+    cmd = _compile_command(compiler, output_format, name, "probe", build_dir, probe)
+    try:
+        result = subprocess.run(cmd, env=_fmt_env(fmt_dir), capture_output=True, timeout=60)
+    except (OSError, subprocess.SubprocessError):
+        return False
+    return result.returncode == 0 and os.path.exists(os.path.join(build_dir, "probe" + output_format))
+
+
+def compile_with_format(tex_file: Path, compiler: str, output_format: str,
+                        fmt_dir: Optional[str] = None) -> Optional[Path]:
+    """
+    用预编译格式编译 manim 生成的 tex 文件，输出与原编译方式同名
+
+    Returns:
+        输出文件（.dvi/.xdv/.pdf）；无法使用格式文件或编译失败时返回 None（由调用方按原方式编译并报告错误）
+    """
+    tex_file = Path(tex_file)
+    try:
+        preamble, body = split_preamble(tex_file.read_text(encoding="utf-8"))
+    except OSError:
+        return None
+    fmt_dir = os.path.abspath(fmt_dir or DEFAULT_FMT_DIR)
+    name = build_format(compiler, preamble, fmt_dir)
+    if name is None:
+        return None
+    body_file = tex_file.with_suffix(".body.tex")
+    body_file.write_text(f"{_BEGIN_DOCUMENT}{body}{_END_DOCUMENT}\n", encoding="utf-8")
+    cmd = _compile_command(compiler, output_format, name, tex_file.stem, str(tex_file.parent), str(body_file))
+    try:
+        result = subprocess.run(cmd, env=_fmt_env(fmt_dir), stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL, timeout=120)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    finally:
+        body_file.unlink(missing_ok=True)
+    output = tex_file.with_suffix(output_format)
+    if result.returncode != 0 or not output.exists():
+        output.unlink(missing_ok=True)
+        return None
+    return output
+
+
+def collect_expressions(py_path: str) -> List[Tuple[str, str]]:
+    """
+    静态扫描代码中参数全为字符串字面量的 MathTex / Tex
+
+    Returns:
+        [(公式, tex 环境)]，按出现顺序去重
+    """
+    try:
+        with open(py_path, "r", encoding="utf-8") as f:
+            tree = ast.parse(f.read())
+    except (OSError, SyntaxError, ValueError):
+        return []
+    try:
+        from manim.mobject.text.tex_mobject import SingleStringMathTex
+        modify = SingleStringMathTex._modify_special_strings
+    except (ImportError, AttributeError):
+        modify = None
+
+    found: Dict[Tuple[str, str], None] = {}
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        func = node.func
+        cls = func.id if isinstance(func, ast.Name) else (func.attr if isinstance(func, ast.Attribute) else None)
+        if cls not in _TEX_CLASSES or not node.args:
+            continue
+        if any(kw.arg in _SKIP_KWARGS or kw.arg is None for kw in node.keywords):
+            continue
+        if not all(isinstance(a, ast.Constant) and isinstance(a.value, str) for a in node.args):
+            continue
+        environment, separator = _TEX_CLASSES[cls]
+        parts = [a.value for a in node.args]
+        if any("{{" in p for p in parts):
+            continue
+        expression = separator.join(parts).strip()
+        if modify is not None:
+            try:
+                expression = modify(None, expression)
+            except Exception:
+                pass
+        found[(expression, environment)] = None
+    return list(found)
+
+
+def compile_batch(expressions: List[Tuple[str, str]], tex_template=None) -> int:
+    """
+    把多个公式合成一个多页文档一次编译，SVG 按 manim 的文件名写入当前 tex_dir
+
+    Args:
+        expressions: [(公式, tex 环境)]
+        tex_template: 模板；默认 config.tex_template
+
+    Returns:
+        新生成的 SVG 数量（失败时为 0，由 manim 逐个编译）
+    """
+    from manim import config
+    import manim.utils.tex_file_writing as tfw
+
+    template = tex_template or config.tex_template
+    compiler = getattr(template, "tex_compiler", "latex")
+    output_format = getattr(template, "output_format", ".dvi")
+    if output_format == ".pdf":
+        return 0
+    tex_dir = Path(config.get_dir("tex_dir"))
+    tex_dir.mkdir(parents=True, exist_ok=True)
+
+    jobs: Dict[Path, str] = {}
+    for expression, environment in expressions:
+        code = template.get_texcode_for_expression_in_env(expression, environment)
+        svg = tex_dir / f"{tfw.tex_hash(code)}.svg"
+        if not svg.exists():
+            jobs[svg] = split_preamble(code)[1]
+    if len(jobs) < 2:
+        return 0
+
+    # standalone 的 multi 模式：每个 manimpage 环境单独裁成一页，与单独编译时的 preview 页一致
+    preamble = split_preamble(template.get_texcode_for_expression_in_env("x", "align*"))[0]
+    match = _STANDALONE_CLASS.search(preamble)
+    if match is None:
+        return 0
+    options = f"{match.group(1)},multi" if match.group(1) else "multi"
+    preamble = (preamble[:match.start()] + f"\\documentclass[{options}]{{standalone}}" + preamble[match.end():]
+                + "\\newenvironment{manimpage}{}{}\n\\standaloneenv{manimpage}\n")
+
+    t0 = time.perf_counter()
+    stem = f"batch_{os.getpid()}_{hashlib.sha256(''.join(jobs.values()).encode('utf-8')).hexdigest()[:12]}"
+    tex_file = tex_dir / f"{stem}.tex"
+    pages = "".join(f"\\begin{{manimpage}}{body}\\end{{manimpage}}\n" for body in jobs.values())
+    tex_file.write_text(f"{preamble}{_BEGIN_DOCUMENT}\n{pages}{_END_DOCUMENT}\n", encoding="utf-8")
+    produced: List[Path] = []
+    try:
+        dvi = compile_with_format(tex_file, compiler, output_format) if FMT_ENABLED else None
+        if dvi is None:
+            cmd = _compile_command(compiler, output_format, None, stem, str(tex_dir), str(tex_file))
+            subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=300)
+            dvi = tex_file.with_suffix(output_format)
+            if not dvi.exists():
+                return 0
+        subprocess.run(["dvisvgm", "--page=1-", "--no-fonts", "--verbosity=0",
+                        f"--output={(tex_dir / stem).as_posix()}-%p.svg", dvi.as_posix()],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=300)
+        produced = [tex_dir / f"{stem}-{i}.svg" for i in range(1, len(jobs) + 1)]
+        # 页数对不上说明有公式拆页或出错，整批作废
+        if not all(p.exists() for p in produced) or (tex_dir / f"{stem}-{len(jobs) + 1}.svg").exists():
+            return 0
+        for page, svg in zip(produced, jobs):
+            # 与逐个编译共用 svg_cache 的锁，其他 worker 正在编译同一个公式时不覆盖
+            with svg_cache.svg_lock(svg):
+                if not svg.exists():
+                    os.replace(page, svg)
+        print(f"[tex_engine] 批量编译 {len(jobs)} 个公式，用时 {time.perf_counter() - t0:.2f}s")
+        return len(jobs)
+    except (OSError, subprocess.SubprocessError):
+        return 0
+    finally:
+        # tex_dir 由所有 worker 共用，只删除本批次自己的文件
+        own = [tex_dir / f"{stem}{suffix}" for suffix in (".tex", ".body.tex", ".dvi", ".xdv", ".log", ".aux")]
+        for p in own + [tex_dir / f"{stem}-{i}.svg" for i in range(1, len(jobs) + 2)]:
+            p.unlink(missing_ok=True)
+
+
+def prewarm(py_path: str) -> int:
+    """渲染前批量编译场景代码中的字面量公式（MANIM_TEX_BATCH 关闭时不做任何事）"""
+    if not BATCH_ENABLED:
+        return 0
+    expressions = collect_expressions(py_path)
+    if len(expressions) < 2:
+        return 0
+    try:
+        return compile_batch(expressions)
+    except Exception as e:
+        print(f"[tex_engine] 批量编译失败，逐个编译: {e}")
+        return 0
+
+
+def install() -> bool:
+    """
+    在当前进程的 manim 上启用预编译格式（重复调用无副作用）
+
+    Returns:
+        是否已启用
+    """
+    global _installed
+    if _installed:
+        return True
+    if not FMT_ENABLED:
+        return False
+    try:
+        import manim.utils.tex_file_writing as tfw
+    except ImportError:
+        return False
+
+    orig_compile = tfw.compile_tex
+
+    def compile_tex(tex_file, tex_compiler, output_format):
+        if not Path(tex_file).with_suffix(output_format).exists():
+            compile_with_format(Path(tex_file), tex_compiler, output_format)
+        # 已有输出时原函数直接返回；格式文件编译失败时由原函数重新编译并报告错误
+        return orig_compile(tex_file, tex_compiler, output_format)
+
+    tfw.compile_tex = compile_tex
+    _installed = True
+    return True
+
+
+def main():
+    """命令行：为 manim 当前的默认模板预编译格式文件"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="预编译 manim tex 模板的格式文件")
+    parser.add_argument("--build", action="store_true", help="编译默认模板的格式文件")
+    parser.add_argument("--ctex", action="store_true", help="同时编译 TexTemplateLibrary.ctex")
+    parser.add_argument("--fmt-dir", default=None, help="格式文件目录")
+    args = parser.parse_args()
+
+    from manim import config, TexTemplateLibrary
+
+    templates = [config.tex_template]
+    if args.ctex:
+        templates.append(TexTemplateLibrary.ctex)
+    for template in templates:
+        compiler = getattr(template, "tex_compiler", "latex")
+        preamble = split_preamble(template.get_texcode_for_expression_in_env("x", "align*"))[0]
+        name = build_format(compiler, preamble, args.fmt_dir) if args.build else None
+        print(f"{compiler}: {name or '未编译'}")
+
+
+if __name__ == "__main__":
+    main()
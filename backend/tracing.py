@@ -0,0 +1,577 @@
+#!/usr/bin/env python3
+"""
+流水线分阶段追踪（耗时 / CPU / token / 费用 / 重试）
+
+替代手写的 spend-time.txt、render_merge_log_*.txt：每个阶段（outline、paginate、code_gen、speech、
+breakpoint、tts、wait、render、merge、ppt）用 span 包起来，每页再套一个带 page 的 span：
+
+    with tracing.span("code_gen", page="1_2"):
+        ...
+
+    @tracing.traced("render")
+    def render_scene(...):
+        tracing.annotate(page=python_file.stem)
+
+LLM 调用处调用 record_llm_response / record_llm，重试处调用 record_retry，数据记入当前 span。
+
+输出（JSON lines，一行一条，多进程追加写同一个文件）：
+    {"type": "span", "stage": ..., "page": ..., "wall_s": ..., "cpu_s": ..., "tokens_in": ..., ...}
+    {"type": "llm",  "stage": ..., "page": ..., "model": ..., "tokens_in": ..., "cost": ..., "cached": ...}
+    {"type": "retry", "stage": ..., "page": ..., "reason": ...}
+
+用 job() 包住一个任务时写到 <trace_dir>/trace.jsonl，结束后生成 trace_summary.json。
+进程内的输出文件和任务 id 放在 contextvars 里（同一进程里并发的多个任务互不影响，线程池任务用 bind() 继承）；
+子进程（例如 video_render_merge 调起的 batch_render_manim.py）要显式传 env=tracing.child_env()，
+通过环境变量 TRACE_FILE / TRACE_JOB_ID 写入同一个文件。
+每个流水线脚本的入口都用 job() 包住（trace_dir 默认是该阶段的输出目录）；任务调度方设置环境变量 TRACE_DIR
+（以及 TRACE_JOB_ID）时，同一任务的所有阶段写入 <TRACE_DIR>/trace.jsonl。
+没有设置输出文件时 span 只做计时，不写任何内容。
+
+费用按 config.json 的 pricing 段计算（美元 / 百万 token，模型名按最长前缀匹配）：
+    "pricing": {"gpt-5-chat": {"input": 1.25, "output": 10.0}, "gpt-5-nano": {"input": 0.05, "output": 0.4}}
+
+查看汇总：
+    python tracing.py <trace.jsonl>
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import resource
+    HAS_RESOURCE = True
+except ImportError:  # Windows
+    HAS_RESOURCE = False
+
+TRACE_FILE_ENV = "TRACE_FILE"
+TRACE_JOB_ENV = "TRACE_JOB_ID"
+TRACE_DIR_ENV = "TRACE_DIR"
+TRACE_FILE_NAME = "trace.jsonl"
+SUMMARY_FILE_NAME = "trace_summary.json"
+
+_current: "contextvars.ContextVar[Optional[_Span]]" = contextvars.ContextVar("trace_span", default=None)
+# 当前任务的 (输出文件, 任务 id)；未设置时回落到环境变量（子进程从父进程继承）
+_job: "contextvars.ContextVar[Optional[Tuple[str, Optional[str]]]]" = contextvars.ContextVar("trace_job", default=None)
+_write_lock = threading.Lock()
+_update_lock = threading.Lock()
+_pricing: Dict[str, Dict[str, float]] = {}
+# 中日韩字符大约一字一个 token，其余按 4 个字符一个 token 估算（流式接口拿不到 usage 时使用）
+_CJK_RE = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+
+def _child_cpu() -> float:
+    """已结束子进程（manim / ffmpeg）累计的 CPU 时间"""
+    if not HAS_RESOURCE:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def trace_file() -> Optional[str]:
+    """当前任务的追踪输出文件；未启用时为 None"""
+    current = _job.get()
+    if current is not None:
+        return current[0]
+    return os.environ.get(TRACE_FILE_ENV) or None
+
+
+def current_job_id() -> Optional[str]:
+    """当前任务 id；未启用时为 None"""
+    current = _job.get()
+    if current is not None:
+        return current[1]
+    return os.environ.get(TRACE_JOB_ENV) or None
+
+
+def child_env(base: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """
+    给子进程用的环境变量：base（默认 os.environ）的副本，加上当前任务的 TRACE_FILE / TRACE_JOB_ID
+
+        subprocess.run(cmd, env=tracing.child_env())
+    """
+    env = dict(os.environ if base is None else base)
+    path = trace_file()
+    if path:
+        env[TRACE_FILE_ENV] = path
+        jid = current_job_id()
+        if jid:
+            env[TRACE_JOB_ENV] = jid
+    return env
+
+
+def _emit(record: Dict[str, Any]):
+    path = trace_file()
+    if not path:
+        return
+    record.setdefault("job", current_job_id())
+    record.setdefault("pid", os.getpid())
+    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    with _write_lock:
+        # 追加模式单次写入一整行，多进程同时写也不会交错
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+class _Span:
+    """一个计时区间；计数（token、费用、重试）同时累加到所有外层 span"""
+
+    __slots__ = ("stage", "page", "attrs", "span_id", "parent", "t0", "wall0", "cpu0", "child0",
+                 "llm_calls", "cache_hits", "tokens_in", "tokens_out", "cost", "retries")
+
+    def __init__(self, stage: str, page: Optional[str], attrs: Dict[str, Any], parent: Optional["_Span"]):
+        self.stage = stage
+        self.page = page if page is not None else (parent.page if parent is not None and parent.stage == stage else None)
+        self.attrs = attrs
+        self.span_id = uuid.uuid4().hex[:12]
+        self.parent = parent
+        self.t0 = time.time()
+        self.wall0 = time.perf_counter()
+        self.cpu0 = time.process_time()
+        self.child0 = _child_cpu()
+        self.llm_calls = 0
+        self.cache_hits = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.cost = 0.0
+        self.retries = 0
+
+    def _chain(self) -> Iterator["_Span"]:
+        s = self
+        while s is not None:
+            yield s
+            s = s.parent
+
+    def finish(self, error: Optional[BaseException] = None):
+        record = {
+            "type": "span",
+            "stage": self.stage,
+            "page": self.page,
+            "span_id": self.span_id,
+            "parent": self.parent.span_id if self.parent is not None else None,
+            "ts": round(self.t0, 3),
+            "wall_s": round(time.perf_counter() - self.wall0, 4),
+            # 进程 CPU 时间（同一进程内并发的 span 会互相计入）
+            "cpu_s": round(time.process_time() - self.cpu0, 4),
+            "child_cpu_s": round(_child_cpu() - self.child0, 4),
+            "llm_calls": self.llm_calls,
+            "cache_hits": self.cache_hits,
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "cost": round(self.cost, 6),
+            "retries": self.retries,
+            "status": "ok" if error is None else "error",
+        }
+        if error is not None:
+            record["error"] = f"{type(error).__name__}: {error}"[:500]
+        if self.attrs:
+            record["attrs"] = self.attrs
+        _emit(record)
+
+
+@contextmanager
+def span(stage: str, page: Optional[Any] = None, **attrs) -> Iterator[_Span]:
+    """
+    记录一个阶段（或阶段内的一页）的耗时与用量
+
+    Args:
+        stage: 阶段名，例如 code_gen / render
+        page: 页 id（文件名去掉扩展名）；嵌套在同阶段 span 内时默认继承外层的 page
+        **attrs: 附加字段，原样写入记录
+    """
+    s = _Span(stage, str(page) if page is not None else None, attrs, _current.get())
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.finish(e)
+        raise
+    else:
+        s.finish()
+    finally:
+        _current.reset(token)
+
+
+def traced(stage: str, **attrs) -> Callable:
+    """
+    span 的装饰器形式，支持普通函数与协程函数；函数内可用 annotate(page=...) 补充页 id
+    """
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage, **attrs):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage, **attrs):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind(func: Callable) -> Callable:
+    """
+    让线程池里的任务继承提交时的 span（contextvars 默认不会传入线程池）：
+        executor.submit(tracing.bind(self.process_single_file), ...)
+    """
+    ctx = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # 每次调用复制一份，同一个 context 不能在多个线程里同时进入
+        return ctx.copy().run(func, *args, **kwargs)
+    return wrapper
+
+
+def annotate(page: Optional[Any] = None, **attrs):
+    """给当前 span 补充页 id 或附加字段（不在 span 内时忽略）"""
+    s = _current.get()
+    if s is None:
+        return
+    if page is not None:
+        s.page = str(page)
+    if attrs:
+        s.attrs.update(attrs)
+
+
+def current_stage() -> Optional[str]:
+    s = _current.get()
+    return s.stage if s is not None else None
+
+
+# ----------------------------------------------------------------------
+# LLM 用量
+# ----------------------------------------------------------------------
+
+def configure_pricing(config: Optional[Dict[str, Any]]):
+    """从 config.json 读取 pricing 段（美元 / 百万 token）；重复调用会合并"""
+    pricing = (config or {}).get("pricing") or {}
+    for model, price in pricing.items():
+        if isinstance(price, dict):
+            _pricing[model] = {"input": float(price.get("input", 0.0)), "output": float(price.get("output", 0.0))}
+
+
+def estimate_cost(model: Optional[str], tokens_in: int, tokens_out: int) -> float:
+    """按 pricing 计算费用；模型名按最长前缀匹配，没有配置时为 0"""
+    if not model or not _pricing:
+        return 0.0
+    price = _pricing.get(model)
+    if price is None:
+        matches = [name for name in _pricing if model.startswith(name)]
+        if not matches:
+            return 0.0
+        price = _pricing[max(matches, key=len)]
+    return (tokens_in * price["input"] + tokens_out * price["output"]) / 1_000_000
+
+
+def estimate_tokens(content: Any) -> int:
+    """粗略估算文本 token 数；content 可以是字符串、OpenAI 消息列表或 content 分段列表（图片不计）"""
+    if content is None:
+        return 0
+    if isinstance(content, str):
+        cjk = len(_CJK_RE.findall(content))
+        return cjk + (len(content) - cjk + 3) // 4
+    if isinstance(content, dict):
+        if "content" in content:
+            return estimate_tokens(content["content"])
+        return estimate_tokens(content.get("text"))
+    if isinstance(content, (list, tuple)):
+        return sum(estimate_tokens(part) for part in content)
+    return 0
+
+
+def _usage_value(usage: Any, *names: str) -> Optional[int]:
+    for name in names:
+        value = usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+        if isinstance(value, (int, float)):
+            return int(value)
+    return None
+
+
+def record_llm(model: Optional[str], tokens_in: int = 0, tokens_out: int = 0, cached: bool = False,
+               estimated: bool = False, latency: Optional[float] = None):
+    """
+    记录一次 LLM 调用
+
+    Args:
+        model: 模型名
+        tokens_in: 输入 token 数
+        tokens_out: 输出 token 数
+        cached: 是否命中响应缓存（不计 token 与费用）
+        estimated: token 数是否为估算值（流式接口没有 usage 时）
+        latency: 耗时（秒）
+    """
+    if cached:
+        tokens_in = tokens_out = 0
+    cost = estimate_cost(model, tokens_in, tokens_out)
+    s = _current.get()
+    if s is not None:
+        with _update_lock:
+            for node in s._chain():
+                node.llm_calls += 1
+                node.cache_hits += int(cached)
+                node.tokens_in += tokens_in
+                node.tokens_out += tokens_out
+                node.cost += cost
+    if trace_file():
+        record = {
+            "type": "llm",
+            "stage": s.stage if s is not None else None,
+            "page": s.page if s is not None else None,
+            "ts": round(time.time(), 3),
+            "model": model,
+            "tokens_in": tokens_in,
+            "tokens_out": tokens_out,
+            "cost": round(cost, 6),
+            "cached": cached,
+            "estimated": estimated,
+        }
+        if latency is not None:
+            record["latency_s"] = round(latency, 3)
+        _emit(record)
+
+
+def record_llm_response(model: Optional[str], response: Any = None, prompt: Any = None, completion: Any = None,
+                        latency: Optional[float] = None):
+    """
+    从 SDK 响应（或 usage 对象 / dict）中取 token 用量记录；拿不到 usage 时按 prompt / completion 文本估算
+
+    Args:
+        model: 模型名
+        response: chat.completions / responses 的返回值，或其 usage 字段
+        prompt: 输入内容（估算用）
+        completion: 输出文本（估算用）
+        latency: 耗时（秒）
+    """
+    usage = getattr(response, "usage", None) if response is not None and not isinstance(response, dict) else response
+    if isinstance(response, dict) and "usage" in response:
+        usage = response["usage"]
+    tokens_in = _usage_value(usage, "prompt_tokens", "input_tokens") if usage is not None else None
+    tokens_out = _usage_value(usage, "completion_tokens", "output_tokens") if usage is not None else None
+    if tokens_in is None and tokens_out is None:
+        record_llm(model, estimate_tokens(prompt), estimate_tokens(completion), estimated=True, latency=latency)
+    else:
+        record_llm(model, tokens_in or 0, tokens_out or 0, latency=latency)
+
+
+def record_retry(reason: Optional[str] = None):
+    """记录一次重试（计入当前 span 及其外层）"""
+    s = _current.get()
+    if s is not None:
+        with _update_lock:
+            for node in s._chain():
+                node.retries += 1
+    if trace_file():
+        _emit({
+            "type": "retry",
+            "stage": s.stage if s is not None else None,
+            "page": s.page if s is not None else None,
+            "ts": round(time.time(), 3),
+            "reason": (reason or "")[:300],
+        })
+
+
+# ----------------------------------------------------------------------
+# 任务与汇总
+# ----------------------------------------------------------------------
+
+@contextmanager
+def job(job_id: Optional[str] = None, trace_dir: Optional[str] = None, stage: str = "job") -> Iterator[Optional[str]]:
+    """
+    开启一个任务级追踪：设置当前上下文的输出文件（子进程通过 child_env() 继承），结束时写出汇总
+
+    Args:
+        job_id: 任务 id；默认沿用外层任务 / 环境变量 TRACE_JOB_ID，否则随机生成
+        trace_dir: 输出目录；环境变量 TRACE_DIR 优先；都为 None 且外层也没有输出文件时不启用
+        stage: 最外层 span 的名字
+
+    Yields:
+        trace.jsonl 路径（未启用时为 None）
+    """
+    path = trace_file()
+    owner = False
+    trace_dir = os.environ.get(TRACE_DIR_ENV) or trace_dir
+    if trace_dir and not path:
+        os.makedirs(trace_dir, exist_ok=True)
+        path = os.path.join(trace_dir, TRACE_FILE_NAME)
+        owner = True
+    token = None
+    if path:
+        # 只改当前上下文，不动 os.environ：同一进程里的另一个任务（例如后台线程里的终版渲染）不受影响
+        token = _job.set((path, current_job_id() or job_id or uuid.uuid4().hex[:12]))
+    try:
+        with span(stage):
+            yield path
+    finally:
+        # 嵌套调用时只由最外层的 job 写汇总
+        if owner:
+            try:
+                write_summary(path)
+            except Exception as e:
+                print(f"[tracing] 写出汇总失败: {e}")
+        if token is not None:
+            _job.reset(token)
+
+
+def load_records(path: str) -> List[Dict[str, Any]]:
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # 进程被杀时可能留下半行
+                continue
+    return records
+
+
+def summarize(records: List[Dict[str, Any]], top_pages: int = 20) -> Dict[str, Any]:
+    """
+    按阶段和页汇总
+
+    - 耗时 / CPU：每个阶段取最外层的同名 span 求和（嵌套的同阶段 span 不重复计算）；
+      阶段内既有整体 span 又有逐页 span 时只用整体 span（逐页 span 可能在线程池里并行）
+    - token / 费用 / 重试：按 llm / retry 事件归到发生时所在的阶段和页
+
+    Returns:
+        {"job", "wall_s", "cost", "stages": {stage: {...}}, "pages": [最慢的若干页]}
+    """
+    spans = [r for r in records if r.get("type") == "span"]
+    by_id = {r["span_id"]: r for r in spans if r.get("span_id")}
+    stages: Dict[str, Dict[str, Any]] = {}
+    pages: Dict[Any, Dict[str, Any]] = {}
+
+    def _stage(name):
+        name = name or "unattributed"
+        if name not in stages:
+            stages[name] = {"wall_s": 0.0, "cpu_s": 0.0, "child_cpu_s": 0.0, "spans": 0, "pages": 0, "errors": 0,
+                            "llm_calls": 0, "cache_hits": 0, "tokens_in": 0, "tokens_out": 0, "cost": 0.0,
+                            "retries": 0, "first_ts": None, "_whole": [0.0, 0.0, 0.0, 0], "_paged": [0.0, 0.0, 0.0]}
+        return stages[name]
+
+    def _page(stage, page):
+        key = (stage or "unattributed", page)
+        if key not in pages:
+            pages[key] = {"stage": key[0], "page": page, "wall_s": 0.0, "tokens_in": 0, "tokens_out": 0,
+                          "cost": 0.0, "retries": 0, "status": "ok"}
+        return pages[key]
+
+    for r in spans:
+        st = _stage(r.get("stage"))
+        st["spans"] += 1
+        if r.get("ts") is not None and (st["first_ts"] is None or r["ts"] < st["first_ts"]):
+            st["first_ts"] = r["ts"]
+        if r.get("status") == "error":
+            st["errors"] += 1
+        parent = by_id.get(r.get("parent"))
+        if parent is None or parent.get("stage") != r.get("stage"):
+            acc = st["_paged"] if r.get("page") is not None else st["_whole"]
+            acc[0] += r.get("wall_s", 0.0)
+            acc[1] += r.get("cpu_s", 0.0)
+            acc[2] += r.get("child_cpu_s", 0.0)
+            if r.get("page") is None:
+                st["_whole"][3] += 1
+        if r.get("page") is not None and (parent is None or parent.get("page") != r.get("page")):
+            st["pages"] += 1
+            pg = _page(r.get("stage"), r["page"])
+            pg["wall_s"] += r.get("wall_s", 0.0)
+            if r.get("status") == "error":
+                pg["status"] = "error"
+
+    for r in records:
+        kind = r.get("type")
+        if kind not in ("llm", "retry"):
+            continue
+        st = _stage(r.get("stage"))
+        pg = _page(r.get("stage"), r["page"]) if r.get("page") is not None else None
+        if kind == "retry":
+            st["retries"] += 1
+            if pg is not None:
+                pg["retries"] += 1
+            continue
+        st["llm_calls"] += 1
+        st["cache_hits"] += int(bool(r.get("cached")))
+        for target in filter(None, (st, pg)):
+            target["tokens_in"] += r.get("tokens_in", 0)
+            target["tokens_out"] += r.get("tokens_out", 0)
+            target["cost"] += r.get("cost", 0.0)
+
+    ordered = dict(sorted(stages.items(), key=lambda kv: kv[1]["first_ts"] or float("inf")))
+    for st in ordered.values():
+        st.pop("first_ts", None)
+        whole, paged = st.pop("_whole"), st.pop("_paged")
+        st["wall_s"], st["cpu_s"], st["child_cpu_s"] = whole[:3] if whole[3] else paged
+        for k in ("wall_s", "cpu_s", "child_cpu_s"):
+            st[k] = round(st[k], 3)
+        st["cost"] = round(st["cost"], 6)
+    page_list = sorted(pages.values(), key=lambda p: p["wall_s"], reverse=True)[:top_pages]
+    for pg in page_list:
+        pg["wall_s"] = round(pg["wall_s"], 3)
+        pg["cost"] = round(pg["cost"], 6)
+
+    ts = [r["ts"] for r in spans if r.get("ts") is not None]
+    ends = [r["ts"] + r.get("wall_s", 0.0) for r in spans if r.get("ts") is not None]
+    return {
+        "job": next((r.get("job") for r in records if r.get("job")), None),
+        "wall_s": round(max(ends) - min(ts), 3) if ts else 0.0,
+        "cost": round(sum(st["cost"] for st in ordered.values()), 6),
+        "stages": ordered,
+        "pages": page_list,
+    }
+
+
+def write_summary(path: str, out_path: Optional[str] = None) -> Dict[str, Any]:
+    """读取 trace.jsonl 并在同目录写出 trace_summary.json"""
+    summary = summarize(load_records(path))
+    out_path = out_path or os.path.join(os.path.dirname(os.path.abspath(path)), SUMMARY_FILE_NAME)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return summary
+
+
+def format_summary(summary: Dict[str, Any]) -> str:
+    lines = [f"job={summary.get('job')}  wall={summary['wall_s']:.1f}s  cost=${summary['cost']:.4f}", ""]
+    lines.append(f"{'stage':<14}{'wall_s':>10}{'cpu_s':>10}{'child_cpu':>10}{'pages':>7}{'calls':>7}"
+                 f"{'tok_in':>10}{'tok_out':>10}{'cost':>10}{'retry':>7}{'err':>5}")
+    for name, st in summary["stages"].items():
+        lines.append(f"{name:<14}{st['wall_s']:>10.1f}{st['cpu_s']:>10.1f}{st['child_cpu_s']:>10.1f}"
+                     f"{st['pages']:>7}{st['llm_calls']:>7}{st['tokens_in']:>10}{st['tokens_out']:>10}"
+                     f"{st['cost']:>10.4f}{st['retries']:>7}{st['errors']:>5}")
+    if summary["pages"]:
+        lines += ["", "slowest pages:"]
+        for pg in summary["pages"]:
+            lines.append(f"  {pg['stage']:<12} {str(pg['page']):<24} {pg['wall_s']:>8.1f}s  "
+                         f"tok={pg['tokens_in']}/{pg['tokens_out']}  retries={pg['retries']}  {pg['status']}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a pipeline trace file")
+    parser.add_argument("trace", help="trace.jsonl path")
+    parser.add_argument("--write", action="store_true", help="Also write trace_summary.json next to the trace")
+    args = parser.parse_args()
+    if not os.path.exists(args.trace):
+        print(f"找不到追踪文件: {args.trace}")
+        sys.exit(1)
+    summary = write_summary(args.trace) if args.write else summarize(load_records(args.trace))
+    print(format_summary(summary))
+
+
+if __name__ == "__main__":
+    main()
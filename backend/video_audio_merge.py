@@ -8,6 +8,19 @@ import subprocess
 import shutil
 from pathlib import Path
 
+import tracing
+import course_assembler
+import page_mux
+import clip_normalize
+import hls_package
+
+# 为 True 时一次 ffmpeg 调用直接组装 Full.mp4（见 course_assembler），失败再回退到逐页 合并 → 填充 → 串联
+SINGLE_PASS = os.environ.get("COURSE_SINGLE_PASS", "1") != "0"
+# 为 True 时生成 Full.mp4 后再打包成按页对齐的 HLS（见 hls_package）
+PACKAGE_HLS = os.environ.get("COURSE_HLS", "0") == "1"
+# 任务 id（由调起本脚本的任务传入），HLS 输出到 HLS_ROOT/<任务 id>/；没有时用输出目录名，见 hls_package.course_name
+COURSE_JOB_ID = os.environ.get("COURSE_JOB_ID") or None
+
 def check_ffmpeg():
     """检查ffmpeg是否安装"""
     try:
@@ -99,8 +112,10 @@ def find_matching_files(video_dir, audio_dir):
     
     return matches
 
+@tracing.traced("merge", step="mux")
 def merge_video_audio(video_file, audio_file, output_file):
     """使用ffmpeg合并视频和音频"""
+    tracing.annotate(page=os.path.splitext(os.path.basename(output_file))[0])
     cmd = [
         '/home/EduAgent/miniconda3/envs/manim_env/bin/ffmpeg',
         '-i', video_file,
@@ -124,8 +139,10 @@ def merge_video_audio(video_file, audio_file, output_file):
         print(f"   错误输出: {e.stderr}")
         return False
 
+@tracing.traced("merge", step="pad")
 def pad_video(input_file, output_file):
     """对视频进行填充处理"""
+    tracing.annotate(page=os.path.splitext(os.path.basename(input_file))[0])
     cmd = [
         '/home/EduAgent/miniconda3/envs/manim_env/bin/ffmpeg',
         '-i', input_file,
@@ -201,10 +218,20 @@ def generate_filelist(categories, output_dir):
         print(f"❌ 文件列表生成失败: {e}")
         return False
 
+@tracing.traced("merge", step="concat")
 def concat_videos(filelist_path, output_dir):
     """使用ffmpeg串联所有视频"""
     output_file = os.path.join(output_dir, "Full.mp4")
     
+    # 参数不一致的片段先统一编码，保证下面的 -c copy 只是重新封装
+    if not clip_normalize.normalize_filelist(filelist_path):
+        # 仍不一致时流拷贝会得到错乱的时间戳，改为整体重新编码
+        print("⚠️  无法确认所有片段编码参数一致，改为重新编码串联")
+        if clip_normalize.reencode_concat(filelist_path, output_file):
+            print(f"✅ 视频串联成功: Full.mp4 ({os.path.getsize(output_file) / (1024 * 1024):.1f} MB)")
+            return True
+        return False
+    
     # 使用相对路径，避免路径问题
     cmd = [
         '/home/EduAgent/miniconda3/envs/manim_env/bin/ffmpeg',
@@ -239,6 +266,38 @@ def concat_videos(filelist_path, output_dir):
         print(f"   错误输出: {e.stderr}")
         return False
 
+def merge_and_pad(video_file, audio_file, output_dir, basename):
+    """单页: 合并音视频后填充，生成 <名称>-padded.mp4"""
+    merged_file = os.path.join(output_dir, f"{basename}.mp4")
+    padded_file = os.path.join(output_dir, f"{basename}-padded.mp4")
+    return merge_video_audio(video_file, audio_file, merged_file) and pad_video(merged_file, padded_file)
+
+def assemble_single_pass(matches, output_dir):
+    """按教学结构排序后一次组装 Full.mp4，成功返回 True"""
+    print("🎬 单次组装: 合并 + 填充 + 串联 (Full.mp4)")
+    audio_of = {video_file: audio_file for video_file, audio_file, _ in matches}
+    categories = categorize_videos(list(audio_of))
+    chapters = [(category, [(video_file, audio_of[video_file]) for video_file in categories[category]])
+                for category in ['Introduction', 'Method', 'Experiment', 'Conclusion']]
+    for category, pages in chapters:
+        print(f"   📂 {category}: {len(pages)} 个文件" if pages else f"   📂 {category}: 无文件")
+    
+    full_video_path = os.path.join(output_dir, "Full.mp4")
+    if not course_assembler.assemble_course(chapters, full_video_path):
+        print("⚠️  单次组装失败，改用逐页处理")
+        print()
+        return False
+    
+    file_size = os.path.getsize(full_video_path) / (1024 * 1024)  # MB
+    print()
+    print("🎊 成功生成完整教学视频！")
+    print(f"   📁 文件路径: {full_video_path}")
+    print(f"   📊 文件大小: {file_size:.1f} MB")
+    if PACKAGE_HLS:
+        hls_package.package_course(full_video_path, job_id=COURSE_JOB_ID)
+    return True
+
+@tracing.traced("merge")
 def main():
     # 检查参数
     if len(sys.argv) != 4:
@@ -311,64 +370,21 @@ def main():
     print(f"✅ 找到 {len(matches)} 对匹配文件")
     print()
     
-    # 逐个合并文件
-    success_count = 0
-    total_count = len(matches)
+    if SINGLE_PASS and assemble_single_pass(matches, output_video_dir):
+        return
     
-    print("🎬 开始合并视频和音频...")
-    for i, (video_file, audio_file, basename) in enumerate(matches, 1):
-        print(f"\n[{i}/{total_count}] 处理文件: {basename}")
-        
-        # 构建输出文件路径
-        output_file = os.path.join(output_video_dir, f"{basename}.mp4")
-        
-        # 合并文件
-        if merge_video_audio(video_file, audio_file, output_file):
-            success_count += 1
-        else:
-            print(f"⚠️  跳过文件: {basename}")
+    # 逐页 合并 → 填充，多页并行
+    jobs = [(basename, merge_and_pad, (video_file, audio_file, output_video_dir, basename))
+            for video_file, audio_file, basename in matches]
+    done, _ = page_mux.mux_pages(jobs, label="合并填充")
+    padded_videos = [os.path.join(output_video_dir, f"{basename}-padded.mp4") for basename in done]
+    success_count = pad_success_count = len(done)
     
-    # 显示合并结果
     print()
-    print("🎉 视频音频合并完成！")
+    print("🎉 视频音频合并填充完成！")
     print("=" * 50)
-    print(f"📊 合并结果:")
-    print(f"   ✅ 成功: {success_count} 个文件")
-    print(f"   ❌ 失败: {total_count - success_count} 个文件")
     print(f"   📁 输出位置: {output_video_dir}")
     
-    if success_count == 0:
-        print()
-        print("❌ 没有成功合并的文件，跳过后续处理")
-        return
-    
-    # Step 2: 视频填充处理
-    print()
-    print("🔧 执行Step 2: 视频填充处理...")
-    
-    merged_videos = glob.glob(os.path.join(output_video_dir, "*.mp4"))
-    padded_videos = []
-    pad_success_count = 0
-    
-    for i, video_file in enumerate(merged_videos, 1):
-        basename = os.path.splitext(os.path.basename(video_file))[0]
-        padded_filename = f"{basename}-padded.mp4"
-        padded_filepath = os.path.join(output_video_dir, padded_filename)
-        
-        print(f"\n[{i}/{len(merged_videos)}] 填充处理: {basename}")
-        
-        if pad_video(video_file, padded_filepath):
-            padded_videos.append(padded_filepath)
-            pad_success_count += 1
-        else:
-            print(f"⚠️  跳过填充: {basename}")
-    
-    print()
-    print("🔧 视频填充处理完成！")
-    print(f"📊 填充结果:")
-    print(f"   ✅ 成功: {pad_success_count} 个文件")
-    print(f"   ❌ 失败: {len(merged_videos) - pad_success_count} 个文件")
-    
     if pad_success_count == 0:
         print()
         print("❌ 没有成功填充的文件，跳过文件列表生成")
@@ -445,6 +461,8 @@ def main():
                 print(f"   📊 文件大小: {file_size:.1f} MB")
                 print()
                 print("✨ 从论文到教学视频的完整转换已完成！")
+                if PACKAGE_HLS:
+                    hls_package.package_course(full_video_path, job_id=COURSE_JOB_ID)
             
         else:
             print()
@@ -466,4 +484,6 @@ def main():
         print("⚠️  文件列表生成失败，跳过视频串联")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    # 由 video_render_merge 调起时沿用其追踪文件，单独运行时写到输出目录
+    with tracing.job(trace_dir=sys.argv[3] if len(sys.argv) == 4 else None, stage="merge"):
+        main() 
\ No newline at end of file
@@ -4,15 +4,24 @@
 与 video_audio_merge_single.py 基本一致，但在第二步根据时长决定处理方式：
 - 如果视频更长或时长相近：为音频做 apad，并用 -shortest 截断，保持原逻辑。
 - 如果音频更长：克隆视频最后一帧延长视频，直到匹配音频时长。
+  只重新编码最后一个关键帧之后的尾段，前面部分流拷贝（见 extend_tail）。
 """
 
 import os
 import sys
+import json
 import subprocess
+from typing import Dict, List, Optional
+
+import page_mux
+import clip_normalize
 
 
 FFMPEG_BIN = "/home/EduAgent/miniconda3/envs/manim_env/bin/ffmpeg"
-FFPROBE_BIN = "/home/EduAgent/miniconda3/envs/manim_env/bin/ffprobe"
+# 音频更长时只重新编码尾段（0 关闭，改回整段重新编码）
+EXTEND_TAIL_ONLY = os.environ.get("MERGE_EXTEND_TAIL_ONLY", "1") != "0"
+# 尾段编码质量，与 manim 输出的 crf 保持一致
+EXTEND_CRF = int(os.environ.get("MERGE_EXTEND_CRF", "23"))
 
 
 def check_ffmpeg() -> bool:
@@ -25,26 +34,8 @@ def check_ffmpeg() -> bool:
 
 
 def get_duration(path: str) -> float:
-    """使用 ffprobe 获取媒体时长（秒）。返回 0 表示失败。"""
-    try:
-        result = subprocess.run(
-            [
-                FFPROBE_BIN,
-                "-v",
-                "error",
-                "-show_entries",
-                "format=duration",
-                "-of",
-                "default=noprint_wrappers=1:nokey=1",
-                path,
-            ],
-            capture_output=True,
-            text=True,
-            check=True,
-        )
-        return float(result.stdout.strip())
-    except Exception:
-        return 0.0
+    """获取媒体时长（秒）：wav 直接读文件头，其他用 ffprobe。返回 0 表示失败。"""
+    return page_mux.media_duration(path)
 
 
 def merge_video_audio(video_file: str, audio_file: str, output_file: str) -> bool:
@@ -80,6 +71,120 @@ def merge_video_audio(video_file: str, audio_file: str, output_file: str) -> boo
         return False
 
 
+def _hold_filter(pen_start: float, pen_end: float, extra: float) -> str:
+    """[pen_start, pen_end) 换成其首帧并多停留 extra 秒，前后内容照常；pen_start 为 0 时没有前段"""
+    hold = (f"trim=start={pen_start}:end={pen_end},setpts=PTS-STARTPTS,"
+            f"fps=1,select=eq(n\\,0),tpad=stop_mode=clone:stop_duration={extra}[hold];")
+    tail = f"[v2]trim=start={pen_end},setpts=PTS-STARTPTS[tail];"
+    if pen_start <= 0:
+        return f"[0:v]split=2[v1][v2];[v1]{hold}{tail}[hold][tail]concat=n=2:v=1:a=0[vout]"
+    return (
+        f"[0:v]split=3[v0][v1][v2];"
+        f"[v0]trim=end={pen_start},setpts=PTS-STARTPTS[head];"
+        f"[v1]{hold}{tail}"
+        f"[head][hold][tail]concat=n=3:v=1:a=0[vout]"
+    )
+
+
+# 尾段必须与头部逐项一致才能流拷贝拼接
+TAIL_KEYS = ("codec_name", "profile", "level", "width", "height", "pix_fmt", "r_frame_rate", "time_base")
+
+
+def keyframe_before(path: str, t: float) -> float:
+    """返回不晚于 t 的最后一个视频关键帧时间（只读包信息，不解码），失败返回 0"""
+    return max((k for k in page_mux.keyframe_times(path) if k <= t), default=0.0)
+
+
+def probe_encoding(path: str) -> Optional[Dict]:
+    """读取首个视频流的编码参数（TAIL_KEYS），失败返回 None"""
+    cmd = [page_mux.FFPROBE, "-v", "error", "-select_streams", "v:0",
+           "-show_entries", "stream=" + ",".join(TAIL_KEYS), "-of", "json", path]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        streams = json.loads(result.stdout or "{}").get("streams") or []
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError):
+        return None
+    return streams[0] if streams else None
+
+
+def tail_encode_args(head: Dict) -> Optional[List[str]]:
+    """
+    按头部的编码参数生成尾段的 libx264 参数
+
+    Args:
+        head: probe_encoding 的结果（流拷贝切出的头部）
+
+    Returns:
+        ffmpeg 输出参数；头部不是 h264，或 profile / level 无法让 libx264 原样复现时返回 None
+    """
+    if head.get("codec_name") != "h264":
+        return None
+    profile = clip_normalize.X264_PROFILES.get((head.get("profile") or "").lower())
+    try:
+        level = int(head.get("level"))
+    except (TypeError, ValueError):
+        return None
+    if not profile or level <= 0 or not head.get("pix_fmt") or not head.get("time_base"):
+        return None
+    return ["-r", head.get("r_frame_rate") or "30", "-c:v", "libx264", "-profile:v", profile,
+            "-level:v", f"{level // 10}.{level % 10}", "-pix_fmt", head["pix_fmt"], "-crf", str(EXTEND_CRF),
+            "-x264-params", "repeat-headers=1", "-video_track_timescale", head["time_base"].split("/")[-1]]
+
+
+def extend_tail(temp_file: str, output_file: str, pen_start: float, pen_end: float, extra: float) -> bool:
+    """
+    只重新编码尾部来延长视频
+
+    关键帧之前的部分原样流拷贝；编码参数取自切出的头部本身（profile、level、像素格式、帧率、时间基），
+    从该关键帧开始按这组参数编码停留帧和尾段，确认尾段参数与头部逐项一致后，再用 concat demuxer
+    流拷贝拼接并复用原音频。尾段每个关键帧都带 SPS/PPS，拼接后无需重新编码。
+    参数无法复现、编码失败或不一致时返回 False，由调用方整段重新编码。
+
+    Returns:
+        是否成功
+    """
+    keyframe = keyframe_before(temp_file, pen_start)
+    if keyframe <= 0:
+        return False
+    base = os.path.splitext(output_file)[0]
+    head_file, tail_file, list_file = f"{base}_head.mp4", f"{base}_tail.mp4", f"{base}_parts.txt"
+    try:
+        subprocess.run([FFMPEG_BIN, "-y", "-loglevel", "error", "-i", temp_file, "-map", "0:v:0",
+                        "-t", f"{keyframe:.6f}", "-c", "copy", head_file],
+                       capture_output=True, text=True, check=True)
+        head = probe_encoding(head_file)
+        args = tail_encode_args(head) if head else None
+        if args is None:
+            print("⚠️  无法按原视频参数编码尾段，改为整段重新编码")
+            return False
+
+        print(f"   Step 2: 音频更长，仅重新编码 {keyframe:.2f}s 之后的尾段（停留 {extra:.2f}s），其余流拷贝")
+        subprocess.run([FFMPEG_BIN, "-y", "-loglevel", "error", "-ss", f"{keyframe:.6f}", "-i", temp_file,
+                        "-filter_complex", _hold_filter(pen_start - keyframe, pen_end - keyframe, extra),
+                        "-map", "[vout]"] + args + ["-an", tail_file],
+                       capture_output=True, text=True, check=True)
+        tail = probe_encoding(tail_file)
+        diff = [k for k in TAIL_KEYS if tail is None or str(tail.get(k)) != str(head.get(k))]
+        if diff:
+            print(f"⚠️  尾段编码参数与原视频不一致（{', '.join(diff)}），改为整段重新编码")
+            return False
+
+        with open(list_file, "w", encoding="utf-8") as f:
+            f.write(page_mux.concat_list_line(head_file))
+            f.write(page_mux.concat_list_line(tail_file))
+        subprocess.run([FFMPEG_BIN, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_file,
+                        "-i", temp_file, "-map", "0:v", "-map", "1:a?", "-c", "copy", output_file],
+                       capture_output=True, text=True, check=True)
+        return os.path.exists(output_file)
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        print(f"⚠️  尾段编码失败，改为整段重新编码: {getattr(e, 'stderr', e)}")
+        return False
+    finally:
+        for path in (head_file, tail_file, list_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+
 def pad_or_extend(temp_file: str, output_file: str, video_duration: float, audio_duration: float) -> bool:
     """
     第二步：根据时长分支处理。
@@ -132,14 +237,10 @@ def pad_or_extend(temp_file: str, output_file: str, video_duration: float, audio
         else:
             pen_start = max(video_duration - 2.5, 0)
             pen_end = max(video_duration - 1.5, 0)
-            filter_complex = (
-                f"[0:v]split=3[v0][v1][v2];"
-                f"[v0]trim=end={pen_start},setpts=PTS-STARTPTS[head];"
-                f"[v1]trim=start={pen_start}:end={pen_end},setpts=PTS-STARTPTS,"
-                f"fps=1,select=eq(n\\,0),tpad=stop_mode=clone:stop_duration={extra}[hold];"
-                f"[v2]trim=start={pen_end},setpts=PTS-STARTPTS[tail];"
-                f"[head][hold][tail]concat=n=3:v=1:a=0[vout]"
-            )
+            if EXTEND_TAIL_ONLY and extend_tail(temp_file, output_file, pen_start, pen_end, extra):
+                print(f"✅ 输出完成: {os.path.basename(output_file)}")
+                return True
+            filter_complex = _hold_filter(pen_start, pen_end, extra)
             cmd = [
                 FFMPEG_BIN,
                 "-i",
@@ -172,15 +273,62 @@ def pad_or_extend(temp_file: str, output_file: str, video_duration: float, audio
             return False
 
 
+def merge_page(audio_file: str, video_file: str, output_file: str,
+               video_duration: float = None, audio_duration: float = None) -> bool:
+    """
+    单页完整流程：合并 → 按时长补静音或延长视频 → 清理临时文件
+
+    Args:
+        video_duration / audio_duration: 已探测的时长，None 时现场探测
+    """
+    output_dir = os.path.dirname(output_file)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    temp_merged_file = output_file.replace(".mp4", "_temp.mp4")
+    try:
+        if not merge_video_audio(video_file, audio_file, temp_merged_file):
+            print("❌ 音视频合并失败")
+            return False
+        if video_duration is None:
+            video_duration = get_duration(video_file)
+        if audio_duration is None:
+            audio_duration = get_duration(audio_file)
+        print(f"   时长检测 {os.path.basename(video_file)}: video={video_duration:.2f}s, audio={audio_duration:.2f}s")
+        return pad_or_extend(temp_merged_file, output_file, video_duration, audio_duration)
+    finally:
+        if os.path.exists(temp_merged_file):
+            os.remove(temp_merged_file)
+
+
+def merge_dir(audio_dir: str, video_dir: str, output_dir: str) -> bool:
+    """目录模式：一次性探测所有时长，再并行处理所有同名的 <名称>.mp4 / <名称>.wav"""
+    pages = []
+    for name in sorted(os.listdir(video_dir)):
+        base, ext = os.path.splitext(name)
+        audio_file = os.path.join(audio_dir, f"{base}.wav")
+        if ext.lower() == ".mp4" and os.path.exists(audio_file):
+            pages.append((base, audio_file, os.path.join(video_dir, name)))
+    if not pages:
+        print("❌ 未找到任何匹配的文件对")
+        return False
+    durations = page_mux.probe_many(path for _, audio, video in pages for path in (video, audio))
+    jobs = [(base, merge_page, (audio, video, os.path.join(output_dir, f"{base}.mp4"),
+                                durations[video], durations[audio]))
+            for base, audio, video in pages]
+    _, failed = page_mux.mux_pages(jobs, label="合并")
+    return not failed
+
+
 def main():
     # 参数检查
     if len(sys.argv) != 4:
         print("❌ 错误: 请提供三个参数")
         print("📝 使用方法: python3 video_audio_merge_change.py <音频文件> <视频文件> <输出文件>")
         print("📝 示例: python3 video_audio_merge_change.py cover.wav cover.mp4 cover-merged.mp4")
+        print("📝 目录模式: python3 video_audio_merge_change.py <音频目录> <视频目录> <输出目录>")
         print()
         print("🎯 功能说明:")
-        print("   1. 将单个音频文件与单个视频文件进行合并")
+        print("   1. 将单个音频文件与单个视频文件进行合并（目录模式下所有同名文件并行处理）")
         print("   2. 根据时长选择：补静音或延长最后一帧")
         print("   3. 输出合并后的视频文件")
         sys.exit(1)
@@ -189,6 +337,20 @@ def main():
     video_file = sys.argv[2]
     output_file = sys.argv[3]
 
+    if not check_ffmpeg():
+        print("❌ 错误: 未找到 ffmpeg，请先安装")
+        sys.exit(1)
+
+    if os.path.isdir(audio_file) and os.path.isdir(video_file):
+        print("🎬 目录音视频合并工具（可延长视频）")
+        print("=" * 50)
+        print(f"🎵 音频目录: {audio_file}")
+        print(f"📁 视频目录: {video_file}")
+        print(f"📤 输出目录: {output_file}")
+        print()
+        os.makedirs(output_file, exist_ok=True)
+        sys.exit(0 if merge_dir(audio_file, video_file, output_file) else 1)
+
     print("🎬 单文件音视频合并工具（可延长视频）")
     print("=" * 50)
     print(f"🎵 音频文件: {audio_file}")
@@ -196,10 +358,6 @@ def main():
     print(f"📤 输出文件: {output_file}")
     print()
 
-    if not check_ffmpeg():
-        print("❌ 错误: 未找到 ffmpeg，请先安装")
-        sys.exit(1)
-
     if not os.path.exists(video_file):
         print(f"❌ 错误: 视频文件不存在: {video_file}")
         sys.exit(1)
@@ -208,39 +366,10 @@ def main():
         print(f"❌ 错误: 音频文件不存在: {audio_file}")
         sys.exit(1)
 
-    output_dir = os.path.dirname(output_file)
-    if output_dir and not os.path.exists(output_dir):
-        os.makedirs(output_dir, exist_ok=True)
-        print(f"📁 创建输出目录: {output_dir}")
-
-    # 临时合并文件
-    temp_merged_file = output_file.replace(".mp4", "_temp.mp4")
-
-    # Step 1
     print("🔄 开始处理...")
-    print("   Step 1: 合并音频和视频")
-    if not merge_video_audio(video_file, audio_file, temp_merged_file):
-        print("❌ 音视频合并失败")
-        sys.exit(1)
-
-    # 计算时长，决定 Step 2 策略
-    video_duration = get_duration(video_file)
-    audio_duration = get_duration(audio_file)
-
-    print(f"   时长检测: video={video_duration:.2f}s, audio={audio_duration:.2f}s")
-
-    print("   Step 2: 时长匹配处理")
-    if not pad_or_extend(temp_merged_file, output_file, video_duration, audio_duration):
-        # 清理临时文件
-        if os.path.exists(temp_merged_file):
-            os.remove(temp_merged_file)
+    if not merge_page(audio_file, video_file, output_file):
         sys.exit(1)
 
-    # 清理临时文件
-    if os.path.exists(temp_merged_file):
-        os.remove(temp_merged_file)
-        print("🧹 清理临时文件")
-
     # 展示结果
     print()
     print("🎉 音视频合并完成！")
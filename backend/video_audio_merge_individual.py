@@ -15,6 +15,8 @@ import subprocess
 import shutil
 from pathlib import Path
 
+import page_mux
+
 def check_ffmpeg():
     """检查ffmpeg是否安装"""
     try:
@@ -93,6 +95,20 @@ def pad_video(input_file, output_file):
         print(f"   错误输出: {e.stderr}")
         return False
 
+def merge_and_pad(video_file, audio_file, output_dir, basename):
+    """单页: 合并到临时文件，填充后输出 <名称>.mp4 并删除临时文件"""
+    temp_merged_file = os.path.join(output_dir, f"{basename}_temp.mp4")
+    final_output_file = os.path.join(output_dir, f"{basename}.mp4")
+    try:
+        return (merge_video_audio(video_file, audio_file, temp_merged_file)
+                and pad_video(temp_merged_file, final_output_file))
+    finally:
+        if os.path.exists(temp_merged_file):
+            try:
+                os.remove(temp_merged_file)
+            except Exception as e:
+                print(f"⚠️  删除临时文件失败: {e}")
+
 def main():
     # 检查参数
     if len(sys.argv) != 4:
@@ -123,8 +139,8 @@ def main():
     print()
     print("🔄 处理流程:")
     print("   Step 1: 查找匹配的视频和音频文件")
-    print("   Step 2: 逐个合并视频和音频")
-    print("   Step 3: 对合并后的视频进行填充处理")
+    print("   Step 2: 合并视频和音频（多页并行）")
+    print("   Step 3: 对合并后的视频进行填充处理（多页并行）")
     print()
     
     # 检查ffmpeg
@@ -162,67 +178,17 @@ def main():
     print(f"✅ 找到 {len(matches)} 对匹配文件")
     print()
     
-    # Step 2: 逐个合并文件
-    success_count = 0
-    total_count = len(matches)
-    merged_files = []
-    
-    print("🎬 Step 2: 开始合并视频和音频...")
-    for i, (video_file, audio_file, basename) in enumerate(matches, 1):
-        print(f"\n[{i}/{total_count}] 处理文件: {basename}")
-        
-        # 构建输出文件路径（临时合并文件）
-        temp_merged_file = os.path.join(output_dir, f"{basename}_temp.mp4")
-        
-        # 合并文件
-        if merge_video_audio(video_file, audio_file, temp_merged_file):
-            merged_files.append((temp_merged_file, basename))
-            success_count += 1
-        else:
-            print(f"⚠️  跳过文件: {basename}")
-    
-    # 显示合并结果
-    print()
-    print("🎉 视频音频合并完成！")
-    print(f"📊 合并结果:")
-    print(f"   ✅ 成功: {success_count} 个文件")
-    print(f"   ❌ 失败: {total_count - success_count} 个文件")
-    
-    if success_count == 0:
-        print("❌ 没有成功合并的文件，处理结束")
-        return
-    
-    # Step 3: 视频填充处理
-    print()
-    print("🔧 Step 3: 视频填充处理...")
-    
-    pad_success_count = 0
-    final_files = []
-    
-    for i, (temp_file, basename) in enumerate(merged_files, 1):
-        print(f"\n[{i}/{len(merged_files)}] 填充处理: {basename}")
-        
-        # 最终输出文件路径
-        final_output_file = os.path.join(output_dir, f"{basename}.mp4")
-        
-        if pad_video(temp_file, final_output_file):
-            final_files.append(final_output_file)
-            pad_success_count += 1
-            
-            # 删除临时文件
-            try:
-                os.remove(temp_file)
-            except Exception as e:
-                print(f"⚠️  删除临时文件失败: {e}")
-        else:
-            print(f"⚠️  跳过填充: {basename}")
+    # Step 2 + 3: 逐页 合并 → 填充，多页并行
+    jobs = [(basename, merge_and_pad, (video_file, audio_file, output_dir, basename))
+            for video_file, audio_file, basename in matches]
+    done, failed = page_mux.mux_pages(jobs, label="合并填充")
+    final_files = [os.path.join(output_dir, f"{basename}.mp4") for basename in done]
     
     print()
     print("🎉 所有处理完成！")
     print("=" * 50)
     print(f"📊 最终结果:")
-    print(f"   🎬 合并成功: {success_count} 个文件")
-    print(f"   🔧 填充成功: {pad_success_count} 个文件")
+    print(f"   🔧 合并填充成功: {len(done)} 个文件")
     print(f"   📁 输出位置: {output_dir}")
     print()
     print("📋 生成的文件:")
@@ -231,10 +197,10 @@ def main():
         print(f"   📄 {os.path.basename(final_file)} ({file_size:.1f} MB)")
     
     print()
-    if pad_success_count == len(merged_files):
+    if not failed:
         print("✨ 视频音频合并填充全部完成！")
     else:
-        print(f"⚠️  部分文件处理失败，成功率: {pad_success_count}/{len(merged_files)}")
+        print(f"⚠️  部分文件处理失败，成功率: {len(done)}/{len(matches)}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
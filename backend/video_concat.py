@@ -15,6 +15,9 @@ import glob
 import subprocess
 from pathlib import Path
 
+import page_mux
+import clip_normalize
+
 def check_ffmpeg():
     """检查ffmpeg是否安装"""
     try:
@@ -69,9 +72,8 @@ def generate_filelist(categories, output_dir):
                     print(f"📝 添加 {category} 内容: {len(categories[category])} 个文件")
                     
                     for video_file in categories[category]:
-                        basename = os.path.basename(video_file)
-                        # 写入相对路径，避免路径问题
-                        f.write(f'file {basename}\n')
+                        # 写入视频的绝对路径（视频目录和输出目录可以不同）
+                        f.write(page_mux.concat_list_line(video_file))
                 else:
                     print(f"⚠️  {category} 部分无任何文件")
         
@@ -93,8 +95,7 @@ def generate_simple_filelist(video_files, output_dir):
         
         with open(filelist_path, 'w', encoding='utf-8') as f:
             for video_file in sorted_videos:
-                basename = os.path.basename(video_file)
-                f.write(f'file {basename}\n')
+                f.write(page_mux.concat_list_line(video_file))
         
         print(f"✅ 简单文件列表生成成功: {filelist_path}")
         print(f"📋 包含 {len(sorted_videos)} 个视频文件")
@@ -107,6 +108,15 @@ def concat_videos(filelist_path, output_dir):
     """使用ffmpeg串联所有视频"""
     output_file = os.path.join(output_dir, "Full.mp4")
     
+    # 参数不一致的片段先统一编码，保证下面的 -c copy 只是重新封装
+    if not clip_normalize.normalize_filelist(filelist_path):
+        # 仍不一致时流拷贝会得到错乱的时间戳，改为整体重新编码
+        print("⚠️  无法确认所有片段编码参数一致，改为重新编码串联")
+        if clip_normalize.reencode_concat(filelist_path, output_file):
+            print(f"✅ 视频串联成功: Full.mp4 ({os.path.getsize(output_file) / (1024 * 1024):.1f} MB)")
+            return output_file
+        return None
+    
     # 使用相对路径，避免路径问题
     cmd = [
         '/home/EduAgent/miniconda3/envs/manim_env/bin/ffmpeg',
@@ -258,11 +268,12 @@ def main():
         for i, line in enumerate(lines, 1):
             # 正确解析文件名：去掉 'file ' 前缀和换行符
             if line.strip().startswith('file '):
-                filename = line.strip()[5:]  # 去掉 'file ' 前缀
+                filename = line.strip()[5:].strip("'")  # 去掉 'file ' 前缀和引号
             else:
                 filename = line.strip()
                 
             full_path = os.path.join(video_dir, filename)
+            filename = os.path.basename(filename)
             if os.path.exists(full_path):
                 file_size = os.path.getsize(full_path) / (1024 * 1024)  # MB
                 print(f"   {i:2d}. {filename} ({file_size:.1f} MB) ✅")
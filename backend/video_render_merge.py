@@ -1,9 +1,22 @@
 import os
+import json
 import time
+import hashlib
 import subprocess
-from typing import Dict, Any, Optional
+import concurrent.futures
+from typing import Dict, Any, List, Optional
 from pathlib import Path
 
+import tracing
+
+# 预览档：480p15，所有页面并行渲染，只用于老师确认内容
+PREVIEW_QUALITY = "l"
+PREVIEW_DIR_NAME = "preview"
+PREVIEW_MANIFEST_NAME = "preview_manifest.json"
+
+# 高清终版在后台渲染时使用的线程（同一进程内的终版渲染排队执行，避免同时占满 CPU）
+_final_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="final-render")
+
 def run_subprocess_command(command: list, description: str = "", verbose: bool = True) -> bool:
     """
     运行子进程命令，提供更好的错误处理和日志
@@ -20,7 +33,8 @@ def run_subprocess_command(command: list, description: str = "", verbose: bool =
         print(f"正在执行: {description}")
     
     try:
-        result = subprocess.run(command, capture_output=True, text=True, check=False)
+        # 显式传入当前任务的 TRACE_FILE / TRACE_JOB_ID（同一进程里可能有另一个任务在跑）
+        result = subprocess.run(command, capture_output=True, text=True, check=False, env=tracing.child_env())
         
         if result.returncode != 0:
             if verbose:
@@ -48,7 +62,8 @@ def ensure_directory_exists(directory: str) -> None:
     os.makedirs(directory, exist_ok=True)
 
 def video_render_merge(manim_code_path: str, speech_audio_path: str, output_dir: str,
-                      quality: str = "h", verbose: bool = True) -> Dict[str, Any]:
+                      quality: str = "h", verbose: bool = True, pages: Optional[List[str]] = None,
+                      workers: Optional[int] = None) -> Dict[str, Any]:
     """
     视频渲染和音视频合并
     
@@ -58,9 +73,13 @@ def video_render_merge(manim_code_path: str, speech_audio_path: str, output_dir:
         output_dir: 输出目录
         quality: 视频质量 (l/m/h/p/k)
         verbose: 是否显示详细日志
+        pages: 只渲染这些页面（文件名，不含扩展名）；None 表示全部
+        workers: 指定时用 batch_render_manim_for_effi_test.py 按该并发数并行渲染各页
     
     返回:
-        包含处理结果和时间信息的字典
+        包含处理结果和时间信息的字典。其中 time_log_path 不再是手写的 render_merge_log_*.txt，
+        而是本次任务的 trace_summary.json（各阶段 / 逐页耗时、token、费用，见 tracing）；
+        外层已开启追踪时汇总由外层写出，这里返回共用的 trace.jsonl；未启用追踪时为 None
     """
     start_time = time.time()
     
@@ -79,53 +98,66 @@ def video_render_merge(manim_code_path: str, speech_audio_path: str, output_dir:
     # 创建输出目录
     ensure_directory_exists(output_dir)
     
-    # 1. 渲染视频（无音频）
-    video_wo_audio_output_path = os.path.join(output_dir, "video_wo_audio")
-    ensure_directory_exists(video_wo_audio_output_path)
+    # 渲染与合并子进程的 span 通过环境变量写入同一个 trace.jsonl；外层已开启追踪时沿用外层的文件
+    with tracing.job(trace_dir=output_dir, stage="render_merge") as trace_path:
+        # 1. 渲染视频（无音频）
+        video_wo_audio_output_path = os.path.join(output_dir, "video_wo_audio")
+        ensure_directory_exists(video_wo_audio_output_path)
     
-    render_command = [
-        "python",
-        "batch_render_manim.py",
-        manim_code_path,
-        video_wo_audio_output_path,
-        "--quality", quality
-    ]
+        if workers:
+            render_command = [
+                "python",
+                "batch_render_manim_for_effi_test.py",
+                "--input_dir", manim_code_path,
+                "--output_dir", video_wo_audio_output_path,
+                "--quality", quality,
+                "--workers", str(workers)
+            ]
+        else:
+            render_command = [
+                "python",
+                "batch_render_manim.py",
+                manim_code_path,
+                video_wo_audio_output_path,
+                "--quality", quality
+            ]
+        if pages:
+            render_command += ["--pages", ",".join(pages)]
     
-    success = run_subprocess_command(render_command, "渲染Manim视频", verbose)
-    if not success:
-        print("警告: 存在视频渲染失败")
+        success = run_subprocess_command(render_command, "渲染Manim视频", verbose)
+        if not success:
+            print("警告: 存在视频渲染失败")
     
-    render_time = time.time() - start_time
+        render_time = time.time() - start_time
     
-    # 2. 合并音频和视频
-    video_w_audio_output_path = os.path.join(output_dir, "video_w_audio")
+        # 2. 合并音频和视频
+        video_w_audio_output_path = os.path.join(output_dir, "video_w_audio")
     
-    merge_command = [
-        "python",
-        "video_audio_merge.py",
-        speech_audio_path,
-        video_wo_audio_output_path,
-        video_w_audio_output_path
-    ]
+        merge_command = [
+            "python",
+            "video_audio_merge.py",
+            speech_audio_path,
+            video_wo_audio_output_path,
+            video_w_audio_output_path
+        ]
     
-    success = run_subprocess_command(merge_command, "合并音视频", verbose)
-    if not success:
-        raise RuntimeError("音视频合并失败")
+        success = run_subprocess_command(merge_command, "合并音视频", verbose)
+        if not success:
+            raise RuntimeError("音视频合并失败")
     
-    merge_time = time.time() - start_time - render_time
+        merge_time = time.time() - start_time - render_time
     total_time = time.time() - start_time
     
-    # 保存时间日志
     time_dict = {
         "render_time": render_time,
         "merge_time": merge_time,
         "total_time": total_time
     }
-    
-    time_log_path = os.path.join(output_dir, f"render_merge_log_{int(time.time())}.txt")
-    with open(time_log_path, 'w', encoding='utf-8') as f:
-        for key, value in time_dict.items():
-            f.write(f"{key}: {value:.2f} 秒\n")
+    # 分阶段 / 逐页的耗时见 trace.jsonl，本函数开启的追踪在结束时写出 trace_summary.json
+    time_log_path = None
+    if trace_path:
+        summary_path = os.path.join(os.path.dirname(trace_path), tracing.SUMMARY_FILE_NAME)
+        time_log_path = summary_path if os.path.exists(summary_path) else trace_path
     
     # 返回结果信息
     result_info = {
@@ -144,6 +176,97 @@ def video_render_merge(manim_code_path: str, speech_audio_path: str, output_dir:
     
     return result_info
 
+def _code_digests(manim_code_path: str) -> Dict[str, str]:
+    """每页代码的内容哈希（文件名不含扩展名 -> sha256）"""
+    digests = {}
+    for py_file in sorted(Path(manim_code_path).glob("*.py")):
+        digests[py_file.stem] = hashlib.sha256(py_file.read_bytes()).hexdigest()
+    return digests
+
+
+def video_render_preview(manim_code_path: str, speech_audio_path: str, output_dir: str,
+                         workers: Optional[int] = None, verbose: bool = True) -> Dict[str, Any]:
+    """
+    预览档渲染：全部页面以 480p15 并行渲染并合成，供 awaiting_preview_decision 阶段预览
+
+    同时记录每页代码的哈希，终版渲染时据此确认使用的是老师预览过的同一份代码。
+
+    参数:
+        manim_code_path: Manim代码路径（已通过调试校验）
+        speech_audio_path: 语音音频路径
+        output_dir: 任务输出目录，预览结果写入其下的 preview/ 子目录
+        workers: 并行渲染数（默认 CPU 核数）
+        verbose: 是否显示详细日志
+
+    返回:
+        同 video_render_merge，另含 manifest_path
+    """
+    preview_dir = os.path.join(output_dir, PREVIEW_DIR_NAME)
+    result = video_render_merge(manim_code_path, speech_audio_path, preview_dir, quality=PREVIEW_QUALITY,
+                                verbose=verbose, workers=workers or os.cpu_count() or 1)
+    manifest = {
+        "quality": PREVIEW_QUALITY,
+        "manim_code_path": os.path.abspath(manim_code_path),
+        "pages": _code_digests(manim_code_path),
+        "created_at": time.time(),
+    }
+    manifest_path = os.path.join(preview_dir, PREVIEW_MANIFEST_NAME)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    result["manifest_path"] = manifest_path
+    return result
+
+
+def video_render_final(manim_code_path: str, speech_audio_path: str, output_dir: str,
+                       pages: Optional[List[str]] = None, quality: str = "h", background: bool = False,
+                       workers: Optional[int] = None, verbose: bool = True):
+    """
+    终版渲染：只为老师确认过的页面渲染高清版本并合成
+
+    参数:
+        manim_code_path: Manim代码路径（与预览时相同）
+        speech_audio_path: 语音音频路径
+        output_dir: 任务输出目录（与预览时相同）
+        pages: 确认通过的页面（文件名，不含扩展名）；None 表示预览中的全部页面
+        quality: 终版质量 (l/m/h/p/k)
+        background: 为 True 时在后台线程渲染，立即返回 Future
+        workers: 并行渲染数（默认 CPU 核数），与预览一样走渲染进程池和调度器
+        verbose: 是否显示详细日志
+
+    返回:
+        video_render_merge 的结果；background=True 时返回其 Future
+
+    异常:
+        ValueError: 没有任何确认通过的页面
+        RuntimeError: 页面代码在预览之后被修改过（终版必须与预览使用同一份代码）
+    """
+    manifest_path = os.path.join(output_dir, PREVIEW_DIR_NAME, PREVIEW_MANIFEST_NAME)
+    current = _code_digests(manim_code_path)
+    previewed = current
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            previewed = json.load(f).get("pages", {}) or {}
+    elif verbose:
+        print(f"警告: 未找到预览记录 {manifest_path}，无法确认代码与预览一致")
+
+    if pages is None:
+        pages = sorted(previewed)
+    if not pages:
+        raise ValueError("没有需要终版渲染的页面")
+    changed = [p for p in pages if p not in current or current[p] != previewed.get(p)]
+    if changed:
+        raise RuntimeError(f"以下页面的代码在预览之后发生变化或不存在，请重新预览: {', '.join(changed)}")
+
+    workers = workers or os.cpu_count() or 1
+    if background:
+        return _final_executor.submit(
+            tracing.bind(video_render_merge), manim_code_path, speech_audio_path, output_dir,
+            quality=quality, verbose=verbose, pages=list(pages), workers=workers,
+        )
+    return video_render_merge(manim_code_path, speech_audio_path, output_dir, quality=quality,
+                              verbose=verbose, pages=list(pages), workers=workers)
+
+
 if __name__ == "__main__":
     # 示例用法
     manim_code_path = "/Users/hendrick/Desktop/manim_codes_final"